@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+compare timing of summing Feff paths with the per-path loop
+and with all paths stacked together (FeffPathStack)
+"""
+from time import time
+from glob import glob
+import numpy as np
+from lmfit import Parameters
+
+from larch.xafs import feffpath, ff2chi
+from larch.xafs.feffdat import FeffPathStack
+
+files = sorted(glob('Feff_Cu/feff*.dat'))
+
+params = Parameters()
+params.add('amp', value=0.90)
+params.add('del_e0', value=2.0)
+params.add('alpha', value=0.002)
+params.add('sig2', value=0.004)
+
+# use each path 5 times to get a path count typical of larger fits
+paths = []
+for i in range(5):
+    for fname in files:
+        paths.append(feffpath(fname, s02='amp', e0='del_e0',
+                              sigma2='sig2*reff/2.5',
+                              deltar='alpha*reff'))
+
+k = 0.05*np.arange(361)
+nruns = 200
+results = {}
+
+def set_cache_size(size):
+    for path in paths:
+        path.interp_cache_size = size
+        path.clear_interp_cache()
+
+stack = FeffPathStack(paths)
+for cache_size in (0, 8):
+    set_cache_size(cache_size)
+    t0 = time()
+    for i in range(nruns):
+        chi_loop = ff2chi(paths, params=params, k=k, batch=False).chi
+    results[f'path loop, cache={cache_size}'] = (time()-t0)/nruns
+
+    set_cache_size(cache_size)
+    t0 = time()
+    for i in range(nruns):
+        chi_stack = ff2chi(paths, params=params, k=k, pathstack=stack).chi
+    results[f'path stack, cache={cache_size}'] = (time()-t0)/nruns
+
+print(f"{len(paths)} paths, {len(k)} k points, max difference = {abs(chi_loop-chi_stack).max():.3g}")
+for key, val in results.items():
+    print(f"{key:22s} :  {1000*val:8.3f} ms per ff2chi")
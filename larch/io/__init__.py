@@ -23,6 +23,7 @@ from .gse_xdiscan import read_gsexdi, gsexdi_deadtime_correct, is_GSEXDI
 from .gse_mcafile import gsemca_group, GSEMCA_File
 
 from .save_restore import (save_session, load_session, read_session,
+                           open_session, SessionFile,
                            clear_session, is_larch_session_file,
                            save_groups, read_groups)
 
@@ -43,6 +44,7 @@ from .stepscan_file import read_stepscan
 
 from .nexus_xas import NXxasFile
 from .xas_data_source import open_xas_source, read_xas_source
+from .batch_import import batch_import, find_datafiles
 
 def read_tiff(fname, *args, **kws):
     """read image data from a TIFF file as an array"""
@@ -78,6 +80,7 @@ __exports__ = dict(increment_filename=increment_filename,
                    clear_session=clear_session,
                    load_session=load_session,
                    read_session=read_session,
+                   open_session=open_session,
                    save_groups=save_groups,
                    read_groups=read_groups,
                    read_xrd_hdf5=read_xrd_hdf5,
@@ -93,7 +96,9 @@ __exports__ = dict(increment_filename=increment_filename,
                    specfile=open_specfile,
                    read_fdmnes=read_fdmnes,
                    open_xas_source=open_xas_source,
-                   read_xas_source=read_xas_source
+                   read_xas_source=read_xas_source,
+                   batch_import=batch_import,
+                   find_datafiles=find_datafiles,
                    )
 
 _larch_builtins = {'_io':__exports__}
@@ -4,14 +4,15 @@ Code to read and write Athena Project files
 
 """
 import io
-import sys
 import time
 import json
 import platform
+import multiprocessing as mp
 from pathlib import Path
 from fnmatch import fnmatch
 from gzip import GzipFile
 from copy import deepcopy
+from collections import namedtuple
 import numpy as np
 from numpy.random import randint
 from pyshortcuts import bytes2str, str2bytes, fix_varname
@@ -42,27 +43,37 @@ def parse_arglist(text):
 
 ERR_MSG = "Error reading Athena Project File"
 
+# index entry for an Athena group: `name` is Athena's hash key, `groupname`
+# the variable name made from `label`, and `start`, `end` the offsets of
+# the record in Perl-style project text (None for JSON project files)
+AthenaRecord = namedtuple('AthenaRecord', ('name', 'label', 'groupname',
+                                           'args', 'start', 'end'))
 
-def _read_raw_athena(filename):
+
+def _read_raw_athena(filename, size=-1):
     """try to read athena project file as plain text,
-    to determine validity
+    to determine validity.  If `size` > 0, only the first
+    `size` bytes are read, as for testing the file header.
     """
+    def decode(buff):
+        if size > 0:
+            return buff.decode('utf-8', errors='replace')
+        return bytes2str(buff)
+
     # try gzip
     text = None
     try:
-        fh = GzipFile(unixpath(filename))
-        text = bytes2str(fh.read())
+        with GzipFile(unixpath(filename)) as fh:
+            text = decode(fh.read(size))
     except Exception:
-        errtype, errval, errtb = sys.exc_info()
         text = None
 
     if text is None:
         # try plain text file
         try:
-            fh = open(filename, 'r')
-            text = bytes2str(fh.read())
+            with open(filename, 'r') as fh:
+                text = fh.read(size)
         except Exception:
-            errtype, errval, errtb = sys.exc_info()
             text = None
 
     return text
@@ -74,7 +85,7 @@ def _test_athena_text(text):
 
 def is_athena_project(filename):
     """tests whether file is a valid Athena Project file"""
-    text = _read_raw_athena(filename)
+    text = _read_raw_athena(filename, size=512)
     if text is None:
         return False
     return _test_athena_text(text)
@@ -293,18 +304,67 @@ def text2list(text):
     return txt
 
 
-def parse_perlathena(text, filename):
-    """
-    parse old athena file format to Group of Groups
-    """
+def plarray2numpy(text):
+    """convert Perl array text "@x = ('1.0','2.0', ...);" to a numpy array"""
+    txt = text.split('=', 1)[1].strip()
+    if txt.endswith(';'):
+        txt = txt[:-1].strip()
+    txt = txt.strip('()').replace("'", '')
+    return np.array(txt.split(','), dtype=np.float64)
+
+
+def _athena_interpreter():
+    "asteval interpreter for evaluating Perl lists"
     aout = io.StringIO()
-    aeval = asteval.Interpreter(minimal=True, writer=aout, err_writer=aout,
-                                max_statement_length=12543000)
+    return asteval.Interpreter(minimal=True, writer=aout, err_writer=aout,
+                               max_statement_length=12543000)
 
-    lines = text.split('\n')
-    athenagroups = []
-    raw = {'name':''}
-    vline = lines.pop(0)
+
+def _perl_value(text, aeval):
+    """evaluate the value of a Perl assignment, using json for
+    lists and strings without escapes or double quotes"""
+    txt = text.split('=', 1)[1].strip()
+    if txt.endswith(';'):
+        txt = txt[:-1].strip()
+    if '\\' not in txt and '"' not in txt:
+        if txt.startswith('(') and txt.endswith(')'):
+            txt = '[' + txt[1:-1] + ']'
+        try:
+            return json.loads(txt.replace("'", '"'))
+        except ValueError:
+            pass
+    return aeval(text2list(text))
+
+
+def _perl_lines(text, start, end):
+    """generate (key, line start, line end) for non-comment lines of Perl
+    project text, without copying the (possibly very long) lines"""
+    while start < end:
+        eol = text.find('\n', start, end)
+        if eol < 0:
+            eol = end
+        pos, start = start, eol+1
+        if (text.startswith('#', pos) or eol-pos < 2 or
+            text.find('undef', pos, eol) > -1):
+            yield None, pos, eol
+            continue
+        key = text[pos:min(eol, pos+64)].split()[0]
+        key = key.replace('$', '').replace('@', '').replace('%', '').strip()
+        yield key, pos, eol
+
+
+def index_perlathena(text, filename=None):
+    """index old athena file format text, without parsing data arrays
+
+    Returns:
+        tuple of (header, journal, records) where `records` is a list of
+        AthenaRecord, giving the offsets of each record in `text`.
+    """
+    aeval = _athena_interpreter()
+    eol = text.find('\n')
+    if eol < 0:
+        eol = len(text)
+    vline = text[:eol]
     if  "Athena project file -- " not in vline:
         raise ValueError("%s '%s': invalid Athena File" % (ERR_MSG, filename))
     major, minor, fix = '0', '0', '0'
@@ -324,81 +384,121 @@ def parse_perlathena(text, filename):
     header = [vline]
     journal = ['']
     is_header = True
-    ix = 0
-    for t in lines:
-        ix += 1
-        if t.startswith('#') or len(t) < 2 or 'undef' in t:
+    records = []
+    name, args, start = '', [], None
+    for key, pos, eol in _perl_lines(text, eol+1, len(text)):
+        if key is None:
             if is_header:
-                header.append(t)
+                header.append(text[pos:eol])
             continue
         is_header = False
-        key = t.split()[0].strip()
-        key = key.replace('$', '').replace('@', '').replace('%', '').strip()
-        if key == 'old_group':
-            raw['name'] = aeval(text2list(t))
-        elif key == '[record]':
-            athenagroups.append(raw)
-            raw = {'name':''}
-        elif key == 'journal':
+        if key == 'journal':
+            t = text[pos:eol]
             try:
                 journal = aeval(text2list(t))
             except ValueError:
                 pass
             if len(aeval.error) > 0:
                 print(f" warning: may not read journal from '{filename:s}' completely")
-                journal = text2list(t)
-
+                journal = [text2list(t)]
+            continue
+        if start is None:
+            start = pos
+        if key == 'old_group':
+            name = _perl_value(text[pos:eol], aeval)
         elif key == 'args':
-            raw['args'] = aeval(text2list(t))
-        elif key == 'xdi':
-            raw['xdi'] = t
-        elif key in ('x', 'y', 'i0', 'signal', 'stddev'):
-            raw[key] = np.array([float(x) for x in aeval(text2list(t))])
-        elif key in ('1;', 'indicator', 'lcf_data', 'plot_features'):
-            pass
+            args = _perl_value(text[pos:eol], aeval)
+        elif key == '[record]':
+            records.append(make_athena_record(name, args, start, eol))
+            name, args, start = '', [], None
+    return '\n'.join(header), '\n'.join(journal), records
+
+
+def make_athena_record(name, args, start=None, end=None):
+    """AthenaRecord for a group, from its Athena name and `args`,
+    as a Perl-style list of key, value pairs or as a dict"""
+    if isinstance(args, dict):
+        args = list(args.items())
+    elif args is None:
+        args = []
+    else:
+        args = [(args[2*i], args[2*i+1]) for i in range(len(args)//2)]
+    label = name
+    for key, val in args:
+        if key == 'label':
+            label = val
+    groupname = label
+    if groupname.startswith(' '):
+        groupname = 'd_' + groupname.strip()
+    groupname = fix_varname(groupname)
+    if groupname.startswith('_'):
+        groupname = 'd' + groupname
+    return AthenaRecord(name, label, groupname, args, start, end)
+
+
+def parse_athena_record(source, record):
+    """parse the data for an indexed Athena record to a Group
+
+    Arguments:
+        source (str or dict): Perl-style project text or JSON project dict
+        record (AthenaRecord): record in `source`, from the project index
+    """
+    if record.start is None:
+        dat = source[record.name]
+        arrays = {key: np.array(dat[key], dtype='float64')
+                  for key in ('x', 'y', 'i0', 'signal', 'stddev') if key in dat}
+    else:
+        arrays = {}
+        aeval = None
+        for key, pos, eol in _perl_lines(source, record.start, record.end):
+            if key in ('x', 'y', 'i0', 'signal', 'stddev'):
+                t = source[pos:eol]
+                try:
+                    arrays[key] = plarray2numpy(t)
+                except ValueError:
+                    if aeval is None:
+                        aeval = _athena_interpreter()
+                    arrays[key] = np.array([float(x) for x in aeval(text2list(t))])
+            elif key not in (None, 'old_group', 'args', '[record]', 'xdi', '1;',
+                             'indicator', 'lcf_data', 'plot_features'):
+                print(" do not know what to do with key '%s' at '%s'" % (key, record.name))
+
+    label = record.name
+    this = Group(energy=arrays['x'], mu=arrays['y'],
+                 athena_params=Group(id=record.name, bkg=Group(), fft=Group()))
+    for key in ('i0', 'signal', 'stddev'):
+        if key in arrays:
+            setattr(this, key, arrays[key])
+    for key, val in record.args:
+        if key.startswith('bkg_'):
+            setattr(this.athena_params.bkg, key[4:], asfloat(val))
+        elif key.startswith('fft_'):
+            setattr(this.athena_params.fft, key[4:], asfloat(val))
+        elif key == 'label':
+            label = this.label = val
+        elif key in ('valence', 'lasso_yvalue', 'epsk', 'epsr'):
+            setattr(this, key, asfloat(val))
+        elif key in ('atsym', 'edge'):
+            setattr(this, key, val)
         else:
-            print(" do not know what to do with key '%s' at '%s'" % (key, raw['name']))
+            setattr(this.athena_params, key, asfloat(val))
+    this.__doc__ = """Athena Group Name %s (key='%s')""" % (label, record.name)
+    return this
+
 
+def parse_perlathena(text, filename):
+    """
+    parse old athena file format to Group of Groups
+    """
+    header, journal, records = index_perlathena(text, filename)
     out = Group()
     out.__doc__ = """XAFS Data from Athena Project File %s""" % (filename)
-    out.journal = '\n'.join(journal)
+    out.journal = journal
     out.group_names = []
-    out.header = '\n'.join(header)
-    for dat in athenagroups:
-        label = dat.get('name', 'unknown')
-        this = Group(energy=dat['x'], mu=dat['y'],
-                     athena_params=Group(id=label, bkg=Group(), fft=Group()))
-
-        if 'i0' in dat:
-            this.i0 = dat['i0']
-        if 'signal' in dat:
-            this.signal = dat['signal']
-        if 'stddev' in dat:
-            this.stddev = dat['stddev']
-        if 'args' in dat:
-            for i in range(len(dat['args'])//2):
-                key = dat['args'][2*i]
-                val = dat['args'][2*i+1]
-                if key.startswith('bkg_'):
-                    setattr(this.athena_params.bkg, key[4:], asfloat(val))
-                elif key.startswith('fft_'):
-                    setattr(this.athena_params.fft, key[4:], asfloat(val))
-                elif key == 'label':
-                    label = this.label = val
-                elif key in ('valence', 'lasso_yvalue', 'epsk', 'epsr'):
-                    setattr(this, key, asfloat(val))
-                elif key in ('atsym', 'edge'):
-                    setattr(this, key, val)
-                else:
-                    setattr(this.athena_params, key, asfloat(val))
-        this.__doc__ = """Athena Group Name %s (key='%s')""" % (label, dat['name'])
-        if label.startswith(' '):
-            label = 'd_' + label.strip()
-        name = fix_varname(label)
-        if name.startswith('_'):
-            name = 'd' + name
-        setattr(out, name, this)
-        out.group_names.append(name)
+    out.header = header
+    for record in records:
+        setattr(out, record.groupname, parse_athena_record(text, record))
+        out.group_names.append(record.groupname)
     return out
 
 
@@ -497,14 +597,16 @@ def parse_perlathena_old(text, filename):
     return out
 
 
-def parse_jsonathena(text, filename):
-    """parse a JSON-style athena file"""
-    jsdict = json.loads(text)
-
-    out = Group()
-    out.__doc__ = """XAFS Data from Athena Project File %s""" % (filename)
+def index_jsonathena(text, filename=None):
+    """index a JSON-style athena file
 
+    Returns:
+        tuple of (header, journal, records, jsdict) where `records` is a
+        list of AthenaRecord for the groups in the decoded JSON `jsdict`.
+    """
+    jsdict = json.loads(text)
     header = []
+    journal = ''
     athena_names = []
     for key, val in jsdict.items():
         if key.startswith('_____head'):
@@ -513,44 +615,22 @@ def parse_jsonathena(text, filename):
             journal = val
         elif key.startswith('_____order'):
             athena_names = val
+    records = [make_athena_record(name, jsdict[name].get('args', {}))
+               for name in athena_names]
+    return '\n'.join(header), journal, records, jsdict
 
+
+def parse_jsonathena(text, filename):
+    """parse a JSON-style athena file"""
+    header, journal, records, jsdict = index_jsonathena(text, filename)
+    out = Group()
+    out.__doc__ = """XAFS Data from Athena Project File %s""" % (filename)
     out.journal = journal
-    out.header = '\n'.join(header)
+    out.header = header
     out.group_names  = []
-    for name in athena_names:
-        label = name
-        dat = jsdict[name]
-        x = np.array(dat['x'], dtype='float64')
-        y = np.array(dat['y'], dtype='float64')
-        this = Group(energy=x, mu=y,
-                     athena_params=Group(id=name, bkg=Group(), fft=Group()))
-
-        if 'i0' in dat:
-            this.i0 = np.array(dat['i0'], dtype='float64')
-        if 'signal' in dat:
-            this.signal = np.array(dat['signal'], dtype='float64')
-        if 'stddev' in dat:
-            this.stddev = np.array(dat['stddev'], dtype='float64')
-        if 'args' in dat:
-            for key, val in dat['args'].items():
-                if key.startswith('bkg_'):
-                    setattr(this.athena_params.bkg, key[4:], asfloat(val))
-                elif key.startswith('fft_'):
-                    setattr(this.athena_params.fft, key[4:], asfloat(val))
-                elif key == 'label':
-                    label = this.label = val
-                elif key in ('valence', 'lasso_yvalue', 'epsk', 'epsr'):
-                    setattr(this, key, asfloat(val))
-                elif key in ('atsym', 'edge'):
-                    setattr(this, key, val)
-                else:
-                    setattr(this.athena_params, key, asfloat(val))
-        this.__doc__ = """Athena Group Name %s (key='%s')""" % (label, name)
-        name = fix_varname(label)
-        if name.startswith('_'):
-            name = 'd' + name
-        setattr(out, name, this)
-        out.group_names.append(name)
+    for record in records:
+        setattr(out, record.groupname, parse_athena_record(jsdict, record))
+        out.group_names.append(record.groupname)
     return out
 
 
@@ -608,6 +688,136 @@ class AthenaGroup(Group):
     def items(self):
         return list(self.groups.items())
 
+# names of the attributes set by process_athena_group()
+ATHENA_PROCESSED_NAMES = ('atsym', 'callargs', 'd2mude', 'dmude', 'e0', 'edge',
+                          'edge_step', 'edge_step_poly', 'flat', 'flat_alt',
+                          'flat_coefs', 'norm', 'norm_poly', 'post_edge',
+                          'pre_edge', 'pre_edge_details', 'autobk_details',
+                          'bkg', 'chi', 'chie', 'ek0', 'k', 'rbkg', 'chir',
+                          'chir_im', 'chir_mag', 'chir_re', 'kwin', 'r')
+
+class AthenaDataGroup(Group):
+    """Group for an Athena dataset, for which pre-edge subtraction and
+    background subtraction are deferred until a derived value (such as
+    `norm`, `e0`, or `chi`) is first accessed.  If that processing fails,
+    accessing a missing derived value raises a RuntimeError."""
+
+    def __init__(self, deferred=None, **kws):
+        self.__deferred = deferred
+        self.__error = None
+        super().__init__(**kws)
+
+    def __getattr__(self, name):
+        if name not in ATHENA_PROCESSED_NAMES:
+            raise AttributeError(f"'{self.__class__.__name__}' has no attribute '{name}'")
+        error = self.__dict__.get('_AthenaDataGroup__error', None)
+        if error is not None:
+            raise RuntimeError(f"processing Athena group failed: {error}")
+        deferred = self.__dict__.get('_AthenaDataGroup__deferred', None)
+        if deferred is None:
+            raise AttributeError(f"'{self.__class__.__name__}' has no attribute '{name}'")
+        self.__deferred = None
+        try:
+            process_athena_group(self, *deferred)
+        except Exception as exc:
+            self.__error = f"{exc.__class__.__name__}: {exc}"
+            raise RuntimeError(f"processing Athena group failed: {self.__error}") from exc
+        return getattr(self, name)
+
+
+def process_athena_group(group, do_bkg=False, do_fft=False):
+    """do pre-edge subtraction, and optionally background subtraction
+    and Fourier transform for an Athena group, using the parameters
+    saved in the project file"""
+    from larch.xafs import pre_edge, autobk, xftf
+    pars = clean_bkg_params(group.athena_params.bkg)
+    pre_edge(group,  e0=float(pars.e0),
+             pre1=float(pars.pre1), pre2=float(pars.pre2),
+             norm1=float(pars.nor1), norm2=float(pars.nor2),
+             nnorm=float(pars.nnorm),
+             nvict=float(pars.nvict),
+             make_flat=bool(pars.flatten))
+    if do_bkg and hasattr(pars, 'rbkg'):
+        autobk(group, e0=float(pars.e0), rbkg=float(pars.rbkg),
+               kmin=float(pars.spl1), kmax=float(pars.spl2),
+               kweight=float(pars.kw), dk=float(pars.dk),
+               clamp_lo=float(pars.clamp1),
+               clamp_hi=float(pars.clamp2))
+        if do_fft:
+            pars = clean_fft_params(group.athena_params.fft)
+            kweight=2
+            if hasattr(pars, 'kw'):
+                kweight = float(pars.kw)
+            xftf(group, kmin=float(pars.kmin),
+                 kmax=float(pars.kmax), kweight=kweight,
+                 window=pars.kwindow, dk=float(pars.dk))
+
+
+def prepare_athena_group(this, do_preedge=True, do_bkg=False, do_fft=False,
+                         lazy=False):
+    """prepare a group read from an Athena project for use: sort arrays by
+    energy, do processing (see process_athena_group), and set the flags
+    and array names used by Larix.  With lazy=True, the processing is
+    deferred, and an AthenaDataGroup is returned.
+    """
+    from larch.xafs.xafsutils import TINY_ENERGY
+    this.energy = remove_dups(this.energy, tiny=TINY_ENERGY)
+    eorder = np.argsort(this.energy)
+    has_nan = False
+    for aname in dir(this):
+        obj = getattr(this, aname)
+        if isinstance(obj, np.ndarray) and len(eorder) == len(obj):
+            setattr(this, aname, obj[eorder])
+            has_nan = has_nan or np.isnan(obj).any()
+    this.energy = remove_dups(this.energy, tiny=TINY_ENERGY)
+    if has_nan:
+        print("NOTE: nans seen!!")
+
+    this.athena_id = this.athena_params.id
+    is_xmu = bool(int(getattr(this.athena_params, 'is_xmu', 1.0)))
+    is_chi = bool(int(getattr(this.athena_params, 'is_chi', 0.0)))
+    is_xmu = is_xmu and not is_chi
+    for aname in ('is_xmudat', 'is_bkg', 'is_diff',
+                  'is_proj', 'is_pixel', 'is_rsp'):
+        val = bool(int(getattr(this.athena_params, aname, 0.0)))
+        is_xmu = is_xmu and not val
+
+    deferred = None
+    if is_xmu and (do_preedge or do_bkg):
+        this.energy_shift = getattr(this.athena_params.bkg, 'eshift', 0.)
+        if lazy:
+            deferred = (do_bkg, do_fft)
+        else:
+            process_athena_group(this, do_bkg=do_bkg, do_fft=do_fft)
+    if is_chi:
+        this.k = this.energy*1.0
+        this.chi = this.mu*1.0
+        this.xdat = this.energy*1.0
+        this.ydat = this.mu*1.0
+        del this.energy
+        del this.mu
+    else:
+        this.xdat = 1.0*this.energy
+        this.ydat = 1.0*this.mu
+
+    # add a selection flag and XAS datatypes, as used by Larix
+    this.sel = 1
+    this.datatype = 'xas'
+    this.filename = getattr(this, 'label', 'unknown')
+    this.yerr = 1.0
+    this.plot_xlabel = 'energy'
+    this.plot_ylabel = 'mu'
+    if deferred is not None:
+        this = AthenaDataGroup(deferred=deferred, **this.__dict__)
+    return this
+
+
+def _athena_task(args):
+    "parse and prepare one Athena record in a worker process"
+    source, record, kws = args
+    return prepare_athena_group(parse_athena_record(source, record), **kws)
+
+
 class AthenaProject(object):
     """read and write Athena Project files, mapping to Larch group
     containing sub-groups for each spectra / record
@@ -627,6 +837,7 @@ class AthenaProject(object):
         self.header = None
         self.journal = None
         self.filename = filename
+        self._index = None
         if filename is not None:
             if Path(filename).exists() and is_athena_project(filename):
                 self.read(filename)
@@ -722,8 +933,56 @@ class AthenaProject(object):
         fh.write(str2bytes("\n".join([bytes2str(t) for t in buff])))
         fh.close()
 
+    def index(self, filename=None):
+        """
+        index the groups in an Athena project file, without parsing data
+        arrays.  The text and index of the most recently indexed file are
+        cached, and reused until the file changes.
+
+        Arguments:
+            filename (string): name of Athena Project file
+
+        Returns:
+            list of AthenaRecord, named tuples with elements
+               `name`:      Athena's hash key for the group
+               `label`:     label for the group
+               `groupname`: name of Larch group, made from the label
+               `args`:      list of (key, value) pairs of Athena parameters
+               `start`, `end`: offsets of the record in the project text
+        """
+        if filename is not None:
+            self.filename = filename
+        if not Path(self.filename).exists():
+            raise IOError("%s '%s': cannot find file" % (ERR_MSG, self.filename))
+        stat = Path(self.filename).stat()
+        key = (Path(self.filename).absolute().as_posix(), stat.st_size, stat.st_mtime_ns)
+        if self._index is not None and self._index[0] == key:
+            return self._index[4]
+
+        text = _read_raw_athena(self.filename)
+        # failed to read:
+        if text is None:
+            raise OSError("failed to read '%s'" % self.filename)
+        if not _test_athena_text(text):
+            raise ValueError("%s '%s': invalid Athena File" % (ERR_MSG, self.filename))
+
+        # index JSON or Perl format
+        index = None
+        if  '____header' in text[:500]:
+            try:
+                header, journal, records, text = index_jsonathena(text, self.filename)
+                index = (key, text, header, journal, records)
+            except Exception:
+                pass
+
+        if index is None:
+            header, journal, records = index_perlathena(text, self.filename)
+            index = (key, text, header, journal, records)
+        self._index = index
+        return records
+
     def read(self, filename=None, match=None, do_preedge=True, do_bkg=False,
-             do_fft=False, use_hashkey=False):
+             do_fft=False, use_hashkey=False, lazy=False, nworkers=1):
         """
         read Athena project to group of groups, one for each Athena dataset
         in the project file.  This supports both gzipped and unzipped files
@@ -737,6 +996,8 @@ class AthenaProject(object):
             do_fft (bool): whether to do XAFS Fast Fourier transform [False]
             use_hashkey (bool): whether to use Athena's hash key as the
                            group name instead of the Athena label [False]
+            lazy (bool): whether to defer processing until needed (see Note 4) [False]
+            nworkers (int): number of worker processes to use (see Note 5) [1]
         Returns:
             None, fills in attributes `header`, `journal`, `filename`, `groups`
 
@@ -745,11 +1006,18 @@ class AthenaProject(object):
                using '*' to match 'all', '?' to match any single character,
                or [sequence] to match any of a sequence of letters.  Matching
                is insensitive to case, and done with Python's fnmatch module.
+               Only the data for matching groups is parsed.
             3. do_preedge,  do_bkg, and do_fft will attempt to reproduce the
                pre-edge, background subtraction, and FFT from Athena by using
                the parameters saved in the project file.
             2. use_hashkey=True will name groups from the internal 5 character
                string used by Athena, instead of the group label.
+            4. with lazy=True, the processing set by do_preedge, do_bkg, and
+               do_fft is done for each group when a value derived from it
+               (such as `norm` or `chi`) is first accessed.
+            5. with nworkers > 1, the matching groups are parsed and processed
+               using a pool of processes.  If nworkers is None, the number of
+               CPUs - 1 is used.
 
         Example:
             1. read in all groups from a project file:
@@ -758,115 +1026,34 @@ class AthenaProject(object):
             2. read in only the "merged" data from a Project, do BKG and FFT:
                zn_data = read_athena('Zn on Stuff.prj', match='*merge*', do_bkg=True, do_fft=True)
         """
-        if filename is not None:
-            self.filename = filename
-        if not Path(self.filename).exists():
-            raise IOError("%s '%s': cannot find file" % (ERR_MSG, self.filename))
-
-        from larch.xafs import pre_edge, autobk, xftf
-        from larch.xafs.xafsutils import TINY_ENERGY
-
-
-        if not Path(filename).exists():
-            raise IOError("file '%s' not found" % filename)
-
-        text = _read_raw_athena(filename)
-        # failed to read:
-        if text is None:
-            raise OSError("failed to read '%s'" % filename)
-        if not _test_athena_text(text):
-            raise ValueError("%s '%s': invalid Athena File" % (ERR_MSG, filename))
-
-        # decode JSON or Perl format
-        data = None
-        if  '____header' in text[:500]:
-            try:
-                data = parse_jsonathena(text, self.filename)
-            except Exception:
-                pass
-
-        if data is None:
-            data = parse_perlathena(text, self.filename)
-
-        if data is None:
-            raise ValueError("cannot read file '%s' as Athena Project File" % (self.filename))
-
-        self.header = data.header
-        self.journal = data.journal
-        self.group_names = data.group_names
+        records = self.index(filename)
+        _, source, self.header, self.journal, _ = self._index
+        self.group_names = [rec.groupname for rec in records]
 
         if match is not None:
             match = match.lower()
-        for gname in data.group_names:
-            oname = gname
-            if match is not None:
-                if not fnmatch(gname.lower(), match):
-                    continue
-            this = getattr(data, gname)
-            this.energy = remove_dups(this.energy, tiny=TINY_ENERGY)
-            eorder = np.argsort(this.energy)
-            has_nan = False
-            for aname in dir(this):
-                obj = getattr(this, aname)
-                if isinstance(obj, np.ndarray) and len(eorder) == len(obj):
-                    setattr(this, aname, obj[eorder])
-                    has_nan = has_nan or any(np.isnan(obj))
-            this.energy = remove_dups(this.energy, tiny=TINY_ENERGY)
-            if has_nan:
-                print("NOTE: nans seen!!")
-
-            this.athena_id = this.athena_params.id
-            if use_hashkey:
-                oname = this.athena_params.id
-            is_xmu = bool(int(getattr(this.athena_params, 'is_xmu', 1.0)))
-            is_chi = bool(int(getattr(this.athena_params, 'is_chi', 0.0)))
-            is_xmu = is_xmu and not is_chi
-            for aname in ('is_xmudat', 'is_bkg', 'is_diff',
-                          'is_proj', 'is_pixel', 'is_rsp'):
-                val = bool(int(getattr(this.athena_params, aname, 0.0)))
-                is_xmu = is_xmu and not val
-
-            if is_xmu and (do_preedge or do_bkg):
-                pars = clean_bkg_params(this.athena_params.bkg)
-                this.energy_shift = getattr(this.athena_params.bkg, 'eshift', 0.)
-                pre_edge(this,  e0=float(pars.e0),
-                         pre1=float(pars.pre1), pre2=float(pars.pre2),
-                         norm1=float(pars.nor1), norm2=float(pars.nor2),
-                         nnorm=float(pars.nnorm),
-                         nvict=float(pars.nvict),
-                         make_flat=bool(pars.flatten))
-                if do_bkg and hasattr(pars, 'rbkg'):
-                    autobk(this, e0=float(pars.e0), rbkg=float(pars.rbkg),
-                           kmin=float(pars.spl1), kmax=float(pars.spl2),
-                           kweight=float(pars.kw), dk=float(pars.dk),
-                           clamp_lo=float(pars.clamp1),
-                           clamp_hi=float(pars.clamp2))
-                    if do_fft:
-                        pars = clean_fft_params(this.athena_params.fft)
-                        kweight=2
-                        if hasattr(pars, 'kw'):
-                            kweight = float(pars.kw)
-                        xftf(this, kmin=float(pars.kmin),
-                             kmax=float(pars.kmax), kweight=kweight,
-                             window=pars.kwindow, dk=float(pars.dk))
-            if is_chi:
-                this.k = this.energy*1.0
-                this.chi = this.mu*1.0
-                this.xdat = this.energy*1.0
-                this.ydat = this.mu*1.0
-                del this.energy
-                del this.mu
-            else:
-                this.xdat = 1.0*this.energy
-                this.ydat = 1.0*this.mu
-
-            # add a selection flag and XAS datatypes, as used by Larix
-            this.sel = 1
-            this.datatype = 'xas'
-            this.filename = getattr(this, 'label', 'unknown')
-            this.yerr = 1.0
-            this.plot_xlabel = 'energy'
-            this.plot_ylabel = 'mu'
+            records = [rec for rec in records if fnmatch(rec.groupname.lower(), match)]
+        kws = dict(do_preedge=do_preedge, do_bkg=do_bkg, do_fft=do_fft, lazy=lazy)
+
+        if nworkers is None:
+            nworkers = max(1, mp.cpu_count()-1)
+        nworkers = min(nworkers, len(records))
+        if nworkers < 2:
+            groups = [prepare_athena_group(parse_athena_record(source, rec), **kws)
+                      for rec in records]
+        else:
+            tasks = []
+            for rec in records:
+                if rec.start is None:
+                    tasks.append(({rec.name: source[rec.name]}, rec, kws))
+                else:
+                    tasks.append((source[rec.start:rec.end],
+                                  rec._replace(start=0, end=rec.end-rec.start), kws))
+            with mp.Pool(nworkers) as pool:
+                groups = pool.map(_athena_task, tasks)
+
+        for rec, this in zip(records, groups):
+            oname = this.athena_id if use_hashkey else rec.groupname
             self.groups[oname] = this
 
     def as_group(self):
@@ -910,7 +1097,7 @@ class AthenaProject(object):
 
 
 def read_athena(filename, match=None, do_preedge=True, do_bkg=False,
-                do_fft=False,  use_hashkey=False):
+                do_fft=False,  use_hashkey=False, lazy=False, nworkers=1):
     """read athena project file
     returns a Group of Groups, one for each Athena Group in the project file
 
@@ -922,6 +1109,8 @@ def read_athena(filename, match=None, do_preedge=True, do_bkg=False,
         do_fft (bool): whether to do XAFS Fast Fourier transform [False]
         use_hashkey (bool): whether to use Athena's hash key as the
                        group name instead of the Athena label [False]
+        lazy (bool): whether to defer processing until needed (see Note 4) [False]
+        nworkers (int): number of worker processes to use (see Note 5) [1]
 
     Returns:
         group of groups each named according the label used by Athena.
@@ -936,6 +1125,12 @@ def read_athena(filename, match=None, do_preedge=True, do_bkg=False,
            the parameters saved in the project file.
         3. use_hashkey=True will name groups from the internal 5 character
            string used by Athena, instead of the group label.
+        4. with lazy=True, the processing set by do_preedge, do_bkg, and
+           do_fft is done for each group when a value derived from it
+           (such as `norm` or `chi`) is first accessed.
+        5. with nworkers > 1, the matching groups are parsed and processed
+           using a pool of processes.  If nworkers is None, the number of
+           CPUs - 1 is used.
 
     Example:
         1. read in all groups from a project file:
@@ -950,7 +1145,8 @@ def read_athena(filename, match=None, do_preedge=True, do_bkg=False,
 
     aprj = AthenaProject()
     aprj.read(filename, match=match, do_preedge=do_preedge, do_bkg=do_bkg,
-              do_fft=do_fft, use_hashkey=use_hashkey)
+              do_fft=do_fft, use_hashkey=use_hashkey, lazy=lazy,
+              nworkers=nworkers)
 
     return aprj.as_group()
 
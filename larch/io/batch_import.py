@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+  batch_import reads many data files, using the reader guessed for each
+  file, parsing files over a pool of processes, and caching the results
+  so that files are parsed again only when they have changed.
+"""
+import os
+import json
+import time
+import hashlib
+import multiprocessing as mp
+from glob import glob
+from pathlib import Path
+from collections import namedtuple
+import numpy as np
+
+from larch.site_config import user_larchdir
+from larch.utils import mkdir, str2bytes, format_exception
+from larch.utils.jsonutils import encode4js, decode4js, ArrayBuffers
+
+from .columnfile import read_ascii, read_fdmnes, guess_filereader
+from .xdi import read_xdi
+from .athena_project import read_athena, is_athena_project
+from .specfile_reader import read_specfile
+from .gse_escan import gsescan_group
+from .gse_xdiscan import read_gsexdi
+
+READERS = {'read_ascii': read_ascii, 'read_xdi': read_xdi,
+           'read_athena': read_athena, 'read_specfile': read_specfile,
+           'read_gsescan': gsescan_group, 'read_gsexdi': read_gsexdi,
+           'read_fdmnes': read_fdmnes}
+
+ImportResult = namedtuple('ImportResult', ('filename', 'reader', 'group',
+                                           'cached', 'time', 'error'))
+
+def import_cache_folder():
+    "default folder for the batch_import cache"
+    return Path(user_larchdir, 'import_cache').as_posix()
+
+def find_datafiles(sources, pattern='*', recurse=False):
+    """list of data files from a file name, glob pattern or folder name,
+    or a list of these.  Folders are searched for files matching
+    `pattern`, including sub-folders if `recurse` is True.
+    Hidden files (starting with '.') are skipped.
+    """
+    if isinstance(sources, (str, Path)):
+        sources = [sources]
+    files = []
+    for source in sources:
+        source = Path(source)
+        if source.is_dir():
+            found = source.rglob(pattern) if recurse else source.glob(pattern)
+        elif source.is_file():
+            found = [source]
+        else:
+            found = [Path(p) for p in glob(source.as_posix(), recursive=recurse)]
+        for path in sorted(found):
+            if path.is_file() and not path.name.startswith('.'):
+                fname = path.absolute().as_posix()
+                if fname not in files:
+                    files.append(fname)
+    return files
+
+def _cache_file(folder, filename, reader, reader_kws):
+    "cache file for a data file, reader, and reader options"
+    key = json.dumps([filename, reader, repr(sorted(reader_kws.items()))])
+    key = hashlib.sha256(str2bytes(key)).hexdigest()
+    return Path(folder, key[:2], f'{key}.npz').as_posix()
+
+def _read_cache(cachefile, stat):
+    """read cached data for a file, returning (reader, group),
+    or None if not found or the size or modification time has changed"""
+    if not os.path.exists(cachefile):
+        return None
+    try:
+        with np.load(cachefile) as npz:
+            meta = json.loads(npz['meta'].tobytes())
+            if meta['size'] != stat.st_size or meta['mtime'] != stat.st_mtime_ns:
+                return None
+            buffers = ArrayBuffers(npz[f'a{i}'] for i in range(meta['narrays']))
+            text = npz['group'].tobytes()
+    except Exception:
+        return None
+    return meta['reader'], decode4js(json.loads(text), buffers)
+
+def _write_cache(cachefile, stat, reader, text, buffers):
+    "write encoded group text and arrays to cache file"
+    meta = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'reader': reader, 'narrays': len(buffers)}
+    arrays = {f'a{i}': arr for i, arr in enumerate(buffers)}
+    arrays['meta'] = np.frombuffer(str2bytes(json.dumps(meta)), dtype=np.uint8)
+    arrays['group'] = np.frombuffer(text, dtype=np.uint8)
+    mkdir(Path(cachefile).parent.as_posix())
+    tmpfile = f'{cachefile}_{os.getpid()}.tmp'
+    with open(tmpfile, 'wb') as fh:
+        np.savez(fh, **arrays)
+    os.replace(tmpfile, cachefile)
+
+def _read_datafile(filename, reader, reader_kws):
+    "read data file, returning (reader, group, parse time)"
+    t0 = time.monotonic()
+    if reader is None:
+        if is_athena_project(filename):
+            reader = 'read_athena'
+        else:
+            reader = guess_filereader(filename)
+    group = READERS[reader](filename, **reader_kws)
+    return reader, group, time.monotonic() - t0
+
+def _import_task(args):
+    """read data file and write cache in a worker process, returning
+    (reader, encoded group, arrays, parse time, error message)"""
+    filename, reader, reader_kws, cachefile = args
+    try:
+        reader, group, dtime = _read_datafile(filename, reader, reader_kws)
+        buffers = ArrayBuffers()
+        text = str2bytes(json.dumps(encode4js(group, buffers)))
+        if cachefile is not None:
+            _write_cache(cachefile, os.stat(filename), reader, text, buffers)
+    except Exception:
+        return reader, None, None, 0, ''.join(format_exception())
+    return reader, text, list(buffers), dtime, None
+
+def batch_import(sources, reader=None, pattern='*', recurse=False, cache=True,
+                 cache_folder=None, nworkers=None, verbose=False, **reader_kws):
+    """read many data files, using a pool of processes, and caching results
+
+    Arguments:
+        sources (str or list):  file name, glob pattern, or folder name,
+                      or a list of these (see find_datafiles)
+        reader (str or None):  name of reader function to use for all files
+                      ('read_ascii', 'read_xdi', 'read_athena', ...) or None
+                      to guess the reader for each file [None]
+        pattern (str): pattern for files to read in folders ['*']
+        recurse (bool): whether to search sub-folders [False]
+        cache (bool):  whether to use and update the cache [True]
+        cache_folder (str or None): folder for the cache [None, see Note 2]
+        nworkers (int or None): number of worker processes [None, see Note 3]
+        verbose (bool): whether to print the time to read each file [False]
+        reader_kws:   other keyword arguments are passed to the reader
+
+    Returns:
+        list of ImportResult, named tuples with elements
+           `filename`: full path to file
+           `reader`:   name of reader function used
+           `group`:    Group read from file, or None if reading failed
+           `cached`:   bool, whether the group was read from the cache
+           `time`:     time in seconds to parse (or read from cache) the file
+           `error`:    None, or error message if reading failed
+
+    Notes:
+        1. The reader for each file is guessed with guess_filereader(),
+           after testing for Athena project files.
+        2. Results are cached in the `import_cache` folder of the user's
+           larch folder, using a cache file named from the file name,
+           reader, and reader options.  The size and modification time
+           of the file are checked, so that changed files are read again.
+        3. If `nworkers` is None, the number of CPUs - 1 is used.  Files
+           are read in the main process if `nworkers` < 2 or only one file
+           needs to be read.
+
+    Example:
+        >>> for res in batch_import('beamtime/*.xdi'):
+        ...     print(res.filename, res.cached, res.time)
+    """
+    filenames = find_datafiles(sources, pattern=pattern, recurse=recurse)
+    if cache_folder is None:
+        cache_folder = import_cache_folder()
+    results = [None]*len(filenames)
+    tasks = []
+    for i, fname in enumerate(filenames):
+        cachefile = None
+        if cache:
+            cachefile = _cache_file(cache_folder, fname, reader, reader_kws)
+            t0 = time.monotonic()
+            cached = _read_cache(cachefile, os.stat(fname))
+            if cached is not None:
+                results[i] = ImportResult(fname, cached[0], cached[1], True,
+                                          time.monotonic()-t0, None)
+                continue
+        tasks.append((i, (fname, reader, reader_kws, cachefile)))
+
+    if nworkers is None:
+        nworkers = max(1, mp.cpu_count()-1)
+    nworkers = min(nworkers, len(tasks))
+    if nworkers < 2:
+        for i, (fname, freader, kws, cachefile) in tasks:
+            try:
+                freader, group, dtime = _read_datafile(fname, freader, kws)
+                if cachefile is not None:
+                    buffers = ArrayBuffers()
+                    text = str2bytes(json.dumps(encode4js(group, buffers)))
+                    _write_cache(cachefile, os.stat(fname), freader, text, buffers)
+                results[i] = ImportResult(fname, freader, group, False, dtime, None)
+            except Exception:
+                results[i] = ImportResult(fname, freader, None, False, 0,
+                                          ''.join(format_exception()))
+    elif len(tasks) > 0:
+        with mp.Pool(nworkers) as pool:
+            out = pool.map(_import_task, [args for i, args in tasks])
+        for (i, args), (freader, text, arrays, dtime, error) in zip(tasks, out):
+            group = None
+            if error is None:
+                group = decode4js(json.loads(text), ArrayBuffers(arrays))
+            results[i] = ImportResult(args[0], freader, group, False, dtime, error)
+
+    if verbose:
+        for res in results:
+            status = 'cached' if res.cached else 'read'
+            if res.error is not None:
+                status = 'failed'
+            print(f"{res.filename}: {res.reader} {status} {res.time:.4f} sec")
+    return results
@@ -7,6 +7,7 @@ import sys
 import time
 import string
 from pathlib import Path
+from gzip import GzipFile
 from collections import namedtuple
 import numpy as np
 from dateutil.parser import parse as dateparse
@@ -15,14 +16,16 @@ from pyshortcuts import gformat, fix_varname
 
 from larch import Group
 from larch.symboltable import isgroup
-from ..utils import read_textfile, format_exception
+from ..utils import read_textfile, format_exception, is_gzip, unixpath
 from .xafs_beamlines import guess_beamline
 
 nanresult = namedtuple('NanResult', ('file_ok', 'message', 'nan_rows',
                                      'nan_cols', 'inf_rows', 'inf_cols'))
 
 TINY = 1.e-7
-MAX_FILESIZE = 100*1024*1024  # 100 Mb limit
+MAX_FILESIZE = 100*1024*1024  # 100 Mb limit for reading line-by-line
+READ_CHUNKSIZE = 4*1024*1024  # bytes read at a time for chunked reading
+HEADER_DATALINES = 5000  # data lines kept in case they are followed by more data
 COMMENTCHARS = '#;%*!$'
 
 def look_for_nans(path):
@@ -231,6 +234,181 @@ def sum_fluor_channels(dgroup, roi, icr=None, ocr=None, ltime=None, label=None,
 
 
 
+def _ascii_sections_lines(filename):
+    """read header, data, and footer of a column ASCII file, parsing
+    each line of text, from the end of the file to the start.
+
+    Returns (headers, data, footers), with data as a list of rows
+    """
+    if os.stat(filename).st_size > MAX_FILESIZE:
+        raise OSError("File '%s' too big for read_ascii()" % filename)
+
+    text = read_textfile(filename)
+    lines = text.split('\n')
+
+    ncol = None
+    data, footers, headers = [], [], []
+
+    lines.reverse()
+    section = 'FOOTER'
+
+    for line in lines:
+        line = line.strip()
+        if len(line) < 1:
+            continue
+        # look for section transitions (going from bottom to top)
+        if section == 'FOOTER' and not None in getfloats(line):
+            section = 'DATA'
+        elif section == 'DATA' and None in getfloats(line):
+            section = 'HEADER'
+
+        # act of current section:
+        if section == 'FOOTER':
+            footers.append(line)
+        elif section == 'HEADER':
+            headers.append(line)
+        elif section == 'DATA':
+            rowdat  = getfloats(line)
+            if ncol is None:
+                ncol = len(rowdat)
+            elif ncol > len(rowdat):
+                rowdat.extend([np.nan]*(ncol-len(rowdat)))
+            elif ncol < len(rowdat):
+                for i in data:
+                    i.extend([np.nan]*(len(rowdat)-ncol))
+                ncol = len(rowdat)
+            data.append(rowdat)
+
+    footers.reverse()
+    headers.reverse()
+    data.reverse()
+    return headers, data, footers
+
+def _isnumeric(line):
+    "quick test of whether all words in a line are numbers, ignoring date/times"
+    try:
+        for word in line.replace(',', ' ').split():
+            float(word)
+    except ValueError:
+        return False
+    return True
+
+def _loadtxt(lines):
+    "np.loadtxt for lines of numbers, or None if any line cannot be parsed"
+    try:
+        block = np.loadtxt(lines, dtype=np.float64, comments=None, ndmin=2)
+    except ValueError:
+        return None
+    return block if len(block) == len(lines) else None
+
+def _parse_datalines(lines):
+    """parse lines of numbers, with the same number of values on each line,
+    returning an array (nrows, ncols) for the leading lines that are all
+    numbers (as for getfloats), or None if the number of values varies.
+    """
+    plines = lines
+    if any(',' in line for line in lines):
+        plines = [line.replace(',', ' ') for line in lines]
+    block = _loadtxt(plines)
+    if block is None:
+        # try again without non-numeric lines at the end
+        nlines = len(lines)
+        while nlines > 0 and None in getfloats(lines[nlines-1]):
+            nlines -= 1
+        if 0 < nlines < len(lines):
+            block = _loadtxt(plines[:nlines])
+    if block is not None:
+        return block
+
+    rows = []
+    for line in lines:
+        row = getfloats(line)
+        if None in row:
+            break
+        if len(rows) > 0 and len(row) != len(rows[0]):
+            return None
+        rows.append(row)
+    if len(rows) == 0:
+        return np.zeros((0, 0))
+    return np.array(rows, dtype=np.float64)
+
+def _ascii_sections_chunked(filename, chunksize=READ_CHUNKSIZE):
+    """read header, data, and footer of a column ASCII file, reading the
+    file in chunks, and parsing blocks of data lines with np.loadtxt.
+
+    Returns (headers, data, footers), with data as an array (nrows, ncols),
+    or None if the file has non-ASCII text, a varying number of columns,
+    or a long block of data lines before the final block of data lines,
+    which need _ascii_sections_lines()
+    """
+    headers, footers, blocks, datalines = [], [], [], []
+    section = 'HEADER'
+    fopen = GzipFile if is_gzip(filename) else open
+    with fopen(unixpath(filename), 'rb') as fh:
+        rest = b''
+        while True:
+            chunk = fh.read(chunksize)
+            buff = rest + chunk
+            if len(chunk) > 0:
+                buff, sep, rest = buff.rpartition(b'\n')
+            elif len(buff) == 0:
+                break
+            else:
+                rest = b''
+            try:
+                text = buff.decode('ascii')
+            except UnicodeDecodeError:
+                return None
+            lines = [line.strip() for line in text.replace('\r', '\n').split('\n')]
+            lines = [line for line in lines if len(line) > 0]
+
+            i = 0
+            while i < len(lines):
+                if section == 'HEADER':
+                    if _isnumeric(lines[i]):
+                        section = 'DATA'
+                        # as when reading up from the data, preceding
+                        # lines with date/times are also data lines
+                        while len(headers) > 0 and not None in getfloats(headers[-1]):
+                            lines.insert(i, headers.pop())
+                    else:
+                        headers.append(lines[i])
+                        i += 1
+                elif section == 'DATA':
+                    block = _parse_datalines(lines[i:])
+                    if block is None:
+                        return None
+                    if len(block) > 0:
+                        if len(blocks) > 0 and block.shape[1] != blocks[0].shape[1]:
+                            return None
+                        blocks.append(block)
+                        if datalines is not None:
+                            datalines.extend(lines[i:i+len(block)])
+                            if len(datalines) > HEADER_DATALINES:
+                                datalines = None
+                    i += len(block)
+                    if i < len(lines):
+                        section = 'FOOTER'
+                else:
+                    if _isnumeric(lines[i]):
+                        # another block of data: data and footer so far are header
+                        if datalines is None:
+                            return None
+                        headers.extend(datalines)
+                        headers.extend(footers)
+                        blocks, datalines, footers = [], [], []
+                        section = 'HEADER'
+                    elif not None in getfloats(lines[i]):
+                        return None
+                    else:
+                        footers.append(lines[i])
+                        i += 1
+
+    if len(blocks) == 0:  # no data, or only date/times
+        return None
+    return headers, np.concatenate(blocks), footers
+
+
 def read_ascii(filename, labels=None, simple_labels=False,
                sort=False, sort_column=0):
     """read a column ascii column file, returning a group
@@ -275,6 +453,12 @@ def read_ascii(filename, labels=None, simple_labels=False,
 
          these will be parsed into a 'attrs' dictionary in the returned group.
 
+      4. reading. Files are read in chunks, with blocks of data lines parsed
+         with `np.loadtxt`. Files with non-ASCII text, date/time values in
+         the data, rows with different numbers of columns or with more than
+         one block of data lines are read line-by-line, which is slower, and
+         limited to files of at most MAX_FILESIZE (100 Mb).
+
     Examples:
 
         >>> feo_data = read_ascii('feo_rt1.dat')
@@ -295,50 +479,13 @@ def read_ascii(filename, labels=None, simple_labels=False,
     """
     if not Path(filename).is_file():
         raise OSError("File not found: '%s'" % filename)
-    if os.stat(filename).st_size > MAX_FILESIZE:
-        raise OSError("File '%s' too big for read_ascii()" % filename)
-
-    text = read_textfile(filename)
-    lines = text.split('\n')
-
-    ncol = None
-    data, footers, headers = [], [], []
-
-    lines.reverse()
-    section = 'FOOTER'
-
-    for line in lines:
-        line = line.strip()
-        if len(line) < 1:
-            continue
-        # look for section transitions (going from bottom to top)
-        if section == 'FOOTER' and not None in getfloats(line):
-            section = 'DATA'
-        elif section == 'DATA' and None in getfloats(line):
-            section = 'HEADER'
-
-        # act of current section:
-        if section == 'FOOTER':
-            footers.append(line)
-        elif section == 'HEADER':
-            headers.append(line)
-        elif section == 'DATA':
-            rowdat  = getfloats(line)
-            if ncol is None:
-                ncol = len(rowdat)
-            elif ncol > len(rowdat):
-                rowdat.extend([np.nan]*(ncol-len(rowdat)))
-            elif ncol < len(rowdat):
-                for i in data:
-                    i.extend([np.nan]*(len(rowdat)-ncol))
-                ncol = len(rowdat)
-            data.append(rowdat)
 
-    # reverse header, footer, data, convert to arrays
-    footers.reverse()
-    headers.reverse()
-    data.reverse()
-    data = np.array(data).transpose()
+    sections = _ascii_sections_chunked(filename)
+    if sections is None:
+        sections = _ascii_sections_lines(filename)
+    headers, data, footers = sections
+    data = np.asarray(data).transpose()
+    ncol = len(data)
 
     # try to parse attributes from header text
     header_attrs = {}
@@ -648,7 +795,7 @@ def guess_filereader(path, return_text=False):
     name of function (as a string) to use to read file
     if return_text: text of the read file
     """
-    text = read_textfile(path)
+    text = read_textfile(path, size=None if return_text else 4096)
     lines = text.split('\n')
     line1 = lines[0].lower()
     reader = 'read_ascii'
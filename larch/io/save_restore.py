@@ -1,8 +1,12 @@
+import os
 import json
 import time
+import gzip
+import zlib
 import numpy as np
 import uuid, socket, platform
 from collections import namedtuple
+from collections.abc import Mapping
 
 from gzip import GzipFile
 
@@ -12,7 +16,15 @@ from pyshortcuts import bytes2str, str2bytes, fix_varname, gformat
 
 from larch import Group, isgroup, __date__, __version__, __release_version__
 from ..utils import read_textfile, unique_name, format_exception, unixpath, isotime
-from ..utils.jsonutils import encode4js, decode4js
+from ..utils.jsonutils import (encode4js, decode4js, ArrayBuffers,
+                               ArrayFileReader)
+
+# version 2 session files have a fixed-size text header, giving the
+# layout (offset, size) of the gzip-compressed session text, the table
+# of contents for the symbols, the symbols (each compressed separately),
+# the offsets of the arrays, and the arrays, stored as binary buffers
+LARIX_HEADSIZE = 256
+MMAP_MINSIZE = 2**20
 
 SessionStore = namedtuple('SessionStore', ('config', 'command_history', 'symbols'))
 
@@ -66,7 +78,7 @@ def read_groups(fname):
 
 
 def save_session(fname=None, symbols=None, histbuff=None,
-                auto_xasgroups=False, _larch=None):
+                auto_xasgroups=False, binary=True, _larch=None):
     """save all groups and data into a Larch Save File (.larix)
     A portable compressed json file, that can be loaded with `read_session()`
 
@@ -80,6 +92,9 @@ def save_session(fname=None, symbols=None, histbuff=None,
                `_xasgroups` dictionary for "XAS Groups" as used by
                Larix, which will include all symbols that are Groups
                and have both 'filename' and 'groupname' attributes.
+        binary [bool]: whether to save arrays as binary data (Larix 2.0 format),
+               which is much faster to save and read [True].  Use `False`
+               for Larix 1.0 files, readable by older versions of Larch.
 
     Notes:
         1. if `symbols` is `None` (default), all variables outside of the
@@ -92,6 +107,8 @@ def save_session(fname=None, symbols=None, histbuff=None,
            Larix to decide what groups to present as "Data Groups") from the
            supplied or available symbols: every Group with a "groupname" and
            "filename" will be included.
+        4. the file is written to a temporary file that then replaces `fname`,
+           so that arrays memory-mapped from an existing `fname` stay valid.
 
     See Also:
         read_session, load_session, clear_sessio
@@ -106,7 +123,8 @@ def save_session(fname=None, symbols=None, histbuff=None,
         raise ValueError('_larch not defined')
     symtab = _larch.symtable
 
-    buff = ["##LARIX: 1.0      Larch Session File",
+    version = '2.0' if binary else '1.0'
+    buff = [f"##LARIX: {version}      Larch Session File",
             "##Date Saved: %s"   % time.strftime('%Y-%m-%d %H:%M:%S'),
             "##<CONFIG>",
             "##Machine Platform: %s" % platform.system(),
@@ -157,26 +175,259 @@ def save_session(fname=None, symbols=None, histbuff=None,
             obj = getattr(symtab, sname, None)
             if isgroup(obj):
                 gname = getattr(obj, 'groupname', None)
-                fname = getattr(obj, 'filename', None)
-                if gname is not None and fname is not None:
-                    _xasgroups[fname] = gname
+                filename = getattr(obj, 'filename', None)
+                if gname is not None and filename is not None:
+                    _xasgroups[filename] = gname
 
-    buff.append("##<Symbols: count=%d>"  % len(symbols))
+    symdata = {}
     if _xasgroups is not None:
-        buff.append('<:_xasgroups:>')
-        buff.append(json.dumps(encode4js(_xasgroups)))
-
+        symdata['_xasgroups'] = _xasgroups
     for attr in symbols:
         if attr not in core_groups:
+            symdata[attr] = getattr(symtab, attr)
+
+    fname = unixpath(fname)
+    tmpname = fname + '.tmp'
+    if binary:
+        buff.append("")
+        write_larix2(tmpname, str2bytes("\n".join(buff)), symdata)
+    else:
+        buff.append("##<Symbols: count=%d>"  % len(symdata))
+        for attr, obj in symdata.items():
             buff.append(f'<:{attr}:>')
-            buff.append(json.dumps(encode4js(getattr(symtab, attr))))
+            buff.append(json.dumps(encode4js(obj)))
+        buff.append("##</Symbols>")
+        buff.append("")
+        fh = GzipFile(tmpname, "w")
+        fh.write(str2bytes("\n".join(buff)))
+        fh.close()
+    os.replace(tmpname, fname)
+
+def write_larix2(fname, text, symdata):
+    """write Larix 2.0 session file, with a fixed-size header giving the
+    layout of the compressed session text, the table of contents for the
+    separately compressed symbols, and the binary arrays"""
+    buffers = ArrayBuffers()
+    toc, blocks, pos = [], [], 0
+    for name, obj in symdata.items():
+        block = zlib.compress(str2bytes(json.dumps(encode4js(obj, buffers))))
+        entry = {'name': name, 'offset': pos, 'size': len(block),
+                 'class': obj.__class__.__name__}
+        if isgroup(obj):
+            entry['attrs'] = dir(obj)
+        toc.append(entry)
+        blocks.append(block)
+        pos += len(block)
+
+    layout = {}
+    with open(fname, 'wb') as fh:
+        fh.write(b' '*LARIX_HEADSIZE)
+        for key, data in (('text', gzip.compress(text)),
+                          ('toc', gzip.compress(str2bytes(json.dumps(toc)))),
+                          ('symbols', b''.join(blocks)),
+                          ('offsets', np.zeros(len(buffers), dtype='<i8').tobytes())):
+            layout[key] = (fh.tell(), len(data))
+            fh.write(data)
+        fh.write(b'\0'*(-fh.tell() % 16))
+        pos = fh.tell()
+        offsets = buffers.write(fh)
+        layout['arrays'] = (pos, fh.tell()-pos)
+        fh.seek(layout['offsets'][0])
+        fh.write(offsets.tobytes())
+
+        head = "##LARIX: 2.0      Larch Session File\n"
+        head = head + f"##Layout: {json.dumps(layout)}"
+        fh.seek(0)
+        fh.write(str2bytes(head.ljust(LARIX_HEADSIZE-1) + '\n'))
+
+
+class SessionSymbols(Mapping):
+    "read-only mapping of symbols in a SessionFile, decoded when accessed"
+    def __init__(self, session):
+        self.session = session
+
+    def __getitem__(self, name):
+        return self.session.get_symbol(name)
+
+    def __contains__(self, name):
+        return name in self.session.toc
+
+    def __iter__(self):
+        return iter(self.session.toc)
+
+    def __len__(self):
+        return len(self.session.toc)
+
+
+class SessionFile:
+    """Larch Session File, opened for reading, with symbols read and decoded
+    only when needed.
 
-    buff.append("##</Symbols>")
-    buff.append("")
+    Arguments:
+         fname (str):  name of session file
+         mmap_arrays (bool): whether to memory-map large arrays [False]
 
-    fh = GzipFile(unixpath(fname), "w")
-    fh.write(str2bytes("\n".join(buff)))
-    fh.close()
+    Attributes:
+         config           - a dict of configuration for the saved session.
+         command_history  - a list of commands in the saved session.
+         toc              - a dict of {name: info} for the symbols in the session
+         symbols          - mapping of symbol names to Larch/Python symbols,
+                            each read from the file when first accessed.
+
+    Notes:
+        For Larix 2.0 files, the table of contents (`toc`) gives the
+        class name, and for Groups, the attribute names of each symbol,
+        and each symbol is read from the file as needed. For older
+        files, the file is read on opening, but each symbol is decoded
+        only as needed.
+
+    See Also:
+        open_session, read_session
+    """
+    def __init__(self, fname, mmap_arrays=False):
+        self.filename = unixpath(fname)
+        self.mmap_arrays = mmap_arrays
+        self.config = {}
+        self.command_history = []
+        self.toc = {}
+        self.layout = None
+        self._text = {}
+        self._cache = {}
+
+        with open(self.filename, 'rb') as fh:
+            head = fh.read(LARIX_HEADSIZE)
+        if not head.startswith(b'##LARIX: 2'):
+            self._parse_text(read_textfile(fname))
+            return
+
+        layout = bytes2str(head).split('\n')[1]
+        if not layout.startswith('##Layout:'):
+            raise ValueError(f"Invalid Larch session file: '{fname:s}'")
+        self.layout = json.loads(layout.split(':', 1)[1])
+        with open(self.filename, 'rb') as fh:
+            self._parse_text(bytes2str(gzip.decompress(self._read(fh, 'text'))))
+            if 'toc' in self.layout:
+                for entry in json.loads(gzip.decompress(self._read(fh, 'toc'))):
+                    self.toc[entry.pop('name')] = entry
+            self.offsets = np.frombuffer(self._read(fh, 'offsets'), dtype='<i8')
+
+    def _read(self, fh, section):
+        "read section of Larix 2.0 file"
+        offset, size = self.layout[section]
+        fh.seek(offset)
+        return fh.read(size)
+
+    def _parse_text(self, text):
+        lines = text.split('\n')
+        line0 = lines.pop(0)
+        if not line0.startswith('##LARIX:'):
+            raise ValueError(f"Invalid Larch session file: '{self.filename:s}'")
+
+        self.version = line0.split()[1]
+        self.config['Larix Version'] = self.version
+        section = symname = '_unknown_'
+        for line in lines:
+            if line.startswith("##<"):
+                section = line.replace('##<','').replace('>', '').strip().lower()
+                if ':' in section:
+                    section, options = section.split(':', 1)
+                if section.startswith('/'):
+                    section = '_unknown_'
+            elif section == 'session commands':
+                self.command_history.append(line)
+
+            elif section == 'symbols':
+                if line.startswith('<:') and line.endswith(':>'):
+                    symname = line.replace('<:', '').replace(':>', '')
+                    self.toc[symname] = {}
+                else:
+                    self._text[symname] = line
+            else:
+                if line.startswith('##') and ':' in line:
+                    line = line[2:]
+                    key, val = line.split(':', 1)
+                    key = key.strip()
+                    val = val.strip()
+                    if '[' in val or '{' in val:
+                        try:
+                            val = decode4js(json.loads(val))
+                        except:
+                            print(''.join(format_exception()))
+                            print("decode failed @## ", repr(val)[:50])
+                    self.config[key] = val
+
+    @property
+    def symbols(self):
+        return SessionSymbols(self)
+
+    def read_symbols(self, names=None):
+        """read and decode symbols, returning a dict of {name: value}
+
+        Arguments:
+            names (list of str or None): names of symbols to read [None, for all]
+        """
+        if names is None:
+            names = list(self.toc.keys())
+        todo = [name for name in names
+                if name in self.toc and name not in self._cache]
+        if len(todo) > 0:
+            arrays = fh = None
+            if self.layout is not None:
+                arrays = ArrayFileReader(self.filename, self.layout['arrays'][0],
+                                         self.offsets, mmap_minsize=(MMAP_MINSIZE
+                                         if self.mmap_arrays else None))
+                fh = arrays.fh
+            for name in todo:
+                if name in self._text:
+                    text = self._text.pop(name)
+                else:
+                    fh.seek(self.layout['symbols'][0] + self.toc[name]['offset'])
+                    text = zlib.decompress(fh.read(self.toc[name]['size']))
+                try:
+                    self._cache[name] = decode4js(json.loads(text), arrays)
+                except:
+                    print(''.join(format_exception()))
+                    print("decode failed:: ", name, repr(text)[:50])
+            if arrays is not None:
+                arrays.close()
+        return {name: self._cache[name] for name in names if name in self._cache}
+
+    def get_symbol(self, name):
+        "read and decode one symbol"
+        if name not in self.toc:
+            raise KeyError(name)
+        return self.read_symbols([name])[name]
+
+    def get_attrs(self, name):
+        "return list of attribute names for a symbol that is a Group"
+        if 'attrs' not in self.toc[name]:
+            obj = self.get_symbol(name)
+            self.toc[name]['class'] = obj.__class__.__name__
+            self.toc[name]['attrs'] = dir(obj) if isgroup(obj) else []
+        return self.toc[name]['attrs']
+
+
+def open_session(fname, mmap_arrays=False):
+    """open Larch Session File for reading, returning a SessionFile,
+    which reads symbols from the file only as they are needed.
+
+    Arguments:
+         fname (str):  name of session file
+         mmap_arrays (bool): whether to memory-map large arrays from Larix 2.0
+                         files, so that they are read only when used [False]
+
+    Returns:
+         SessionFile
+
+    Example:
+         >>> session = open_session('my.larix')
+         >>> print(list(session.symbols))
+         >>> data = session.symbols['data1']
+
+    See Also:
+       read_session, load_session
+    """
+    return SessionFile(fname, mmap_arrays=mmap_arrays)
 
 def clear_session(_larch=None):
     """clear user-definded data in a session
@@ -196,12 +447,16 @@ def clear_session(_larch=None):
             delattr(_larch.symtable, attr)
 
 
-def read_session(fname, clean_xasgroups=True):
+def read_session(fname, clean_xasgroups=True, mmap_arrays=False):
     """read Larch Session File, returning data into new data in the
     current session
 
     Arguments:
          fname (str):  name of save file
+         clean_xasgroups (bool): whether to remove `_xasgroups` entries
+                         for missing groups [True]
+         mmap_arrays (bool): whether to memory-map large arrays from Larix 2.0
+                         files, so that they are read only when used [False]
 
     Returns:
        Tuple
@@ -212,55 +467,11 @@ def read_session(fname, clean_xasgroups=True):
            | symbols         - a dict of Larch/Python symbols, groups, etc
 
     See Also:
-       load_session
-
+       open_session, load_session
 
     """
-    text = read_textfile(fname)
-    lines = text.split('\n')
-    line0 = lines.pop(0)
-    if not line0.startswith('##LARIX:'):
-        raise ValueError(f"Invalid Larch session file: '{fname:s}'")
-
-    version = line0.split()[1]
-
-    symbols = {}
-    config = {'Larix Version': version}
-    cmd_history = []
-    nsyms = nsym_expected = 0
-    section = symname = '_unknown_'
-    for line in lines:
-        if line.startswith("##<"):
-            section = line.replace('##<','').replace('>', '').strip().lower()
-            if ':' in section:
-                section, options = section.split(':', 1)
-            if section.startswith('/'):
-                section = '_unknown_'
-        elif section == 'session commands':
-            cmd_history.append(line)
-
-        elif section == 'symbols':
-            if line.startswith('<:') and line.endswith(':>'):
-                symname = line.replace('<:', '').replace(':>', '')
-            else:
-                try:
-                    symbols[symname] = decode4js(json.loads(line))
-                except:
-                    print(''.join(format_exception()))
-                    print("decode failed:: ", symname, repr(line)[:50])
-        else:
-            if line.startswith('##') and ':' in line:
-                line = line[2:]
-                key, val = line.split(':', 1)
-                key = key.strip()
-                val = val.strip()
-                if '[' in val or '{' in val:
-                    try:
-                        val = decode4js(json.loads(val))
-                    except:
-                        print(''.join(format_exception()))
-                        print("decode failed @## ", repr(val)[:50])
-                config[key] = val
+    session = SessionFile(fname, mmap_arrays=mmap_arrays)
+    symbols = session.read_symbols()
     if '_xasgroups' in symbols and clean_xasgroups:
         missing = []
         for name, group in symbols['_xasgroups'].items():
@@ -269,10 +480,11 @@ def read_session(fname, clean_xasgroups=True):
         for name in missing:
             symbols['_xasgroups'].pop(name)
 
-    return SessionStore(config, cmd_history, symbols)
+    return SessionStore(session.config, session.command_history, symbols)
 
 
-def load_session(fname, ignore_groups=None, include_xasgroups=None, _larch=None, verbose=False):
+def load_session(fname, ignore_groups=None, include_xasgroups=None,
+                 mmap_arrays=False, _larch=None, verbose=False):
     """load all data from a Larch Session File into current larch session,
     merging into existing groups as appropriate (see Notes below)
 
@@ -281,6 +493,7 @@ def load_session(fname, ignore_groups=None, include_xasgroups=None, _larch=None,
        ignore_groups (list of strings): list of symbols to not import
        include_xasgroups (list of strings): list of symbols to import as XAS spectra,
                            even if not expicitly set in `_xasgroups`
+       mmap_arrays (bool): whether to memory-map large arrays [False]
        verbose (bool): whether to print warnings for overwrites [False]
     Returns:
         None
@@ -294,11 +507,13 @@ def load_session(fname, ignore_groups=None, include_xasgroups=None, _larch=None,
         2. to avoid name clashes, group and file names in the `_xasgroups` dictionary
            may be modified on loading
 
+        3. symbols in `ignore_groups` are not read from Larix 2.0 files.
+
     """
     if _larch is None:
         raise ValueError('load session needs a larch session')
 
-    session = read_session(fname)
+    session = SessionFile(fname, mmap_arrays=mmap_arrays)
 
     if ignore_groups is None:
         ignore_groups = []
@@ -307,13 +522,27 @@ def load_session(fname, ignore_groups=None, include_xasgroups=None, _larch=None,
 
     # special groups to merge into existing session:
     #  _feffpaths, _feffcache, _xasgroups
-    s_symbols = session.symbols
-    s_xasgroups = s_symbols.pop('_xasgroups', {})
-
+    special = ('_xasgroups', '_feffpaths', '_feffcache')
+    s_special = session.read_symbols(special)
+    s_xasgroups = {key: gname for key, gname in
+                   s_special.get('_xasgroups', {}).items() if gname in session.toc}
     s_xasg_inv = invert_dict(s_xasgroups)
 
-    s_feffpaths = s_symbols.pop('_feffpaths', {})
-    s_feffcache = s_symbols.pop('_feffcache', EMPTY_FEFFCACHE)
+    s_feffpaths = s_special.get('_feffpaths', {})
+    s_feffcache = s_special.get('_feffcache', EMPTY_FEFFCACHE)
+
+    names = []
+    for sym in session.toc:
+        if sym in special:
+            continue
+        if sym in ignore_groups:
+            if sym in s_xasgroups.values():
+                s_key = s_xasg_inv[sym]
+                s_xasgroups.pop(s_key)
+                s_xasg_inv = invert_dict(s_xasgroups)
+        else:
+            names.append(sym)
+    s_symbols = session.read_symbols(names)
 
     symtab = _larch.symtable
     if not hasattr(symtab, '_xasgroups'):
@@ -333,13 +562,6 @@ def load_session(fname, ignore_groups=None, include_xasgroups=None, _larch=None,
     c_xas_gnames = list(symtab._xasgroups.values())
 
     for sym, val in s_symbols.items():
-        if sym in ignore_groups:
-            if sym in s_xasgroups.values():
-                s_key = s_xasg_inv[sym]
-                s_xasgroups.pop(s_key)
-                s_xasg_inv = invert_dict(s_xasgroups)
-
-            continue
         if sym in c_xas_gnames or sym in include_xasgroups:
             newsym = unique_name(sym, c_xas_gnames)
             c_xas_gnames.append(newsym)
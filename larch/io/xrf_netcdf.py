@@ -60,102 +60,120 @@ class xMAPData(object):
 
 CLOCKTICK = 0.320  # xmap clocktick = 320 ns
 
-def read_xrf_netcdf(fname, npixels=None, verbose=False):
-    # Reads a netCDF file created with the DXP xMAP driver
-    # with the netCDF plugin buffers
-    if verbose:
-        print( ' reading ', fname)
-    t0 = time.time()
-    # read data from array_data variable of netcdf file
-    read_ok = False
-    fh = None
-    try:
-        fh = netcdf_file(fname,'r')
-        read_ok = True
-    except:
-        time.sleep(0.010)
+# buffer header, 256 words at the start of each (array, module) buffer.
+# 32 bit values are held as 2 words, low word first.
+XMAP_BUFFER_HEADER = np.dtype([('tag0', 'u2'), ('tag1', 'u2'), ('headerSize', 'u2'),
+                               ('mappingMode', 'u2'), ('runNumber', 'u2'),
+                               ('bufferNumber', 'u2', (2,)), ('bufferID', 'u2'),
+                               ('numPixels', 'u2'), ('startingPixel', 'u2', (2,)),
+                               ('moduleNumber', 'u2'), ('channelID', 'u2', (8,)),
+                               ('channelSize', 'u2', (4,)), ('bufferErrors', 'u2'),
+                               ('reserved', 'u2', (7,)), ('userDefined', 'u2', (32,)),
+                               ('spare', 'u2', (192,))])
+
+def _words2long(words):
+    """combine pairs of 16 bit words along the last axis (low word first)
+    into 32 bit integers, as aslong() does for a single buffer"""
+    words = np.asarray(words).astype(np.uint16).astype(np.uint32)
+    return (words[..., 0::2] | (words[..., 1::2] << 16)).view(np.int32)
+
+def _open_netcdf(fname):
+    "open netcdf file, trying a second time on failure"
+    for i in range(2):
         try:
-            fh = netcdf_file(fname,'r')
-            read_ok = True
+            return netcdf_file(fname, 'r', mmap=True)
         except:
-            pass
-
-    if not read_ok or fh is None:
-        if fh is not None:
-            fh.close()
-        return None
-
-    array_data = fh.variables['array_data']
-    t1 = time.time()
-
-    # array_data will normally be 3d:
-    #  shape = (narrays, nmodules, buffersize)
-    # but nmodules and narrays could be 1, so that
-    # array_data could be 1d or 2d.
-    #
-    # here we force the data to be 3d
+            time.sleep(0.010)
+    return None
+
+def _as_3d(array_data):
+    """array_data will normally be 3d:
+        shape = (narrays, nmodules, buffersize)
+    but nmodules and narrays could be 1, so that
+    array_data could be 1d or 2d.  Here we force the data to be 3d"""
     shape = array_data.shape
     if len(shape) == 1:
-        array_data.shape = (1, 1, shape[0])
+        return array_data.reshape((1, 1, shape[0]))
     elif len(shape) == 2:
-        array_data.shape = (1, shape[0], shape[1])
-
+        return array_data.reshape((1, shape[0], shape[1]))
+    return array_data
+
+def extract_xmap_data(array_data):
+    """extract xMAPData from array_data of an xMAP netcdf file, as
+    (narrays, nmodules, buffersize) array of 16 bit words.
+
+    All buffer headers are parsed at once with the XMAP_BUFFER_HEADER
+    dtype, and the counts, times and input/output counts for all pixels
+    of all buffers are taken with slicing and fancy indexing, without
+    looping over buffers.
+    """
+    array_data = _as_3d(array_data)
     narrays, nmodules, buffersize = array_data.shape
-    modpixs    = int(max(124, array_data[0, 0, 8]))
-    npix_total = 0
+    headers = array_data[:, :, :256].astype(np.uint16).view(XMAP_BUFFER_HEADER)[..., 0]
+    modpixs = int(max(124, array_data[0, 0, 8]))
+    pixels = array_data[:, :, 256:256+modpixs*((buffersize-256)//modpixs)]
+    pixels = pixels.reshape(narrays, nmodules, modpixs, -1)
+
+    # pixels with data are given by the number of pixels of module 0
+    # for each array, ordered by array, then pixel
+    valid = np.arange(modpixs) < headers['numPixels'][:, 0:1]
+    arrs, pixs = np.nonzero(valid)
+    npix_total = len(arrs)
+
+    mapmode = pixels[0, 0, 0, 3]
+    if mapmode == 1:  # mapping, full spectra
+        nchans = int(headers['channelSize'][0, 0, 0])
+        data_slice = slice(256, 256+4*nchans)
+    elif mapmode == 2:  # ROI mode
+        # Note:  nchans = number of ROIS !!
+        nchans     = int(max(pixels[0, 0, 0, 8:12]))
+        data_slice = slice(64, 64+8*nchans)
+
+    xmapdat = xMAPData(0, nmodules, nchans)
+    xmapdat.firstPixel = int(_words2long(headers['startingPixel'][0, 0])[0])
+    xmapdat.numPixels = npix_total
+
+    # ordered as (array, pixel, module, ...), selecting valid pixels,
+    # with module m giving detectors 4*m to 4*m+3
+    pixels = pixels.transpose(0, 2, 1, 3)
+    ndet = 4*nmodules
+
+    counts = pixels[arrs, pixs, :, data_slice]
+    if mapmode == 2:
+        counts = _words2long(counts)
+    xmapdat.counts = counts.reshape(npix_total, ndet, nchans).astype('i2', copy=False)
+
+    # acquistion times and i/o counts data are stored
+    # as longs in locations 32:64 of each pixel header
+    t_times = _words2long(pixels[arrs, pixs, :, 32:64]).reshape(npix_total, ndet, 4)
     # real / live times are returned in microseconds.
-    for array in range(narrays):
-        for module in range(nmodules):
-            d   = array_data[array,module, :]
-            bh  = xMAPBufferHeader(d)
-            #if verbose and array==0:
-            dat = d[256:].reshape(modpixs, int((d.size-256)/modpixs ))
-
-            npix = bh.numPixels
-            if module == 0:
-                npix_total += npix
-                if array == 0:
-                    # first time through, (array,module)=(0,0) we
-                    # read mapping mode, set up how to slice the
-                    # data, and build data arrays in xmapdat
-                    mapmode = dat[0, 3]
-                    if mapmode == 1:  # mapping, full spectra
-                        nchans = d[20]
-                        data_slice = slice(256, 8448)
-                    elif mapmode == 2:  # ROI mode
-                        # Note:  nchans = number of ROIS !!
-                        nchans     = max(d[264:268])
-                        data_slice = slice(64, 64+8*nchans)
-                    xmapdat = xMAPData(narrays*modpixs, nmodules, nchans)
-                    xmapdat.firstPixel = bh.startingPixel
-
-            # acquistion times and i/o counts data are stored
-            # as longs in locations 32:64
-            t_times = aslong(dat[:npix, 32:64]).reshape(npix, 4, 4)
-            p1 = npix_total - npix
-            p2 = npix_total
-            xmapdat.realTime[p1:p2, :]     = t_times[:, :, 0]
-            xmapdat.liveTime[p1:p2, :]     = t_times[:, :, 1]
-            xmapdat.inputCounts[p1:p2, :]  = t_times[:, :, 2]
-            xmapdat.outputCounts[p1:p2, :] = t_times[:, :, 3]
-
-            # the data, extracted as per data_slice and mapmode
-            t_data = dat[:npix, data_slice]
-            if mapmode == 2:
-                t_data = aslong(t_data)
-            xmapdat.counts[p1:p2, :, :] = t_data.reshape(npix, 4, nchans)
+    xmapdat.realTime = CLOCKTICK * t_times[:, :, 0].astype('i8')
+    xmapdat.liveTime = CLOCKTICK * t_times[:, :, 1].astype('i8')
+    xmapdat.inputCounts  = t_times[:, :, 2]
+    xmapdat.outputCounts = t_times[:, :, 3]
+    return xmapdat
 
+def read_xrf_netcdf(fname, npixels=None, verbose=False):
+    """read a netCDF file created with the DXP xMAP driver
+    with the netCDF plugin buffers, returning xMAPData.
+
+    array_data is memory-mapped, and the data for all buffers is
+    extracted together (see extract_xmap_data).
+    """
+    if verbose:
+        print( ' reading ', fname)
+    t0 = time.time()
+    fh = _open_netcdf(fname)
+    if fh is None:
+        return None
+    t1 = time.time()
+    # all extracted arrays are copies, so that the file can be closed
+    xmapdat = extract_xmap_data(fh.variables['array_data'].data)
     t2 = time.time()
-    xmapdat.numPixels = npix_total
-    xmapdat.counts    = xmapdat.counts[:npix_total]
-    xmapdat.realTime = CLOCKTICK * xmapdat.realTime[:npix_total]
-    xmapdat.liveTime = CLOCKTICK * xmapdat.liveTime[:npix_total]
-    xmapdat.inputCounts  = xmapdat.inputCounts[:npix_total]
-    xmapdat.outputCounts = xmapdat.outputCounts[:npix_total]
     if verbose:
         print('   time to read file    = %5.1f ms' % ((t1-t0)*1000))
         print('   time to extract data = %5.1f ms' % ((t2-t1)*1000))
-        print('   read %i pixels ' %  npix_total)
+        print('   read %i pixels ' %  xmapdat.numPixels)
         print('   data shape:    ' ,  xmapdat.counts.shape)
     fh.close()
     return xmapdat
@@ -40,79 +40,126 @@ class XSP3Data(object):
         self.inputCounts  = np.zeros((npix, ndet), dtype='f8')
         # self.counts       = np.zeros((npix, ndet, nchan), dtype='f4')
 
-def get_counts_carefully(h5link):
-    """
-    get counts array with some error checking for corrupted files,
-    especially those that give
+def _chunk_pixels(h5link, block_pixels=None):
+    """number of pixels to read at a time: a multiple of the number of
+    pixels per chunk, of about `block_pixels` pixels [None, about 32 Mb]"""
+    npix = h5link.shape[0]
+    pixsize = max(1, h5link.dtype.itemsize*int(np.prod(h5link.shape[1:])))
+    chunk = 1 if h5link.chunks is None else h5link.chunks[0]
+    if block_pixels is None:
+        block_pixels = 2**25 // pixsize
+    return max(1, min(npix, int(block_pixels)//chunk)*chunk)
+
+def _bad_pixels(h5link, p0, p1):
+    """list of (start, stop) ranges of pixels between p0 and p1 that
+    cannot be read, found by reading each chunk holding those pixels"""
+    if h5link.chunks is None:
+        sels = [(slice(i, i+1),) for i in range(p0, p1)]
+    else:
+        sels = h5link.iter_chunks((slice(p0, p1),) + tuple(slice(0, n) for n in h5link.shape[1:]))
+    bad = {}
+    for sel in sels:
+        if (sel[0].start, sel[0].stop) in bad:
+            continue
+        try:
+            h5link[sel]
+        except OSError:
+            bad[(sel[0].start, sel[0].stop)] = True
+    return sorted(bad)
+
+def _read_pixel(h5link, i):
+    "read counts for one pixel, or None if not readable"
+    if i < 0 or i >= h5link.shape[0]:
+        return None
+    try:
+        return h5link[i]
+    except OSError:
+        return None
+
+def _ranges(indices):
+    "list of (start, stop) for runs of consecutive indices"
+    if len(indices) == 0:
+        return []
+    breaks = np.where(np.diff(indices) > 1)[0]
+    starts = np.concatenate(([indices[0]], indices[breaks+1]))
+    stops = np.concatenate((indices[breaks], [indices[-1]])) + 1
+    return list(zip(starts, stops))
+
+def read_counts_block(h5link, p0, p1):
+    """read counts for pixels p0 to p1-1, with some error checking for
+    corrupted files, especially those that give
        'OSError: Can't read data (inflate() failed)'
-    because one data point is bad.
+    because one chunk is bad.
 
-    This seems to be a common enough failure mode that this function looks
-    for such points and replaces offending points by the average of the
-    neighboring points
+    Pixels in unreadable chunks are replaced by the average of the
+    neighboring pixels, for one bad pixel, or by the nearest good pixel.
     """
     # will usually succeed, of course.
     try:
-        return h5link[()]
+        return h5link[p0:p1]
     except OSError:
         pass
 
-    # find bad point
-    npts = h5link.shape[0]
-    ilo, ihi = 0, npts
-    imid = (ihi-ilo)//2
-    while (ihi-ilo) > 1:
-        try:
-            _tmp = h5link[ilo:imid]
-            ilo, imid = imid, ihi
-        except OSError:
-            ihi, imid = imid, (imid+ilo)//2
+    counts = np.zeros((p1-p0,) + h5link.shape[1:], dtype=h5link.dtype)
+    good = np.ones(p1-p0, dtype=bool)
+    for b0, b1 in _bad_pixels(h5link, p0, p1):
+        good[b0-p0:b1-p0] = False
+    for i0, i1 in _ranges(np.where(good)[0]):
+        counts[i0:i1] = h5link[p0+i0:p0+i1]
+    bad = [(p0+i0, p0+i1) for i0, i1 in _ranges(np.where(~good)[0])]
+
+    nbad = sum(b1-b0 for b0, b1 in bad)
+    print("fixing %d bad point%s in h5 file" % (nbad, '' if nbad == 1 else 's'))
+    for b0, b1 in bad:
+        lo = counts[b0-p0-1] if b0 > p0 else _read_pixel(h5link, b0-1)
+        hi = _read_pixel(h5link, b1)
+        if lo is None and hi is None:
+            continue
+        if b1 - b0 == 1 and lo is not None and hi is not None:
+            counts[b0-p0] = ((lo + hi)/2.0).astype(h5link.dtype)
+            continue
+        mid = (b0+b1+1)//2
+        if lo is None:
+            lo, mid = hi, b1
+        elif hi is None:
+            mid = b1
+        counts[b0-p0:mid-p0] = lo
+        if mid < b1:
+            counts[mid-p0:b1-p0] = hi
+    return counts
 
-    # retest to make sure there is one bad point
-    for i in range(ilo, ihi):
-        try:
-            _tmp = h5link[i]
-        except OSError:
-            ibad = i
-            break
+def get_counts_carefully(h5link):
+    """
+    get counts array with some error checking for corrupted files,
+    replacing pixels in unreadable chunks (see read_counts_block)
+    """
+    return read_counts_block(h5link, 0, h5link.shape[0])
 
-    # its not unusual to have two bad points in a row:
-    p1bad = m1bad = False
-    try:
-        _tmp = h5link[i+1]
-    except OSError:
-        p1bad = True
-    try:
-        _tmp = h5link[i-1]
-    except OSError:
-        m1bad = True
-
-    if  m1bad:
-        ibad = ibad - 1
-        p1bad = True
-
-    counts = np.zeros(h5link.shape, dtype=h5link.dtype)
-    counts[:ibad] = h5link[:ibad]
-    counts[ibad+2:] = h5link[ibad+2:]
-    if p1bad: # two in a row
-        print("fixing 2 bad points in h5 file")
-        counts[ibad]   = h5link[ibad-1]
-        counts[ibad+1] = h5link[ibad+2]
-    else:
-        print("fixing bad point in h5 file")
-        counts[ibad+1] = h5link[ibad+1]
-        if ibad == 0:
-            counts[ibad] = counts[ibad+1]
-        elif ibad == npts - 1:
-            counts[ibad] = counts[ibad-1]
-        else:
-            counts[ibad] = ((counts[ibad-1]+counts[ibad+1])/2.0).astype(h5link.dtype)
-    return counts
+def iter_xsp3_counts(h5link, npixels=None, block_pixels=None):
+    """iterate over blocks of pixels of Xspress3 counts, yielding
+    (first pixel, counts) for each block, with counts of shape
+    (npix_block, ndet, nchan) and the dtype of the file.
 
+    Arguments:
+        h5link:        HDF5 dataset of counts ('entry/instrument/detector/data')
+        npixels:       number of pixels to read [None, all pixels]
+        block_pixels:  approximate number of pixels per block [None, see Note]
+
+    Note:
+        blocks are a whole number of HDF5 chunks, of about 32 Mb by default.
+        Corrupted chunks are repaired with read_counts_block.
+    """
+    npts = h5link.shape[0]
+    if npixels is not None:
+        npts = min(npts, npixels)
+    nblock = _chunk_pixels(h5link, block_pixels)
+    for p0 in range(0, npts, nblock):
+        yield p0, read_counts_block(h5link, p0, min(npts, p0+nblock))
 
 def read_xsp3_hdf5(fname, npixels=None, verbose=False,
-                   estimate_dtc=False, **kws):
+                   estimate_dtc=False, block_pixels=None, **kws):
     # Reads a HDF5 file created with the Xspress3 driver
+    # counts are read in blocks of pixels (see iter_xsp3_counts)
     npixels = None
 
     clockrate = 12.5e-3  # microseconds per clock tick: 80MHz clock
@@ -120,7 +167,7 @@ def read_xsp3_hdf5(fname, npixels=None, verbose=False,
     h5file = h5py.File(fname, 'r')
 
     root  = h5file['entry/instrument']
-    counts = get_counts_carefully(root['detector/data'])
+    h5counts = root['detector/data']
 
     # support bother newer and earlier location of NDAttributes
     ndattr = None
@@ -139,8 +186,9 @@ def read_xsp3_hdf5(fname, npixels=None, verbose=False,
 
     # note: sometimes counts has npix-1 pixels, while the time arrays
     # really have npix...  So we take npix from the time array, and
+    # pad counts with zeros
     npix = ndattr['CHAN1SCA0'].shape[0]
-    ndpix, ndet, nchan = counts.shape
+    ndpix, ndet, nchan = h5counts.shape
     if npixels is None:
         npixels = npix
         if npixels < ndpix:
@@ -148,13 +196,14 @@ def read_xsp3_hdf5(fname, npixels=None, verbose=False,
 
     out = XSP3Data(npixels, ndet, nchan)
     out.numPixels = npixels
-    t1 = time.time()
-
     if ndpix < npix:
-        out.counts = np.zeros((npix, ndet, nchan), dtype='f8')
-        out.counts[:ndpix, :, :]  = counts
+        out.counts = np.zeros((npix, ndet, nchan), dtype=h5counts.dtype)
     else:
-        out.counts = counts
+        out.counts = np.empty((npix, ndet, nchan), dtype=h5counts.dtype)
+    for p0, counts in iter_xsp3_counts(h5counts, npixels=ndpix,
+                                       block_pixels=block_pixels):
+        out.counts[p0:p0+len(counts)] = counts
+    t1 = time.time()
 
     if estimate_dtc:
         dtc_taus = [XSPRESS3_TAU]*ndet
@@ -174,6 +223,8 @@ def read_xsp3_hdf5(fname, npixels=None, verbose=False,
         out.realTime[:, i] = rtime
         out.liveTime[:, i] = rtime
         ocounts = out.counts[:, i, 1:-1].sum(axis=1)
+        if ndpix < npix:  # padded pixels get the minimum output counts
+            ocounts = ocounts.astype('f8')
         ocounts[np.where(ocounts<0.1)] = 0.1
         out.outputCounts[:, i] = ocounts
 
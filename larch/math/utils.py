@@ -73,7 +73,8 @@ deriv.__doc__ = np.gradient.__doc__
 
 def realimag(arr):
     "return real array of real/imag pairs from complex array"
-    return np.array([(i.real, i.imag) for i in arr]).flatten()
+    arr = np.asarray(arr)
+    return np.column_stack((arr.real.ravel(), arr.imag.ravel())).ravel()
 
 def complex_phase(arr):
     "return phase, modulo 2pi jumps"
@@ -26,6 +26,11 @@ from larch.utils.logging  import _levels as LoggingLevels
 HAS_STATE = {}
 LarchGroupTypes = {}
 
+# array dtype kinds (bool, int, uint, float, complex) that can be
+# written as binary buffers
+BUFFER_KINDS = 'biufc'
+BUFFER_ALIGN = 16
+
 def setup_larchtypes():
     global HAS_STATE,  LarchGroupTypes
     if len(HAS_STATE) == 0 or len(LarchGroupTypes)==0:
@@ -51,11 +56,12 @@ def setup_larchtypes():
         HAS_STATE['FeffPathGroup'] = FeffPathGroup
 
         from larch import ParameterGroup
-        from larch.io.athena_project import AthenaGroup
+        from larch.io.athena_project import AthenaGroup, AthenaDataGroup
         from larch.xafs import FeffitDataSet, TransformGroup
 
         LarchGroupTypes = {'Group': Group,
                            'AthenaGroup': AthenaGroup,
+                           'AthenaDataGroup': AthenaDataGroup,
                            'ParameterGroup': ParameterGroup,
                            'FeffitDataSet': FeffitDataSet,
                            'TransformGroup': TransformGroup,
@@ -87,13 +93,83 @@ def unpack_minimizer(out):
     return mini
 
 
-def encode4js(obj):
+class ArrayBuffers(list):
+    """list of numerical arrays, used with encode4js() and decode4js()
+    to store arrays as binary data, separate from the json text.
+
+    >>> buffers = ArrayBuffers()
+    >>> text = json.dumps(encode4js(group, buffers))
+    >>> offsets = buffers.write(fh)
+
+    the arrays can be read back with an ArrayFileReader, using the offsets.
+    """
+    def write(self, fh, align=BUFFER_ALIGN):
+        """write arrays to an open binary file, each starting at a multiple
+        of `align` bytes from the current position.
+        Returns array of offsets from the current position"""
+        offsets = np.zeros(len(self), dtype='<i8')
+        pos = 0
+        for i, arr in enumerate(self):
+            pad = -pos % align
+            if pad > 0:
+                fh.write(b'\0'*pad)
+                pos += pad
+            offsets[i] = pos
+            fh.write(arr.tobytes())
+            pos += arr.nbytes
+        return offsets
+
+    def read_array(self, index, dtype, shape):
+        "return copy of array with native byte order"
+        return self[index].astype(dtype.newbyteorder('=')).reshape(shape)
+
+
+class ArrayFileReader:
+    """read arrays written with ArrayBuffers.write() from a file
+
+    Arguments:
+        filename (str):  name of file
+        offset (int):    position in file where arrays start
+        offsets (array): offsets for each array, returned by ArrayBuffers.write()
+        mmap_minsize (int or None): arrays with at least this many bytes
+                         are memory-mapped (copy-on-write) rather than read.
+                         [None, for never]
+    """
+    def __init__(self, filename, offset, offsets, mmap_minsize=None):
+        self.filename = filename
+        self.offset = offset
+        self.offsets = offsets
+        self.mmap_minsize = mmap_minsize
+        self.fh = open(filename, 'rb')
+
+    def read_array(self, index, dtype, shape):
+        pos = self.offset + int(self.offsets[index])
+        count = int(np.prod(shape))
+        if (self.mmap_minsize is not None and count > 0 and
+            count*dtype.itemsize >= self.mmap_minsize):
+            return np.memmap(self.filename, dtype=dtype, mode='c',
+                             offset=pos, shape=shape)
+        self.fh.seek(pos)
+        out = np.fromfile(self.fh, dtype=dtype, count=count).reshape(shape)
+        if not out.dtype.isnative:
+            out = out.astype(dtype.newbyteorder('='))
+        return out
+
+    def close(self):
+        self.fh.close()
+
+
+def encode4js(obj, buffers=None):
     """return an object ready for json encoding.
     has special handling for many Python types
       numpy array
       complex numbers
       Larch Groups
       Larch Parameters
+
+    if `buffers` is an ArrayBuffers (or list), numerical arrays are
+    appended to it as little-endian arrays, and encoded as a reference
+    to their index in `buffers`, instead of as a list of values.
     """
     setup_larchtypes()
     if obj is None:
@@ -101,12 +177,17 @@ def encode4js(obj):
     if isinstance(obj, np.ndarray):
         out = {'__class__': 'Array', '__shape__': obj.shape,
                '__dtype__': obj.dtype.name}
+        if buffers is not None and obj.dtype.kind in BUFFER_KINDS:
+            out['__buffer__'] = len(buffers)
+            buffers.append(np.ascontiguousarray(obj,
+                                     dtype=obj.dtype.newbyteorder('<')))
+            return out
         out['value'] = obj.flatten().tolist()
 
         if 'complex' in obj.dtype.name:
             out['value'] = [(obj.real).tolist(), (obj.imag).tolist()]
         elif obj.dtype.name == 'object':
-            out['value'] = [encode4js(i) for i in out['value']]
+            out['value'] = [encode4js(i, buffers) for i in out['value']]
         return out
     elif isinstance(obj, (bool, np.bool_)):
         return bool(obj)
@@ -143,19 +224,19 @@ def encode4js(obj):
         return {'__class__': 'Slice', 'value': (obj.start, obj.stop, obj.step)}
 
     elif isinstance(obj, list):
-        return {'__class__': 'List', 'value': [encode4js(item) for item in obj]}
+        return {'__class__': 'List', 'value': [encode4js(item, buffers) for item in obj]}
     elif isinstance(obj, tuple):
         if hasattr(obj, '_fields'):  # named tuple!
             return {'__class__': 'NamedTuple',
                     '__name__': obj.__class__.__name__,
                     '_fields': obj._fields,
-                    'value': [encode4js(item) for item in obj]}
+                    'value': [encode4js(item, buffers) for item in obj]}
         else:
-            return {'__class__': 'Tuple', 'value': [encode4js(item) for item in obj]}
+            return {'__class__': 'Tuple', 'value': [encode4js(item, buffers) for item in obj]}
     elif isinstance(obj, dict):
         out = {'__class__': 'Dict'}
         for key, val in obj.items():
-            out[encode4js(key)] = encode4js(val)
+            out[encode4js(key, buffers)] = encode4js(val, buffers)
         return out
     elif isinstance(obj, logging.Logger):
         level = 'DEBUG'
@@ -175,7 +256,7 @@ def encode4js(obj):
                      'nan_policy', 'success', 'nfev', 'nfree', 'ndata', 'ier',
                      'errorbars', 'message', 'lmdif_message', 'chisqr',
                      'redchi', 'covar', 'userkws', 'userargs', 'result'):
-            out[attr] = encode4js(getattr(obj, attr, None))
+            out[attr] = encode4js(getattr(obj, attr, None), buffers)
         return out
     elif isinstance(obj, MinimizerResult):
         out = {'__class__': 'MinimizerResult'}
@@ -185,12 +266,12 @@ def encode4js(obj):
                      'lmdif_message', 'message', 'method', 'ndata', 'nfev',
                      'nfree', 'nvarys', 'params', 'redchi', 'residual',
                      'success', 'var_names'):
-            out[attr] = encode4js(getattr(obj, attr, None))
+            out[attr] = encode4js(getattr(obj, attr, None), buffers)
         return out
     elif isinstance(obj, Parameters):
         out = {'__class__': 'Parameters'}
         o_ast = obj._asteval
-        out['unique_symbols'] = {key: encode4js(o_ast.symtable[key])
+        out['unique_symbols'] = {key: encode4js(o_ast.symtable[key], buffers)
                                  for key in o_ast.user_defined_symbols()}
         out['params'] = [(p.name, p.__getstate__()) for p in obj.values()]
         return out
@@ -207,10 +288,10 @@ def encode4js(obj):
             parnames = dir(obj)
             for par in obj.__params__.keys():
                 if par in parnames:
-                    out[par] = encode4js(getattr(obj, par))
+                    out[par] = encode4js(getattr(obj, par), buffers)
         else:
             for item in dir(obj):
-                out[item] = encode4js(getattr(obj, item))
+                out[item] = encode4js(getattr(obj, item), buffers)
         return out
 
     elif isinstance(obj, ModuleType):
@@ -218,7 +299,7 @@ def encode4js(obj):
     elif hasattr(obj, '__getstate__') and not callable(obj):
         return {'__class__': 'StatefulObject',
                 '__type__': obj.__class__.__name__,
-                'value': encode4js(obj.__getstate__())}
+                'value': encode4js(obj.__getstate__(), buffers)}
     elif isinstance(obj, type):
         return {'__class__': 'Type',  'value': repr(obj),
                 'module': getattr(obj, '__module__', None)}
@@ -237,15 +318,18 @@ def encode4js(obj):
             thing = getattr(obj, attr)
             if not callable(thing):
                 # print("will try to encode thing ", thing, type(thing))
-                out[attr] = encode4js(thing)
+                out[attr] = encode4js(thing, buffers)
         return out
 
     return obj
 
-def decode4js(obj):
+def decode4js(obj, buffers=None):
     """
     return decoded Python object from encoded object.
 
+    `buffers` must be given for objects encoded with `buffers`, and
+    must have a `read_array(index, dtype, shape)` method, as for
+    ArrayBuffers and ArrayFileReader.
     """
     if not isinstance(obj, dict):
         return obj
@@ -260,18 +344,22 @@ def decode4js(obj):
     elif classname in ('List', 'Tuple', 'NamedTuple'):
         out = []
         for item in obj['value']:
-            out.append(decode4js(item))
+            out.append(decode4js(item, buffers))
         if classname == 'Tuple':
             out = tuple(out)
         elif classname == 'NamedTuple':
             out = namedtuple(obj['__name__'], obj['_fields'])(*out)
     elif classname == 'Array':
-        if obj['__dtype__'].startswith('complex'):
+        if '__buffer__' in obj:
+            dtype = np.dtype(obj['__dtype__']).newbyteorder('<')
+            return buffers.read_array(obj['__buffer__'], dtype,
+                                      tuple(obj['__shape__']))
+        elif obj['__dtype__'].startswith('complex'):
             re = np.asarray(obj['value'][0], dtype='double')
             im = np.asarray(obj['value'][1], dtype='double')
             out = re + 1j*im
         elif obj['__dtype__'].startswith('object'):
-            val = [decode4js(v) for v in obj['value']]
+            val = [decode4js(v, buffers) for v in obj['value']]
             out = np.array(val,  dtype=obj['__dtype__'])
 
         else:
@@ -280,7 +368,7 @@ def decode4js(obj):
     elif classname in ('Dict', 'dict'):
         out = {}
         for key, val in obj.items():
-            out[key] = decode4js(val)
+            out[key] = decode4js(val, buffers)
     elif classname == 'Datetime':
         obj = datetime.fromisoformat(obj['isotime'])
     elif classname in ('Path', 'PosixPath'):
@@ -302,29 +390,29 @@ def decode4js(obj):
     elif classname == 'Parameters':
         out = Parameters()
         out.clear()
-        unique_symbols = {key: decode4js(obj['unique_symbols'][key]) for key
+        unique_symbols = {key: decode4js(obj['unique_symbols'][key], buffers) for key
                           in obj['unique_symbols']}
 
         state = {'unique_symbols': unique_symbols, 'params': []}
         for name, parstate in obj['params']:
-            par = Parameter(decode4js(name))
-            par.__setstate__(decode4js(parstate))
+            par = Parameter(decode4js(name, buffers))
+            par.__setstate__(decode4js(parstate, buffers))
             state['params'].append(par)
         out.__setstate__(state)
     elif classname in ('Parameter', 'parameter'):
-        name = decode4js(obj['name'])
-        state = decode4js(obj['state'])
+        name = decode4js(obj['name'], buffers)
+        state = decode4js(obj['state'], buffers)
         out = Parameter(name)
         out.__setstate__(state)
 
     elif classname == 'Model':
         mod = Model(lambda x: x)
-        out = mod.loads(decode4js(obj['value']))
+        out = mod.loads(decode4js(obj['value'], buffers))
 
     elif classname == 'ModelResult':
         params = Parameters()
         res = ModelResult(Model(lambda x: x, None), params)
-        out = res.loads(decode4js(obj['value']))
+        out = res.loads(decode4js(obj['value'], buffers))
 
     elif classname == 'Logger':
         out = getLogger(obj['name'], level=obj['level'])
@@ -333,7 +421,7 @@ def decode4js(obj):
         dtype = obj.get('__type__')
         if dtype in HAS_STATE:
             out = HAS_STATE[dtype]()
-            out.__setstate__(decode4js(obj.get('value')))
+            out.__setstate__(decode4js(obj.get('value'), buffers))
         elif dtype == 'Minimizer':
             out = unpack_minimizer(out['value'])
         else:
@@ -347,7 +435,7 @@ def decode4js(obj):
                 val.get('__name__', None) is not None):
                 pass  # ignore class methods for subclassed Groups
             else:
-                out[key] = decode4js(val)
+                out[key] = decode4js(val, buffers)
         if classname == 'Minimizer':
             out = unpack_minimizer(out)
         elif classname == 'FeffDatFile':
@@ -1847,7 +1847,7 @@ class RemoveDialog(wx.Dialog):
 
 
 class LoadSessionDialog(wx.Frame):
-    """Read, show data from saved larch session"""
+    """Read, show data from saved larch session, as opened with open_session()"""
 
     xasgroups_name = '_xasgroups'
     feffgroups_name = ['_feffpaths', '_feffcache']
@@ -1899,14 +1899,17 @@ class LoadSessionDialog(wx.Frame):
         top_message = 'Larch Session File: No XAFS Groups'
         symtable = controller.symtable
 
-        self.allgroups = session.symbols.get(self.xasgroups_name, {})
+        self.allgroups = {fname: gname for fname, gname in
+                          session.symbols.get(self.xasgroups_name, {}).items()
+                          if gname in session.toc}
         self.extra_groups = []
-        for key, val in session.symbols.items():
+        for key in session.symbols:
             if key == self.xasgroups_name or key in self.feffgroups_name:
                 continue
             if key in self.allgroups:
                 continue
-            if hasattr(val, 'energy') and hasattr(val, 'mu'):
+            attrs = session.get_attrs(key)
+            if 'energy' in attrs and 'mu' in attrs:
                 if key in self.allgroups.keys() or key in self.allgroups.values():
                     continue
                 self.allgroups[key] = key
@@ -25,7 +25,7 @@ from wx.richtext import RichTextCtrl
 
 import larch
 from larch import Group, Journal, Entry
-from larch.io import save_session, read_session
+from larch.io import save_session, open_session
 from larch.math import index_of
 from larch.utils import (isotime, time_ago, is_gzip, path_split)
 from larch.utils.strutils import (file2groupname, unique_name,
@@ -973,7 +973,7 @@ class LarixFrame(wx.Frame):
             return
 
         try:
-            _session  = read_session(path)
+            _session  = open_session(path)
         except:
             title = "Invalid Path for Larch Session"
             message = [f"{path} is not a valid Larch Session File"]
@@ -6,7 +6,9 @@ The functions here include (but are not limited to):
 function         description
 ------------     ------------------------------
 pre_edge         pre_edge subtraction, normalization
+pre_edge_stack   pre_edge for a 2-d array of spectra sharing an energy array
 autobk           XAFS background subtraction (mu(E) to chi(k))
+autobk_batch     autobk for many groups sharing an energy array
 xftf             forward XAFS Fourier transform (k -> R)
 xftr             backward XAFS Fourier transform, Filter (R -> q)
 ftwindow         create XAFS Fourier transform window
@@ -19,21 +21,25 @@ feffit_dataset   create a Dataset for Feffit
 feffit_transform create a Feffit transform group
 feffit           fit a set of Feff Paths to Feffit Datasets
 feffit_report    create a report from feffit() results
+feffit_batch     fit a set of Feff Paths to each of many data groups
+feffit_batch_summary  table of parameters and statistics from feffit_batch() results
 '''
 
 
 from .xafsutils import KTOE, ETOK, set_xafsGroup, etok, ktoe, guess_energy_units
 from .xafsft import xftf, xftr, xftf_fast, xftr_fast, ftwindow, xftf_prep
-from .pre_edge import pre_edge, preedge, find_e0, energy_align, find_energy_step
+from .pre_edge import (pre_edge, preedge, pre_edge_stack, find_e0,
+                       energy_align, find_energy_step)
 from .prepeaks import prepeaks_setup, pre_edge_baseline, prepeaks_fit
 from .feffdat import FeffDatFile, FeffPathGroup, feffpath, path2chi, ff2chi, use_feffpath
 from .feffit import (FeffitDataSet, TransformGroup, feffit,
                      feffit_dataset, feffit_transform, feffit_report,
                      feffit_conf_map)
+from .feffit_batch import feffit_batch, feffit_batch_summary
 
-from .autobk import autobk, autobk_lmfit, autobk_delta_chi
+from .autobk import autobk, autobk_batch, autobk_lmfit, autobk_delta_chi
 from .mback import mback, mback_norm
-from .diffkk import diffkk, diffKKGroup
+from .diffkk import diffkk, diffkk_stack, diffKKGroup
 from .fluo import fluo_corr
 
 ## from .cif2feff import cif_sites, cif2feff6l
@@ -59,14 +65,17 @@ def _larch_init(_larch):
 _larch_groups = (diffKKGroup, FeffRunner, FeffDatFile, FeffPathGroup,
                  TransformGroup, FeffitDataSet)
 
-_larch_builtins = {'_xafs': dict(autobk=autobk, autobk_lmfit=autobk_lmfit,
+_larch_builtins = {'_xafs': dict(autobk=autobk, autobk_batch=autobk_batch,
+                                 autobk_lmfit=autobk_lmfit,
                                  autobk_delta_chi=autobk_delta_chi,
                                  etok=etok, ktoe=ktoe,
                                  guess_energy_units=guess_energy_units,
-                                 diffkk=diffkk, xftf=xftf, xftr=xftr,
+                                 diffkk=diffkk, diffkk_stack=diffkk_stack,
+                                 xftf=xftf, xftr=xftr,
                                  xftf_prep=xftf_prep, xftf_fast=xftf_fast,
                                  xftr_fast=xftr_fast, ftwindow=ftwindow,
                                  find_e0=find_e0, pre_edge=pre_edge,
+                                 pre_edge_stack=pre_edge_stack,
                                  find_energy_step=find_energy_step,
                                  energy_align=energy_align,
                                  prepeaks_setup=prepeaks_setup,
@@ -87,6 +96,8 @@ _larch_builtins = {'_xafs': dict(autobk=autobk, autobk_lmfit=autobk_lmfit,
                                  feffit_transform=feffit_transform,
                                  feffit_report=feffit_report,
                                  feffit_conf_map=feffit_conf_map,
+                                 feffit_batch=feffit_batch,
+                                 feffit_batch_summary=feffit_batch_summary,
                                  feffrunner=feffrunner, feff6l=feff6l,
                                  feff8l=feff8l,
                                  feffpath= feffpath,
@@ -2,7 +2,8 @@
 import sys
 import time
 import numpy as np
-from scipy.interpolate import splrep, splev, UnivariateSpline
+from scipy.interpolate import (splrep, splev, UnivariateSpline, BSpline,
+                               make_interp_spline)
 from scipy.stats import t
 from scipy.special import erf
 from scipy.optimize import leastsq
@@ -25,90 +26,111 @@ def spline_eval(kraw, mu, knots, coefs, order, kout):
     chi = UnivariateSpline(kraw, (mu-bkg), s=0)(kout)
     return bkg, chi
 
-def _resid(vcoefs, ncoef, kraw, mu, chi_std, knots, order, kout,
-            ftwin, nfft, irbkg, nclamp, clamp_lo, clamp_hi):
-    global NFEV
-    NFEV += 1
-    nspl = len(vcoefs)
-    coefs = np.ones(ncoef)*vcoefs[-1]
-    coefs[:nspl] = vcoefs
-    bkg, chi = spline_eval(kraw, mu, knots, coefs, order, kout)
-    if chi_std is not None:
-        chi = chi - chi_std
-    out =  realimag(xftf_fast(chi*ftwin, nfft=nfft)[:irbkg])
-    if nclamp == 0:
-        return out
-    scale = 1.0 + 100*(out*out).mean()
-    return  np.concatenate((out,
-                            abs(clamp_lo)*scale*chi[:nclamp],
-                            abs(clamp_hi)*scale*chi[-nclamp:]))
+def spline_interp(kraw, y, kout):
+    """interpolate y(kraw) onto kout with an interpolating cubic spline.
+    This is linear in y, which may be 2-d with kraw as the first axis,
+    and is the same as UnivariateSpline(kraw, y, s=0)(kout) for 1-d y"""
+    return make_interp_spline(kraw, y, k=3)(kout)
 
+def autobk_operators(kraw, knots, order, nspl, kout):
+    """linear operators for autobk, fixed for a set of knots
 
-@Make_CallArgs(["energy" ,"mu"])
-def autobk(energy, mu=None, group=None, rbkg=1, nknots=None, e0=None, ek0=None,
-           edge_step=None, kmin=0, kmax=None, kweight=1, dk=0.1,
-           win='hanning', k_std=None, chi_std=None, nfft=2048, kstep=0.05,
-           pre_edge_kws=None, nclamp=3, clamp_lo=0, clamp_hi=1,
-           calc_uncertainties=False, err_sigma=1, _larch=None, **kws):
-    """Use Autobk algorithm to remove XAFS background
+    Returns:
+    --------
+      basis:   array (len(kraw), nspl) of B-spline basis functions, so that
+               bkg(kraw) = basis @ coefs[:nspl]
+      chi_op:  array (len(kout), nspl) of basis functions interpolated
+               onto kout, so that chi(kout) = chi0 - chi_op @ coefs[:nspl]
+               with chi0 = spline_interp(kraw, mu, kout)
 
-    Parameters:
-    -----------
-      energy:    1-d array of x-ray energies, in eV, or group
-      mu:        1-d array of mu(E)
-      group:     output group (and input group for e0 and edge_step).
-      rbkg:      distance (in Ang) for chi(R) above
-                 which the signal is ignored. Default = 1.
-      e0:        edge energy, in eV.  (deprecated: use ek0)
-      ek0:       edge energy, in eV.  If None, it will be determined.
-      edge_step: edge step.  If None, it will be determined.
-      pre_edge_kws:  keyword arguments to pass to pre_edge()
-      nknots:    number of knots in spline.  If None, it will be determined.
-      kmin:      minimum k value   [0]
-      kmax:      maximum k value   [full data range].
-      kweight:   k weight for FFT.  [1]
-      dk:        FFT window window parameter.  [0.1]
-      win:       FFT window function name.     ['hanning']
-      nfft:      array size to use for FFT [2048]
-      kstep:     k step size to use for FFT [0.05]
-      k_std:     optional k array for standard chi(k).
-      chi_std:   optional chi array for standard chi(k).
-      nclamp:    number of energy end-points for clamp [3]
-      clamp_lo:  weight of low-energy clamp [0]
-      clamp_hi:  weight of high-energy clamp [1]
-      calc_uncertaintites:  Flag to calculate uncertainties in
-                            mu_0(E) and chi(k) [True]
-      err_sigma: sigma level for uncertainties in mu_0(E) and chi(k) [1]
+    Together, these give the same results as spline_eval().
+    """
+    basis = BSpline(knots, np.eye(nspl), order)(kraw)
+    return basis, spline_interp(kraw, basis, kout)
 
-    Output arrays are written to the provided group.
 
-    Follows the 'First Argument Group' convention.
+class AutobkModel:
+    """model for the autobk residual, from precomputed linear operators.
+
+    With knots fixed, chi(k) is linear in the spline coefficients,
+        chi = chi0 - chi_op @ coefs
+    as is the windowed Fourier transform of chi(k) for R < rbkg, so the
+    residual is linear in the coefficients apart from the scaling of the
+    end-point clamps, and has an analytic Jacobian.
     """
-    msg = sys.stdout.write
-    if _larch is not None:
-        msg = _larch.writer.write
-    if 'kw' in kws:
-        kweight = kws.pop('kw')
-    if len(kws) > 0:
-        msg('Unrecognized arguments for autobk():\n')
-        msg('    %s\n' % (', '.join(kws.keys())))
-        return
-    energy, mu, group = parse_group_args(energy, members=('energy', 'mu'),
-                                         defaults=(mu,), group=group,
-                                         fcn_name='autobk')
-    if len(energy.shape) > 1:
-        energy = energy.squeeze()
-    if len(mu.shape) > 1:
-        mu = mu.squeeze()
-    energy = remove_dups(energy, tiny=TINY_ENERGY)
-    # if e0 or edge_step are not specified, get them, either from the
-    # passed-in group or from running pre_edge()
-    group = set_xafsGroup(group, _larch=_larch)
+    def __init__(self, kraw, kout, knots, order, nspl, ftwin, irbkg,
+                 nfft=2048, nclamp=3, clamp_lo=0, clamp_hi=1):
+        self.kraw = kraw
+        self.kout = kout
+        self.nspl = nspl
+        self.ftwin = ftwin
+        self.irbkg = irbkg
+        self.nfft = nfft
+        self.nclamp = nclamp
+        self.clamp_lo = clamp_lo
+        self.clamp_hi = clamp_hi
+        self.basis, self.chi_op = autobk_operators(kraw, knots, order,
+                                                   nspl, kout)
+        self.ft_op = self.fourier(self.chi_op)
+        if nclamp > 0:
+            self.clamp_rows = np.concatenate((np.arange(nclamp),
+                                              np.arange(len(kout)-nclamp,
+                                                        len(kout))))
+            self.clamp_wts = np.concatenate((abs(clamp_lo)*np.ones(nclamp),
+                                             abs(clamp_hi)*np.ones(nclamp)))
+
+    def fourier(self, chi):
+        """real/imag parts of FT of chi(k) for R < rbkg.  For a 2-d chi,
+        with k as the first axis, each column is transformed"""
+        chir = xftf_fast((chi.T*self.ftwin), nfft=self.nfft)[..., :self.irbkg]
+        out = np.empty((2*self.irbkg,) + chi.shape[1:])
+        out[0::2] = chir.real.T
+        out[1::2] = chir.imag.T
+        return out
 
+    def set_data(self, mu, chi_std=None):
+        """set mu(kraw), and optional chi_std(kout)"""
+        self.mu = mu
+        self.chi0 = spline_interp(self.kraw, mu, self.kout)
+        chi = self.chi0 if chi_std is None else self.chi0 - chi_std
+        self.ft0 = self.fourier(chi)
+        if self.nclamp > 0:
+            self.clamp0 = chi[self.clamp_rows]
+            self.clamp_op = self.chi_op[self.clamp_rows]
+
+    def bkg_chi(self, coefs):
+        "return bkg(kraw), chi(kout) for spline coefficients"
+        return self.basis @ coefs, self.chi0 - self.chi_op @ coefs
+
+    def resid(self, coefs):
+        "residual for spline coefficients"
+        global NFEV
+        NFEV += 1
+        out = self.ft0 - self.ft_op @ coefs
+        if self.nclamp == 0:
+            return out
+        scale = 1.0 + 100*(out*out).mean()
+        clamp = self.clamp0 - self.clamp_op @ coefs
+        return np.concatenate((out, self.clamp_wts*scale*clamp))
+
+    def jacobian(self, coefs):
+        "Jacobian of resid(), with shape (len(resid), nspl)"
+        if self.nclamp == 0:
+            return -self.ft_op
+        out = self.ft0 - self.ft_op @ coefs
+        scale = 1.0 + 100*(out*out).mean()
+        dscale = -200*(out @ self.ft_op)/len(out)
+        clamp = self.clamp0 - self.clamp_op @ coefs
+        dclamp = np.outer(clamp, dscale) - scale*self.clamp_op
+        return np.concatenate((-self.ft_op, self.clamp_wts[:, None]*dclamp))
+
+
+def _autobk_edge(energy, mu, group, ek0=None, edge_step=None,
+                 pre_edge_kws=None, _larch=None):
+    """get ek0 and edge_step, either as given, from the group, or
+    by running pre_edge()"""
     if edge_step is None and isgroup(group, 'edge_step'):
         edge_step = group.edge_step
-    if e0 is not None and ek0 is None:  # command-line e0 still valid
-        ek0 = e0
     if ek0 is None and isgroup(group, 'ek0'):
         ek0 = group.ek0
     if ek0 is None and isgroup(group, 'e0'):
@@ -127,10 +149,13 @@ def autobk(energy, mu=None, group=None, rbkg=1, nknots=None, e0=None, ek0=None,
             ek0 = group.e0
         if edge_step is None:
             edge_step = group.edge_step
-    if ek0 is None or edge_step is None:
-        msg('autobk() could not determine ek0 or edge_step!: trying running pre_edge first\n')
-        return
+    return ek0, edge_step
 
+def _autobk_prep(energy, ek0, rbkg=1, nknots=None, kmin=0, kmax=None,
+                 kweight=1, dk=0.1, win='hanning', nfft=2048, kstep=0.05,
+                 nclamp=3, clamp_lo=0, clamp_hi=1):
+    """set up the k grids, knots, and AutobkModel for autobk, which depend
+    on the energy array and ek0 but not on mu(E)"""
     # get array indices for rkbg and ek0: irbkg, iek0
     iek0 = index_of(energy, ek0)
     rgrid = np.pi/(kstep*nfft)
@@ -147,95 +172,267 @@ def autobk(energy, mu=None, group=None, rbkg=1, nknots=None, e0=None, ek0=None,
     kout  = kstep * np.arange(int(1.01+kmax/kstep), dtype='float64')
     iemax = min(len(energy), 2+index_of(energy, ek0+kmax*kmax/ETOK)) - 1
 
-    # interpolate provided chi(k) onto the kout grid
-    if chi_std is not None and k_std is not None:
-        chi_std = np.interp(kout, k_std, chi_std)
     # pre-load FT window
     ftwin = kout**kweight * ftwindow(kout, xmin=kmin, xmax=kmax,
                                      window=win, dx=dk, dx2=dk)
-    # calc k-value and initial guess for y-values of spline params
+    # calc k-value for spline params
     nspl = 1 + int(2*rbkg*(kmax-kmin)/np.pi)
     irbkg = int(1 + (nspl-1)*np.pi/(2*rgrid*(kmax-kmin)))
     if nknots is not None:
         nspl = nknots
     nspl = max(5, min(128, nspl))
-    spl_y, spl_k  = np.ones(nspl), np.zeros(nspl)
-
+    spl_k, spl_ik = np.zeros(nspl), np.zeros(nspl, dtype=int)
     for i in range(nspl):
         q  = kmin + i*(kmax-kmin)/(nspl - 1)
         ik = index_nearest(kraw, q)
-        i1 = min(len(kraw)-1, ik + 5)
-        i2 = max(0, ik - 5)
-        spl_k[i] = kraw[ik]
-        spl_y[i] = (2*mu[ik+iek0] + mu[i1+iek0] + mu[i2+iek0] ) / 4.0
+        spl_k[i], spl_ik[i] = kraw[ik], ik
 
+    # the knots of an interpolating spline depend only on spl_k
     order = 3
-    qmin, qmax  = spl_k[0], spl_k[nspl-1]
-    knots = [spl_k[0] - 1.e-4*(order-i) for i in range(order)]
+    knots = splrep(spl_k, np.zeros(nspl), k=order)[0]
+    kraw_ = kraw[:iemax-iek0+1]
+    model = AutobkModel(kraw_, kout, knots, order, nspl, ftwin, irbkg,
+                        nfft=nfft, nclamp=nclamp, clamp_lo=clamp_lo,
+                        clamp_hi=clamp_hi)
+    return Group(iek0=iek0, iemax=iemax, ek0=ek0, rbkg=rbkg, kmin=kmin,
+                 kmax=kmax, kraw=kraw, kout=kout, nspl=nspl, irbkg=irbkg,
+                 spl_k=spl_k, spl_ik=spl_ik, order=order, knots=knots,
+                 model=model)
+
+def _autobk_fit(prep, mu, edge_step, group, chi_std=None,
+                calc_uncertainties=False, err_sigma=1,
+                analytic_jacobian=False):
+    """fit the autobk background for one mu(E), using the results of
+    _autobk_prep(), writing outputs to group"""
+    global NFEV
+    iek0, iemax, nspl, kraw = prep.iek0, prep.iemax, prep.nspl, prep.kraw
+    model = prep.model
+    nclamp = model.nclamp
 
-    for i in range(order, nspl):
-        knots.append((i-order)*(qmax - qmin)/(nspl-order+1))
-    qlast = knots[-1]
-    for i in range(order+1):
-        knots.append(qlast + 1.e-4*(i+1))
+    # initial guess for y-values of spline params
+    spl_y = np.ones(nspl)
+    for i, ik in enumerate(prep.spl_ik):
+        i1 = min(len(kraw)-1, ik + 5)
+        i2 = max(0, ik - 5)
+        spl_y[i] = (2*mu[ik+iek0] + mu[i1+iek0] + mu[i2+iek0] ) / 4.0
 
-    # coefs = [mu[index_nearest(energy, ek0 + q**2/ETOK)] for q in knots]
-    knots, coefs, order = splrep(spl_k, spl_y, k=order)
+    knots, coefs, order = splrep(prep.spl_k, spl_y, k=prep.order)
     coefs[nspl:] = coefs[nspl-1]
     ncoefs = len(coefs)
-    kraw_ = kraw[:iemax-iek0+1]
-    mu_  = mu[iek0:iemax+1]
-    initbkg, initchi = spline_eval(kraw_, mu_, knots, coefs, order, kout)
-    global NFEV
+    model.set_data(mu[iek0:iemax+1], chi_std=chi_std)
+    initbkg, initchi = model.bkg_chi(coefs[:nspl])
     NFEV = 0
 
     vcoefs = 1.0*coefs[:nspl]
-    userargs = (len(coefs), kraw_, mu_, chi_std, knots, order, kout,
-               ftwin, nfft, irbkg, nclamp, clamp_lo, clamp_hi)
-
-    lsout = leastsq(_resid, vcoefs, userargs, maxfev=2000*(ncoefs+1),
-                    gtol=0.0, ftol=1.e-6, xtol=1.e-6, epsfcn=1.e-6,
-                    full_output=1, col_deriv=0, factor=100, diag=None)
+    if analytic_jacobian:
+        lsout = leastsq(model.resid, vcoefs, Dfun=model.jacobian,
+                        maxfev=2000*(ncoefs+1), gtol=0.0, ftol=1.e-6,
+                        xtol=1.e-6, full_output=1, col_deriv=0, factor=100,
+                        diag=None)
+    else:
+        lsout = leastsq(model.resid, vcoefs, maxfev=2000*(ncoefs+1),
+                        gtol=0.0, ftol=1.e-6, xtol=1.e-6, epsfcn=1.e-6,
+                        full_output=1, col_deriv=0, factor=100, diag=None)
 
     best, covar, _infodict, errmsg, ier = lsout
     final_coefs        = coefs[:]
     final_coefs[:nspl] = best[:]
     final_coefs[nspl:] = best[-1]
 
-    chisqr = ((_resid(best, *userargs))**2).sum()
-    redchi = chisqr / (2*irbkg+2*nclamp - nspl)
+    chisqr = ((model.resid(best))**2).sum()
+    redchi = chisqr / (2*prep.irbkg+2*nclamp - nspl)
 
     coefs_std = np.array([np.sqrt(redchi*covar[i, i]) for i in range(nspl)])
-    bkg, chi = spline_eval(kraw[:iemax-iek0+1], mu[iek0:iemax+1],
-                           knots, final_coefs, order, kout)
+    bkg, chi = model.bkg_chi(best)
     obkg = mu[:]*1.0
     obkg[iek0:iek0+len(bkg)] = bkg
 
     # outputs to group
-    group = set_xafsGroup(group, _larch=_larch)
     group.bkg  = obkg
     group.chie = (mu-obkg)/edge_step
-    group.k    = kout
+    group.k    = prep.kout
     group.chi  = chi/edge_step
-    group.ek0  = ek0
-    group.rbkg = rbkg
+    group.ek0  = prep.ek0
+    group.rbkg = prep.rbkg
 
     knots_y  = np.array([coefs[i] for i in range(nspl)])
     init_bkg = mu[:]*1.0
     init_bkg[iek0:iek0+len(bkg)] = initbkg
     # now fill in 'autobk_details' group
 
-    group.autobk_details = Group(kmin=kmin, kmax=kmax, irbkg=irbkg,
-                                 nknots=len(spl_k), knots=knots, order=order,
-                                 init_knots_y=spl_y, nspl=nspl,
+    group.autobk_details = Group(kmin=prep.kmin, kmax=prep.kmax,
+                                 irbkg=prep.irbkg, nknots=nspl, knots=knots,
+                                 order=order, init_knots_y=spl_y, nspl=nspl,
                                  init_chi=initchi/edge_step, coefs=final_coefs,
                                  coefs_std=coefs_std, iek0=iek0, iemax=iemax,
-                                 ek0=ek0, covar=covar, chisqr=chisqr,
+                                 ek0=prep.ek0, covar=covar, chisqr=chisqr,
                                  redchi=redchi, init_bkg=init_bkg,
-                                 knots_y=knots_y, kraw=kraw, mu=mu)
+                                 knots_y=knots_y, kraw=kraw, mu=mu, nfev=NFEV)
 
     if  calc_uncertainties and covar is not None:
-        autobk_delta_chi(group, err_sigma=err_sigma)
+        _autobk_delta_chi(group, model.basis, model.chi_op, err_sigma=err_sigma)
+
+
+@Make_CallArgs(["energy" ,"mu"])
+def autobk(energy, mu=None, group=None, rbkg=1, nknots=None, e0=None, ek0=None,
+           edge_step=None, kmin=0, kmax=None, kweight=1, dk=0.1,
+           win='hanning', k_std=None, chi_std=None, nfft=2048, kstep=0.05,
+           pre_edge_kws=None, nclamp=3, clamp_lo=0, clamp_hi=1,
+           calc_uncertainties=False, err_sigma=1, analytic_jacobian=False,
+           _larch=None, **kws):
+    """Use Autobk algorithm to remove XAFS background
+
+    Parameters:
+    -----------
+      energy:    1-d array of x-ray energies, in eV, or group
+      mu:        1-d array of mu(E)
+      group:     output group (and input group for e0 and edge_step).
+      rbkg:      distance (in Ang) for chi(R) above
+                 which the signal is ignored. Default = 1.
+      e0:        edge energy, in eV.  (deprecated: use ek0)
+      ek0:       edge energy, in eV.  If None, it will be determined.
+      edge_step: edge step.  If None, it will be determined.
+      pre_edge_kws:  keyword arguments to pass to pre_edge()
+      nknots:    number of knots in spline.  If None, it will be determined.
+      kmin:      minimum k value   [0]
+      kmax:      maximum k value   [full data range].
+      kweight:   k weight for FFT.  [1]
+      dk:        FFT window window parameter.  [0.1]
+      win:       FFT window function name.     ['hanning']
+      nfft:      array size to use for FFT [2048]
+      kstep:     k step size to use for FFT [0.05]
+      k_std:     optional k array for standard chi(k).
+      chi_std:   optional chi array for standard chi(k).
+      nclamp:    number of energy end-points for clamp [3]
+      clamp_lo:  weight of low-energy clamp [0]
+      clamp_hi:  weight of high-energy clamp [1]
+      calc_uncertaintites:  Flag to calculate uncertainties in
+                            mu_0(E) and chi(k) [True]
+      err_sigma: sigma level for uncertainties in mu_0(E) and chi(k) [1]
+      analytic_jacobian: Flag to fit with the analytic Jacobian of the
+                 residual, instead of finite differences.  This needs
+                 fewer function evaluations, but may converge to a
+                 slightly different background [False]
+
+    Output arrays are written to the provided group.
+
+    Follows the 'First Argument Group' convention.
+    """
+    msg = sys.stdout.write
+    if _larch is not None:
+        msg = _larch.writer.write
+    if 'kw' in kws:
+        kweight = kws.pop('kw')
+    if len(kws) > 0:
+        msg('Unrecognized arguments for autobk():\n')
+        msg('    %s\n' % (', '.join(kws.keys())))
+        return
+    energy, mu, group = parse_group_args(energy, members=('energy', 'mu'),
+                                         defaults=(mu,), group=group,
+                                         fcn_name='autobk')
+    if len(energy.shape) > 1:
+        energy = energy.squeeze()
+    if len(mu.shape) > 1:
+        mu = mu.squeeze()
+    energy = remove_dups(energy, tiny=TINY_ENERGY)
+    # if e0 or edge_step are not specified, get them, either from the
+    # passed-in group or from running pre_edge()
+    group = set_xafsGroup(group, _larch=_larch)
+
+    if e0 is not None and ek0 is None:  # command-line e0 still valid
+        ek0 = e0
+    ek0, edge_step = _autobk_edge(energy, mu, group, ek0=ek0,
+                                  edge_step=edge_step,
+                                  pre_edge_kws=pre_edge_kws, _larch=_larch)
+    if ek0 is None or edge_step is None:
+        msg('autobk() could not determine ek0 or edge_step!: trying running pre_edge first\n')
+        return
+
+    prep = _autobk_prep(energy, ek0, rbkg=rbkg, nknots=nknots, kmin=kmin,
+                        kmax=kmax, kweight=kweight, dk=dk, win=win,
+                        nfft=nfft, kstep=kstep, nclamp=nclamp,
+                        clamp_lo=clamp_lo, clamp_hi=clamp_hi)
+
+    # interpolate provided chi(k) onto the kout grid
+    if chi_std is not None and k_std is not None:
+        chi_std = np.interp(prep.kout, k_std, chi_std)
+
+    _autobk_fit(prep, mu, edge_step, group, chi_std=chi_std,
+                calc_uncertainties=calc_uncertainties, err_sigma=err_sigma,
+                analytic_jacobian=analytic_jacobian)
+
+
+def autobk_batch(groups, rbkg=1, nknots=None, ek0=None, edge_step=None,
+                 kmin=0, kmax=None, kweight=1, dk=0.1, win='hanning',
+                 k_std=None, chi_std=None, nfft=2048, kstep=0.05,
+                 pre_edge_kws=None, nclamp=3, clamp_lo=0, clamp_hi=1,
+                 calc_uncertainties=False, err_sigma=1,
+                 analytic_jacobian=False, _larch=None, **kws):
+    """Use Autobk algorithm to remove XAFS background for many groups
+    that share the same energy array, as for a series of scans.
+
+    Parameters:
+    -----------
+      groups:    list of groups, each with arrays 'energy' and 'mu'
+      ek0:       edge energy, in eV, used for all groups.  If None,
+                 the value for the first group will be used.
+      edge_step: edge step, used for all groups.  If None, it will be
+                 taken from or determined for each group.
+
+    All other arguments are as for autobk(), and are used for all groups.
+
+    Output arrays are written to each group, as for autobk().
+
+    Notes:
+    ------
+      The k grids, spline knots, and the linear operators for the
+      background and Fourier transform depend only on the energy array
+      and ek0, and are calculated once for all groups.
+    """
+    msg = sys.stdout.write
+    if _larch is not None:
+        msg = _larch.writer.write
+    if 'kw' in kws:
+        kweight = kws.pop('kw')
+    if len(kws) > 0:
+        msg('Unrecognized arguments for autobk_batch():\n')
+        msg('    %s\n' % (', '.join(kws.keys())))
+        return
+    if len(groups) < 1:
+        return
+    energy = groups[0].energy.squeeze()
+    for grp in groups[1:]:
+        if (grp.energy.size != energy.size or
+            not np.allclose(grp.energy.squeeze(), energy)):
+            raise ValueError("autobk_batch() needs all groups to have the same energy array")
+    energy = remove_dups(energy, tiny=TINY_ENERGY)
+
+    edge_steps = []
+    for grp in groups:
+        _ek0, _step = _autobk_edge(energy, grp.mu.squeeze(), grp,
+                                   ek0=ek0, edge_step=edge_step,
+                                   pre_edge_kws=pre_edge_kws, _larch=_larch)
+        if _ek0 is None or _step is None:
+            msg('autobk_batch() could not determine ek0 or edge_step for %s\n' % repr(grp))
+            return
+        if ek0 is None:
+            ek0 = _ek0
+        edge_steps.append(_step)
+
+    prep = _autobk_prep(energy, ek0, rbkg=rbkg, nknots=nknots, kmin=kmin,
+                        kmax=kmax, kweight=kweight, dk=dk, win=win,
+                        nfft=nfft, kstep=kstep, nclamp=nclamp,
+                        clamp_lo=clamp_lo, clamp_hi=clamp_hi)
+
+    # interpolate provided chi(k) onto the kout grid
+    if chi_std is not None and k_std is not None:
+        chi_std = np.interp(prep.kout, k_std, chi_std)
+
+    for grp, _step in zip(groups, edge_steps):
+        _autobk_fit(prep, grp.mu.squeeze(), _step, grp, chi_std=chi_std,
+                    calc_uncertainties=calc_uncertainties,
+                    err_sigma=err_sigma,
+                    analytic_jacobian=analytic_jacobian)
 
 
 def autobk_delta_chi(group, err_sigma=1):
@@ -245,34 +442,22 @@ def autobk_delta_chi(group, err_sigma=1):
     d = getattr(group, 'autobk_details', None)
     if d is None or getattr(d, 'covar', None) is None:
         return
-
+    basis, chi_op = autobk_operators(d.kraw[:d.iemax-d.iek0+1], d.knots,
+                                     d.order, d.nspl, group.k)
+    _autobk_delta_chi(group, basis, chi_op, err_sigma=err_sigma)
+
+def _autobk_delta_chi(group, basis, chi_op, err_sigma=1):
+    """uncertainties in chi(k) and bkg(E) from the operators for
+    bkg and chi(k), which are linear in the spline coefficients"""
+    d = group.autobk_details
     nchi = len(group.chi)
     nmue = d.iemax-d.iek0 + 1
     nspl = d.nspl
-    jac_chi = np.zeros(nchi*nspl).reshape((nspl, nchi))
-    jac_bkg = np.zeros(nmue*nspl).reshape((nspl, nmue))
-    tcoefs = np.ones(len(d.coefs)) * d.coefs[-1]
 
-    step = 0.5
-    # find derivatives by hand
-    for i in range(nspl):
-        b = [0, 0]
-        c = [0, 0]
-        for k in (0, 1):
-            tcoefs = [1.0*d.coefs[j] for j in range(nspl)]
-            tcoefs[i] = d.coefs[i] + (2*k-1)*step*d.coefs_std[i]
-            b[k], c[k] = spline_eval(d.kraw[:d.iemax-d.iek0+1],
-                                     d.mu[d.iek0:d.iemax+1],
-                                     d.knots, tcoefs, d.order, group.k)
-        jac_chi[i] = (c[1]- c[0])/(2*step*d.coefs_std[i])
-        jac_bkg[i] = (b[1]- b[0])/(2*step*d.coefs_std[i])
-
-    dfchi = np.zeros(nchi)
-    dfbkg = np.zeros(nmue)
-    for i in range(nspl):
-        for j in range(nspl):
-            dfchi += jac_chi[i]*jac_chi[j]*d.covar[i,j]
-            dfbkg += jac_bkg[i]*jac_bkg[j]*d.covar[i,j]
+    # chi and bkg are linear in the coefficients, so that the Jacobians
+    # are the operators themselves
+    dfchi = np.einsum('ki,ij,kj->k', chi_op, d.covar, chi_op)
+    dfbkg = np.einsum('ki,ij,kj->k', basis, d.covar, basis)
 
     prob = 0.5*(1.0 + erf(err_sigma/np.sqrt(2.0)))
     dchi = t.ppf(prob, nchi-nspl) * np.sqrt(dfchi*d.redchi)
@@ -1,6 +1,7 @@
 import time
 import numpy as np
 from scipy.special import erfc
+from scipy.signal import fftconvolve
 
 from larch import Group
 from larch.math import interp
@@ -70,7 +71,7 @@ def kkmclf_sca(e, finp):
     fout = [0.0]*npts
     if npts >= 2:
         factor = FOPI * (e[npts-1] - e[0]) / (npts - 1)
-        nptsk = npts / 2
+        nptsk = npts // 2
         for i in range(npts):
             fout[i] = 0.0
             ei2 = e[i]*e[i]
@@ -105,7 +106,7 @@ def kkmclr_sca(e, finp):
     fout = [0.0]*npts
 
     factor = -FOPI * (e[npts-1] - e[0]) / (npts - 1)
-    nptsk  = npts / 2
+    nptsk  = npts // 2
     for i in range(npts):
         fout[i] = 0.0
         ei2 = e[i]*e[i]
@@ -154,7 +155,7 @@ def kkmclf(e, finp):
         de2  = e[j]**2 - ei2[i]
         fout[i] = sum(finp[j]/de2)
 
-    fout = fout * factor
+    fout = fout * factor * e
     return fout
 
 
@@ -191,6 +192,96 @@ def kkmclr(e, finp):
     fout = fout * factor
     return fout
 
+###
+###  FFT forms of the MacLaurin series algorithm.  On an even grid,
+###     e[j]/(e[j]**2-e[i]**2) = (1/(e[j]-e[i]) + 1/(e[j]+e[i]))/2
+###  and the two terms depend only on (j-i) and (i+j), so that the sums over
+###  points of opposite parity are convolutions, done with FFTs in O(N log N).
+###  These give the same result as the forms above, to numerical precision,
+###  and accept a 2-D array of spectra [nspectra, npts] to transform at once.
+###
+
+def _kkmcl_sums(e, finp):
+    """MacLaurin sums of finp*1/(e[j]-e[i]) and of finp*1/(e[j]+e[i])
+    over points of opposite parity, for finp with shape [..., npts]"""
+    e = np.asarray(e, dtype='float64')
+    finp = np.asarray(finp, dtype='float64')
+    npts = len(e)
+    if finp.shape[-1] != npts:
+        raise ValueError("Input arrays not of same length for diff KK transform")
+    if npts < 2:
+        raise ValueError("Array too short for diff KK transform")
+    estep = (e[-1] - e[0]) / (npts-1)
+
+    shape = (1,)*(finp.ndim-1) + (2*npts-1,)
+    idx = np.arange(2*npts-1)
+    # kernel for 1/(e[j]-e[i]), reversed so that index 0 is j-i = npts-1
+    jmi = npts - 1 - idx
+    odd = (jmi % 2) == 1
+    kdiff = np.zeros(2*npts-1)
+    kdiff[odd] = 1.0/(jmi[odd]*estep)
+    # kernel for 1/(e[j]+e[i]), index is i+j
+    odd = (idx % 2) == 1
+    ksum = np.zeros(2*npts-1)
+    esum = 2*e[0] + idx[odd]*estep
+    esum[abs(esum) <= TINY] = TINY
+    ksum[odd] = 1.0/esum
+
+    tdiff = fftconvolve(finp, kdiff.reshape(shape), axes=-1)
+    tsum = fftconvolve(finp[..., ::-1], ksum.reshape(shape), axes=-1)
+    return tdiff[..., npts-1:2*npts-1], tsum[..., npts-1:2*npts-1], estep
+
+def kkmclf_fft(e, finp):
+    """
+    forward (f'->f'') kk transform, using maclaurin series algorithm
+    evaluated with FFTs
+
+    arguments:
+      e      energy array *must be on an even grid with an even number of points* [npts] (in)
+      finp   f' array [npts] or [nspectra, npts] (in)
+      fout   f'' array, same shape as finp (out)
+    """
+    tdiff, tsum, estep = _kkmcl_sums(e, finp)
+    return (FOPI*estep/2) * (tdiff - tsum)
+
+def kkmclr_fft(e, finp):
+    """
+    reverse (f''->f') kk transform, using maclaurin series algorithm
+    evaluated with FFTs
+
+    arguments:
+      e      energy array *must be on an even grid with an even number of points* [npts] (in)
+      finp   f'' array [npts] or [nspectra, npts] (in)
+      fout   f' array, same shape as finp (out)
+    """
+    tdiff, tsum, estep = _kkmcl_sums(e, finp)
+    return (-FOPI*estep/2) * (tdiff + tsum)
+
+KK_REVERSE = {'fft': kkmclr_fft, 'vector': kkmclr, 'scalar': kkmclr_sca}
+
+
+def kk_grid(energy):
+    """even energy grid with an even number of points (about 1 eV)
+    spanning an energy array, for the MacLaurin KK transforms"""
+    erange = int(energy[-1] - energy[0])
+    return np.linspace(energy[0], energy[-1], erange + erange%2)
+
+def _kk_method(how):
+    "name of KK transform method for 'how' argument"
+    how = 'fft' if how is None else how.lower()
+    for name in KK_REVERSE:
+        if how.startswith(name[:3]):
+            return name
+    raise ValueError(f"unknown KK transform method '{how}'")
+
+def _mback_kws(z, edge, mback_kws=None):
+    "keyword arguments for mback() as used for diffKK"
+    kws = dict(order=3, z=z, edge=edge, e0=None, leexiang=False,
+               tables='chantler', fit_erfc=False, return_f1=True)
+    if mback_kws is not None:
+        kws.update(mback_kws)
+    return kws
+
 
 class diffKKGroup(Group):
     """
@@ -211,7 +302,7 @@ class diffKKGroup(Group):
 
 
 # e0=None, z=None, edge=None, order=3, form='mback', whiteline=False, how=None
-    def kk(self, energy=None, mu=None, z=None, edge='K', how='scalar', mback_kws=None):
+    def kk(self, energy=None, mu=None, z=None, edge='K', how='fft', mback_kws=None):
         """
         Convert mu(E) data into f'(E) and f"(E).  f"(E) is made by
         matching mu(E) to the tabulated values of the imaginary part
@@ -225,6 +316,8 @@ class diffKKGroup(Group):
             z:          Z number of absorber
             edge:       absorption edge, usually 'K' or 'L3'
             mback_kws:  arguments for the mback algorithm
+            how:        KK transform method, one of 'fft' (default),
+                        'vector', or 'scalar'.  All give the same result.
 
           Returns
             self.f1, self.f2:  CL values over on the input energy grid
@@ -250,26 +343,17 @@ class diffKKGroup(Group):
         if self.edge == None:
             Exception("absorption edge not provided for diffKK")
 
-        mb_kws = dict(order=3, z=self.z, edge=self.edge, e0=None,
-                      leexiang=False, tables='chantler',
-                      fit_erfc=False, return_f1=True)
-        if self.mback_kws is not None:
-            mb_kws.update(self.mback_kws)
-
         start = time.monotonic()
 
-        mback(self.energy, self.mu, group=self, **mb_kws)
+        mback(self.energy, self.mu, group=self,
+              **_mback_kws(self.z, self.edge, self.mback_kws))
 
         ## interpolate matched data onto an even grid with an even number of elements (about 1 eV)
-        npts = int(self.energy[-1] - self.energy[0]) + (int(self.energy[-1] - self.energy[0])%2)
-        self.grid = np.linspace(self.energy[0], self.energy[-1], npts)
+        self.grid = kk_grid(self.energy)
         fpp = interp(self.energy, self.f2-self.fpp, self.grid, fill_value=0.0)
 
         ## do difference KK
-        if repr(how).startswith('sca'):
-            fp = kkmclr_sca(self.grid, fpp)
-        else:
-            fp = kkmclr(self.grid, fpp)
+        fp = np.asarray(KK_REVERSE[_kk_method(how)](self.grid, fpp))
 
         ## interpolate back to original grid and add diffKK result to f1 to make fp array
         self.fp = self.f1 + interp(self.grid, fp, self.energy, fill_value=0.0)
@@ -292,3 +376,50 @@ def diffkk(energy=None, mu=None, z=None, edge='K', mback_kws=None, **kws):
         mback_kws:  arguments for the mback algorithm
     """
     return diffKKGroup(energy=energy, mu=mu, z=z, mback_kws=mback_kws)
+
+def diffkk_stack(energy, mu, z=None, edge='K', mback_kws=None, how='fft'):
+    """
+    diffKK for a stack of spectra that share one energy array, matching
+    each spectrum with mback and then doing the KK transforms of all
+    spectra at once.
+
+      Arguments
+        energy:     energy array, with length nenergy
+        mu:         2-d array of mu(E), with shape (nspectra, nenergy)
+        z:          Z number of absorber
+        edge:       absorption edge, usually 'K' or 'L3'
+        mback_kws:  arguments for the mback algorithm, used for all spectra
+        how:        KK transform method, one of 'fft' (default),
+                    'vector', or 'scalar'.
+
+      Returns
+        group with energy, grid, and arrays with shape (nspectra, nenergy) of
+          f1, f2:   CL values on the input energy grid
+          fpp:      matched data on the input energy grid
+          fp:       f1 plus the KK transformed data on the input energy grid
+    """
+    energy = np.asarray(energy)
+    mu = np.atleast_2d(mu)
+    mb_kws = _mback_kws(z, edge, mback_kws)
+    grid = kk_grid(energy)
+    start = time.monotonic()
+
+    out = {attr: np.zeros(mu.shape) for attr in ('f1', 'f2', 'fpp', 'fp')}
+    fpp_grid = np.zeros((len(mu), len(grid)))
+    for i, mu_i in enumerate(mu):
+        tmp = Group()
+        mback(energy, mu_i, group=tmp, **mb_kws)
+        for attr in ('f1', 'f2', 'fpp'):
+            out[attr][i] = getattr(tmp, attr)
+        fpp_grid[i] = interp(energy, tmp.f2-tmp.fpp, grid, fill_value=0.0)
+
+    method = _kk_method(how)
+    if method == 'fft':
+        fp_grid = kkmclr_fft(grid, fpp_grid)
+    else:
+        fp_grid = [KK_REVERSE[method](grid, f) for f in fpp_grid]
+    for i, fp in enumerate(fp_grid):
+        out['fp'][i] = out['f1'][i] + interp(grid, np.asarray(fp), energy,
+                                             fill_value=0.0)
+    return Group(name='diffKK stack', energy=energy, grid=grid, z=z,
+                 edge=edge, time_elapsed=time.monotonic()-start, **out)
@@ -15,7 +15,7 @@ creates a group that contains the chi(k) for the sum of paths.
 from pathlib import Path
 import numpy as np
 from copy import deepcopy
-from scipy.interpolate import UnivariateSpline
+from scipy.interpolate import UnivariateSpline, PPoly, splrep
 from lmfit import Parameters, Parameter
 
 from xraydb import atomic_mass, atomic_symbol
@@ -29,10 +29,17 @@ from .sigma2_models import add_sigma2funcs
 
 SMALL_ENERGY = 1.e-6
 
+# number of (k grid, e0, ei) entries of interpolated Feff.dat values
+# remembered by each FeffPathGroup
+INTERP_CACHE_SIZE = 8
+
 PATH_PARS = ('degen', 's02', 'e0', 'ei', 'deltar', 'sigma2', 'third', 'fourth')
 FDAT_ARRS = ('real_phc', 'mag_feff', 'pha_feff', 'red_fact',
              'lam', 'rep', 'pha', 'amp', 'k')
 
+# Feff.dat arrays that are interpolated onto the e0-shifted k grid
+INTERP_ARRS = ('pha', 'amp', 'rep', 'lam')
+
 # values that will be available in calculations of Path Parameter values
 FEFFDAT_VALUES = ('reff', 'nleg', 'degen', 'rmass', 'rnorman',
                   'gam_ch', 'rs_int', 'vint', 'vmu', 'vfermi')
@@ -230,6 +237,8 @@ class FeffPathGroup(Group):
         self.geom  = []
         self.shell = 'K'
         self.absorber = None
+        self.interp_cache_size = INTERP_CACHE_SIZE
+        self.clear_interp_cache()
         self._feffdat = _feffdat
         self.dataset = 'd001'
         self.hashkey = 'p001'
@@ -290,6 +299,9 @@ class FeffPathGroup(Group):
     def __setstate__(self, state):
         self.params = self.spline_coefs = self.k = self.chi = None
         self.use = True
+        self.dataset = 'd001'
+        self.interp_cache_size = INTERP_CACHE_SIZE
+        self.clear_interp_cache()
         if len(state) == 12:  # "use" was added after paths states were being saved
             (self.filename, self.label, self.feffrun, self.degen,
              self.s02, self.e0, self.ei, self.deltar, self.sigma2,
@@ -358,6 +370,49 @@ class FeffPathGroup(Group):
     @rmass.setter
     def rmass(self, val):  pass
 
+    @property
+    def _feffdat(self): return self.__feffdat
+
+    @_feffdat.setter
+    def _feffdat(self, val):
+        """replacing the Feff data invalidates splines and cached values"""
+        self.__feffdat = val
+        self.spline_coefs = None
+        self.clear_interp_cache()
+
+    def clear_interp_cache(self):
+        """clear cached interpolations of Feff.dat values, and reset counters"""
+        self.__interp_cache = {}
+        self.__interp_stats = [0, 0]
+
+    def interp_cache_info(self):
+        """return dict of hits, misses, and size of the cache of
+        interpolated Feff.dat values"""
+        hits, misses = self.__interp_stats
+        return dict(hits=hits, misses=misses, size=len(self.__interp_cache),
+                    maxsize=self.interp_cache_size)
+
+    def _interp_cache_key(self, k, e0, ei, interp):
+        """key for cached interpolations: exact k grid, e0, and ei"""
+        return (k.tobytes(), float(e0), float(ei), interp)
+
+    def _interp_cache_get(self, key):
+        """get cached (q, pha, amp, rep, lam, p, pp) or None"""
+        cache = self.__interp_cache
+        val = cache.pop(key, None)
+        if val is None:
+            self.__interp_stats[1] += 1
+        else:
+            self.__interp_stats[0] += 1
+            cache[key] = val   # most recently used goes last
+        return val
+
+    def _interp_cache_put(self, key, val):
+        cache = self.__interp_cache
+        cache[key] = val
+        while len(cache) > max(0, self.interp_cache_size):
+            cache.pop(next(iter(cache)))
+
     def __repr__(self):
         return f'<FeffPath Group label={self.label:s}, filename={self.filename:s}, use={self.use}>'
 
@@ -392,8 +447,29 @@ class FeffPathGroup(Group):
             self.params.add(parname, **kws)
             self.params[parname].is_pathparam = True
 
+    def has_path_params(self, params):
+        """return whether Path Parameters already exist in the `params`
+        namespace with the current values/expressions for this path,
+        so that create_path_params() does not need to be re-run.
+        """
+        if params is None or params is not self.params:
+            return False
+        for pname in PATH_PARS:
+            par = params.get(self.pathpar_name(pname), None)
+            if par is None:
+                return False
+            val = getattr(self, pname)
+            if isinstance(val, str):
+                if par.expr != val:
+                    return False
+            elif (par.expr is not None or not isinstance(val, (int, float))
+                  or par.value != val):
+                return False
+        return True
+
     def create_spline_coefs(self):
         """pre-calculate spline coefficients for feff data"""
+        self.clear_interp_cache()
         self.spline_coefs = {}
         fdat = self._feffdat
         self.spline_coefs['pha'] = UnivariateSpline(fdat.k, fdat.pha, s=0)
@@ -539,27 +615,39 @@ class FeffPathGroup(Group):
                                    deltar=deltar, sigma2=sigma2,
                                    third=third, fourth=fourth)
 
-        # create e0-shifted energy and k, careful to look for |e0| ~= 0.
-        en = k*k - e0*ETOK
-        if min(abs(en)) < SMALL_ENERGY:
-            try:
-                en[np.where(abs(en) < 1.5*SMALL_ENERGY)] = SMALL_ENERGY
-            except ValueError:
-                pass
-        # q is the e0-shifted wavenumber
-        q = np.sign(en)*np.sqrt(abs(en))
-
-        # lookup Feff.dat values (pha, amp, rep, lam)
-        if interp.startswith('lin'):
-            pha = np.interp(q, fdat.k, fdat.pha)
-            amp = np.interp(q, fdat.k, fdat.amp)
-            rep = np.interp(q, fdat.k, fdat.rep)
-            lam = np.interp(q, fdat.k, fdat.lam)
+        ckey = self._interp_cache_key(k, e0, ei, interp)
+        cached = self._interp_cache_get(ckey)
+        if cached is None:
+            # create e0-shifted energy and k, careful to look for |e0| ~= 0.
+            en = k*k - e0*ETOK
+            if min(abs(en)) < SMALL_ENERGY:
+                try:
+                    en[np.where(abs(en) < 1.5*SMALL_ENERGY)] = SMALL_ENERGY
+                except ValueError:
+                    pass
+            # q is the e0-shifted wavenumber
+            q = np.sign(en)*np.sqrt(abs(en))
+
+            # lookup Feff.dat values (pha, amp, rep, lam)
+            if interp.startswith('lin'):
+                pha = np.interp(q, fdat.k, fdat.pha)
+                amp = np.interp(q, fdat.k, fdat.amp)
+                rep = np.interp(q, fdat.k, fdat.rep)
+                lam = np.interp(q, fdat.k, fdat.lam)
+            else:
+                if self.spline_coefs is None:
+                    self.create_spline_coefs()
+                pha = self.spline_coefs['pha'](q)
+                amp = self.spline_coefs['amp'](q)
+                rep = self.spline_coefs['rep'](q)
+                lam = self.spline_coefs['lam'](q)
+
+            # p = complex wavenumber, and its square:
+            pp   = (rep + 1j/lam)**2 + 1j * ei * ETOK
+            p    = np.sqrt(pp)
+            self._interp_cache_put(ckey, (q, pha, amp, rep, lam, p, pp))
         else:
-            pha = self.spline_coefs['pha'](q)
-            amp = self.spline_coefs['amp'](q)
-            rep = self.spline_coefs['rep'](q)
-            lam = self.spline_coefs['lam'](q)
+            q, pha, amp, rep, lam, p, pp = cached
 
         if debug:
             self.debug_k   = q
@@ -568,10 +656,6 @@ class FeffPathGroup(Group):
             self.debug_rep = rep
             self.debug_lam = lam
 
-        # p = complex wavenumber, and its square:
-        pp   = (rep + 1j/lam)**2 + 1j * ei * ETOK
-        p    = np.sqrt(pp)
-
         # the xafs equation:
         cchi = np.exp(-2*reff*p.imag - 2*pp*(sigma2 - pp*fourth/3) +
                       1j*(2*q*reff + pha +
@@ -586,6 +670,254 @@ class FeffPathGroup(Group):
         self.chi_imag = -cchi.real
 
 
+class FeffPathStack(object):
+    """Stacked Feff.dat tables for a list of FeffPathGroups, used to
+    evaluate chi(k) for all paths in a single NumPy pass.
+
+    Paths sharing the same Feff.dat k grid are evaluated together: the
+    cubic splines for pha, amp, rep, and lam are converted to piecewise
+    polynomials on common breakpoints and stacked into one array, so that
+    interpolation at every path's e0-shifted k is a single gather, and
+    the EXAFS equation is evaluated on (npaths, nk) arrays.
+
+    Paths that cannot be stacked (no Feff data, or reff too small) fall
+    back to FeffPathGroup._calc_chi().  The tables are rebuilt if the
+    list of paths or any path's Feff data changes.
+    """
+    def __init__(self, paths=None):
+        self.paths = []
+        self.tables = []
+        self._sources = []
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        """set list (or dict) of paths, rebuilding tables only if needed"""
+        if paths is None:
+            paths = []
+        elif isinstance(paths, dict):
+            paths = list(paths.values())
+        paths = list(paths)
+        same = (len(paths) == len(self.paths) and
+                all(a is b for a, b in zip(paths, self.paths)))
+        if not same:
+            self.paths = paths
+            self.tables = []
+            self._sources = []
+
+    def is_current(self):
+        "return whether the stacked tables match the Feff data of the paths"
+        return (len(self._sources) == len(self.paths) and
+                all(p._feffdat is s for p, s in zip(self.paths, self._sources)))
+
+    def build(self):
+        """build the stacked interpolation tables, grouping paths by k grid"""
+        grids = {}
+        for ipath, path in enumerate(self.paths):
+            fdat = path._feffdat
+            if fdat is None or fdat.reff < 0.05:
+                continue
+            grids.setdefault(fdat.k.tobytes(), []).append(ipath)
+
+        self.tables = []
+        for index in grids.values():
+            kdat = self.paths[index[0]]._feffdat.k
+            breaks, cubic, linear = None, [], []
+            for ipath in index:
+                fdat = self.paths[ipath]._feffdat
+                coefs = []
+                for attr in INTERP_ARRS:
+                    ppoly = PPoly.from_spline(splrep(fdat.k, getattr(fdat, attr), s=0))
+                    # drop zero-width intervals from repeated end knots
+                    keep = np.diff(ppoly.x) > 0
+                    coefs.append(ppoly.c[:, keep])
+                    if breaks is None:
+                        breaks = ppoly.x[:-1][keep]
+                cubic.append(np.array(coefs))
+                linear.append(np.array([getattr(fdat, a) for a in INTERP_ARRS]))
+            # cubic:  (npaths, nintervals, 4 arrays, 4 poly coefs)
+            # linear: (npaths, nkdat, 4 arrays)
+            cubic = np.ascontiguousarray(np.array(cubic).transpose(0, 3, 1, 2))
+            linear = np.ascontiguousarray(np.array(linear).transpose(0, 2, 1))
+            reff = np.array([self.paths[i]._feffdat.reff for i in index])
+            self.tables.append(Group(index=np.array(index), kdat=kdat,
+                                     breaks=breaks, cubic=cubic,
+                                     linear=linear, reff=reff))
+        self._sources = [p._feffdat for p in self.paths]
+
+    def _interp(self, table, rows, q, interp='cubic', deriv=False):
+        """interpolate (pha, amp, rep, lam) for all rows at q[nrows, nk].
+        With deriv=True, also return their derivatives with respect to q.
+        """
+        ir = np.arange(len(rows))[:, None]
+        if interp.startswith('lin'):
+            kdat = table.kdat
+            ipt = np.clip(np.searchsorted(kdat, q, side='right') - 1,
+                          0, len(kdat)-2)
+            step = (kdat[ipt+1] - kdat[ipt])[..., None]
+            frac = (q[..., None] - kdat[ipt][..., None])/step
+            lin = table.linear[rows]
+            lo, hi = lin[ir, ipt], lin[ir, ipt+1]
+            vals = lo + np.clip(frac, 0, 1)*(hi - lo)
+            if deriv:
+                dvals = (hi - lo)/step
+                dvals[((frac < 0) | (frac > 1))[..., 0]] = 0.0
+        else:
+            ipt = np.clip(np.searchsorted(table.breaks, q, side='right') - 1,
+                          0, len(table.breaks)-1)
+            dq = (q - table.breaks[ipt])[..., None]
+            c = table.cubic[rows][ir, ipt]
+            vals = ((c[..., 0]*dq + c[..., 1])*dq + c[..., 2])*dq + c[..., 3]
+            if deriv:
+                dvals = (3*c[..., 0]*dq + 2*c[..., 1])*dq + c[..., 2]
+        if deriv:
+            return np.moveaxis(vals, -1, 0), np.moveaxis(dvals, -1, 0)
+        return np.moveaxis(vals, -1, 0)
+
+    def calc_chi(self, k, interp='cubic'):
+        """calculate chi(k) for all paths, returning the sum of all paths.
+
+        Path Parameters must already be created for each path.
+        Each path will have its k, p, chi, and chi_imag set, as
+        from FeffPathGroup._calc_chi()
+        """
+        if not self.is_current():
+            self.build()
+        k = np.asarray(k, dtype='float64')
+        out = np.zeros(len(k), dtype='float64')
+        stacked = np.zeros(len(self.paths), dtype=bool)
+        for table in self.tables:
+            stacked[table.index] = True
+            use = np.array([self.paths[i].use for i in table.index])
+            for ipath in table.index[~use]:
+                path = self.paths[ipath]
+                path.k = path.p = k
+                path.chi = 0.0*k
+                path.chi_imag = 0.0*k
+            rows = np.where(use)[0]
+            if len(rows) == 0:
+                continue
+            paths = [self.paths[i] for i in table.index[rows]]
+            pars = []
+            for path in paths:
+                pvals = path.path_paramvals()
+                pars.append([pvals[p] for p in PATH_PARS])
+            pars = np.array(pars, dtype='float64').T[:, :, None]
+            degen, s02, e0, ei, deltar, sigma2, third, fourth = pars
+            reff = table.reff[rows][:, None]
+
+            # reuse interpolated values for paths with unchanged e0 and ei
+            keys = [path._interp_cache_key(k, e0[i, 0], ei[i, 0], interp)
+                    for i, path in enumerate(paths)]
+            cached = [path._interp_cache_get(key) for path, key in zip(paths, keys)]
+            miss = np.array([c is None for c in cached])
+            if miss.any():
+                # e0-shifted energy and k, careful to look for |e0| ~= 0.
+                en = k*k - e0[miss]*ETOK
+                small = abs(en) < 1.5*SMALL_ENERGY
+                if small.any():
+                    small &= (abs(en).min(axis=1) < SMALL_ENERGY)[:, None]
+                    en[small] = SMALL_ENERGY
+                q = np.sign(en)*np.sqrt(abs(en))
+
+                pha, amp, rep, lam = self._interp(table, rows[miss], q,
+                                                  interp=interp)
+                pp = (rep + 1j/lam)**2 + 1j * ei[miss] * ETOK
+                p = np.sqrt(pp)
+                for j, i in enumerate(np.where(miss)[0]):
+                    cached[i] = (q[j], pha[j], amp[j], rep[j], lam[j], p[j], pp[j])
+                    paths[i]._interp_cache_put(keys[i], cached[i])
+            if not miss.all():
+                q, pha, amp, rep, lam, p, pp = [np.array(a) for a in zip(*cached)]
+
+            cchi = np.exp(-2*reff*p.imag - 2*pp*(sigma2 - pp*fourth/3) +
+                          1j*(2*q*reff + pha +
+                              2*p*(deltar - 2*sigma2/reff - 2*pp*third/3) ))
+            cchi = degen * s02 * amp * cchi / (q*(reff + deltar)**2)
+            cchi[:, 0] = 2*cchi[:, 1] - cchi[:, 2]
+
+            chi = cchi.imag
+            chi_imag = -cchi.real
+            for i, path in enumerate(paths):
+                path.k = k
+                path.p = p[i]
+                path.chi = chi[i]
+                path.chi_imag = chi_imag[i]
+            out += chi.sum(axis=0)
+
+        for ipath in np.where(~stacked)[0]:
+            path = self.paths[ipath]
+            path._calc_chi(k=k, interp=interp)
+            if path.chi is not None:
+                out += path.chi
+        return out
+
+    def calc_chi_derivs(self, k, interp='cubic'):
+        """calculate derivatives of chi(k) for each path with respect to
+        each of its Path Parameters, using the current parameter values.
+
+        Returns array of shape (npaths, len(PATH_PARS), len(k)), with
+        Path Parameters in the order of PATH_PARS. Paths that are not
+        used or cannot be stacked have derivatives of 0.
+        """
+        if not self.is_current():
+            self.build()
+        k = np.asarray(k, dtype='float64')
+        out = np.zeros((len(self.paths), len(PATH_PARS), len(k)), dtype='float64')
+        for table in self.tables:
+            use = np.array([self.paths[i].use for i in table.index])
+            rows = np.where(use)[0]
+            if len(rows) == 0:
+                continue
+            pars = []
+            for ipath in table.index[rows]:
+                pvals = self.paths[ipath].path_paramvals()
+                pars.append([pvals[p] for p in PATH_PARS])
+            pars = np.array(pars, dtype='float64').T[:, :, None]
+            degen, s02, e0, ei, deltar, sigma2, third, fourth = pars
+            reff = table.reff[rows][:, None]
+
+            en = k*k - e0*ETOK
+            small = abs(en) < 1.5*SMALL_ENERGY
+            if small.any():
+                small &= (abs(en).min(axis=1) < SMALL_ENERGY)[:, None]
+                en[small] = SMALL_ENERGY
+            q = np.sign(en)*np.sqrt(abs(en))
+
+            vals, dvals = self._interp(table, rows, q, interp=interp, deriv=True)
+            pha, amp, rep, lam = vals
+            dpha, damp, drep, dlam = dvals
+
+            pp = (rep + 1j/lam)**2 + 1j * ei * ETOK
+            p = np.sqrt(pp)
+            rpath = reff + deltar
+            xphase = deltar - 2*sigma2/reff - 2*pp*third/3
+            expx = np.exp(-2*reff*p.imag - 2*pp*(sigma2 - pp*fourth/3) +
+                          1j*(2*q*reff + pha + 2*p*xphase))
+            base = amp * expx / (q*rpath**2)
+            cchi = degen * s02 * base
+
+            def dexpo(dq, dpha, dpp):
+                "derivative of exponent, given derivatives of q, pha, pp"
+                dp = dpp/(2*p)
+                return (-2*reff*dp.imag + dpp*(-2*sigma2 + 4*pp*fourth/3) +
+                        1j*(2*reff*dq + dpha + 2*dp*xphase - 4*p*dpp*third/3))
+
+            # e0 enters through q:  dq/de0 = -ETOK/(2q)
+            dq = -ETOK/(2*q)
+            dpp = 2*(rep + 1j/lam)*(drep - 1j*dlam/lam**2)*dq
+            de0 = (cchi*dexpo(dq, dpha*dq, dpp) +
+                   degen*s02*expx*(damp/q - amp/q**2)*dq/rpath**2)
+            dei = cchi*dexpo(0.0, 0.0, 1j*ETOK)
+
+            dchi = np.array([s02*base, degen*base, de0, dei,
+                             cchi*(2j*p - 2/rpath),
+                             cchi*(-2*pp - 4j*p/reff),
+                             cchi*(-4j*p*pp/3),
+                             cchi*(2*pp*pp/3)]).transpose(1, 0, 2)
+            dchi[..., 0] = 2*dchi[..., 1] - dchi[..., 2]
+            out[table.index[rows]] = dchi.imag
+        return out
+
 
 def path2chi(path, params=None, paramgroup=None, **kws):
     """calculate chi(k) for a Feff Path,
@@ -614,7 +946,7 @@ def path2chi(path, params=None, paramgroup=None, **kws):
 
 
 def ff2chi(paths, group=None, params=None, k=None, kmax=None, kstep=0.05,
-           paramgroup=None, **kws):
+           paramgroup=None, interp='cubic', batch=True, pathstack=None, **kws):
     """sum chi(k) for a list of FeffPath Groups.
 
     Parameters:
@@ -625,12 +957,17 @@ def ff2chi(paths, group=None, params=None, k=None, kmax=None, kstep=0.05,
       kmax:        maximum k value for chi calculation [20].
       kstep:       step in k value for chi calculation [0.05].
       k:           explicit array of k values to calculate chi.
+      interp:      interpolation for Feff.dat values, 'cubic' or 'linear' ['cubic']
+      batch:       whether to calculate all paths at once [True]
+      pathstack:   FeffPathStack to reuse for batch calculation [None]
     Returns:
     ---------
        group contain arrays for k and chi
 
     This essentially calls path2chi() for each of the paths in the
     `paths` and writes the resulting arrays to group.k and group.chi.
+    With `batch=True`, the paths are evaluated together with a FeffPathStack,
+    which gives the same results much faster for many paths.
 
     """
     if params is None:
@@ -644,7 +981,7 @@ def ff2chi(paths, group=None, params=None, k=None, kmax=None, kstep=0.05,
     elif isinstance(paths, dict):
         pathlist = list(paths.values())
     else:
-        raise ValueErrror('paths must be list, tuple, or dict')
+        raise ValueError('paths must be list, tuple, or dict')
 
     if len(pathlist) == 0:
         return Group(k=np.linspace(0, 20, 401),
@@ -654,12 +991,30 @@ def ff2chi(paths, group=None, params=None, k=None, kmax=None, kstep=0.05,
         if not isNamedClass(path, FeffPathGroup):
             print(f"{path} is not a valid Feff Path")
             return
-        path.create_path_params(params=params)
-        path._calc_chi(k=k, kstep=kstep, kmax=kmax)
-    k = pathlist[0].k[:]*1.0
-    out = np.zeros_like(k)
-    for path in pathlist:
-        out += path.chi
+        if not path.has_path_params(params):
+            path.create_path_params(params=params)
+
+    if batch:
+        if k is None:
+            fdat = pathlist[0]._feffdat
+            if kmax is None:
+                kmax = 30.0
+            kmax = min(max(fdat.k), kmax)
+            if kstep is None: kstep = 0.05
+            k = kstep * np.arange(int(1.01 + kmax/kstep), dtype='float64')
+        if pathstack is None:
+            pathstack = FeffPathStack(pathlist)
+        else:
+            pathstack.set_paths(pathlist)
+        out = pathstack.calc_chi(k, interp=interp)
+        k = k[:]*1.0
+    else:
+        for path in pathlist:
+            path._calc_chi(k=k, kstep=kstep, kmax=kmax, interp=interp)
+        k = pathlist[0].k[:]*1.0
+        out = np.zeros_like(k)
+        for path in pathlist:
+            out += path.chi
 
     if group is None:
         group = Group()
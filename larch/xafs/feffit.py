@@ -26,9 +26,9 @@ from ..fitting import (correlated_values, eval_stderr, ParameterGroup,
                        group2params, params2group, isParameter)
 
 from .xafsutils import set_xafsGroup, gfmt
-from .xafsft import xftf_fast, xftr_fast, ftwindow
+from .xafsft import ftwindow, fft, ifft, rfft, sqrtpi
 from .autobk import autobk_delta_chi
-from .feffdat import FeffPathGroup, ff2chi
+from .feffdat import FeffPathGroup, FeffPathStack, ff2chi, PATH_PARS
 
 class TransformGroup(Group):
     """A Group of transform parameters.
@@ -40,11 +40,16 @@ class TransformGroup(Group):
     That is: don't simply change the parameters and expect different results.
     If you do change parameters, reset kwin / rwin to None to cause them to be
     recalculated.
+
+    The products of kwin and k**kweight are cached for each kweight, and the
+    zero-padded FFT buffers are allocated once.  With use_rfft=True (the
+    default), the forward transform of real chi(k) uses a real-input FFT.
     """
     def __init__(self, kmin=0, kmax=20, kweight=2, dk=4, dk2=None,
                  window='kaiser', nfft=2048, kstep=0.05,
                  rmin = 0, rmax=10, dr=0, dr2=None, rwindow='hanning',
-                 fitspace='r', wavelet_mask=None, rbkg=0, _larch=None, **kws):
+                 fitspace='r', wavelet_mask=None, rbkg=0, use_rfft=True,
+                 _larch=None, **kws):
         Group.__init__(self, **kws)
         self.kmin = kmin
         self.kmax = kmax
@@ -70,6 +75,7 @@ class TransformGroup(Group):
 
         self.fitspace = fitspace
         self.wavelet_mask = wavelet_mask
+        self.use_rfft = use_rfft
         self._cauchymask = None
 
         self._larch = _larch
@@ -90,7 +96,7 @@ class TransformGroup(Group):
                               rwindow=self.rwindow, nfft=self.nfft,
                               fitspace=self.fitspace,
                               wavelet_mask=self.wavelet_mask,
-                              _larch=self._larch)
+                              use_rfft=self.use_rfft, _larch=self._larch)
 
     def __deepcopy__(self, memo):
         return TransformGroup(kmin=self.kmin, kmax=self.kmax,
@@ -101,7 +107,7 @@ class TransformGroup(Group):
                               rwindow=self.rwindow, nfft=self.nfft,
                               fitspace=self.fitspace,
                               wavelet_mask=self.wavelet_mask,
-                              _larch=self._larch)
+                              use_rfft=self.use_rfft, _larch=self._larch)
 
     def make_karrays(self, k=None, chi=None):
         "this should be run in kstep or nfft changes"
@@ -113,6 +119,24 @@ class TransformGroup(Group):
         self.rstep = pi/(self.kstep*self.nfft)
         self.k_ = self.kstep * arange(self.nfft, dtype='float64')
         self.r_ = self.rstep * arange(self.nfft, dtype='float64')
+        self._kbuff = zeros(self.nfft, dtype='float64')
+        self._cbuff = zeros(self.nfft, dtype='complex128')
+        self._nkbuff = self._ncbuff = 0
+        self._kwin_kw = {}
+
+    def get_kwin_kweight(self, kweight):
+        """return kwin*k**kweight on the k_ grid, cached for each kweight.
+        The cache is cleared if kwin is reset"""
+        if self.kwin is None:
+            self.kwin = ftwindow(self.k_, xmin=self.kmin, xmax=self.kmax,
+                                 dx=self.dk, dx2=self.dk2, window=self.window)
+        cache = self._kwin_kw
+        if cache.get('kwin', None) is not self.kwin:
+            cache.clear()
+            cache['kwin'] = self.kwin
+        if kweight not in cache:
+            cache[kweight] = self.kwin * self.k_**kweight
+        return cache[kweight]
 
     def _xafsft(self, chi, group=None, rmax_out=10, with_chiq=False, **kws):
         "returns "
@@ -164,13 +188,24 @@ class TransformGroup(Group):
         chi must be on self.k_ grid"""
         if self.kstep != self.__kstep or self.nfft != self.__nfft:
             self.make_karrays()
-        if self.kwin is None:
-            self.kwin = ftwindow(self.k_, xmin=self.kmin, xmax=self.kmax,
-                                 dx=self.dk, dx2=self.dk2, window=self.window)
         if kweight is None:
             kweight = self.get_kweight()
-        cx = chi * self.kwin[:len(chi)] * self.k_[:len(chi)]**kweight
-        return xftf_fast(cx, kstep=self.kstep, nfft=self.nfft)
+        kwin_kw = self.get_kwin_kweight(kweight)
+        npts = len(chi)
+        if self.use_rfft and np.isrealobj(chi):
+            buff = self._kbuff
+            if npts < self._nkbuff:
+                buff[npts:self._nkbuff] = 0.0
+            self._nkbuff = npts
+            np.multiply(chi, kwin_kw[:npts], out=buff[:npts])
+            return (self.kstep/sqrtpi) * rfft(buff)[:self.nfft//2]
+
+        buff = self._cbuff
+        if npts < self._ncbuff:
+            buff[npts:self._ncbuff] = 0.0
+        self._ncbuff = npts
+        np.multiply(chi, kwin_kw[:npts], out=buff[:npts])
+        return (self.kstep/sqrtpi) * fft(buff)[:self.nfft//2]
 
     def fftr(self, chir):
         " reverse FT -- meant to be used internally"
@@ -180,8 +215,13 @@ class TransformGroup(Group):
             xmin = max(self.rbkg, self.rmin)
             self.rwin = ftwindow(self.r_, xmin=xmin, xmax=self.rmax,
                                  dx=self.dr, dx2=self.dr2, window=self.rwindow)
-        cx = chir * self.rwin[:len(chir)]
-        return xftr_fast(cx, kstep=self.kstep, nfft=self.nfft)
+        npts = len(chir)
+        buff = self._cbuff
+        if npts < self._ncbuff:
+            buff[npts:self._ncbuff] = 0.0
+        self._ncbuff = npts
+        np.multiply(chir, self.rwin[:npts], out=buff[:npts])
+        return (4*sqrtpi/self.kstep) * ifft(buff)[:self.nfft//2]
 
 
     def make_cwt_arrays(self, nkpts, nrpts):
@@ -309,6 +349,7 @@ class FeffitDataSet(Group):
         self.bkg_spline = {}
         self._chi = None
         self._bkg = 0.0
+        self._pathstack = None
         self._prepared = False
 
 
@@ -412,6 +453,8 @@ class FeffitDataSet(Group):
             path.create_path_params(params=params, dataset=self.hashkey)
             if path.spline_coefs is None:
                 path.create_spline_coefs()
+            path.clear_interp_cache()
+        self._pathstack = FeffPathStack(self.paths)
 
         self.bkg_spline = {}
         if self.refine_bkg:
@@ -515,7 +558,8 @@ class FeffitDataSet(Group):
             self.prepare_fit(params)
 
         ff2chi(self.paths, params=params, k=self.model.k,
-                _larch=self._larch, group=self.model)
+               pathstack=self._pathstack, _larch=self._larch,
+               group=self.model)
 
         self._bkg = 0.0
         if self.refine_bkg:
@@ -529,13 +573,19 @@ class FeffitDataSet(Group):
                 coefs.append(par.value)
             self._bkg = splev(self.model.k, [knots, coefs, order])
 
+        diff  = self._chi - self._bkg
+        if not data_only:  # data_only for extracting transformed data
+            diff -= self.model.chi
+        return self._transform_diff(diff)
+
+    def _transform_diff(self, diff):
+        """apply the fit transform and uncertainties to a difference in
+        chi(k), returning the residual array.  This is linear in diff.
+        """
         eps_k = self.epsilon_k
         if isinstance(eps_k, np.ndarray):
             eps_k[np.where(eps_k<1.e-12)[0]] = 1.e-12
 
-        diff  = self._chi - self._bkg
-        if not data_only:  # data_only for extracting transformed data
-            diff -= self.model.chi
         trans = self.transform
         k     = trans.k_[:len(diff)]
 
@@ -582,6 +632,44 @@ class FeffitDataSet(Group):
                     out.append( realimag(chiq_[iqmin:iqmax])[::2])
             return np.concatenate(out)
 
+    def _jacobian(self, params, var_names, dpathpars):
+        """return the Jacobian of the residual for this data set, with one
+        row per variable in var_names.
+
+        dpathpars holds the derivatives of the Path Parameters (in the order
+        of PATH_PARS) of each path with respect to each variable, with shape
+        (npaths, len(PATH_PARS), nvarys). The derivatives of chi(k) for each
+        path with respect to its Path Parameters are analytic, and the
+        transform of the difference in chi(k) is linear.
+        """
+        if not self._prepared:
+            self.prepare_fit(params)
+        k = self.model.k
+        dchi = self._pathstack.calc_chi_derivs(k)
+        dmodel = np.einsum('pjk,pjv->vk', dchi, dpathpars)
+
+        bkg_basis = None
+        if self.refine_bkg:
+            bkg_basis = self.bkg_spline.get('basis', None)
+            if bkg_basis is None:
+                knots = self.bkg_spline['knots']
+                order = self.bkg_spline['order']
+                nspline = self.bkg_spline['nspline']
+                bkg_basis = {}
+                for i in range(nspline):
+                    coefs = np.zeros(nspline)
+                    coefs[i] = 1.0
+                    bkg_basis[f'bkg{i:02d}_{self.hashkey}'] = splev(k, [knots, coefs, order])
+                self.bkg_spline['basis'] = bkg_basis
+
+        out = []
+        for iv, vname in enumerate(var_names):
+            ddiff = -dmodel[iv]
+            if bkg_basis is not None and vname in bkg_basis:
+                ddiff = ddiff - bkg_basis[vname]
+            out.append(self._transform_diff(ddiff))
+        return np.array(out)
+
     def save_outputs(self, rmax_out=10, path_outputs=True, with_chiq=True):
         "save fft outputs, and may also map a refined _bkg to the data chi(k) arrays"
         def xft(dgroup):
@@ -653,8 +741,63 @@ def _feffit_resid(params, datasets=None, **kwargs):
     """ this is the residual function for feffit"""
     return concatenate([d._residual(params) for d in datasets])
 
+def _pathpar_values(datasets):
+    """current Path Parameter values for the paths of each dataset,
+    as a list of arrays of shape (npaths, len(PATH_PARS))"""
+    out = []
+    for ds in datasets:
+        vals = []
+        for path in ds._pathstack.paths:
+            pvals = path.path_paramvals()
+            vals.append([pvals[p] for p in PATH_PARS])
+        out.append(np.array(vals, dtype='float64').reshape(-1, len(PATH_PARS)))
+    return out
+
+def _feffit_jacobian(params, datasets=None, **kwargs):
+    """analytic Jacobian for feffit, with one row per variable.
+
+    Derivatives of the Path Parameters with respect to the variables
+    are found numerically by re-evaluating the constraint expressions,
+    which is cheap compared to calculating chi(k).  Derivatives of chi(k)
+    with respect to Path Parameters are analytic.
+    """
+    var_names = [name for name, par in params.items() if par.vary]
+    for ds in datasets:
+        if ds._pathstack is None:
+            ds.prepare_fit(params)
+    # Path Parameters are re-evaluated with each path's values for 'reff',
+    # etc, so other constraints only need updating if there are any
+    def update_constraints():
+        if any(par.expr is not None and not getattr(par, 'is_pathparam', False)
+               for par in params.values()):
+            params.update_constraints()
+
+    dpathpars = [np.zeros((len(ds._pathstack.paths), len(PATH_PARS),
+                           len(var_names))) for ds in datasets]
+    for iv, vname in enumerate(var_names):
+        par = params[vname]
+        value = par.value
+        step = 1.e-6*max(abs(value), 1.e-3)
+        par.value = value + step
+        vplus = par.value
+        update_constraints()
+        fplus = _pathpar_values(datasets)
+        par.value = value - step
+        vminus = par.value
+        update_constraints()
+        fminus = _pathpar_values(datasets)
+        par.value = value
+        if vplus != vminus:
+            for i, (fp, fm) in enumerate(zip(fplus, fminus)):
+                dpathpars[i][:, :, iv] = (fp - fm)/(vplus - vminus)
+    update_constraints()
+    _pathpar_values(datasets)
+    return concatenate([ds._jacobian(params, var_names, dpars)
+                        for ds, dpars in zip(datasets, dpathpars)], axis=1)
+
 def feffit(paramgroup, datasets, rmax_out=10, path_outputs=True,
-           fix_unused_variables=True,  _larch=None, **kws):
+           fix_unused_variables=True, analytic_jacobian=False, _larch=None,
+           **kws):
     """execute a Feffit fit: a fit of feff paths to a list of datasets
 
     Parameters:
@@ -665,6 +808,9 @@ def feffit(paramgroup, datasets, rmax_out=10, path_outputs=True,
       path_output:  Flag to set whether all Path outputs should be written.
       fix_unused_variables: Flag for whether to set `vary=False` for unused
                     variable parameters.  Otherwise, a warning will be printed.
+      analytic_jacobian: Flag for whether to use analytic derivatives of the
+                    Path sum for the Jacobian, instead of finite differences
+                    of the full residual [False]
     Returns:
     ---------
       a fit results group.  This will contain subgroups of:
@@ -673,6 +819,9 @@ def feffit(paramgroup, datasets, rmax_out=10, path_outputs=True,
         params:   This will be identical to the input parameter group.
         fit:      an object which points to the low-level fit.
 
+     The `interp_cache` dict gives the number of times interpolated Feff.dat
+     values were reused (hits) or recalculated (misses) during the fit.
+
      Statistical parameters will be put into the params group.  Each
      dataset will have a 'data' and 'model' subgroup, each with arrays:
         k            wavenumber array of k
@@ -740,7 +889,10 @@ def feffit(paramgroup, datasets, rmax_out=10, path_outputs=True,
     fit = Minimizer(_feffit_resid, params, fcn_kws=dict(datasets=datasets),
                     scale_covar=False, **fit_kws)
 
-    result = fit.leastsq()
+    if analytic_jacobian:
+        result = fit.leastsq(Dfun=_feffit_jacobian, col_deriv=1)
+    else:
+        result = fit.leastsq()
     dat = concatenate([d._residual(result.params, data_only=True)
                        for d in datasets])
 
@@ -803,6 +955,16 @@ def feffit(paramgroup, datasets, rmax_out=10, path_outputs=True,
     # reset the parameters group with the newly updated uncertainties
     params2group(result.params, work_paramgroup)
 
+    # statistics for reuse of interpolated Feff.dat values during the fit
+    interp_cache = dict(hits=0, misses=0)
+    for ds in datasets:
+        for path in ds.paths.values():
+            info = path.interp_cache_info()
+            interp_cache['hits'] += info['hits']
+            interp_cache['misses'] += info['misses']
+    ncache = interp_cache['hits'] + interp_cache['misses']
+    interp_cache['hit_rate'] = interp_cache['hits']/max(1, ncache)
+
     # here we create outputs arrays for chi(k), chi(r):
     for ds in datasets:
         ds.save_outputs(rmax_out=rmax_out, path_outputs=path_outputs)
@@ -811,7 +973,7 @@ def feffit(paramgroup, datasets, rmax_out=10, path_outputs=True,
                 paramgroup=work_paramgroup, fit_kws=fit_kws, datasets=datasets,
                 fit_details=result, chi_square=chi_square, n_independent=n_idp,
                 chi2_reduced=chi2_reduced, rfactor=rfactor, aic=aic, bic=bic,
-                covar=covar)
+                covar=covar, interp_cache=interp_cache)
 
     for attr in ('params', 'nvarys', 'nfree', 'ndata', 'var_names', 'nfev',
                  'success', 'errorbars', 'message', 'lmdif_message'):
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+"""
+  feffit_batch fits one Feff Path model to many data groups,
+  running the independent fits over a pool of processes
+"""
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from copy import copy, deepcopy
+import numpy as np
+
+from lmfit import Parameter
+
+from larch import Group
+from .feffdat import FeffDatFile, FeffPathGroup, FDAT_ARRS, PATH_PARS
+from .feffit import TransformGroup, FeffitDataSet, feffit
+
+# header values of a FeffDatFile, sent to worker processes once
+FDAT_HEADER = ('filename', 'title', 'version', 'shell', 'absorber', 'degen',
+               'reff', 'nleg', 'rnorman', 'edge', 'gam_ch', 'exch', 'vmu',
+               'vfermi', 'vint', 'rs_int', 'potentials', 'geom')
+
+# attributes of data groups that feffit uses
+DATA_ATTRS = ('k', 'chi', 'delta_chi', 'epsilon_k', 'energy', 'norm',
+              'e0', 'ek0', 'rbkg', 'edge_step', 'filename', 'groupname')
+
+# state for worker processes, set by _batch_init()
+_BATCH = {}
+
+def _path_specs(paths):
+    """distinct FeffDatFiles used by a list of paths, and a spec for each
+    path with the index of its FeffDatFile and its Path Parameters"""
+    fdats, fdat_index, pathspecs = [], {}, []
+    for path in paths:
+        fdat = path._feffdat
+        if id(fdat) not in fdat_index:
+            fdat_index[id(fdat)] = len(fdats)
+            fdats.append(fdat)
+        spec = dict(ifdat=fdat_index[id(fdat)], label=path.label,
+                    filename=path.filename, feffrun=path.feffrun,
+                    use=path.use)
+        for pname in PATH_PARS:
+            spec[pname] = getattr(path, pname)
+        pathspecs.append(spec)
+    return fdats, pathspecs
+
+def _pack_feffdat(fdats):
+    """pack the arrays of a list of FeffDatFiles into one shared memory
+    block, returning (SharedMemory, layout), with layout holding
+    (offset, npts, header) for each FeffDatFile
+    """
+    narr = len(FDAT_ARRS)
+    total = sum(narr*len(fdat.k) for fdat in fdats)
+    shm = shared_memory.SharedMemory(create=True, size=max(8, 8*total))
+    buff = np.ndarray((total,), dtype='float64', buffer=shm.buf)
+    layout, offset = [], 0
+    for fdat in fdats:
+        npts = len(fdat.k)
+        for i, attr in enumerate(FDAT_ARRS):
+            buff[offset+i*npts:offset+(i+1)*npts] = getattr(fdat, attr)
+        header = {attr: getattr(fdat, attr, None) for attr in FDAT_HEADER}
+        layout.append((offset, npts, header))
+        offset += narr*npts
+    return shm, layout
+
+def _unpack_feffdat(buff, layout):
+    """create FeffDatFiles with arrays viewing the shared buffer"""
+    out = []
+    for offset, npts, header in layout:
+        fdat = FeffDatFile()
+        fdat._set_from_dict(**header)
+        for i, attr in enumerate(FDAT_ARRS):
+            setattr(fdat, attr, buff[offset+i*npts:offset+(i+1)*npts])
+        out.append(fdat)
+    return out
+
+def _make_paths(fdats, pathspecs):
+    """create fresh FeffPathGroups from path specs, sharing Feff data"""
+    paths = {}
+    for spec in pathspecs:
+        kws = {pname: spec[pname] for pname in PATH_PARS}
+        path = FeffPathGroup(label=spec['label'], feffrun=spec['feffrun'],
+                             use=spec['use'], _feffdat=fdats[spec['ifdat']],
+                             **kws)
+        path.filename = spec['filename']
+        paths[path.label] = path
+    return paths
+
+def _reduce_datagroup(data):
+    """copy of a data group with only the attributes used by feffit"""
+    out = Group(__name__=getattr(data, '__name__', repr(data)))
+    for attr in DATA_ATTRS:
+        if hasattr(data, attr):
+            setattr(out, attr, getattr(data, attr))
+    if getattr(out, 'groupname', None) is None:
+        out.groupname = repr(data)
+    if getattr(out, 'filename', None) is None:
+        out.filename = out.groupname
+    return out
+
+def _batch_init(shm_name, layout, pathspecs, paramgroup, transform, fit_opts):
+    """initialize worker process: attach to the shared Feff data"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    total = sum(len(FDAT_ARRS)*npts for offset, npts, header in layout)
+    buff = np.ndarray((total,), dtype='float64', buffer=shm.buf)
+    _BATCH.update(shm=shm, fdats=_unpack_feffdat(buff, layout),
+                  pathspecs=pathspecs, paramgroup=paramgroup,
+                  transform=transform, fit_opts=fit_opts)
+
+def _seed_params(paramgroup, values):
+    """copy of a parameter group, with starting values for variables"""
+    out = deepcopy(paramgroup)
+    for name, value in values.items():
+        par = getattr(out, name, None)
+        if isinstance(par, Parameter) and par.vary and value is not None:
+            par.value = value
+    return out
+
+def _run_fits(datagroups, fdats, pathspecs, paramgroup, transform,
+              seed_previous=False, starts=None, refine_bkg=False,
+              epsilon_k=None, **fit_kws):
+    """run fits for a sequence of data groups, returning list of results"""
+    results, prev = [], None
+    if starts is None or len(starts) == 0:
+        starts = [{}]
+    for data in datagroups:
+        best = None
+        for start in starts:
+            init = dict(start)
+            if seed_previous and prev is not None:
+                init.update({name: prev.params[name].value
+                             for name in prev.var_names})
+            dset = FeffitDataSet(data=data, paths=_make_paths(fdats, pathspecs),
+                                 transform=copy(transform),
+                                 refine_bkg=refine_bkg, epsilon_k=epsilon_k)
+            result = feffit(_seed_params(paramgroup, init), dset, **fit_kws)
+            if best is None or result.chi_square < best.chi_square:
+                best = result
+        for dset in best.datasets:
+            dset._pathstack = None
+        results.append(best)
+        prev = best
+    return results
+
+def _batch_task(datagroups):
+    "run one block of fits in a worker process"
+    return _run_fits(datagroups, _BATCH['fdats'], _BATCH['pathspecs'],
+                     _BATCH['paramgroup'], _BATCH['transform'],
+                     **_BATCH['fit_opts'])
+
+def feffit_batch_summary(results, labels=None):
+    """make a table of results from a list of feffit results
+
+    Parameters:
+    ------------
+      results:  list of feffit results, as from feffit_batch()
+      labels:   list of labels for each fit [data groupname]
+
+    Returns:
+    ---------
+      (table, text): table is a dict of {column: array} with columns for
+      label, chi_square, chi2_reduced, rfactor, nfev, and the value and
+      uncertainty of each variable, and text is a printable table.
+    """
+    if labels is None:
+        labels = [res.datasets[0].data.groupname for res in results]
+    var_names = []
+    for res in results:
+        for name in res.var_names:
+            if name not in var_names and not name.startswith('bkg'):
+                var_names.append(name)
+
+    table = {'label': list(labels)}
+    for attr in ('chi_square', 'chi2_reduced', 'rfactor', 'nfev'):
+        table[attr] = np.array([getattr(res, attr) for res in results])
+    for name in var_names:
+        vals, errs = [], []
+        for res in results:
+            par = res.params.get(name, None)
+            vals.append(np.nan if par is None else par.value)
+            stderr = None if par is None else par.stderr
+            errs.append(np.nan if stderr is None else stderr)
+        table[name] = np.array(vals)
+        table[f'{name}_stderr'] = np.array(errs)
+
+    columns = list(table.keys())
+    lines = ['# ' + ' '.join(f'{c:>14s}' for c in columns)]
+    for i in range(len(results)):
+        words = []
+        for col in columns:
+            val = table[col][i]
+            if isinstance(val, str):
+                words.append(f'{val[-14:]:>14s}')
+            else:
+                words.append(f'{val:14.6g}')
+        lines.append('  ' + ' '.join(words))
+    return table, '\n'.join(lines)
+
+def feffit_batch(paramgroup, paths, datagroups, transform=None,
+                 refine_bkg=False, epsilon_k=None, seed_previous=False,
+                 starts=None, ncpus=None, _larch=None, **fit_kws):
+    """fit the same Feff Path model to each of a list of data groups,
+    running the independent fits over a pool of processes
+
+    Parameters:
+    ------------
+      paramgroup:    group containing parameters, used as template for each fit
+      paths:         dict of {label: FeffPathGroup} or list of FeffPathGroup
+      datagroups:    list of groups containing EXAFS data ('k' and 'chi')
+      transform:     Feffit Transform group, used for all fits
+      refine_bkg:    whether to refine the background spline [False]
+      epsilon_k:     uncertainty in data for all fits [None]
+      seed_previous: whether to start each fit from the result for the
+                     preceding data group, for sequential series [False]
+      starts:        list of dicts of {variable: starting value} to try,
+                     keeping the fit with lowest chi-square [None]
+      ncpus:         number of worker processes [number of CPUs - 1].
+                     Use 0 to run all fits in this process.
+      fit_kws:       other keyword arguments are passed to feffit()
+
+    Returns:
+    ---------
+      a group containing
+        results:   list of feffit results, in the order of datagroups
+        table:     dict of arrays of fit statistics and variable values
+        summary:   printable text of table
+
+    Notes:
+    -------
+     1. The Feff.dat data for the paths is put in shared memory, and each
+        worker process receives the paths and parameters only once.
+     2. With seed_previous=True, the data groups are split into ncpus
+        contiguous blocks, fit in order within each block.
+    """
+    if isinstance(paths, dict):
+        paths = list(paths.values())
+    if transform is None:
+        transform = TransformGroup()
+    datagroups = [_reduce_datagroup(d) for d in datagroups]
+    ndat = len(datagroups)
+
+    fit_opts = dict(seed_previous=seed_previous, starts=starts,
+                    refine_bkg=refine_bkg, epsilon_k=epsilon_k)
+    fit_opts.update(fit_kws)
+    fit_opts['path_outputs'] = fit_kws.get('path_outputs', False)
+
+    if ncpus is None:
+        ncpus = max(1, mp.cpu_count()-1)
+    ncpus = min(ncpus, ndat)
+
+    fdats, pathspecs = _path_specs(paths)
+    if ncpus < 2:
+        results = _run_fits(datagroups, fdats, pathspecs, paramgroup,
+                            transform, **fit_opts)
+    else:
+        if seed_previous:
+            bounds = np.linspace(0, ndat, ncpus+1).astype(int)
+        else:
+            bounds = np.arange(ndat+1)
+        blocks = [datagroups[i0:i1] for i0, i1 in zip(bounds[:-1], bounds[1:])]
+
+        shm, layout = _pack_feffdat(fdats)
+        try:
+            with mp.Pool(ncpus, initializer=_batch_init,
+                         initargs=(shm.name, layout, pathspecs, paramgroup,
+                                   transform, fit_opts)) as pool:
+                out = pool.map(_batch_task, blocks)
+        finally:
+            shm.close()
+            shm.unlink()
+        results = []
+        for block in out:
+            results.extend(block)
+        # paths are pickled without their parameters: link them to
+        # the parameters of each fit
+        for result in results:
+            for dset in result.datasets:
+                for path in dset.paths.values():
+                    path.params = result.params
+                    path.dataset = dset.hashkey
+
+    table, summary = feffit_batch_summary(results)
+    return Group(__name__='feffit batch results', results=results,
+                 table=table, summary=summary)
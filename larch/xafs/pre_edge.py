@@ -5,11 +5,13 @@
 import numpy as np
 
 from lmfit import Parameters, Minimizer, report_fit
+from scipy.signal import fftconvolve
 from xraydb import guess_edge
 from larch import Group, Make_CallArgs, parse_group_args
 
 from larch.math import (index_of, index_nearest, interp, smooth,
                         polyfit, remove_dups, remove_nans, remove_nans2)
+from larch.math.lineshapes import lorentzian
 from .xafsutils import set_xafsGroup, TINY_ENERGY
 
 MODNAME = '_xafs'
@@ -122,6 +124,67 @@ def _finde0(energy, mu_input, estep=None, use_smooth=True):
 def flat_resid(pars, en, mu):
     return pars['c0'] + en * (pars['c1'] + en * pars['c2']) - mu
 
+def _preedge_ranges(energy, ie0, nnorm=None, nvict=0, npre=1, pre1=None,
+                    pre2=None, norm1=None, norm2=None):
+    """resolve pre-edge and normalization ranges and polynomial degree
+    for e0 = energy[ie0], returning a dict with pre1, pre2, norm1, norm2,
+    nnorm, and index ranges 'ipre' and 'inorm' for the fits.
+    These depend only on the energy array and ie0, not on mu(E).
+    """
+    e0 = energy[ie0]
+    if pre1 is None:
+        # skip first energy point, often bad
+        if ie0 > 20:
+            pre1  = 5.0*round((energy[1] - e0)/5.0)
+        else:
+            pre1  = 2.0*round((energy[1] - e0)/2.0)
+    pre1 = max(pre1,  (min(energy) - e0))
+    if pre2 is None:
+        pre2 = 0.5*pre1
+    if pre1 > pre2:
+        pre1, pre2 = pre2, pre1
+    ipre1 = index_of(energy-e0, pre1)
+    ipre2 = index_of(energy-e0, pre2)
+    if npre==1 and ipre2 < ipre1 + 2 + nvict:
+        pre2 = (energy-e0)[int(ipre1 + 2 + nvict)]
+
+    if norm2 is None:
+        norm2 = 5.0*round((max(energy) - e0)/5.0)
+    if norm2 < 0:
+        norm2 = max(energy) - e0 - norm2
+    norm2 = min(norm2, (max(energy) - e0))
+    if norm1 is None:
+        norm1 = min(25, 5.0*round(norm2/15.0))
+
+    if norm1 > norm2:
+        norm1, norm2 = norm2, norm1
+
+    norm1 = min(norm1, norm2 - 10)
+    if nnorm is None:
+        nnorm = 2
+        if norm2-norm1 < 300: nnorm = 1
+        if norm2-norm1 <  30: nnorm = 0
+    nnorm = max(min(nnorm, MAX_NNORM), 0)
+    # preedge
+    p1 = index_of(energy, pre1+e0)
+    p2 = index_nearest(energy, pre2+e0)
+    if npre == 0:
+        if p2 == p1:
+            p2 = p2 + 1
+    elif p2-p1 < 2:
+        p2 = min(len(energy), p1 + 2)
+    ipre = (p1, p2)
+
+    # normalization
+    p1 = index_of(energy, norm1+e0)
+    p2 = index_nearest(energy, norm2+e0)
+    if p2-p1 < 2:
+        p2 = min(len(energy), p1 + 2)
+    if p2-p1 < 2:
+        p1 = p1-2
+    return {'pre1': pre1, 'pre2': pre2, 'norm1': norm1, 'norm2': norm2,
+            'nnorm': nnorm, 'ipre': ipre, 'inorm': (p1, p2)}
+
 def preedge(energy, mu, e0=None, step=None, nnorm=None, nvict=0, npre=1, pre1=None,
             pre2=None, norm1=None, norm2=None):
     """pre edge subtraction, normalization for XAFS (straight python)
@@ -181,52 +244,18 @@ def preedge(energy, mu, e0=None, step=None, nnorm=None, nvict=0, npre=1, pre1=No
         e0 = find_e0(energy, mu)
     ie0 = index_nearest(energy, e0)
     e0 = energy[ie0]
+    rng = _preedge_ranges(energy, ie0, nnorm=nnorm, nvict=nvict, npre=npre,
+                          pre1=pre1, pre2=pre2, norm1=norm1, norm2=norm2)
+    nnorm = rng['nnorm']
+    pre1, pre2, norm1, norm2 = rng['pre1'], rng['pre2'], rng['norm1'], rng['norm2']
 
-    if pre1 is None:
-        # skip first energy point, often bad
-        if ie0 > 20:
-            pre1  = 5.0*round((energy[1] - e0)/5.0)
-        else:
-            pre1  = 2.0*round((energy[1] - e0)/2.0)
-    pre1 = max(pre1,  (min(energy) - e0))
-    if pre2 is None:
-        pre2 = 0.5*pre1
-    if pre1 > pre2:
-        pre1, pre2 = pre2, pre1
-    ipre1 = index_of(energy-e0, pre1)
-    ipre2 = index_of(energy-e0, pre2)
-    if npre==1 and ipre2 < ipre1 + 2 + nvict:
-        pre2 = (energy-e0)[int(ipre1 + 2 + nvict)]
-
-    if norm2 is None:
-        norm2 = 5.0*round((max(energy) - e0)/5.0)
-    if norm2 < 0:
-        norm2 = max(energy) - e0 - norm2
-    norm2 = min(norm2, (max(energy) - e0))
-    if norm1 is None:
-        norm1 = min(25, 5.0*round(norm2/15.0))
-
-    if norm1 > norm2:
-        norm1, norm2 = norm2, norm1
-
-    norm1 = min(norm1, norm2 - 10)
-    if nnorm is None:
-        nnorm = 2
-        if norm2-norm1 < 300: nnorm = 1
-        if norm2-norm1 <  30: nnorm = 0
-    nnorm = max(min(nnorm, MAX_NNORM), 0)
     # preedge
-    p1 = index_of(energy, pre1+e0)
-    p2 = index_nearest(energy, pre2+e0)
+    p1, p2 = rng['ipre']
     if npre == 0:
-        if p2 == p1:
-            p2 = p2 + 1
         mu_mean = mu[p1:p2].mean()
         pre_edge = mu_mean * np.ones(len(energy))
         precoefs = [mu_mean, 0.0]
     else:
-        if p2-p1 < 2:
-            p2 = min(len(energy), p1 + 2)
         omu  = mu*energy**nvict
         ex = remove_nans(energy[p1:p2], interp=True)
         mx = remove_nans(omu[p1:p2], interp=True)
@@ -237,13 +266,7 @@ def preedge(energy, mu, e0=None, step=None, nnorm=None, nvict=0, npre=1, pre1=No
         pre_edge = (precoefs[0] + energy*precoefs[1]) * energy**(-nvict)
 
     # normalization
-    p1 = index_of(energy, norm1+e0)
-    p2 = index_nearest(energy, norm2+e0)
-    if p2-p1 < 2:
-        p2 = min(len(energy), p1 + 2)
-    if p2-p1 < 2:
-        p1 = p1-2
-
+    p1, p2 = rng['inorm']
     presub = (mu-pre_edge)[p1:p2]
     coefs = polyfit(energy[p1:p2], presub, nnorm)
     post_edge = 1.0*pre_edge
@@ -435,6 +458,224 @@ def pre_edge(energy, mu=None, group=None, e0=None, step=None, nnorm=None,
         if group.edge is None:  group.edge = _edge
     return
 
+
+def _interp_rows(x, y, xnew):
+    """linear interpolation of each row of y(x) onto xnew, holding
+    end values outside the range of x, as for np.interp()"""
+    idx = np.clip(np.searchsorted(x, xnew), 1, len(x)-1)
+    frac = np.clip((xnew - x[idx-1])/(x[idx] - x[idx-1]), 0, 1)
+    return y[:, idx-1]*(1-frac) + y[:, idx]*frac
+
+def _smooth_rows(x, y, sigma=1, xstep=None, npad=5):
+    """smooth each row of y(x), as smooth() with its default lorentzian"""
+    if xstep is None:
+        xstep = min(np.diff(x))
+    xmin = xstep * int( (min(x) - npad*xstep)/xstep)
+    xmax = xstep * int( (max(x) + npad*xstep)/xstep)
+    npts1 = 1 + int(abs(xmax-xmin+xstep*0.1)/xstep)
+    npts = min(npts1, 50*len(x))
+    x0  = np.linspace(xmin, xmax, npts)
+    y0  = _interp_rows(x, y, x0)
+
+    win = lorentzian(np.arange(2*npts), center=npts, sigma=sigma/xstep)
+    y1 = np.concatenate((y0[:, npts:0:-1], y0, y0[:, -1:-npts-1:-1]), axis=1)
+    y2 = fftconvolve(y1, (win/win.sum())[None, :], mode='valid', axes=1)
+    if y2.shape[1] > len(x0):
+        nex = int((y2.shape[1] - len(x0))/2)
+        y2 = (y2[:, nex:])[:, :len(x0)]
+    return _interp_rows(x0, y2, x)
+
+def _finde0_rows(energy, mu, estep=None, use_smooth=True):
+    "_finde0() for each row of a 2-d mu, all sharing energy"
+    en = remove_dups(energy, tiny=TINY_ENERGY)
+    ordered = np.where(np.diff(np.argsort(en))==1)[0]
+    en = en[ordered]
+    mu = mu[:, ordered]
+    if estep is None:
+        estep = find_energy_step(en)
+
+    nmin = max(3, int(len(en)*0.02))
+    dmu = np.gradient(mu, axis=1)/np.gradient(en)
+    if use_smooth:
+        dmu = _smooth_rows(en, dmu, xstep=estep, sigma=estep)
+    # find points of high derivative
+    dmu[np.where(~np.isfinite(dmu))] = -1.0
+    dm_min = dmu[:, nmin:-nmin].min(axis=1)
+    dm_ptp = np.maximum(1.e-10, np.ptp(dmu[:, nmin:-nmin], axis=1))
+    dmu = (dmu - dm_min[:, None])/dm_ptp[:, None]
+
+    dhigh = (0.60 if len(en) > 20 else 0.30) * np.ones(len(mu))
+    nhigh = (dmu > dhigh[:, None]).sum(axis=1)
+    retry = nhigh < 3
+    for _ in range(2):
+        retry = retry & (nhigh <= 3)
+        dhigh[retry] *= 0.5
+        nhigh = (dmu > dhigh[:, None]).sum(axis=1)
+    high = dmu > dhigh[:, None]
+    high[nhigh < 3] = True
+
+    # largest derivative with both neighbors also of high derivative
+    cand = high.copy()
+    cand[:, 1:-1] &= high[:, :-2] & high[:, 2:]
+    cand[:, :nmin] = False
+    cand[:, len(en)-nmin+1:] = False
+    dcand = np.where(cand & (dmu > 0), dmu, -np.inf)
+    imax = np.argmax(dcand, axis=1)
+    imax[~np.isfinite(dcand[np.arange(len(mu)), imax])] = 0
+    return en[imax], imax, estep
+
+def _find_e0_rows(energy, mu):
+    "find_e0() for each row of a 2-d mu, all sharing energy"
+    e0 = np.zeros(len(mu))
+    e1, ie0, estep1 = _finde0_rows(energy, mu, estep=None, use_smooth=False)
+    # the refinement range and smoothing depend only on the first e0
+    for i0 in np.unique(ie0):
+        rows = np.where(ie0 == i0)[0]
+        _e1 = e1[rows[0]]
+        istart = max(3, i0-75)
+        istop  = min(i0+75, len(energy)-3)
+        if i0 < 0.05*len(energy):
+            _e1 = energy.mean()
+            istart = max(3, i0-20)
+            istop = len(energy)-3
+        estep = 0.5*(max(0.01, min(1.0, estep1)) + max(0.01, min(1.0, _e1/25000.)))
+        _e0, ix, ex = _finde0_rows(energy[istart:istop], mu[rows, istart:istop],
+                                   estep=estep, use_smooth=True)
+        _e0[ix < 1] = energy[istart+2]
+        e0[rows] = _e0
+    return e0
+
+def _polyfit_rows(x, y, deg=1):
+    """polyfit() of each row of y to x, all with the same design matrix,
+    returning array of coefficients with shape (nrows, deg+1)"""
+    xmin, xmax = x.min(), x.max()
+    if xmax > xmin:
+        off, scl = -(xmax+xmin)/(xmax-xmin), 2.0/(xmax-xmin)
+    else:
+        off, scl = -xmin, 1.0
+    # fit in the window [-1, 1], as np.polynomial.Polynomial.fit(),
+    # then convert to coefficients for powers of x
+    vander = np.polynomial.polynomial.polyvander(off + scl*x, deg)
+    coefs = np.linalg.lstsq(vander, y.T, rcond=None)[0]
+    conv = np.zeros((deg+1, deg+1))
+    for j in range(deg+1):
+        pcoefs = np.polynomial.polynomial.polypow([off, scl], j)
+        conv[:len(pcoefs), j] = pcoefs
+    return (conv @ coefs).T
+
+def pre_edge_stack(energy, mu, e0=None, step=None, nnorm=None, nvict=0,
+                   npre=1, pre1=None, pre2=None, norm1=None, norm2=None,
+                   _larch=None):
+    """pre edge subtraction and normalization for a stack of spectra
+    that share one energy array, as from quick-XAS or XANES imaging.
+
+    Arguments
+    ----------
+    energy:  1-d array of x-ray energies, in eV, with length nenergy
+    mu:      2-d array of mu(E), with shape (nspectra, nenergy)
+    e0:      edge energy, in eV, as a single value or array of nspectra
+             values.  If None, it will be determined for each spectrum.
+    step:    edge jump, as single value or array.  If None, it will be
+             determined for each spectrum.
+
+    All other arguments are as for pre_edge(), and are used for all spectra.
+
+    Returns
+    -------
+      group with arrays for all spectra:
+        e0          energy origin, shape (nspectra,)
+        edge_step   edge step, shape (nspectra,)
+        energy      energy array, sorted and made strictly increasing
+        norm        normalized mu(E), shape (nspectra, nenergy)
+        flat        flattened, normalized mu(E), shape (nspectra, nenergy)
+        pre_edge    determined pre-edge curves, shape (nspectra, nenergy)
+        post_edge   determined post-edge curves, shape (nspectra, nenergy)
+        precoefs    pre-edge offset and slope, shape (nspectra, 2)
+        norm_coefs  post-edge coefficients, shape (nspectra, MAX_NNORM+1)
+        nnorm, pre1, pre2, norm1, norm2:  arrays of values used
+
+    Notes
+    -----
+      1. The results are the same as from pre_edge() for each spectrum.
+         The fit ranges depend only on the energy index of e0, so the
+         spectra are grouped by that index, and all fits in each group
+         use a single design matrix.
+      2. flat is found from the post-edge and pre-edge curves, not by the
+         separate quadratic fit of pre_edge() (flat_alt).
+      3. mu is expected to be finite.
+    """
+    energy = np.asarray(energy, dtype='float64').squeeze()
+    mu = np.atleast_2d(np.asarray(mu, dtype='float64'))
+    if mu.shape[1] != len(energy):
+        raise ValueError("mu must have shape (nspectra, len(energy))")
+    nspec, nen = mu.shape
+
+    order = np.argsort(energy)
+    if len(np.where(np.diff(order)!=1)[0]) > 0:
+        energy, mu = energy[order], mu[:, order]
+    energy = remove_dups(energy, tiny=TINY_ENERGY)
+    if energy.size <= 1:
+        raise ValueError("energy array must have at least 2 points")
+
+    e0 = np.ones(nspec)*(np.nan if e0 is None else np.asarray(e0, dtype='float64'))
+    need_e0 = ~np.isfinite(e0) | (e0 < energy[1]) | (e0 > energy[-2])
+    if need_e0.any():
+        e0[need_e0] = _find_e0_rows(energy, mu[need_e0])
+    ie0 = np.abs(energy[None, :] - e0[:, None]).argmin(axis=1)
+    e0 = energy[ie0]
+
+    steps = None if step is None else np.ones(nspec)*step
+    out = Group(e0=e0, energy=energy, edge_step=np.zeros(nspec),
+                pre_edge=np.zeros((nspec, nen)), post_edge=np.zeros((nspec, nen)),
+                precoefs=np.zeros((nspec, 2)),
+                norm_coefs=np.zeros((nspec, MAX_NNORM+1)),
+                nnorm=np.zeros(nspec, dtype=int), pre1=np.zeros(nspec),
+                pre2=np.zeros(nspec), norm1=np.zeros(nspec),
+                norm2=np.zeros(nspec), nvict=nvict, npre=npre)
+
+    for i0 in np.unique(ie0):
+        rows = np.where(ie0 == i0)[0]
+        rng = _preedge_ranges(energy, i0, nnorm=nnorm, nvict=nvict, npre=npre,
+                              pre1=pre1, pre2=pre2, norm1=norm1, norm2=norm2)
+        for attr in ('nnorm', 'pre1', 'pre2', 'norm1', 'norm2'):
+            getattr(out, attr)[rows] = rng[attr]
+        mux = mu[rows]
+        p1, p2 = rng['ipre']
+        if npre == 0:
+            precoefs = np.zeros((len(rows), 2))
+            precoefs[:, 0] = mux[:, p1:p2].mean(axis=1)
+            pre_edge = precoefs[:, :1] * np.ones(nen)
+        else:
+            omu = mux*energy**nvict
+            precoefs = _polyfit_rows(energy[p1:p2], omu[:, p1:p2], 1)
+            pre_edge = ((precoefs[:, :1] + energy*precoefs[:, 1:2])
+                        * energy**(-nvict))
+
+        p1, p2 = rng['inorm']
+        ncoefs = rng['nnorm'] + 1
+        coefs = _polyfit_rows(energy[p1:p2], (mux-pre_edge)[:, p1:p2],
+                              rng['nnorm'])
+        post_edge = pre_edge + coefs @ (energy**np.arange(ncoefs)[:, None])
+
+        out.precoefs[rows] = precoefs
+        out.norm_coefs[rows, :ncoefs] = coefs
+        out.pre_edge[rows] = pre_edge
+        out.post_edge[rows] = post_edge
+        if steps is None:
+            out.edge_step[rows] = post_edge[:, i0] - pre_edge[:, i0]
+        else:
+            out.edge_step[rows] = steps[rows]
+
+    out.edge_step = np.maximum(1.e-12, abs(out.edge_step))
+    out.norm = (mu - out.pre_edge)/out.edge_step[:, None]
+
+    flat_residue = (out.post_edge - out.pre_edge)/out.edge_step[:, None]
+    flat_residue -= flat_residue[np.arange(nspec), ie0][:, None]
+    below = np.arange(nen)[None, :] < ie0[:, None]
+    out.flat = np.where(below, out.norm, out.norm - flat_residue)
+    return out
+
+
 def energy_align(group, reference, array='dmude', emin=-15, emax=35):
     """
     align XAFS data group to a reference group
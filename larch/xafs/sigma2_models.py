@@ -2,12 +2,15 @@
 # models for debye-waller factors for xafs
 
 import ctypes
+from collections import OrderedDict
 import numpy as np
 from larch.larchlib import get_dll
 
 import scipy.constants as consts
 from scipy.special import gamma
 
+from larch import Group
+
 # EINS_FACTOR  = hbarc*hbarc/(2 * k_boltz * amu) = 24.254360157751783
 #    k_boltz = 8.6173324e-5  # [eV / K]
 #    amu     = 931.494061e6  # [eV / (c*c)]
@@ -16,6 +19,55 @@ EINS_FACTOR = 1.e20*consts.hbar**2/(2*consts.k*consts.atomic_mass)
 
 FEFF6LIB = None
 
+# memoized sigma2 values, keyed by (model, path geometry, t, theta)
+SIGMA2_CACHE = OrderedDict()
+SIGMA2_CACHE_SIZE = 8192
+SIGMA2_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+def clear_sigma2_cache():
+    "clear cache of calculated sigma2 values"
+    SIGMA2_CACHE.clear()
+    SIGMA2_CACHE_STATS.update(hits=0, misses=0)
+
+def sigma2_cache_info():
+    "return dict with hits, misses, and size of sigma2 cache"
+    return dict(size=len(SIGMA2_CACHE), maxsize=SIGMA2_CACHE_SIZE,
+                **SIGMA2_CACHE_STATS)
+
+def path_geometry(feffpath):
+    """geometry of a FeffDatFile for sigma2 calculations, as a group with
+    natoms, rnorm, x, y, z, mass, reduced mass `rmass`, and a hashable `key`.
+
+    This is calculated once and stored on the FeffDatFile.
+    """
+    cached = getattr(feffpath, '_sigma2_geom', None)
+    if cached is not None and cached[0] is feffpath.geom:
+        return cached[1]
+    atoms = np.array([atom[3:7] for atom in feffpath.geom], dtype='float64')
+    atoms = atoms.reshape((-1, 4))
+    mass, x, y, z = atoms.T.copy()
+    rmass = 1.0/max(1.e-12, (1.0/np.maximum(0.1, mass)).sum())
+    rnorm = float(feffpath.rnorman)
+    key = (rnorm,) + tuple(atoms.ravel().tolist())
+    geom = Group(natoms=len(mass), rnorm=rnorm, x=x, y=y, z=z, mass=mass,
+                 rmass=rmass, key=key)
+    feffpath._sigma2_geom = (feffpath.geom, geom)
+    return geom
+
+def _memoize(model, geom, t, theta, calc):
+    "return cached sigma2 value, calculating with calc() if needed"
+    key = (model, geom.key, t, theta)
+    val = SIGMA2_CACHE.get(key, None)
+    if val is not None:
+        SIGMA2_CACHE.move_to_end(key)
+        SIGMA2_CACHE_STATS['hits'] += 1
+        return val
+    SIGMA2_CACHE_STATS['misses'] += 1
+    val = SIGMA2_CACHE[key] = calc()
+    if len(SIGMA2_CACHE) > SIGMA2_CACHE_SIZE:
+        SIGMA2_CACHE.popitem(last=False)
+    return val
+
 def gnxas(r0, sigma, beta, path=None):
     """calculate GNXAS amplitude for values of r0, sigma, beta for a feffpath
 
@@ -79,15 +131,15 @@ def sigma2_eins(t, theta, path):
     mass_red = reduced mass of Path (in amu)
     FACTOR  = hbarc*hbarc/(2*k_boltz*amu) ~= 24.25 Ang^2 * K * amu
     """
-    feffpath = path._feffdat
+    return _sigma2_eins(t, theta, path._feffdat)
+
+def _sigma2_eins(t, theta, feffpath):
+    "sigma2_eins for a FeffDatFile"
     if feffpath is None:
         return 0.
     theta = max(float(theta), 1.e-5)
     t     = max(float(t), 1.e-5)
-    rmass = 0.
-    for sym, iz, ipot, amass, x, y, z in feffpath.geom:
-        rmass = rmass + 1.0/max(0.1, amass)
-    rmass = 1.0/max(1.e-12, rmass)
+    rmass = path_geometry(feffpath).rmass
     return EINS_FACTOR/(theta * rmass * np.tanh(theta/(2.0*t)))
 
 def sigma2_debye(t, theta, path):
@@ -100,23 +152,23 @@ def sigma2_debye(t, theta, path):
       t        sample temperature (in K)
       theta    Debye temperature (in K)
       path     FeffPath to calculate sigma2 for
+
+    Notes:
+       values are cached for each path geometry, t, and theta.
     """
-    feffpath = path._feffdat
+    return _sigma2_debye(t, theta, path._feffdat)
+
+def _sigma2_debye(t, theta, feffpath):
+    "sigma2_debye for a FeffDatFile"
     if feffpath is None:
         return 0.
     thetad = max(float(theta), 1.e-5)
     tempk  = max(float(t), 1.e-5)
-    natoms = len(feffpath.geom)
-    rnorm  = feffpath.rnorman
-    atomx, atomy, atomz, atomm = [], [], [], []
-    for sym, iz, ipot, am, x, y, z in feffpath.geom:
-        atomx.append(x)
-        atomy.append(y)
-        atomz.append(z)
-        atomm.append(am)
-
-    return sigma2_correldebye(natoms, tempk, thetad, rnorm,
-                              atomx, atomy, atomz, atomm)
+    geom = path_geometry(feffpath)
+    return _memoize('debye', geom, tempk, thetad,
+                    lambda: sigma2_correldebye(geom.natoms, tempk, thetad,
+                                               geom.rnorm, geom.x, geom.y,
+                                               geom.z, geom.mass))
 
 def sigma2_correldebye(natoms, tk, theta, rnorm, x, y, z, atwt):
     """
@@ -136,11 +188,20 @@ def sigma2_correldebye(natoms, tk, theta, rnorm, x, y, z, atwt):
 
    Returns:
       sig2_cordby  double, calculated sigma2
+
+   Notes:
+      uses the compiled feff6 library if available, and
+      sigma2_correldebye_np otherwise.
     """
     global FEFF6LIB
     if FEFF6LIB is None:
-        FEFF6LIB = get_dll('feff6')
-        FEFF6LIB.sigma2_debye.restype = ctypes.c_double
+        try:
+            FEFF6LIB = get_dll('feff6')
+            FEFF6LIB.sigma2_debye.restype = ctypes.c_double
+        except (OSError, AttributeError):
+            FEFF6LIB = False
+    if not FEFF6LIB:
+        return sigma2_correldebye_np(natoms, tk, theta, rnorm, x, y, z, atwt)
 
     na = ctypes.pointer(ctypes.c_int(natoms))
     t  = ctypes.pointer(ctypes.c_double(tk))
@@ -225,6 +286,33 @@ def sigma2_correldebye_py(natoms, tk, theta, rnorm, x, y, z, atwt):
 
 
 
+def sigma2_correldebye_np(natoms, tk, theta, rnorm, x, y, z, atwt):
+    """calculate the XAFS debye-waller factor for a path with the
+    correlated Debye model, as sigma2_correldebye_py, but with numpy
+    arrays for all atom pairs, and for all points of each level of
+    the Romberg integrations.
+
+    Arguments and Returns are as for sigma2_correldebye_py.
+    """
+    pos = np.array([x[:natoms], y[:natoms], z[:natoms]], dtype='float64').T
+    mass = np.asarray(atwt[:natoms], dtype='float64')
+    i0, j0 = np.triu_indices(natoms)
+    i1, j1 = (i0 + 1) % natoms, (j0 + 1) % natoms
+
+    def pdist(ia, ib):
+        return np.sqrt(((pos[ia] - pos[ib])**2).sum(axis=1))
+
+    # correlations between atom pairs, for (i0,j0), (i1,j1), (i0,j1), (i1,j0)
+    rij = np.concatenate((pdist(i0, j0), pdist(i1, j1), pdist(i0, j1), pdist(i1, j0)))
+    am1 = np.concatenate((mass[i0], mass[i1], mass[i0], mass[i1]))
+    am2 = np.concatenate((mass[j0], mass[j1], mass[j1], mass[j0]))
+    corr = corrfn(rij, theta, tk, am1, am2, rnorm).reshape((4, len(i0)))
+
+    ridotj = ((pos[i0] - pos[i1]) * (pos[j0] - pos[j1])).sum(axis=1)
+    sig2ij = ridotj*(corr[0] + corr[1] - corr[2] - corr[3])/(pdist(i0, i1)*pdist(j0, j1))
+    sig2ij[i0 == j0] /= 2.0
+    return sig2ij.sum()/2.0
+
 def dist(x0, y0, z0, x1, y1, z1):
     """find distance between cartesian points
     (x, y, z)0 and (x, y, z)1
@@ -270,6 +358,8 @@ def corrfn(rij, theta, tk, am1, am2, rs):
 
     NOTE: for backward compatibility, the constants used by feff6 are
     retained, even though some have been refined later.
+
+    rij, am1, and am2 can be arrays, giving an array of correlations.
     """
     conh = 72.7630804732553
     conr = 4.5693349700844
@@ -278,6 +368,8 @@ def corrfn(rij, theta, tk, am1, am2, rs):
     rx     = conr  * rij / rs
     tx     = theta / tk
     rmass  = theta * np.sqrt(am1 * am2)
+    if np.ndim(rx) > 0:
+        return conh * debint_array(rx, tx) / rmass
     return conh  * debint(rx, tx) / rmass
 
 def debfun(w, rx, tx):
@@ -341,6 +433,48 @@ def debint(rx, tx):
     return result
 
 
+def debint_array(rx, tx):
+    """debint() for an array of rx values, evaluating all points of
+    each level of the Romberg integration at once.  Each value is
+    taken from the first level at which it converged, as for debint().
+    """
+    MAXITER = 12
+    tol = 1.e-9
+    argmax = 50.0
+    rx = np.asarray(rx, dtype='float64')
+    urx, inverse = np.unique(rx, return_inverse=True)
+    sinc = urx > 0
+    rdiv = np.where(sinc, urx, 1.0)
+
+    def debfun_w(w):
+        "debfun for array of w values (all w > 0) for all rx: [nrx, nw]"
+        emwt = np.exp(-np.minimum(w*tx, argmax))
+        wrx = np.outer(urx, w)
+        out = np.where(sinc[:, None], np.sin(wrx)/rdiv[:, None], w[None, :])
+        return out * ((1 + emwt) / (1 - emwt))[None, :]
+
+    # debfun(0) = 2/tx
+    bn = (2.0/tx + debfun_w(np.ones(1))[:, 0])/2.0
+    bo = bn.copy()
+    result = np.zeros(len(urx))
+    active = np.arange(len(urx))
+    step, itn = 1.0, 1
+    for iter in range(MAXITER):
+        step = step / 2.
+        w = step*(2*np.arange(itn) + 1)
+        itn = 2*itn
+        bnp1 = step * debfun_w(w)[active].sum(axis=1) + bn[active]/2.0
+        res = (4*bnp1 - bn[active])/3.0
+        result[active] = res
+        with np.errstate(divide='ignore', invalid='ignore'):
+            done = abs((res - bo[active])/res) < tol
+        bn[active] = bnp1
+        bo[active] = res
+        active = active[~done]
+        if len(active) == 0:
+            break
+    return result[inverse].reshape(rx.shape)
+
 ####################################################
 ## sigma2_eins and sigma2_debye are defined here to
 ## be injected as Procedures within lmfit's asteval
@@ -350,32 +484,10 @@ def debint(rx, tx):
 ##
 _sigma2_funcs = """
 def sigma2_eins(t, theta):
-    if feffpath is None:
-         return 0.
-    theta = max(float(theta), 1.e-5)
-    t     = max(float(t), 1.e-5)
-    rmass = 0.
-    for sym, iz, ipot, amass, x, y, z in feffpath.geom:
-        rmass = rmass + 1.0/max(0.1, amass)
-    rmass = 1.0/max(1.e-12, rmass)
-    return EINS_FACTOR/(theta * rmass * tanh(theta/(2.0*t)))
+    return _sigma2_eins(t, theta, feffpath)
 
 def sigma2_debye(t, theta):
-    if feffpath is None:
-         return 0.
-    thetad = max(float(theta), 1.e-5)
-    tempk  = max(float(t), 1.e-5)
-    natoms = len(feffpath.geom)
-    rnorm  = feffpath.rnorman
-    atomx, atomy, atomz, atomm = [], [], [], []
-    for sym, iz, ipot, am, x, y, z in feffpath.geom:
-        atomx.append(x)
-        atomy.append(y)
-        atomz.append(z)
-        atomm.append(am)
-
-    return sigma2_correldebye(natoms, tempk, thetad, rnorm,
-                              atomx, atomy, atomz, atomm)
+    return _sigma2_debye(t, theta, feffpath)
 
 
 def gnxas(r0, sigma, beta):
@@ -401,6 +513,8 @@ def add_sigma2funcs(params):
     f_eval = params._asteval
     f_eval.symtable['EINS_FACTOR'] = EINS_FACTOR
     f_eval.symtable['sigma2_correldebye'] = sigma2_correldebye
+    f_eval.symtable['_sigma2_eins'] = _sigma2_eins
+    f_eval.symtable['_sigma2_debye'] = _sigma2_debye
     f_eval.symtable['feffpath'] = None
     f_eval.symtable['gamma'] = gamma
     f_eval(_sigma2_funcs)
@@ -43,7 +43,8 @@ from sqlalchemy.orm import sessionmaker
 
 
 from .amcsd_utils import (make_engine, isAMCSD, put_optarray, get_optarray,
-                          PMG_CIF_OPTS, CifParser, SpacegroupAnalyzer, pmg_version)
+                          PMG_CIF_OPTS, CifParser, SpacegroupAnalyzer, pmg_version,
+                          indexes as AMCSD_INDEXES)
 
 from xraydb.chemparser import chemparse
 from xraydb import f0, f1_chantler, f2_chantler
@@ -71,7 +72,7 @@ CIF_TEXTCOLUMNS = ('formula', 'compound', 'pub_title', 'formula_title', 'a',
                    'atoms_z', 'atoms_occupancy', 'atoms_u_iso',
                    'atoms_aniso_label', 'atoms_aniso_u11', 'atoms_aniso_u22',
                    'atoms_aniso_u33', 'atoms_aniso_u12', 'atoms_aniso_u13',
-                   'atoms_aniso_u23', 'qdat','url', 'hkls')
+                   'atoms_aniso_u23', 'qdat','url', 'hkls', 'sfactors')
 
 
 
@@ -141,6 +142,89 @@ def unpack_hkl_degen(sinp):
     return np.array(hkls), np.array(degen)
 
 
+def pack_sfactors(elems, unitcell, sfactors):
+    """pack list of elements, unit cell dict, and complex site factors
+    array [nhkl, nelem] (as from CifStructure.site_factors()) into a
+    printable string for storage alongside the packed HKLs.
+
+    see also unpack_sfactors() to reverse the process.
+    """
+    sfactors = np.asarray(sfactors, dtype=np.complex128)
+    return json.dumps({'elems': list(elems), 'unitcell': unitcell,
+                       'shape': list(sfactors.shape), 'dtype': 'complex128',
+                       'sfactors': b64encode(sfactors.tobytes()).decode('ascii')})
+
+
+def unpack_sfactors(sinp):
+    """unpack elements, unit cell, and site factors stored by pack_sfactors()
+    see also pack_sfactors()
+    """
+    dat = json.loads(sinp)
+    dtype = dat.get('dtype', 'complex64')
+    sfactors = np.frombuffer(b64decode(dat['sfactors']), dtype=dtype)
+    sfactors = sfactors.reshape(dat['shape']).astype(np.complex128)
+    return dat['elems'], dat['unitcell'], sfactors
+
+
+def calc_f2hkl(elems, sfactors, qhkls, energy=None, resonant=None):
+    """calculate F*F' from site factors for each element
+
+    Arguments:
+      elems:      list of element symbols
+      sfactors:   complex array [nhkl, nelem] of site factors
+      qhkls:      array of q values for the HKLs
+      energy:     x-ray energy in eV for resonant corrections [None]
+      resonant:   dict of {elem: (f1, f2)} at energy, used and updated
+                  to avoid repeated lookups [None]
+
+    If energy is not None, then resonant corrections will be included.
+    """
+    sq = qhkls/(2*TAU)
+    if resonant is None:
+        resonant = {}
+    fsum = np.zeros(len(qhkls), dtype=np.complex128)
+    for ielem, elem in enumerate(elems):
+        fval = f0(elem, sq)
+        if energy is not None:
+            if elem not in resonant:
+                resonant[elem] = (f1_chantler(elem, energy),
+                                  f2_chantler(elem, energy))
+            fval = fval + resonant[elem][0] - 1j*resonant[elem][1]
+        fsum += fval*sfactors[:, ielem]
+    return (fsum*fsum.conjugate()).real
+
+
+def make_structure_factor(hkls, degen, unitcell, elems, sfactors,
+                          wavelength=0.75, resonant=None):
+    """StructureFactor for HKLs and degeneracies, using the unit cell and
+    site factors for the elements, sorted by q.  See calc_f2hkl()"""
+    dhkls = d_from_hkl(hkls, **unitcell)
+    qhkls = TAU / dhkls
+
+    # sort by q
+    qsort = np.argsort(qhkls)
+    qhkls = qhkls[qsort]
+    dhkls = dhkls[qsort]
+    hkls  = hkls[qsort]
+    degen = degen[qsort]
+
+    energy = E_from_lambda(wavelength, E_units='eV')
+    f2hkl = calc_f2hkl(elems, sfactors[qsort], qhkls, energy=energy,
+                       resonant=resonant)
+
+    # lorentz and polarization correction
+    twoth = twth_from_q(qhkls, wavelength)
+    arad = (TAU/360)*twoth
+    corr = (1+np.cos(arad)**2)/(np.sin(arad/2)**2*np.cos(arad/2))
+
+    intensity = f2hkl * degen * corr
+
+    return StructureFactor(q=qhkls, intensity=intensity, hkl=hkls, d=dhkls,
+                           f2hkl=f2hkl, twotheta=twoth, degen=degen,
+                           lorentz=corr, wavelength=wavelength,
+                           energy=energy)
+
+
 
 def select(*args):
     """wrap sqlalchemy select for version 1.3 and 2.0"""
@@ -230,7 +314,7 @@ class CifStructure():
                  atoms_occupancy=None, atoms_u_iso=None, atoms_aniso_u11=None,
                  atoms_aniso_u22=None, atoms_aniso_u33=None,
                  atoms_aniso_u12=None, atoms_aniso_u13=None,
-                 atoms_aniso_u23=None):
+                 atoms_aniso_u23=None, sfactors=None):
 
         self.ams_id = ams_id
         self.ams_db = ams_db
@@ -249,6 +333,7 @@ class CifStructure():
         self.beta = beta
         self.gamma = gamma
         self.hkls = hkls
+        self.sfactors = sfactors
         self.cell_volume = cell_volume
         self.crystal_density = crystal_density
         self.atoms_sites = atoms_sites
@@ -413,22 +498,13 @@ class CifStructure():
         qhkls = qhkls[qfilt]
         hkls  = hkls[qfilt]
 
-        # find duplicate q-values, set degen
+        # find duplicate q-values, set degen, keeping the first HKL for each
         # scale up q values to better find duplicates
-        qscaled = [int(round(q*1.e9)) for q in qhkls]
-        q_unique, q_degen, hkl_unique = [], [], []
-        for i, q in enumerate(qscaled):
-            if q in q_unique:
-                q_degen[q_unique.index(q)] += 1
-            else:
-                q_unique.append(q)
-                q_degen.append(1)
-                hkl_unique.append(hkls[i])
-
-        qorder = np.argsort(q_unique)
-        qhkls  = 1.e-9*np.array(q_unique)[qorder]
-        hkls   = abs(np.array(hkl_unique)[qorder])
-        degen  = np.array(q_degen)[qorder]
+        qscaled = np.round(qhkls*1.e9).astype(np.int64)
+        q_unique, ifirst, degen = np.unique(qscaled, return_index=True,
+                                            return_counts=True)
+        qhkls  = 1.e-9*q_unique
+        hkls   = abs(hkls[ifirst])
 
         # note the f2 is calculated here without resonant corrections
         f2 = self.calculate_f2(hkls, qhkls=qhkls, wavelength=None)
@@ -456,11 +532,37 @@ class CifStructure():
         main_peaks = np.argsort(intensity)[::-1][:nmax]
 
         hkls_main, degen_main = hkls[main_peaks], degen[main_peaks]
+        elems, sfactors = self.site_factors(hkls_main)
+        self.sfactors = pack_sfactors(elems, unitcell, sfactors)
         if self.ams_db is not None:
-            self.hkls = self.ams_db.set_hkls(self.ams_id, hkls_main, degen_main)
+            self.hkls = self.ams_db.set_hkls(self.ams_id, hkls_main, degen_main,
+                                             sfactors=self.sfactors)
+        else:
+            self.hkls = pack_hkl_degen(hkls_main, degen_main)
 
         return hkls_main, degen_main
 
+    def get_sfactors(self):
+        """elements, unit cell, and site factors for the stored HKLs,
+        as cached in the database.  These will be calculated if needed,
+        but not saved (see AMCSD.build_sfactors()).
+
+        returns elems, unitcell, sfactors or None if the CIF structure
+        cannot be parsed.
+        """
+        if self.hkls is None:
+            self.find_hkls(nmax=64, qmax=10)
+        if self.hkls is None:
+            return None
+        if self.sfactors is None:
+            unitcell = self.get_unitcell()
+            if unitcell is None:
+                return None
+            hkls, degen = unpack_hkl_degen(self.hkls)
+            elems, sfactors = self.site_factors(hkls)
+            self.sfactors = pack_sfactors(elems, unitcell, sfactors)
+        return unpack_sfactors(self.sfactors)
+
     def get_structure_factors(self, wavelength=0.75):
         """given arrays of HKLs and degeneracies (perhaps from find_hkls(),
         return structure factors
@@ -471,41 +573,41 @@ class CifStructure():
         if self.hkls is None:
             self.find_hkls(nmax=64, qmax=10, wavelength=wavelength)
 
-        hkls, degen = unpack_hkl_degen(self.hkls)
-
-        self.get_pmg_struct()
-        pstruct = self.pmg_pstruct
-        if pstruct is None:
+        sfdata = self.get_sfactors()
+        if sfdata is None:
             print(f"pymatgen could not parse CIF structure for CIF {self.ams_id}")
             return
 
-        unitcell = self.get_unitcell()
-        dhkls = d_from_hkl(hkls, **unitcell)
-        qhkls = TAU / dhkls
-
-        # sort by q
-        qsort = np.argsort(qhkls)
-        qhkls = qhkls[qsort]
-        dhkls = dhkls[qsort]
-        hkls  = hkls[qsort]
-        degen = degen[qsort]
-
-        energy = E_from_lambda(wavelength, E_units='eV')
-
-        f2hkl = self.calculate_f2(hkls, qhkls=qhkls, wavelength=wavelength)
-
-        # lorentz and polarization correction
-        twoth = twth_from_q(qhkls, wavelength)
-        arad = (TAU/360)*twoth
-        corr = (1+np.cos(arad)**2)/(np.sin(arad/2)**2*np.cos(arad/2))
-
-        intensity = f2hkl * degen * corr
+        hkls, degen = unpack_hkl_degen(self.hkls)
+        elems, unitcell, sfactors = sfdata
+        return make_structure_factor(hkls, degen, unitcell, elems, sfactors,
+                                     wavelength=wavelength)
 
-        return StructureFactor(q=qhkls, intensity=intensity, hkl=hkls, d=dhkls,
-                               f2hkl=f2hkl, twotheta=twoth, degen=degen,
-                               lorentz=corr, wavelength=wavelength,
-                               energy=energy)
+    def site_factors(self, hkls, chunk_size=4096):
+        """geometric structure factors for each element: the sum over all
+        sites for an element of occupancy*exp(2*pi*i*(hkl.xyz)),
+        calculated for all HKLs as one matrix product.
 
+        returns list of elements, complex array [nhkl, nelem]
+        """
+        sites = self.get_sites()
+        elems = list(sites.keys())
+        coords, weights = [], []
+        for ielem, elem in enumerate(elems):
+            for occu, fcoords in sites[elem]:
+                weight = np.zeros(len(elems))
+                weight[ielem] = occu
+                coords.append(fcoords)
+                weights.append(weight)
+        coords = np.array(coords, dtype=np.float64).T
+        weights = np.array(weights)
+
+        hkls = np.asarray(hkls, dtype=np.float64)
+        out = np.zeros((len(hkls), len(elems)), dtype=np.complex128)
+        for i0 in range(0, len(hkls), chunk_size):
+            phase = np.exp(1j*TAU*(hkls[i0:i0+chunk_size] @ coords))
+            out[i0:i0+chunk_size] = phase @ weights
+        return elems, out
 
     def calculate_f2(self, hkls, qhkls=None, energy=None, wavelength=None):
         """calculate F*F'.
@@ -516,33 +618,12 @@ class CifStructure():
         if qhkls is None:
             unitcell = self.get_unitcell()
             qhkls = TAU / d_from_hkl(hkls, **unitcell)
-        sq = qhkls/(2*TAU)
-        sites = self.get_sites()
 
         if energy is None and wavelength is not None:
             energy = E_from_lambda(wavelength, E_units='eV')
 
-        # get f0 and resonant scattering factors
-        f0vals, f1vals, f2vals = {}, {}, {}
-        for elem in sites.keys():
-            if elem not in f0vals:
-                f0vals[elem] = f0(elem, sq)
-                if energy is not None:
-                    f1vals[elem] = f1_chantler(elem, energy)
-                    f2vals[elem] = f2_chantler(elem, energy)
-
-        # and f2
-        f2 = np.zeros(len(hkls))
-        for i, hkl in enumerate(hkls):
-            fsum = 0.
-            for elem in f0vals:
-                fval = f0vals[elem][i]
-                if energy is not None:
-                    fval += f1vals[elem] - 1j*f2vals[elem]
-                for occu, fcoord in sites[elem]:
-                    fsum += fval*occu*np.exp(1j*TAU*(fcoord*hkl).sum())
-            f2[i] = (fsum*fsum.conjugate()).real
-        return f2
+        elems, sfactors = self.site_factors(hkls)
+        return calc_f2hkl(elems, sfactors, qhkls, energy=energy)
 
 
     def get_pmg_struct(self):
@@ -650,6 +731,29 @@ class CifStructure():
             fh.write(feff6text)
         return filename
 
+class LazyCifStructure(CifStructure):
+    """CifStructure for a CIF in an AMCSD database, as from find_cifs(),
+    holding only the AMS ID, formula, and mineral until any other data is
+    needed, when the full CIF data is read from the database.
+    """
+    def __init__(self, ams_id, ams_db, formula=None, mineral=None):
+        self.__dict__.update(ams_id=ams_id, ams_db=ams_db, formula=formula,
+                             mineral=mineral, _loaded=False)
+
+    def __getattr__(self, attr):
+        if attr.startswith('__') or self.__dict__.get('_loaded', True):
+            raise AttributeError(attr)
+        self.load()
+        return getattr(self, attr)
+
+    def load(self):
+        "read full CIF data from database"
+        self._loaded = True
+        cif = self.ams_db.get_cif(self.ams_id)
+        if cif is not None:
+            self.__dict__.update(cif.__dict__)
+
+
 class AMCSD():
     """
     Database of CIF structure data from the American Mineralogical Crystal Structure Database
@@ -679,6 +783,10 @@ class AMCSD():
                 time.sleep(0.1)
                 self.insert('version', tag=f'with {colname}', date=isotime(),
                             notes=f'added {colname} column to cif table')
+        if not read_only:
+            for stmt in AMCSD_INDEXES:
+                self.session.execute(text(stmt))
+            self.session.commit()
 
     def finalize_amcsd(self):
         conn = getattr(self, 'conn', None)
@@ -687,6 +795,7 @@ class AMCSD():
 
     def connect(self, dbname, read_only=False):
         self.dbname = dbname
+        self.read_only = read_only
         self.engine = make_engine(dbname)
         self.conn = self.engine.connect()
         kwargs = {'bind': self.engine, 'autoflush': True, 'autocommit': False}
@@ -700,6 +809,7 @@ class AMCSD():
         self.metadata.reflect(bind=self.engine)
         self.tables = self.metadata.tables
         self.cif_elems = None
+        self.cif_elem_bits = None
 
     def close(self):
         "close session"
@@ -901,6 +1011,7 @@ class AMCSD():
         if with_elements:
             for element in chemparse(formula).keys():
                 self.insert('cif_elements', cif_id=cif_id, element=element)
+            self.cif_elems = self.cif_elem_bits = None
         return self.get_cif(cif_id)
 
 
@@ -1141,6 +1252,8 @@ class AMCSD():
         out.hkls = None
         if hasattr(cif, 'hkls'):
             out.hkls = cif.hkls
+        if out.hkls is not None:
+            out.sfactors = getattr(cif, 'sfactors', None)
 
         return out
 
@@ -1189,126 +1302,257 @@ class AMCSD():
         return self.cif_elems
 
 
-    def find_cifs(self, id=None, mineral_name=None, author_name=None,
-                  journal_name=None, contains_elements=None,
-                  excludes_elements=None, strict_contains=False,
-                  full_occupancy=False, max_matches=1000):
-        """return list of CIF Structures matching mineral, publication, or elements
-        """
-        if id is not None:
-            thiscif = self.get_cif(id)
-            if thiscif is not None:
-                return [thiscif]
+    def get_cif_elem_bits(self):
+        """cached element-membership bitmap for all CIFs
 
+        Returns:
+          cif_ids:   sorted array of CIF ids
+          bitmap:    uint64 array [ncifs, nwords], with bit i set for element i
+          elem_bit:  dict of {element: bit}
+        """
+        if self.cif_elem_bits is None:
+            tab_ce = self.tables['cif_elements']
+            rows = self.execall(select(tab_ce.c.cif_id, tab_ce.c.element))
+            elem_bit = {sym: i for i, sym in enumerate(ATOM_SYMS)}
+            for row in rows:
+                if row[1] not in elem_bit:
+                    elem_bit[row[1]] = len(elem_bit)
+            cids = np.array([int(row[0]) for row in rows], dtype=np.int64)
+            bits = np.array([elem_bit[row[1]] for row in rows], dtype=np.uint64)
+            cif_ids, icif = np.unique(cids, return_inverse=True)
+            bitmap = np.zeros((len(cif_ids), 1 + (len(elem_bit)-1)//64), dtype=np.uint64)
+            np.bitwise_or.at(bitmap, (icif, (bits//64).astype(np.int64)),
+                             np.left_shift(np.uint64(1), bits % 64))
+            self.cif_elem_bits = (cif_ids, bitmap, elem_bit)
+        return self.cif_elem_bits
+
+    def _elem_mask(self, elems):
+        "bitmap mask for list of elements, or None if any is not known"
+        cif_ids, bitmap, elem_bit = self.get_cif_elem_bits()
+        mask = np.zeros(bitmap.shape[1], dtype=np.uint64)
+        for elem in elems:
+            if elem not in elem_bit:
+                return None
+            bit = elem_bit[elem]
+            mask[bit//64] |= np.left_shift(np.uint64(1), np.uint64(bit % 64))
+        return mask
+
+    def _regex_ids(self, tablename, column, pattern):
+        "ids of rows in a table with column matching a case-insensitive regex"
+        pattern = pattern.replace('*', '.*').replace('..*', '.*')
+        tab = self.tables[tablename]
+        return [row[0] for row in self.execall(select(tab.c.id, tab.c[column]))
+                if re.search(pattern, row[1], flags=re.IGNORECASE) is not None]
+
+    def find_cif_ids(self, mineral_name=None, author_name=None,
+                     journal_name=None, contains_elements=None,
+                     excludes_elements=None, strict_contains=False,
+                     full_occupancy=False, with_data=False):
+        """return sorted list of ids of CIFs matching mineral, publication,
+        or elements.  See find_cifs().
+
+        mineral and journal names containing '*', '^', or '$' are
+        case-insensitive regular expressions, resolved to ids first.  All
+        other criteria are combined in a single query, and elements are
+        filtered using a cached element bitmap.
+
+        with_data=True returns a list of (id, formula, mineral_id) instead.
+        """
         tabcif = self.tables['cif']
         tabmin = self.tables['minerals']
         tabpub = self.tables['publications']
         tabaut = self.tables['authors']
         tab_ap = self.tables['publication_authors']
-        tab_ce = self.tables['cif_elements']
-
-        matches = []
-        t0 = time.time()
-        if mineral_name is None:
-            mineral_name = ''
-        mineral_name = mineral_name.strip()
-
-        if mineral_name not in (None, '') and ('*' in mineral_name or
-                                               '^' in mineral_name or
-                                               '$' in mineral_name):
-            pattern = mineral_name.replace('*', '.*').replace('..*', '.*')
-            matches = []
-            for row in self.get_all('minerals'):
-                if re.search(pattern, row.name, flags=re.IGNORECASE) is not None:
-                    query = select(tabcif.c.id).where(tabcif.c.mineral_id==row.id)
-                    for m in [row[0] for row in self.execall(query)]:
-                        if m not in matches:
-                           matches.append(m)
-
-            if journal_name not in (None, ''):
-                pattern = journal_name.replace('*', '.*').replace('..*', '.*')
-                new_matches = []
-                for c in matches:
-                    pub_id = self.execone(select(tabcif.c.publication_id
-                                             ).where(tabcif.c.id==c))
-                    this_journal = self.execone(select(tabpub.c.journalname
-                                                   ).where(tabpub.c.id==pub_id))
-                    if re.search(pattern,  this_journal, flags=re.IGNORECASE) is not None:
-                        new_matches.append[c]
-                matches = new_matches
-
-
-        else: # strict mineral name or no mineral name
-            args = []
-            if mineral_name not in (None, ''):
+
+        def is_pattern(name):
+            return '*' in name or '^' in name or '$' in name
+
+        args = []
+        mineral_name = '' if mineral_name is None else mineral_name.strip()
+        if mineral_name != '':
+            if is_pattern(mineral_name):
+                mids = self._regex_ids('minerals', 'name', mineral_name)
+                args.append(tabcif.c.mineral_id.in_(mids))
+            else:
                 args.append(func.lower(tabmin.c.name)==mineral_name.lower())
                 args.append(tabmin.c.id==tabcif.c.mineral_id)
 
-            if journal_name not in (None, ''):
+        if journal_name not in (None, ''):
+            if is_pattern(journal_name):
+                pids = self._regex_ids('publications', 'journalname', journal_name)
+                args.append(tabcif.c.publication_id.in_(pids))
+            else:
                 args.append(func.lower(tabpub.c.journalname)==journal_name.lower())
                 args.append(tabpub.c.id==tabcif.c.publication_id)
 
-            if author_name not in (None, ''):
-                args.append(func.lower(tabaut.c.name)==author_name.lower())
-                args.append(tabcif.c.publication_id==tab_ap.c.publication_id)
-                args.append(tabaut.c.id==tab_ap.c.author_id)
-
-            query = select(tabcif.c.id)
-            if len(args) > 0:
-                query = select(tabcif.c.id).where(and_(*args))
-            matches = [row[0] for row in self.execall(query)]
-            matches = list(set(matches))
-        #
-        cif_elems = self.get_cif_elems()
-        if contains_elements is not None:
-            for el in contains_elements:
-                new_matches = []
-                for row in matches:
-                    if row in cif_elems and el in cif_elems[row]:
-                        new_matches.append(row)
-                matches = new_matches
-
-            if strict_contains:
-                excludes_elements = ATOM_SYMS[:]
-                for c in contains_elements:
-                    if c in excludes_elements:
-                        excludes_elements.remove(c)
-        if excludes_elements is not None:
-            bad = []
-            for el in excludes_elements:
-                for row in matches:
-                    if el in cif_elems[row] and row not in bad:
-                        bad.append(row)
-            for row in bad:
-                matches.remove(row)
+        if author_name not in (None, ''):
+            args.append(func.lower(tabaut.c.name)==author_name.lower())
+            args.append(tabcif.c.publication_id==tab_ap.c.publication_id)
+            args.append(tabaut.c.id==tab_ap.c.author_id)
 
+        cols = [tabcif.c.id, tabcif.c.formula, tabcif.c.mineral_id]
+        if full_occupancy:
+            cols.append(tabcif.c.atoms_occupancy)
+        query = select(*cols)
+        if len(args) > 0:
+            query = query.where(and_(*args))
+        rows = self.execall(query.distinct().order_by(tabcif.c.id))
+
+        if contains_elements is not None or excludes_elements is not None:
+            cif_ids, bitmap, elem_bit = self.get_cif_elem_bits()
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            ipos = np.zeros(len(ids), dtype=np.int64)
+            found = np.zeros(len(ids), dtype=bool)
+            if len(cif_ids) > 0:
+                ipos = np.clip(np.searchsorted(cif_ids, ids), 0, len(cif_ids)-1)
+                found = cif_ids[ipos] == ids
+            rowbits = np.zeros((len(ids), bitmap.shape[1]), dtype=np.uint64)
+            rowbits[found] = bitmap[ipos[found]]
+            keep = np.ones(len(ids), dtype=bool)
+            if contains_elements is not None:
+                mask = self._elem_mask(contains_elements)
+                if mask is None:
+                    keep[:] = False
+                else:
+                    keep &= found & np.all((rowbits & mask) == mask, axis=1)
+                if strict_contains:
+                    excludes_elements = [e for e in ATOM_SYMS
+                                         if e not in contains_elements]
+            if excludes_elements is not None:
+                mask = self._elem_mask([e for e in excludes_elements if e in elem_bit])
+                keep &= np.all((rowbits & mask) == 0, axis=1)
+            rows = [row for row, k in zip(rows, keep) if k]
 
         if full_occupancy:
             good = []
-            for cif_id in matches:
-                cif = self.execone(tabcif.select().where(tabcif.c.id==cif_id))
-                occ = get_optarray(getattr(cif, 'atoms_occupancy'))
+            for row in rows:
+                occ = get_optarray(row[3])
                 if occ in ('0', 0, None):
-                    good.append(cif_id)
+                    good.append(row)
                 else:
                     try:
                         min_wt = min([float(x) for x in occ])
                     except:
                         min_wt = 0
                     if min_wt > 0.96:
-                        good.append(cif_id)
-            matches = good
+                        good.append(row)
+            rows = good
 
+        if with_data:
+            return [tuple(row[:3]) for row in rows]
+        return [row[0] for row in rows]
+
+    def find_cifs(self, id=None, mineral_name=None, author_name=None,
+                  journal_name=None, contains_elements=None,
+                  excludes_elements=None, strict_contains=False,
+                  full_occupancy=False, max_matches=1000):
+        """return list of CIF Structures matching mineral, publication, or elements
+
+        The CIF Structures are sorted by id and read from the database
+        only as needed.  See find_cif_ids().
+        """
+        if id is not None:
+            thiscif = self.get_cif(id)
+            if thiscif is not None:
+                return [thiscif]
+
+        matches = self.find_cif_ids(mineral_name=mineral_name,
+                                    author_name=author_name,
+                                    journal_name=journal_name,
+                                    contains_elements=contains_elements,
+                                    excludes_elements=excludes_elements,
+                                    strict_contains=strict_contains,
+                                    full_occupancy=full_occupancy,
+                                    with_data=True)
         if len(matches) > max_matches:
             matches = matches[:max_matches]
-        return [self.get_cif(cid) for cid in matches]
 
-    def set_hkls(self, cifid, hkls, degens):
+        tabmin = self.tables['minerals']
+        mids = list(set([m[2] for m in matches]))
+        minerals = {row.id: row for row in
+                    self.execall(tabmin.select().where(tabmin.c.id.in_(mids)))}
+        return [LazyCifStructure(cid, self, formula=formula,
+                                 mineral=minerals.get(mid, None))
+                for cid, formula, mid in matches]
+
+    def set_hkls(self, cifid, hkls, degens, sfactors=None):
+        """save HKLs and degeneracies for a CIF, with packed site
+        factors for them, if available (see pack_sfactors()).
+        Nothing is saved for a read-only database."""
         ctab = self.tables['cif']
         packed_hkls = pack_hkl_degen(hkls, degens)
-        self.update(ctab, whereclause=(ctab.c.id == cifid), hkls=packed_hkls)
+        if self.read_only:
+            return packed_hkls
+        kws = {'hkls': packed_hkls}
+        if 'sfactors' in ctab.columns:
+            kws['sfactors'] = sfactors
+        self.update(ctab, whereclause=(ctab.c.id == cifid), **kws)
         return packed_hkls
 
+    def set_sfactors(self, cifid, sfactors):
+        """save packed site factors for the HKLs of a CIF"""
+        ctab = self.tables['cif']
+        if 'sfactors' in ctab.columns and not self.read_only:
+            self.update(ctab, whereclause=(ctab.c.id == cifid),
+                        sfactors=sfactors)
+
+    def build_sfactors(self, cif_ids=None):
+        """calculate and save site factors for the stored HKLs of CIFs,
+        so that structure factors can be calculated without parsing
+        the CIF structures.
+
+        Arguments:
+          cif_ids:     list of AMS IDs [None, all CIFs with stored HKLs
+                       but no site factors]
+
+        Returns:
+          number of CIFs for which site factors were saved
+        """
+        ctab = self.tables['cif']
+        if self.read_only or 'sfactors' not in ctab.columns:
+            return 0
+        if cif_ids is None:
+            query = select(ctab.c.id).where(and_(ctab.c.hkls.isnot(None),
+                                                 ctab.c.sfactors.is_(None)))
+            cif_ids = [row[0] for row in self.execall(query)]
+        nsaved = 0
+        for cid in cif_ids:
+            cif = self.get_cif(cid)
+            if cif is None or cif.sfactors is not None:
+                continue
+            if cif.get_sfactors() is not None:
+                self.set_sfactors(cid, cif.sfactors)
+                nsaved += 1
+        return nsaved
+
+    def get_structure_factors(self, cif_ids, wavelength=0.75):
+        """structure factors for many CIFs, as from
+        CifStructure.get_structure_factors(), using the site factors
+        cached in the database, and looking up resonant scattering
+        factors only once per element.
+
+        Arguments:
+          cif_ids:     list of AMS IDs or CifStructures
+          wavelength:  x-ray wavelength in Ang [0.75]
+
+        Returns:
+          list of StructureFactor (or None for a CIF that cannot be parsed)
+        """
+        resonant, out = {}, []
+        for cif in cif_ids:
+            if not isinstance(cif, CifStructure):
+                cif = self.get_cif(cif)
+            sfdata = None if cif is None else cif.get_sfactors()
+            if sfdata is None:
+                out.append(None)
+                continue
+            hkls, degen = unpack_hkl_degen(cif.hkls)
+            elems, unitcell, sfactors = sfdata
+            out.append(make_structure_factor(hkls, degen, unitcell, elems,
+                                             sfactors, wavelength=wavelength,
+                                             resonant=resonant))
+        return out
+
 def get_amcsd(download_full=True, timeout=30):
     """return instance of the AMCSD CIF Database
 
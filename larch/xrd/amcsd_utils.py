@@ -185,6 +185,15 @@ schema = (
         element VARCHAR(2) not null);''',
     )
 
+indexes = (
+    'CREATE INDEX IF NOT EXISTS cif_mineral_idx ON cif (mineral_id);',
+    'CREATE INDEX IF NOT EXISTS cif_publication_idx ON cif (publication_id);',
+    'CREATE INDEX IF NOT EXISTS pubauth_publication_idx ON publication_authors (publication_id);',
+    'CREATE INDEX IF NOT EXISTS pubauth_author_idx ON publication_authors (author_id);',
+    'CREATE INDEX IF NOT EXISTS cifelem_cif_idx ON cif_elements (cif_id);',
+    'CREATE INDEX IF NOT EXISTS cifelem_element_idx ON cif_elements (element);',
+    )
+
 
 def create_amcsd(dbname='test.db'):
     if os.path.exists(dbname):
@@ -192,7 +201,7 @@ def create_amcsd(dbname='test.db'):
 
     conn = sqlite3.connect(dbname)
     cursor = conn.cursor()
-    for s in schema:
+    for s in schema + indexes:
         cursor.execute(s)
 
     cursor.execute('insert into version values (?,?,?,?)',
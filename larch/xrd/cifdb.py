@@ -14,6 +14,8 @@ from .xrd_tools import lambda_from_E
 
 import json
 from larch.utils.jsonutils import encode4js, decode4js
+from larch.utils import mkdir
+from larch.site_config import user_larchdir
 
 from sqlalchemy import (create_engine, MetaData, Table, Column, Integer,
                         String, Unicode, PrimaryKeyConstraint,
@@ -124,6 +126,166 @@ def iscifDB(dbname):
     return result
 
 
+class QPeakIndex(object):
+    '''
+    sparse index of the q peaks of all structures in a cif database:
+    a postings list for each bin of the q axis with the structures that
+    have a peak in that bin, and a weight for each peak.
+
+    The arrays are saved as .npy files in a folder, and can be loaded
+    memory-mapped.  Scoring a peak list only reads the postings for the
+    bins of the peaks, with totals of peaks for each structure cached
+    for each q range and bin size used.
+    '''
+    arrays = ('axis', 'amcsd_ids', 'indptr', 'cifidx', 'weight')
+
+    def __init__(self, axis, amcsd_ids, indptr, cifidx, weight=None, key=None):
+        self.axis = axis
+        self.amcsd_ids = amcsd_ids
+        self.indptr = indptr
+        self.cifidx = cifidx
+        if weight is None:
+            weight = np.ones(len(cifidx), dtype=np.float32)
+        self.weight = weight
+        self.key = key
+        self.binned = {}
+
+    @classmethod
+    def from_qarrays(cls, axis, amcsd_ids, qarrays, weights=None, key=None):
+        '''build index from list of 0/1 q arrays on axis for each structure,
+        with optional list of arrays of peak weights'''
+        rows, cols, wts = [], [], []
+        for i, qarr in enumerate(qarrays):
+            icol = np.nonzero(np.asarray(qarr))[0]
+            rows.append(np.full(len(icol), i, dtype=np.int32))
+            cols.append(icol)
+            if weights is not None:
+                wts.append(np.asarray(weights[i])[icol])
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        wts = np.ones(len(rows)) if weights is None else np.concatenate(wts)
+        order = np.lexsort((rows, cols))
+        indptr = np.searchsorted(cols[order], np.arange(len(axis)+1)).astype(np.int64)
+        return cls(np.asarray(axis, dtype=np.float64),
+                   np.asarray(amcsd_ids, dtype=np.int64), indptr,
+                   rows[order], wts[order].astype(np.float32), key=key)
+
+    def save(self, folder):
+        mkdir(folder)
+        for attr in self.arrays:
+            np.save(os.path.join(folder, '%s.npy' % attr), getattr(self, attr))
+        with open(os.path.join(folder, 'key.json'), 'w') as fh:
+            fh.write(json.dumps(self.key))
+
+    @classmethod
+    def load(cls, folder, key=None, mmap_mode='r'):
+        '''load saved index from folder, memory-mapped, returning None if
+        not found or if the saved key does not match'''
+        try:
+            with open(os.path.join(folder, 'key.json'), 'r') as fh:
+                saved_key = json.loads(fh.read())
+            if key is not None and saved_key != key:
+                return None
+            arrs = [np.load(os.path.join(folder, '%s.npy' % attr),
+                            mmap_mode=mmap_mode) for attr in cls.arrays]
+        except (IOError, OSError, ValueError):
+            return None
+        return cls(*arrs, key=saved_key)
+
+    def get_binned(self, imin, imax, qstep):
+        '''postings for q axis[imin:imax], re-binned to qstep if that is
+        larger than the axis step, keeping the largest weight for a structure
+        in each new bin.  Returns (qaxis, indptr, cifidx, weight, totals),
+        where totals is the sum of weights for each structure'''
+        key = (imin, imax, qstep)
+        if key in self.binned:
+            return self.binned[key]
+        qaxis = self.axis[imin:imax]
+        stepq = (qaxis[1]-qaxis[0])
+        p0, p1 = self.indptr[imin], self.indptr[imax]
+        indptr = np.asarray(self.indptr[imin:imax+1]) - p0
+        cifidx = self.cifidx[p0:p1]
+        weight = self.weight[p0:p1]
+        if qstep > stepq*(1 + 1.e-6):
+            new_qaxis = np.arange(np.min(qaxis), np.max(qaxis)+stepq, qstep)
+            newbin = abs(new_qaxis[None, :]-qaxis[:, None]).argmin(axis=1)
+            col = np.repeat(newbin, np.diff(indptr))
+            order = np.lexsort((weight, cifidx, col))
+            col, cifidx, weight = col[order], cifidx[order], weight[order]
+            last = np.ones(len(col), dtype=bool)
+            last[:-1] = (col[1:] != col[:-1]) | (cifidx[1:] != cifidx[:-1])
+            col, cifidx, weight = col[last], cifidx[last], weight[last]
+            indptr = np.searchsorted(col, np.arange(len(new_qaxis)+1))
+            qaxis = new_qaxis
+        totals = np.bincount(cifidx, weights=weight, minlength=len(self.amcsd_ids))
+        if len(self.binned) > 8:
+            self.binned.clear()
+        self.binned[key] = (qaxis, indptr, cifidx, weight, totals)
+        return self.binned[key]
+
+    def score(self, peaks, qmin=None, qmax=None, qstep=None, list=None,
+              tol=None, peak_weights=None):
+        '''score a list of q peaks against all structures in the index
+
+        Arguments:
+        ----------
+        peaks         list of q values of peaks
+        qmin, qmax    q range to compare [QMIN, QMAX]
+        qstep         q bin size, larger than the q axis step to rebin [QSTEP]
+        list          list of amcsd ids to limit search to [None]
+        tol           tolerance in q for matching peaks [None, nearest bin]
+        peak_weights  weights for each peak in matching [None, all 1]
+
+        Returns:
+        --------
+        scores, amcsd_ids, total_peaks, match_peaks, miss_peaks arrays, with
+        score = sum of peak weights for matched peaks - missed peaks, as for
+        cifDB.amcsd_by_q()
+        '''
+        if qmin is None: qmin = QMIN
+        if qmax is None: qmax = QMAX
+        if qstep is None: qstep = QSTEP
+        axis = self.axis
+
+        imin, imax = 0, len(axis)
+        if qmax < np.max(axis):
+            imax = abs(axis-qmax).argmin()
+        if qmin > np.min(axis):
+            imin = abs(axis-qmin).argmin()
+        qaxis, indptr, cifidx, weight, totals = self.get_binned(imin, imax, qstep)
+
+        ## weight of each peak bin, nearest bin and those within tol
+        peaks = np.atleast_1d(np.asarray(peaks, dtype=np.float64))
+        if peak_weights is None:
+            peak_weights = np.ones(len(peaks))
+        bin_weights = {}
+        ipeak = abs(qaxis[None, :]-peaks[:, None]).argmin(axis=1)
+        for i, wt in zip(ipeak, peak_weights):
+            bin_weights[i] = wt
+        if tol is not None:
+            for p, wt in zip(peaks, peak_weights):
+                for i in np.nonzero(abs(qaxis-p) <= tol)[0]:
+                    bin_weights[i] = max(wt, bin_weights.get(i, wt))
+
+        ## postings for peak bins
+        bins = np.array(sorted(bin_weights.keys()), dtype=np.int64)
+        nper = indptr[bins+1] - indptr[bins]
+        ipost = np.repeat(indptr[bins] - np.cumsum(nper) + nper, nper) + np.arange(nper.sum())
+        pcif, pwt = cifidx[ipost], weight[ipost]
+        pbin_wt = np.repeat([bin_weights[i] for i in bins], nper)
+
+        ncif = len(self.amcsd_ids)
+        match_peaks = np.bincount(pcif, weights=pwt, minlength=ncif)
+        matched = np.bincount(pcif, weights=pwt*(pbin_wt+1), minlength=ncif)
+        miss_peaks = totals - match_peaks
+        scores = matched - totals
+        ids = np.asarray(self.amcsd_ids)
+        out = [scores, ids, totals, match_peaks, miss_peaks]
+        if list is not None:
+            irows = np.nonzero(np.isin(ids, np.asarray(list)))[0]
+            out = [arr[irows] for arr in out]
+        return tuple(out)
+
+
 class cifDB(object):
     '''
     interface to the American Mineralogist Crystal Structure Database
@@ -182,6 +344,39 @@ class cifDB(object):
         self.ciftbl  = Table('ciftbl', self.metadata)
 
         self.axis = np.array([float(q[0]) for q in self.query(self.qtbl.c.q).all()])
+        self._qindex = QPeakIndex.load(self.qindex_folder(), key=self.qindex_key())
+
+    def qindex_folder(self):
+        "folder for saved q peak index"
+        dbname = os.path.splitext(os.path.basename(self.dbname))[0]
+        return os.path.join(user_larchdir, 'xrd', '%s_qindex' % dbname)
+
+    def qindex_key(self):
+        "key identifying the database file for the saved q peak index"
+        stat = os.stat(self.dbname)
+        return [os.path.abspath(self.dbname), stat.st_size, stat.st_mtime_ns]
+
+    def build_qindex(self, save=True):
+        '''build sparse q peak index for all structures, and save it
+        to be loaded memory-mapped for later sessions'''
+        rows = self.query(self.ciftbl.c.amcsd_id, self.ciftbl.c.qstr).all()
+        qindex = QPeakIndex.from_qarrays(self.axis, [row[0] for row in rows],
+                                         [json.loads(row[1]) for row in rows],
+                                         key=self.qindex_key())
+        if save:
+            try:
+                qindex.save(self.qindex_folder())
+            except (IOError, OSError):
+                pass
+        self._qindex = qindex
+        return qindex
+
+    @property
+    def qindex(self):
+        "sparse q peak index, built if needed"
+        if self._qindex is None:
+            self.build_qindex()
+        return self._qindex
 
 
     def query(self, *args, **kws):
@@ -368,12 +563,13 @@ class cifDB(object):
         for spgrp_no in SPACEGROUPS.keys():
             for spgrp_name in SPACEGROUPS[spgrp_no]:
                 match = False
-                search_spgrp = self.spgptbl.select(self.spgptbl.c.hm_notation == spgrp_name)
-                for row in search_spgrp.execute():
+                search_spgrp = self.session.execute(self.spgptbl.select().where(self.spgptbl.c.hm_notation == spgrp_name))
+                for row in search_spgrp:
                     match = True
                 if match is False:
                     print('Adding: %s %s' % (spgrp_no,spgrp_name))
-                    self.spgptbl.insert().execute(iuc_id=spgrp_no,hm_notation=spgrp_name)
+                    self.session.execute(self.spgptbl.insert().values(iuc_id=spgrp_no,hm_notation=spgrp_name))
+        self.session.commit()
 
     def add_ciffile(self, ciffile, verbose=True, url=False, ijklm=1, file=None):
         '''
@@ -417,8 +613,8 @@ class cifDB(object):
         ## check for amcsd in file already
         ## Find amcsd_id in database
         self.ciftbl = Table('ciftbl', self.metadata)
-        search_cif = self.ciftbl.select(self.ciftbl.c.amcsd_id == cif.id_no)
-        for row in search_cif.execute():
+        search_cif = self.session.execute(self.ciftbl.select().where(self.ciftbl.c.amcsd_id == cif.id_no))
+        for row in search_cif:
             if verbose:
                 if url:
                     print('AMCSD %i already exists in database.\n' % cif.id_no)
@@ -428,7 +624,7 @@ class cifDB(object):
             return
 
         ## Define q-array for each entry at given energy
-        qhkl = cif.calc_q(wvlgth=lambda_from_E(ENERGY), q_min=QMIN, q_max=QMAX)
+        qhkl = cif.calc_q(q_min=QMIN, q_max=QMAX)
         qarr = self.create_q_array(qhkl)
 
         ###################################################
@@ -448,73 +644,73 @@ class cifDB(object):
 
         ## Find mineral_name
         match = False
-        search_mineral = self.nametbl.select(self.nametbl.c.mineral_name == cif.label)
-        for row in search_mineral.execute():
+        search_mineral = self.session.execute(self.nametbl.select().where(self.nametbl.c.mineral_name == cif.label))
+        for row in search_mineral:
             mineral_id = row.mineral_id
             match = True
         if match is False:
-            def_name.execute(mineral_name=cif.label)
-            search_mineral = self.nametbl.select(self.nametbl.c.mineral_name == cif.label)
-            for row in search_mineral.execute():
+            self.session.execute(def_name.values(mineral_name=cif.label))
+            search_mineral = self.session.execute(self.nametbl.select().where(self.nametbl.c.mineral_name == cif.label))
+            for row in search_mineral:
                 mineral_id = row.mineral_id
 
         ## Find formula_name
         match = False
-        search_formula = self.formtbl.select(self.formtbl.c.formula_name == cif.formula)
-        for row in search_formula.execute():
+        search_formula = self.session.execute(self.formtbl.select().where(self.formtbl.c.formula_name == cif.formula))
+        for row in search_formula:
             formula_id = row.formula_id
             match = True
         if match is False:
-            def_form.execute(formula_name=cif.formula)
-            search_formula = self.formtbl.select(self.formtbl.c.formula_name == cif.formula)
-            for row in search_formula.execute():
+            self.session.execute(def_form.values(formula_name=cif.formula))
+            search_formula = self.session.execute(self.formtbl.select().where(self.formtbl.c.formula_name == cif.formula))
+            for row in search_formula:
                 formula_id = row.formula_id
 
         ## Find composition (loop over all elements)
         z_list = []
         for element in set(cif.atom.label):
-            search_elements = self.elemtbl.select(self.elemtbl.c.element_symbol == element)
-            for row in search_elements.execute():
+            search_elements = self.session.execute(self.elemtbl.select().where(self.elemtbl.c.element_symbol == element))
+            for row in search_elements:
                 z_list += [row.z]
         zarr = self.create_z_array(z_list)
 
 
         ## Save CIF entry into database
-        new_cif.execute(amcsd_id=cif.id_no,
-                        mineral_id=int(mineral_id),
-                        formula_id=int(formula_id),
-                        iuc_id=cif.symmetry.no,
-                        a=str(cif.unitcell[0]),
-                        b=str(cif.unitcell[1]),
-                        c=str(cif.unitcell[2]),
-                        alpha=str(cif.unitcell[3]),
-                        beta=str(cif.unitcell[4]),
-                        gamma=str(cif.unitcell[5]),
-                        cif=cifstr,
-                        zstr=json.dumps(zarr.tolist(),default=str),
-                        qstr=json.dumps(qarr.tolist(),default=str),
-                        url=str(ciffile))
+        self.session.execute(new_cif.values(amcsd_id=cif.id_no,
+                                            mineral_id=int(mineral_id),
+                                            formula_id=int(formula_id),
+                                            iuc_id=cif.symmetry.no,
+                                            a=str(cif.unitcell[0]),
+                                            b=str(cif.unitcell[1]),
+                                            c=str(cif.unitcell[2]),
+                                            alpha=str(cif.unitcell[3]),
+                                            beta=str(cif.unitcell[4]),
+                                            gamma=str(cif.unitcell[5]),
+                                            cif=cifstr,
+                                            zstr=json.dumps(zarr.tolist(),default=str),
+                                            qstr=json.dumps(qarr.tolist(),default=str),
+                                            url=str(ciffile)))
 
         ## Build q cross-reference table
         for q in qhkl:
-            search_q = self.qtbl.select(self.qtbl.c.q == '%0.2f' % (int(q * 100) / 100.))
-            for row in search_q.execute():
+            search_q = self.session.execute(self.qtbl.select().where(self.qtbl.c.q == '%0.2f' % (int(q * 100) / 100.)))
+            for row in search_q:
                 q_id = row.q_id
 
             try:
-                add_q.execute(q_id=q_id,amcsd_id=cif.id_no)
+                self.session.execute(add_q.values(q_id=q_id,amcsd_id=cif.id_no))
             except:
                 pass
 
 
         ## Build composition cross-reference table
         for element in set(cif.atom.label):
-            search_elements = self.elemtbl.select(self.elemtbl.c.element_symbol == element)
-            for row in search_elements.execute():
+            search_elements = self.session.execute(self.elemtbl.select().where(self.elemtbl.c.element_symbol == element))
+            for row in search_elements:
                 z = row.z
 
             try:
-                add_comp.execute(z=z, amcsd_id=cif.id_no)
+                self.session.execute(add_comp.values(z=z, amcsd_id=cif.id_no))
             except:
                 print('could not find element: %s (amcsd: %i)' % (element,cif.id_no))
                 pass
@@ -522,24 +718,28 @@ class cifDB(object):
         ## Find author_name
         for author_name in cif.publication.author:
             match = False
-            search_author = self.authtbl.select(self.authtbl.c.author_name == author_name)
-            for row in search_author.execute():
+            search_author = self.session.execute(self.authtbl.select().where(self.authtbl.c.author_name == author_name))
+            for row in search_author:
                 author_id = row.author_id
                 match = True
             if match is False:
-                def_auth.execute(author_name=author_name)
-                search_author = self.authtbl.select(self.authtbl.c.author_name == author_name)
-                for row in search_author.execute():
+                self.session.execute(def_auth.values(author_name=author_name))
+                search_author = self.session.execute(self.authtbl.select().where(self.authtbl.c.author_name == author_name))
+                for row in search_author:
                     author_id = row.author_id
                     match = True
             if match == True:
-                add_auth.execute(author_id=author_id,
-                                   amcsd_id=cif.id_no)
+                self.session.execute(add_auth.values(author_id=author_id,
+                                                     amcsd_id=cif.id_no))
 
     #     ## not ready for defined categories
     #     cif_category.execute(category_id='none',
     #                          amcsd_id=cif.id_no)
 
+        self.session.commit()
+        ## new q peaks: rebuild q index on next use
+        self._qindex = None
+
         if url:
             self.amcsd_info(cif.id_no, no_qpeaks=np.sum(qarr))
         else:
@@ -667,8 +867,8 @@ class cifDB(object):
             return
 
     def return_cif(self,amcsd_id):
-        search_cif = self.ciftbl.select(self.ciftbl.c.amcsd_id == amcsd_id)
-        for row in search_cif.execute():
+        search_cif = self.session.execute(self.ciftbl.select().where(self.ciftbl.c.amcsd_id == amcsd_id))
+        for row in search_cif:
             return row.cif
 
 ##################################################################################
@@ -692,9 +892,9 @@ class cifDB(object):
 
     def author_by_amcsd(self,amcsd_id):
 
-        search_authors = self.authref.select(self.authref.c.amcsd_id == amcsd_id)
+        search_authors = self.session.execute(self.authref.select().where(self.authref.c.amcsd_id == amcsd_id))
         authors = []
-        for row in search_authors.execute():
+        for row in search_authors:
             authors.append(self.search_for_author(row.author_id,id_no=False)[0][0])
         return authors
 
@@ -704,23 +904,30 @@ class cifDB(object):
 
     def cif_by_amcsd(self,amcsd_id,only_ids=False):
 
-        search_cif = self.ciftbl.select(self.ciftbl.c.amcsd_id == amcsd_id)
-        for row in search_cif.execute():
+        search_cif = self.session.execute(self.ciftbl.select().where(self.ciftbl.c.amcsd_id == amcsd_id))
+        for row in search_cif:
             if only_ids:
                 return row.mineral_id, row.iuc_id
             else:
                 return row.cif
 
+    def minerals_by_amcsd(self, amcsd_ids):
+        '''dictionary of mineral names for a list of amcsd ids'''
+        rows = self.query(self.ciftbl.c.amcsd_id, self.nametbl.c.mineral_name)\
+                   .filter(self.ciftbl.c.mineral_id == self.nametbl.c.mineral_id)\
+                   .filter(self.ciftbl.c.amcsd_id.in_(list(amcsd_ids))).all()
+        return {row[0]: row[1] for row in rows}
+
     def mineral_by_amcsd(self,amcsd_id):
 
-        search_cif = self.ciftbl.select(self.ciftbl.c.amcsd_id == amcsd_id)
-        for row in search_cif.execute():
+        search_cif = self.session.execute(self.ciftbl.select().where(self.ciftbl.c.amcsd_id == amcsd_id))
+        for row in search_cif:
             cifstr = row.cif
             mineral_id = row.mineral_id
             iuc_id = row.iuc_id
 
-        search_mineralname = self.nametbl.select(self.nametbl.c.mineral_id == mineral_id)
-        for row in search_mineralname.execute():
+        search_mineralname = self.session.execute(self.nametbl.select().where(self.nametbl.c.mineral_id == mineral_id))
+        for row in search_mineralname:
             mineral_name = row.mineral_name
         return mineral_name
 
@@ -728,51 +935,18 @@ class cifDB(object):
 ##################################################################################
 
     def amcsd_by_q(self, peaks, qmin=None, qmax=None, qstep=None, list=None,
-                   verbose=False):
-
-        if qmin is None: qmin = QMIN
-        if qmax is None: qmax = QMAX
-        if qstep is None: qstep = QSTEP
-
-        ## Defines min/max limits of q-range
-        imin, imax = 0, len(self.axis)
-        if qmax < np.max(self.axis):
-            imax = abs(self.axis-qmax).argmin()
-        if qmin > np.min(self.axis):
-            imin = abs(self.axis-qmin).argmin()
-        qaxis = self.axis[imin:imax]
-        stepq = (qaxis[1]-qaxis[0])
-
-        amcsd, q_amcsd = self.match_qc(list=list, qmin=qmin, qmax=qmax)
-
-        ## Re-bins data if different step size is specified
-        if qstep > stepq:
-            new_qaxis   = np.arange(np.min(qaxis),np.max(qaxis)+stepq,qstep)
-            new_q_amcsd = np.zeros((np.shape(q_amcsd)[0],np.shape(new_qaxis)[0]))
-            for m,qrow in enumerate(q_amcsd):
-                for n,qn in enumerate(qrow):
-                    if qn == 1:
-                        k = np.abs(new_qaxis-qaxis[n]).argmin()
-                        new_q_amcsd[m][k] = 1
-            qaxis = new_qaxis
-            q_amcsd = new_q_amcsd
-
+                   verbose=False, tol=None, peak_weights=None):
+        '''score a list of q peaks against the structures in the database,
+        using the sparse q peak index (see QPeakIndex.score())
 
-        ## Create data array
-        peaks_weighting = np.ones(len(qaxis),dtype=int)*-1
-        peaks_true = np.zeros(len(qaxis),dtype=int)
-        peaks_false = np.ones(len(qaxis),dtype=int)
-        for p in peaks:
-            i = np.abs(qaxis-p).argmin()
-            peaks_weighting[i],peaks_true[i],peaks_false[i] = 1,1,0
-
-        ## Calculate score/matches/etc.
-        total_peaks = np.sum((q_amcsd),axis=1)
-        match_peaks = np.sum((peaks_true*q_amcsd),axis=1)
-        miss_peaks = np.sum((peaks_false*q_amcsd),axis=1)
-        scores = np.sum((peaks_weighting*q_amcsd),axis=1)
-
-        return sorted(zip(scores, amcsd, total_peaks, match_peaks, miss_peaks), reverse=True)
+        returns list of (score, amcsd_id, total_peaks, match_peaks, miss_peaks)
+        sorted by decreasing score
+        '''
+        out = self.qindex.score(peaks, qmin=qmin, qmax=qmax, qstep=qstep,
+                                list=list, tol=tol, peak_weights=peak_weights)
+        scores, amcsd = out[0], out[1]
+        order = np.lexsort((-amcsd, -scores))
+        return [tuple(arr[i] for arr in out) for i in order]
 
 
     def amcsd_by_chemistry(self, include=[], exclude=[]):
@@ -1260,13 +1434,14 @@ def match_database(cifdb, peaks, minq=QMIN, maxq=QMAX, verbose=True):
             print('DISPLAYING TOP 100 of %i TOTAL MATCHES FOUND.' % len(MATCHES))
         else:
             print('%i TOTAL MATCHES FOUND.' % len(MATCHES))
+        minerals = cifdb.minerals_by_amcsd(MATCHES[:100])
         j = 0
         for i,id_no in enumerate(amcsd):
             if j < 100:
                 if scores[i] > 0:
                     j += 1
                     str = 'AMCSD %5d, %s (score of %2d --> %i of %i peaks)' % (id_no,
-                             cifdb.mineral_by_amcsd(id_no),scores[i],
+                             minerals.get(id_no, ''),scores[i],
                              match_peaks[i],total_peaks[i])
                     print(str)
         print('')
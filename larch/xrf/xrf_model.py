@@ -1,6 +1,7 @@
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from numpy.linalg import lstsq
 from scipy.optimize import nnls
@@ -25,6 +26,99 @@ xrf_peak = namedtuple('xrf_peak', ('name', 'amplitude', 'center', 'step',
 
 predict_methods = {'lstsq': lstsq, 'nnls': nnls}
 
+def _solve_passive(gram, ctb, passive):
+    """solve normal equations for many columns of ctb, using only the
+    variables in the passive set for each column.  Inactive variables are
+    decoupled on the diagonal so all columns are solved in one batch,
+    falling back to grouping columns by passive set if that is singular"""
+    pset = passive.T
+    mats = gram[None, :, :] * (pset[:, :, None] & pset[:, None, :])
+    idiag = np.arange(gram.shape[0])
+    mats[:, idiag, idiag] += ~pset
+    try:
+        return np.linalg.solve(mats, (ctb*passive).T[:, :, None])[:, :, 0].T
+    except np.linalg.LinAlgError:
+        pass
+    out = np.zeros(ctb.shape)
+    patterns, inverse = np.unique(pset, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    for ipat, pvars in enumerate(patterns):
+        if not pvars.any():
+            continue
+        cols = np.where(inverse == ipat)[0]
+        sub = np.ix_(pvars, cols)
+        out[sub] = lstsq(gram[np.ix_(pvars, pvars)], ctb[sub], rcond=None)[0]
+    return out
+
+def nnls_batch(amat, bvecs, gram=None, maxiter=None):
+    """non-negative least-squares for many right-hand sides at once,
+    minimizing |amat @ x - b| with x >= 0 for each row b of bvecs.
+
+    Arguments:
+    ----------
+    amat       matrix [NPTS, NCOMPS], shared by all vectors
+    bvecs      vectors to fit [NVEC, NPTS]
+    gram       precomputed amat.T @ amat [None - calculate]
+    maxiter    maximum number of iterations [3*NCOMPS]
+
+    Returns:
+    ---------
+    array of solutions [NVEC, NCOMPS]
+
+    Notes:
+    ------
+    Uses the fast combinatorial active-set method (Van Benthem and Keenan,
+    J Chemometrics 18, 441 (2004)), working with the Gram matrix so that
+    vectors with the same set of active components are solved together.
+    Results agree with scipy.optimize.nnls applied to each vector.
+    """
+    amat = np.asarray(amat, dtype='float64')
+    bvecs = np.atleast_2d(bvecs)
+    ncomps = amat.shape[1]
+    if gram is None:
+        gram = amat.T @ amat
+    if maxiter is None:
+        maxiter = 3*ncomps
+    ctb = amat.T @ bvecs.T
+    tol = 1.e-12*max(1.0, abs(ctb).max())
+
+    xout = lstsq(gram, ctb, rcond=None)[0]
+    passive = xout > 0
+    xout[~passive] = 0.0
+    xprev = xout.copy()
+    fset = np.where(~passive.all(axis=0))[0]
+    niter = nouter = 0
+    while len(fset) > 0 and nouter < maxiter:
+        nouter += 1
+        xout[:, fset] = _solve_passive(gram, ctb[:, fset], passive[:, fset])
+        # inner loop: step back to feasible solutions, dropping variables
+        hset = fset[(xout[:, fset] < 0).any(axis=0)]
+        while len(hset) > 0 and niter < maxiter:
+            niter += 1
+            xh, xp = xout[:, hset], xprev[:, hset]
+            neg = passive[:, hset] & (xh < 0)
+            alpha = np.full(xh.shape, np.inf)
+            alpha[neg] = xp[neg] / (xp[neg] - xh[neg])
+            imin = alpha.argmin(axis=0)
+            amin = alpha[imin, np.arange(len(hset))]
+            xp = xp - amin*(xp - xh)
+            xp[imin, np.arange(len(hset))] = 0.0
+            xprev[:, hset] = xp
+            passive[:, hset] &= xp > tol
+            passive[imin, hset] = False
+            xout[:, hset] = _solve_passive(gram, ctb[:, hset], passive[:, hset])
+            hset = hset[(xout[:, hset] < 0).any(axis=0)]
+        # check optimality with gradient of inactive variables
+        grad = ctb[:, fset] - gram @ xout[:, fset]
+        grad[passive[:, fset]] = -np.inf
+        done = (grad <= tol).all(axis=0)
+        fset = fset[~done]
+        if len(fset) > 0:
+            passive[grad[:, ~done].argmax(axis=0), fset] = True
+            xprev[:, fset] = xout[:, fset]
+    xout[xout < 0] = 0.0
+    return xout.T
+
 # Note on units:  energies are in keV, lengths in cm
 
 
@@ -231,6 +325,10 @@ class XRF_Model:
         self.escape_scale = None
         self.script = ''
         self.mca = None
+        self.comp_cache = OrderedDict()
+        self.comp_cache_size = 4
+        self.fit_stats = {}
+        self.reset_fit_stats()
         if bgr is not None:
             self.add_background(bgr)
 
@@ -362,18 +460,91 @@ class XRF_Model:
         """ energy width of peak """
         return np.sqrt(self.efano*energy + noise**2)
 
-    def calc_spectrum(self, energy, params=None):
-        if params is None:
-            params = self.params
-        pars = params.valuesdict()
-        self.comps = {}
-        self.eigenvalues = {}
+    def reset_fit_stats(self):
+        """reset counts and timing of model evaluations"""
+        self.fit_stats = {'model_evals': 0, 'cache_hits': 0, 'cache_misses': 0,
+                          'model_time': 0.0, 'fit_time': 0.0, 'time_per_eval': 0.0}
 
+    def _element_components(self, energy, pars):
+        "unit-amplitude spectra for all elements"
         det_noise = pars['det_noise']
         step = pars['peak_step']
         tail = pars['peak_tail']
         beta = pars['peak_beta']
         gamma = pars['peak_gamma']
+        ucomps = np.zeros((len(self.elements), len(energy)))
+        for elem, comp in zip(self.elements, ucomps):
+            for key, line in elem.lines.items():
+                ilevel = line.initial_level
+                ecen = 0.001*line.energy
+                line_amp = (line.intensity * elem.mu *
+                            elem.fyields[ilevel] * elem.taus[ilevel])
+                sigma = self.det_sigma(ecen, det_noise)
+                comp += hypermet(energy, amplitude=line_amp, center=ecen,
+                                 sigma=sigma, step=step, tail=tail,
+                                 beta=beta, gamma=gamma)
+        return ucomps
+
+    def _scatter_component(self, energy, pars, name):
+        "unit-amplitude spectrum for Rayleigh or Compton scatter peak"
+        ecen = pars['%s_center' % name]
+        sigma = pars['%s_sigmax' % name] * self.det_sigma(ecen, pars['det_noise'])
+        return hypermet(energy, amplitude=1.0, center=ecen, sigma=sigma,
+                        step=pars['%s_step' % name], tail=pars['%s_tail' % name],
+                        beta=pars['%s_beta' % name], gamma=pars['peak_gamma'])
+
+    def _cached_components(self, energy, key, calc, *args):
+        """unit-amplitude spectra from calc(energy, *args), with attenuation
+        and escape peaks applied, cached by key"""
+        if key in self.comp_cache:
+            self.comp_cache.move_to_end(key)
+            self.fit_stats['cache_hits'] += 1
+            return self.comp_cache[key]
+        self.fit_stats['cache_misses'] += 1
+        ucomps = calc(energy, *args).reshape((-1, len(energy)))
+        ucomps *= self.atten * self.count_time
+        for comp in ucomps:
+            comp += self.escape_amp * interp1d(energy-self.escape_energy, comp, energy)
+        ucomps[np.where(np.isnan(ucomps))] = 0.0
+        self.comp_cache[key] = ucomps
+        while len(self.comp_cache) > self.comp_cache_size*(1+len(self.scatter)):
+            self.comp_cache.popitem(last=False)
+        return ucomps
+
+    def unit_components(self, energy, pars):
+        """unit-amplitude spectra for elements and then scatter peaks, as
+        array [NCOMPS, NPTS], including attenuation and escape peaks.
+
+        These depend on the energy calibration, peak shape parameters,
+        attenuation, escape, and the elements (with their absorption at
+        the incident energy), but not on amplitudes.  They are cached
+        with those as the key, separately for the elements and for each
+        scatter peak, so that changing only amplitudes (as for most steps
+        of a fit) needs no new peak shapes, and the model is the product
+        of these with the amplitudes.
+        """
+        base = (energy.tobytes(), np.asarray(self.atten).tobytes(),
+                np.asarray(self.escape_amp).tobytes(), self.escape_energy,
+                self.count_time, pars['det_noise'], pars['peak_gamma'])
+        elems = tuple((elem.symbol, elem.xray_energy, float(elem.mu))
+                      for elem in self.elements)
+        key = ('elements', elems) + base + tuple(pars[k] for k in
+                                                 ('peak_step', 'peak_tail', 'peak_beta'))
+        out = [self._cached_components(energy, key, self._element_components, pars)]
+        for peak in self.scatter:
+            key = (peak.name,) + base + tuple(pars['%s_%s' % (peak.name, attr)] for attr in
+                                              ('center', 'step', 'tail', 'beta', 'sigmax'))
+            out.append(self._cached_components(energy, key, self._scatter_component,
+                                               pars, peak.name))
+        return np.concatenate(out)
+
+    def calc_spectrum(self, energy, params=None):
+        t0 = time.time()
+        if params is None:
+            params = self.params
+        pars = params.valuesdict()
+        self.comps = {}
+        self.eigenvalues = {}
 
         # escape: calc only if needed
         if ((not self.fit_in_progress) or
@@ -415,48 +586,17 @@ class XRF_Model:
         #     self.calc_matrix_attenuation(energy)
         # atten *= self.matrix_atten
 
-        nlines = 0
-        for elem in self.elements:
-            comp = 0. * energy
-            amp = pars.get('amp_%s' % elem.symbol.lower(), None)
-            if amp is None:
-                continue
-            for key, line in elem.lines.items():
-                ilevel = line.initial_level
-                ecen = 0.001*line.energy
-                nlines += 1
-                line_amp = (line.intensity * elem.mu *
-                            elem.fyields[ilevel] * elem.taus[ilevel])
-                sigma = self.det_sigma(ecen, det_noise)
-                comp += hypermet(energy, amplitude=line_amp, center=ecen,
-                                 sigma=sigma, step=step, tail=tail,
-                                 beta=beta, gamma=gamma)
-            comp *= amp * self.atten * self.count_time
-            comp += self.escape_amp * interp1d(energy-self.escape_energy, comp, energy)
-            comp[np.where(np.isnan(comp))] = 0.0
-            self.comps[elem.symbol] = comp
-            self.eigenvalues[elem.symbol] = amp
-
-        # scatter peaks for Rayleigh and Compton
-        for peak in self.scatter:
-            p = peak.name
-            amp  = pars.get('%s_amp' % p, None)
-            if amp is None:
-                continue
-            ecen = pars['%s_center' % p]
-            step = pars['%s_step' % p]
-            tail = pars['%s_tail' % p]
-            beta = pars['%s_beta' % p]
-            sigma = pars['%s_sigmax' % p]
-            sigma *= self.det_sigma(ecen, det_noise)
-            comp = hypermet(energy, amplitude=1.0, center=ecen,
-                            sigma=sigma, step=step, tail=tail, beta=beta,
-                            gamma=gamma)
-            comp *= amp * self.atten * self.count_time
-            comp += self.escape_amp * interp1d(energy-self.escape_energy, comp, energy)
-            comp[np.where(np.isnan(comp))] = 0.0
-            self.comps[p] = comp
-            self.eigenvalues[p] = amp
+        names = [elem.symbol for elem in self.elements]
+        amps = [pars.get('amp_%s' % elem.symbol.lower(), None) for elem in self.elements]
+        names.extend([peak.name for peak in self.scatter])
+        amps.extend([pars.get('%s_amp' % peak.name, None) for peak in self.scatter])
+        use = [i for i, amp in enumerate(amps) if amp is not None]
+        if len(use) > 0:
+            ucomps = self.unit_components(energy, pars)
+            weighted = np.array([amps[i] for i in use])[:, np.newaxis] * ucomps[use]
+            for i, comp in zip(use, weighted):
+                self.comps[names[i]] = comp
+                self.eigenvalues[names[i]] = amps[i]
         if self.bgr is not None:
             bgr_amp = pars.get('background_amp', 0.0)
             self.comps['background'] = bgr_amp * self.bgr
@@ -476,6 +616,8 @@ class XRF_Model:
         floor = 1.e-10*max(total)
         total[np.where(total<floor)] = floor
         self.current_model = total
+        self.fit_stats['model_evals'] += 1
+        self.fit_stats['model_time'] += time.time() - t0
         return total
 
     def __resid(self, params, data, index):
@@ -530,6 +672,8 @@ class XRF_Model:
         self.npts = (self.imax - self.imin)
         self.set_fit_weight(work_energy, work_counts, energy_min, energy_max)
         self.fit_iter = 0
+        self.comp_cache.clear()
+        self.reset_fit_stats()
 
         # reset attenuation calcs for matrix, detector, filters
         self.matrix_atten = 1.0
@@ -545,10 +689,13 @@ class XRF_Model:
 
         tol = self.fit_toler
         self.fit_in_progress = True
+        t0 = time.time()
         self.result = minimize(self.__resid, self.params, kws=userkws,
                                method='leastsq', maxfev=self.max_nfev,
                                scale_covar=True, epsfcn=self.fit_step,
                                gtol=tol, ftol=tol, xtol=tol)
+        self.fit_stats['fit_time'] = time.time() - t0
+        self.fit_stats['time_per_eval'] = self.fit_stats['fit_time']/max(1, self.fit_iter)
 
         self.fit_report = fit_report(self.result, min_correl=0.5)
         pars = self.result.params
@@ -585,7 +732,7 @@ class XRF_Model:
 
         for attr in ('atten', 'best_en', 'best_fit', 'bgr', 'comps', 'count_time',
                      'eigenvalues', 'energy_max', 'energy_min', 'fit_iter', 'fit_log',
-                     'fit_report', 'fit_toler', 'fit_weight', 'fit_window', 'init_fit',
+                     'fit_report', 'fit_stats', 'fit_toler', 'fit_weight', 'fit_window', 'init_fit',
                      'scatter', 'script', 'transfer_matrix', 'xray_energy'):
             setattr(out, attr, getattr(self, attr, None))
 
@@ -704,21 +851,30 @@ class XRFFitResult(Group):
         return xrf_prediction(weights, total)
 
     def decompose_map(self, map, scale=1.0, pixel_time=1.0, method='lstsq',
-                      nworkers=4):
+                      nworkers=4, chunk_size=None):
         """
         Apply XRFFitResult to an XRF Map, decomposing it into maps of elemental weights
 
         Arguments:
         ----------
         map          XRF map array: [NY, NX, NMCA], on the same energy grid as the fitted data.
+                     This can be an HDF5 dataset, which will be read in chunks of rows.
         scale        scale factor to apply to output weights [1]
         pixel_time   count time in seconds for each pixel [1.0]
         method       decomposition method: one of `lstsq` for basic least-squares or
                      `nnls` for non-negative least-squares [`lstsq`]
+        nworkers     number of threads to use for decomposing chunks of rows [4]
+        chunk_size   number of rows per chunk [None - use ~32 Mb chunks]
 
         Returns:
         ---------
         dict of elements: weights maps (NY, NX) for all components used in the fit
+
+        Notes:
+        ------
+        The pseudo-inverse (for `lstsq`) or Gram matrix (for `nnls`) of the
+        transfer matrix is computed once, and all pixels in a chunk are
+        solved together.  At most 2*nworkers chunks are held in memory.
         """
         method, scale = self._prep_decompose(scale, pixel_time, method)
         ny, nx, nchan = map.shape
@@ -735,39 +891,34 @@ class XRFFitResult(Group):
         win = self.fit_window[w0:w1]
         result = np.zeros((ny, nx, ncomps), dtype='float32')
 
-        def decomp_lstsq(i0, i1):
-            """very efficient lstsq"""
-            tmap = map[i0:i1, :, w0:w1].swapaxes(1, 2)
-            ny = tmap.shape[0]
-            win.shape = (win.shape[0], 1)
-            for iy in range(ny):
-                results = lstsq(xfer, win*tmap[iy])
-                for i in range(ncomps):
-                    result[i0+iy,:,i] = results[0][i] * scale
-
-        def decomp_nnls(i0, i1):
-            """need to explicitly loop of nx as well as ny"""
-            tmap = map[i0:i1, :, w0:w1]
-            ny = tmap.shape[0]
-            for iy in range(ny):
-                for ix in range(nx):
-                    results = nnls(xfer, win*tmap[iy,ix,:])
-                    for i in range(ncomps):
-                        result[i0+iy,ix,i] = results[0][i] * scale
-
-        decomp = decomp_lstsq
         if method == nnls:
-            decomp = decomp_nnls
-        # if we're going to use up more than ~1Gb per lstsq, do it in chunks
-        if (ny*nx*(w1-w0) > 1e8):
-            nchunks = 1+int(1.e-8*ny*nx*(w1-w0))
-            ns = int(ny/nchunks)
-            for i in range(nchunks):
-                ilast = (i+1)*ns
-                if i == nchunks-1: ilast = ny
-                decomp(i*ns, ilast)
+            gram = xfer.T @ xfer
         else:
-            decomp(0, ny)
+            pinv = np.linalg.pinv(xfer).T * (scale*win[:, np.newaxis])
+
+        def decomp(i0, tmap):
+            "decompose a chunk of rows, starting at row i0"
+            nrows = tmap.shape[0]
+            tmap = tmap.reshape((nrows*nx, w1-w0))
+            if method == nnls:
+                weights = scale*nnls_batch(xfer, tmap*win, gram=gram)
+            else:
+                weights = tmap @ pinv
+            result[i0:i0+nrows] = weights.reshape((nrows, nx, ncomps))
+
+        if chunk_size is None:
+            chunk_size = int(4.e6/(nx*(w1-w0)))
+        chunk_size = max(1, min(ny, chunk_size))
+        nworkers = max(1, nworkers)
+        with ThreadPoolExecutor(max_workers=nworkers) as pool:
+            pending = []
+            for i0 in range(0, ny, chunk_size):
+                if len(pending) >= 2*nworkers:
+                    pending.pop(0).result()
+                tmap = np.asarray(map[i0:i0+chunk_size, :, w0:w1], dtype='float64')
+                pending.append(pool.submit(decomp, i0, tmap))
+            for job in pending:
+                job.result()
         return {name: result[:,:,i] for i, name in enumerate(self.eigenvalues.keys())}
 
 def xrf_model(xray_energy=None, energy_min=1500, energy_max=None, use_bgr=False, **kws):
@@ -9,6 +9,7 @@ import scipy.stats as stats
 import json
 import multiprocessing as mp
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 from pyshortcuts import fix_varname, fix_filename, bytes2str
 
@@ -42,6 +43,7 @@ EXTRA_DETGROUPS =  ('scalars', 'work', 'xrd1d', 'xrd2d')
 NOT_OWNER = "Not Owner of HDF5 file %s"
 READ_ONLY = "HDF5 file %s is open read-only"
 QSTEPS = 2048
+ROI_INDEX_BINSIZE = 16
 
 H5ATTRS = {'Type': 'XRM 2D Map',
            'Version': '2.1.0',
@@ -197,6 +199,31 @@ def remove_zigzag(map, zigzag=0):
     return tmp
 
 
+def roi_index_edges(nchan, binsize=ROI_INDEX_BINSIZE):
+    """channel edges of an ROI index: every `binsize` channels, and `nchan`.
+    The ROI index holds the summed counts below each of these edges"""
+    return np.array(list(range(binsize, nchan, binsize)) + [nchan])
+
+def calc_roi_index(counts, edges):
+    """ROI index (cumulative counts at `edges`) for counts with
+    channels along the last axis"""
+    dtype = np.float64 if counts.dtype.kind == 'f' else np.uint64
+    return np.cumsum(counts, axis=-1, dtype=dtype)[..., edges-1]
+
+def calc_roi_sums(counts, cmin, cmax):
+    """summed counts for channels cmin[i] to cmax[i]-1 of many ROIs at once,
+    for counts with channels along the last axis.  The ROIs are along
+    the last axis of the result"""
+    dtype = np.float64 if counts.dtype.kind == 'f' else np.uint64
+    csum = np.zeros(counts.shape[:-1] + (counts.shape[-1]+1,), dtype=dtype)
+    np.cumsum(counts, axis=-1, dtype=dtype, out=csum[..., 1:])
+    return csum[..., cmax] - csum[..., cmin]
+
+def read_maprow(args, kws):
+    """read and process one row of raw map data, as GSEXRM_MapRow(*args, **kws),
+    with arguments from GSEXRM_MapFile.rowdata_args()"""
+    return GSEXRM_MapRow(*args, **kws)
+
 class GSEXRM_MapFile(object):
     '''
     Access to GSECARS X-ray Microprobe Map File:
@@ -227,6 +254,11 @@ class GSEXRM_MapFile(object):
                     None means to use the sum of all detectors
        dtcorrect:   whether to return dead-time corrected spectra     [True]
 
+    With roi_index=True (or a bin size in channels), an ROI index of the
+    summed counts at every `binsize` channels is stored for each detector
+    as rows are added, so that maps for new ROIs (see add_xrfroi) can be
+    made without reading the full XRF spectra.  Use build_roi_index() to
+    add an ROI index to an existing map file.
     '''
 
     ScanFile   = 'Scan.ini'
@@ -242,7 +274,7 @@ class GSEXRM_MapFile(object):
                  bkgdscale=1., has_xrf=True, has_xrd1d=False, has_xrd2d=False,
                  compression=COMPRESSION, compression_opts=COMPRESSION_OPTS,
                  facility='APS', beamline='13-ID-E', run='', proposal='',
-                 user='', scandb=None, all_mcas=False, **kws):
+                 user='', scandb=None, all_mcas=False, roi_index=False, **kws):
 
         self.filename      = filename
         self.folder        = folder
@@ -267,10 +299,12 @@ class GSEXRM_MapFile(object):
         self.rowdata       = []
         self.roi_names     = {}
         self.roi_slices    = None
+        self.area_sums     = {}
         self._pixeltime    = None
         self.masterfile    = None
         self.force_no_dtc  = False
         self.all_mcas      = all_mcas
+        self.roi_index     = roi_index
         self.detector_list = None
 
         self.compress_args = {'compression': compression}
@@ -733,6 +767,14 @@ class GSEXRM_MapFile(object):
     def process_row(self, irow, flush=False, complete=False, offset=None,
                     nrows_expected=None, callback=None):
         row = self.read_rowdata(irow, offset=offset)
+        if row is None:
+            return
+        self.store_row(irow, row, flush=flush, complete=complete,
+                       nrows_expected=nrows_expected, callback=callback)
+
+    def store_row(self, irow, row, flush=False, complete=False,
+                  nrows_expected=None, callback=None):
+        "add a row read with read_rowdata() to the HDF5 file"
         if irow == 0:
             nmca, nchan = 0, 2048
             if row.counts is not None:
@@ -761,7 +803,16 @@ class GSEXRM_MapFile(object):
 
     def process(self, maxrow=None, force=False, callback=None, offset=None,
                 force_no_dtc=False, all_mcas=None):
-        "look for more data from raw folder, process if needed"
+        """look for more data from raw folder, process if needed
+
+        Arguments:
+          maxrow       maximum number of rows to process [None, all rows]
+          force        whether to force re-reading the Master file [False]
+          callback     function to call for each row and on completion [None]
+          offset       offset of raw data from positions [None]
+          force_no_dtc whether to ignore deadtime correction [False]
+          all_mcas     whether to save data for each MCA [None]
+        """
         self.force_no_dtc = force_no_dtc
         if all_mcas is not None:
             self.all_mcas = all_mcas
@@ -853,6 +904,15 @@ class GSEXRM_MapFile(object):
         '''read a row worth of raw data from the Map Folder
         returns arrays of data
         '''
+        args = self.rowdata_args(irow, offset=offset)
+        if args is None:
+            return
+        return read_maprow(*args)
+
+    def rowdata_args(self, irow, offset=None):
+        '''arguments (args, kws) for GSEXRM_MapRow to read a row
+        worth of raw data from the Map Folder
+        '''
         if self.dimension is None or irow > len(self.rowdata):
             self.read_master()
 
@@ -913,20 +973,20 @@ class GSEXRM_MapFile(object):
         if offset is not None:
             ioffset = offset
         self.has_xrf = self.has_xrf and xrff != '_unused_'
-        return GSEXRM_MapRow(yval, xrff, xrdf, xpsf, sisf, self.folder,
-                             irow=irow, nrows_expected=self.nrows_expected,
-                             ixaddr=0, dimension=self.dimension,
-                             npts=self.npts,
-                             reverse=reverse,
-                             ioffset=ioffset,
-                             force_no_dtc=self.force_no_dtc,
-                             masterfile=self.masterfile, flip=self.flip,
-                             xrdcal=self.xrdcalfile,
-                             xrd2dmask=self.mask_xrd2d,
-                             xrd2dbkgd=self.bkgd_xrd2d, wdg=self.azwdgs,
-                             steps=self.qstps, has_xrf=self.has_xrf,
-                             has_xrd2d=self.has_xrd2d,
-                             has_xrd1d=self.has_xrd1d)
+        return ((yval, xrff, xrdf, xpsf, sisf, self.folder),
+                dict(irow=irow, nrows_expected=self.nrows_expected,
+                     ixaddr=0, dimension=self.dimension,
+                     npts=self.npts,
+                     reverse=reverse,
+                     ioffset=ioffset,
+                     force_no_dtc=self.force_no_dtc,
+                     masterfile=self.masterfile, flip=self.flip,
+                     xrdcal=self.xrdcalfile,
+                     xrd2dmask=self.mask_xrd2d,
+                     xrd2dbkgd=self.bkgd_xrd2d, wdg=self.azwdgs,
+                     steps=self.qstps, has_xrf=self.has_xrf,
+                     has_xrd2d=self.has_xrd2d,
+                     has_xrd1d=self.has_xrd1d))
 
 
     def add_rowdata(self, row, callback=None, flush=True):
@@ -996,6 +1056,8 @@ class GSEXRM_MapFile(object):
                     for idet, gname in enumerate(mca_dets):
                         grp = self.xrmmap[gname]
                         grp['counts'][thisrow, :npts, :] = row.counts[idet, :npts, :]
+                        if 'roi_index' in grp:
+                            self.add_roi_index_row(grp, thisrow, row.counts[idet, :npts, :])
                         grp['dtfactor'][thisrow,  :npts] = row.dtfactor[idet, :npts]
                         grp['realtime'][thisrow,  :npts] = row.realtime[idet, :npts]
                         grp['livetime'][thisrow,  :npts] = row.livetime[idet, :npts]
@@ -1020,6 +1082,8 @@ class GSEXRM_MapFile(object):
 
                 sumgrp = self.xrmmap['mcasum']
                 sumgrp['counts'][thisrow, :npts, :nchan] = row.total[:npts, :nchan]
+                if 'roi_index' in sumgrp:
+                    self.add_roi_index_row(sumgrp, thisrow, row.total[:npts, :nchan])
                 # dt.add(" map xrf 4b: set counts")
                 # print("add realtime ", sumgrp['realtime'].shape, self.xrmmap['roimap/det_raw'].shape, thisrow)
                 sumgrp['realtime'][thisrow,  :npts] = realtime
@@ -1302,6 +1366,8 @@ class GSEXRM_MapFile(object):
                     dgrp.create_dataset('counts', (NSTART, npts, nchan), np.uint32,
                                         chunks=self.chunksize,
                                         maxshape=(None, npts, nchan), **self.compress_args)
+                    if self.roi_index:
+                        self.create_roi_index(dgrp, nrows=NSTART)
 
                     for name, dtype in (('realtime',  np.int64),
                                         ('livetime',  np.int64),
@@ -1343,6 +1409,8 @@ class GSEXRM_MapFile(object):
             dgrp.create_dataset('counts', (NSTART, npts, nchan), np.float64,
                                 chunks=self.chunksize,
                                 maxshape=(None, npts, nchan), **self.compress_args)
+            if self.roi_index:
+                self.create_roi_index(dgrp, nrows=NSTART)
 
             for name, dtype in (('realtime',  np.int64),
                                 ('livetime',  np.int64),
@@ -1789,9 +1857,15 @@ class GSEXRM_MapFile(object):
                         for aname in ('livetime', 'realtime',
                                       'inpcounts', 'outcounts', 'dtfactor'):
                             g[aname].resize((nrow, npts))
+                        if 'roi_index' in g:
+                            oldnrow, npts, nedges = g['roi_index'].shape
+                            g['roi_index'].resize((nrow, npts, nedges))
                     elif type_attr.startswith('virtual mca'):
                         oldnrow, npts, nchan = g['counts'].shape
                         g['counts'].resize((nrow, npts, nchan))
+                        if 'roi_index' in g:
+                            oldnrow, npts, nedges = g['roi_index'].shape
+                            g['roi_index'].resize((nrow, npts, nedges))
                         for aname in ('livetime', 'realtime',
                                       'inpcounts', 'outcounts', 'dtfactor'):
                             if aname in g:
@@ -2534,7 +2608,86 @@ class GSEXRM_MapFile(object):
             counts = counts*mapdat['dtfactor'][sy, sx].reshape(ny, nx, 1)
         return counts
 
-    def get_mca_area(self, areaname, det=None, dtcorrect=None):
+    def sum_area_counts(self, area, det=None, dtcorrect=None, nworkers=0):
+        '''sum XRF counts, live time and real time over the pixels of an area
+
+        Parameters
+        ---------
+        area :       ndarray   boolean mask, the same shape as the map
+        det :        optional, None or int         index of detector
+        dtcorrect :  optional, bool [None]         dead-time correct data
+        nworkers :   optional, int [0]             number of threads for summing
+
+        Returns
+        -------
+        counts, livetime, realtime summed over area (times in seconds)
+
+        Notes
+        -----
+        counts are read one HDF5 chunk of rows at a time, and only for the
+        rows with pixels in the area, and the columns spanning those pixels.
+        With nworkers > 0, the blocks of rows read are summed by a pool of
+        threads while the next blocks are read.
+        '''
+        if dtcorrect is None:
+            dtcorrect = self.dtcorrect
+        mapdat = self.get_detgroup(det)
+        if 'counts' not in mapdat:
+            mapdat = self.get_detgroup(None)
+        tgroup = self.get_detgroup(det)
+        counts = mapdat['counts']
+        nrows, npts, nchan = counts.shape[0], counts.shape[1], counts.shape[-1]
+        area = np.asarray(area, dtype=bool)[:nrows, :npts]
+        use_dt = dtcorrect and 'dtfactor' in mapdat
+        has_times = 'livetime' in tgroup
+        nblock = 1 if counts.chunks is None else counts.chunks[0]
+        rows = np.where(area.any(axis=1))[0]
+
+        def read_block(r0):
+            mask = area[r0:r0+nblock]
+            cols = np.where(mask.any(axis=0))[0]
+            sx, sy = slice(cols[0], cols[-1]+1), slice(r0, r0+len(mask))
+            mask = mask[:, sx]
+            dtf = mapdat['dtfactor'][sy, sx][mask] if use_dt else None
+            times = None
+            if has_times:
+                times = (tgroup['livetime'][sy, sx][mask].sum(),
+                         tgroup['realtime'][sy, sx][mask].sum())
+            return counts[sy, sx], mask, dtf, times
+
+        def sum_block(block, mask, dtf):
+            spectra = block[mask]
+            if dtf is not None:
+                spectra = spectra*dtf.reshape((len(dtf),) + (1,)*(spectra.ndim-1))
+            return spectra.reshape(-1, nchan).sum(axis=0)
+
+        total, ltime, rtime = 0, 0, 0
+        pending = []
+        pool = ThreadPoolExecutor(max_workers=nworkers) if nworkers > 0 else None
+        for r0 in sorted(set(nblock*(rows//nblock))):
+            block, mask, dtf, times = read_block(r0)
+            if times is not None:
+                ltime, rtime = ltime + times[0], rtime + times[1]
+            if pool is None:
+                total = total + sum_block(block, mask, dtf)
+            else:
+                if len(pending) >= 2*nworkers:
+                    total = total + pending.pop(0).result()
+                pending.append(pool.submit(sum_block, block, mask, dtf))
+        for job in pending:
+            total = total + job.result()
+        if pool is not None:
+            pool.shutdown()
+
+        if has_times:
+            ltime, rtime = 1.e-6*ltime, 1.e-6*rtime
+        else:
+            ltime = rtime = self.pixeltime*area.sum()
+        if isinstance(total, int):
+            total = np.zeros(nchan)
+        return total, ltime, rtime
+
+    def get_mca_area(self, areaname, det=None, dtcorrect=None, nworkers=0):
         '''return XRF spectra as MCA() instance for
         spectra summed over a pre-defined area
 
@@ -2542,11 +2695,16 @@ class GSEXRM_MapFile(object):
         ---------
         areaname :   str       name of area
         dtcorrect :  optional, bool [None]       dead-time correct data
+        nworkers :   optional, int [0]           number of threads for summing
 
         Returns
         -------
         MCA object for XRF counts in area
 
+        Notes
+        -----
+        spectra are summed with sum_area_counts(), and kept for each area,
+        detector, and dtcorrect, until the area changes or rows are added.
         '''
         try:
             area = self.get_area(areaname)[()]
@@ -2559,19 +2717,17 @@ class GSEXRM_MapFile(object):
             return None
 
         dgroup = self.get_detname(det)
-
-        # first get data for bounding rectangle
-        _ay, _ax = np.where(area)
-        ymin, ymax, xmin, xmax = _ay.min(), _ay.max()+1, _ax.min(), _ax.max()+1
-        opts = {'dtcorrect': dtcorrect, 'det': det}
-        counts = self.get_counts_rect(ymin, ymax, xmin, xmax, **opts)
-        ltime, rtime = self.get_livereal_rect(ymin, ymax, xmin, xmax, **opts)
-        ltime = ltime[area[ymin:ymax, xmin:xmax]].sum()
-        rtime = rtime[area[ymin:ymax, xmin:xmax]].sum()
-        counts = counts[area[ymin:ymax, xmin:xmax]]
-        while(len(counts.shape) > 1):
-            counts = counts.sum(axis=0)
-        return self._getmca(dgroup, counts, areaname, npixels=npixels,
+        key = (areaname, dgroup, bool(dtcorrect))
+        last_row = int(self.xrmmap.attrs.get('Last_Row', self.last_row))
+        cached = self.area_sums.get(key, None)
+        if (cached is not None and cached[0] == last_row and
+            np.array_equal(cached[1], area)):
+            counts, ltime, rtime = cached[2]
+        else:
+            counts, ltime, rtime = self.sum_area_counts(area, det=det, dtcorrect=dtcorrect,
+                                                        nworkers=nworkers)
+            self.area_sums[key] = (last_row, area, (counts, ltime, rtime))
+        return self._getmca(dgroup, counts.copy(), areaname, npixels=npixels,
                             real_time=rtime, live_time=ltime)
 
     def get_mca_rect(self, ymin, ymax, xmin, xmax, det=None, dtcorrect=None):
@@ -2596,17 +2752,14 @@ class GSEXRM_MapFile(object):
         dgroup = self.get_detname(det)
         mapdat = self.get_detgroup(det)
         if 'counts' not in mapdat:
-            mapdat = self.get_detgroup(None)
             dgroup = self.get_detname(None)
-        counts = self.get_counts_rect(ymin, ymax, xmin, xmax, mapdat=mapdat,
-                                      det=det, dtcorrect=dtcorrect)
+        area = np.zeros(self.get_shape(), dtype=bool)
+        area[ymin:ymax, xmin:xmax] = True
+        counts, ltime, rtime = self.sum_area_counts(area, det=det, dtcorrect=dtcorrect)
         name = 'rect(y=[%i:%i], x==[%i:%i])' % (ymin, ymax, xmin, xmax)
         npix = (ymax-ymin+1)*(xmax-xmin+1)
-        ltime, rtime = self.get_livereal_rect(ymin, ymax, xmin, xmax, det=det,
-                                              dtcorrect=dtcorrect)
-        counts = counts.sum(axis=0).sum(axis=0)
         return self._getmca(dgroup, counts, name, npixels=npix,
-                            real_time=rtime.sum(), live_time=ltime.sum())
+                            real_time=rtime, live_time=ltime)
 
 
     def get_livereal_rect(self, ymin, ymax, xmin, xmax, det=None, **kws):
@@ -3017,7 +3170,7 @@ class GSEXRM_MapFile(object):
             self.h5root.flush()
 
 
-    def save_roi(self, roiname, det, raw, cor, drange, dtype, units):
+    def save_roi(self, roiname, det, raw, cor, drange, dtype, units, flush=True):
         ds = ensure_subgroup(roiname, self.xrmmap['roimap'][det])
         ds.create_dataset('raw',    data=raw   )
         ds.create_dataset('cor',    data=cor   )
@@ -3025,7 +3178,8 @@ class GSEXRM_MapFile(object):
         ds['limits'].attrs['type']  = dtype
         ds['limits'].attrs['units'] = units
 
-        self.h5root.flush()
+        if flush:
+            self.h5root.flush()
 
     def build_mca_roimap(self):
         det_list = []
@@ -3044,7 +3198,125 @@ class GSEXRM_MapFile(object):
 
         return roigroup, det_list, sumdet
 
+    def create_roi_index(self, dgrp, nrows=None, binsize=None):
+        """create an empty ROI index for the counts of an MCA detector group,
+        holding the summed counts at every `binsize` channels"""
+        if binsize is None:
+            binsize = self.roi_index
+        if binsize is True or not binsize:
+            binsize = ROI_INDEX_BINSIZE
+        _nrows, npts, nchan = dgrp['counts'].shape
+        if nrows is None:
+            nrows = _nrows
+        nedges = len(roi_index_edges(nchan, binsize))
+        dtype = np.float64 if dgrp['counts'].dtype.kind == 'f' else np.uint64
+        if 'roi_index' in dgrp:
+            del dgrp['roi_index']
+        index = dgrp.create_dataset('roi_index', (nrows, npts, nedges), dtype,
+                                    chunks=(1, npts, nedges),
+                                    maxshape=(None, npts, nedges), **self.compress_args)
+        index.attrs['binsize'] = binsize
+        return index
+
+    def add_roi_index_row(self, dgrp, irow, counts):
+        "add ROI index for one row of counts"
+        index = dgrp['roi_index']
+        _nrows, npts, nedges = index.shape
+        nchan = counts.shape[-1]
+        edges = roi_index_edges(nchan, int(index.attrs['binsize']))
+        index[irow, :len(counts), :] = calc_roi_index(counts, edges)
+
+    def build_roi_index(self, binsize=ROI_INDEX_BINSIZE, nrows_block=None):
+        """build ROI index for all MCA detectors in the map file, replacing
+        any existing index.  The index is then updated as rows are added.
+
+        Arguments:
+          binsize      number of channels per bin of the ROI index [16]
+          nrows_block  number of rows of counts to read at a time [None]
+        """
+        if not self.check_hostid():
+            raise GSEXRM_Exception(NOT_OWNER % self.filename)
+        if not self.write_access:
+            raise GSEXRM_Exception(READ_ONLY % self.filename)
+        if not version_ge(self.version, '2.0.0'):
+            raise GSEXRM_Exception("ROI index needs map file version 2.0 or higher")
+
+        roigroup, det_list, sumdet  = self.build_mca_roimap()
+        if sumdet is not None and sumdet not in det_list:
+            det_list.append(sumdet)
+        for det in det_list:
+            dgrp = self.xrmmap[det]
+            nrows, npts, nchan = dgrp['counts'].shape
+            index = self.create_roi_index(dgrp, binsize=binsize)
+            edges = roi_index_edges(nchan, binsize)
+            nblock = nrows_block
+            if nblock is None:
+                nblock = max(1, 2**26//(8*npts*nchan))
+            for r0 in range(0, nrows, nblock):
+                r1 = min(nrows, r0+nblock)
+                index[r0:r1] = calc_roi_index(dgrp['counts'][r0:r1], edges)
+        self.roi_index = binsize
+        self.h5root.flush()
+
+    def calc_roi_counts(self, det, cmin, cmax, exact=True):
+        """map of summed counts for an MCA detector for channels cmin to cmax-1
+
+        Arguments:
+          det     name of detector group ('mca1', ..., 'mcasum')
+          cmin    first channel
+          cmax    last channel + 1
+          exact   whether to read counts for channels not on the bin edges
+                  of the ROI index, or to use the nearest bin edges [True]
+
+        Notes:
+          with an ROI index (see build_roi_index), only the counts for the
+          channels between cmin or cmax and the nearest bin edges inside
+          (cmin, cmax) are read, and none are read if exact is False.
+          Without an ROI index, all counts for cmin to cmax-1 are read.
+        """
+        dgrp = self.xrmmap[det]
+        counts = dgrp['counts']
+        nrows, npts, nchan = counts.shape[0], counts.shape[1], counts.shape[-1]
+        cmin, cmax = max(0, int(cmin)), min(nchan, int(cmax))
+        if 'roi_index' not in dgrp:
+            return counts[:, :, cmin:cmax].sum(axis=2)
+
+        index = dgrp['roi_index']
+        edges = np.concatenate(([0], roi_index_edges(nchan, int(index.attrs['binsize']))))
+        if exact:
+            ilo = np.searchsorted(edges, cmin)
+            ihi = max(ilo, np.searchsorted(edges, cmax, side='right') - 1)
+        else:
+            ilo = np.abs(edges-cmin).argmin()
+            ihi = max(ilo, np.abs(edges-cmax).argmin())
+
+        out = np.zeros((nrows, npts), dtype=index.dtype)
+        if ihi > ilo:
+            out += index[:, :, ihi-1]
+            if ilo > 0:
+                out -= index[:, :, ilo-1]
+        chans = []
+        if exact:
+            if ihi > ilo:
+                chans = list(range(cmin, edges[ilo])) + list(range(edges[ihi], cmax))
+            else:
+                chans = list(range(cmin, cmax))
+        if len(chans) > 0:
+            out += counts[:, :, chans].sum(axis=2, dtype=index.dtype)
+        return out
+
     def add_xrfroi(self, roiname, Erange, unit='keV'):
+        """add an XRF ROI for all MCA detectors, by energy range
+
+        Arguments:
+          roiname   name of ROI
+          Erange    energy range (or channel range, see unit)
+          unit      'keV', 'eV', or 'channels' ['keV']
+
+        Notes:
+          the ROI maps are made with calc_roi_counts(), using the ROI
+          index for each detector if available.
+        """
         if not self.has_xrf:
             return
 
@@ -3060,17 +3332,96 @@ class GSEXRM_MapFile(object):
                 print(f"ROI '{roiname:s}' exists for detector '{det:s}'.  Delete before adding")
                 continue
             mapdat = self.xrmmap[det]
-            if unit.startswith('chan'):
-                emin, emax = Erange
-            else:
-                en  = mapdat['energy'][:]
-                emin = (np.abs(en-Erange[0])).argmin()
-                emax = (np.abs(en-Erange[1])).argmin()+1
-            raw = mapdat['counts'][:, :, emin:emax].sum(axis=2)
+            emin, emax = self.get_roi_channels(det, Erange, unit=unit)
+            raw = self.calc_roi_counts(det, emin, emax)
             cor = raw * mapdat['dtfactor']
             self.save_roi(roiname, det, raw, cor, Erange, 'energy', unit)
         self.get_roi_list('mcasum', force=True)
 
+    def get_roi_channels(self, det, Erange, unit='keV'):
+        "channel range (first, last+1) for an energy range (in keV) or channel range"
+        if unit.startswith('chan'):
+            return int(Erange[0]), int(Erange[1])
+        en  = self.xrmmap[det]['energy'][:]
+        emin = (np.abs(en-Erange[0])).argmin()
+        emax = (np.abs(en-Erange[1])).argmin()+1
+        return emin, emax
+
+    def add_xrfrois(self, rois, unit='keV', nworkers=None, nrows_block=None):
+        """add many XRF ROIs for all MCA detectors at once, by energy range
+
+        Arguments:
+          rois         dict of {roiname: Erange}, or list of (roiname, Erange)
+          unit         'keV', 'eV', or 'channels' ['keV']
+          nworkers     number of threads, each summing one detector at a time
+                       [None, one thread per detector]
+          nrows_block  number of rows of counts to read at a time [None]
+
+        Notes:
+          the counts for each detector are read only once, in blocks of rows,
+          with the counts for all ROIs summed together for each block (see
+          calc_roi_sums).  Detectors are summed in parallel threads, and
+          all ROI maps are written after all the sums are done.  ROIs that
+          already exist for a detector are skipped.
+        """
+        if not self.has_xrf:
+            return
+        rois = dict(rois)
+        if unit == 'eV':
+            rois = {name: [x/1000. for x in Erange] for name, Erange in rois.items()}
+
+        roigroup, det_list, sumdet  = self.build_mca_roimap()
+        if sumdet not in det_list:
+            det_list.append(sumdet)
+
+        tasks = {}
+        for det in det_list:
+            names, cmin, cmax = [], [], []
+            for roiname, Erange in rois.items():
+                if roiname in self.xrmmap['roimap'][det]:
+                    print(f"ROI '{roiname:s}' exists for detector '{det:s}'.  Delete before adding")
+                    continue
+                emin, emax = self.get_roi_channels(det, Erange, unit=unit)
+                names.append(roiname)
+                cmin.append(emin)
+                cmax.append(emax)
+            if len(names) > 0:
+                tasks[det] = (names, np.array(cmin), np.array(cmax))
+
+        def sum_rois(det):
+            names, cmin, cmax = tasks[det]
+            counts = self.xrmmap[det]['counts']
+            nrows, npts, nchan = counts.shape[0], counts.shape[1], counts.shape[-1]
+            cmin, cmax = np.clip(cmin, 0, nchan), np.clip(cmax, 0, nchan)
+            cmax = np.maximum(cmin, cmax)
+            nblock = nrows_block
+            if nblock is None:
+                nblock = max(1, 2**26//(8*npts*nchan))
+            out = None
+            for r0 in range(0, nrows, nblock):
+                sums = calc_roi_sums(counts[r0:r0+nblock], cmin, cmax)
+                if out is None:
+                    out = np.zeros((nrows, npts, len(names)), dtype=sums.dtype)
+                out[r0:r0+len(sums)] = sums
+            return out
+
+        if nworkers is None:
+            nworkers = len(tasks)
+        if nworkers > 1 and len(tasks) > 1:
+            with ThreadPoolExecutor(max_workers=nworkers) as pool:
+                results = dict(zip(tasks, pool.map(sum_rois, tasks)))
+        else:
+            results = {det: sum_rois(det) for det in tasks}
+
+        for det, (names, cmin, cmax) in tasks.items():
+            dtfactor = self.xrmmap[det]['dtfactor'][()]
+            for i, roiname in enumerate(names):
+                raw = results[det][:, :, i]
+                self.save_roi(roiname, det, raw, raw*dtfactor, rois[roiname],
+                              'energy', unit, flush=False)
+        self.h5root.flush()
+        self.get_roi_list('mcasum', force=True)
+
     def del_xrfroi(self, roiname):
         roigroup, det_list, sumdet  = self.build_mca_roimap()
         if sumdet not in det_list:
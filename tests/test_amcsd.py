@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+""" Tests of AMCSD structure factors, using a small database
+made from example CIF files """
+import json
+from pathlib import Path
+import numpy as np
+
+from xraydb import f0
+from larch.xrd.amcsd import AMCSD, unpack_hkl_degen
+from larch.xrd.amcsd_utils import create_amcsd, encode_farray
+from larch.utils.physical_constants import TAU
+
+cifdir = Path(__file__).parent.parent / 'examples' / 'structuredata'
+CIFFILES = ('struct2xas/ZnO_mp-2133.cif', 'struct2xas/ZnO_mp-997630.cif')
+ELEMS = ('O', 'Si', 'Fe', 'Mg', 'Al', 'Ca', 'S', 'Cu')
+
+def make_db(folder):
+    dbname = str(Path(folder, 'amcsd_test.db'))
+    create_amcsd(dbname)
+    db = AMCSD(dbname)
+    ids = [db.add_ciffile(str(cifdir / fname)) for fname in CIFFILES]
+    return db, ids
+
+def loop_f2(cif, hkls, qhkls):
+    "F*F' without resonant corrections, summing over sites one at a time"
+    sites = cif.get_sites()
+    f2 = np.zeros(len(hkls))
+    for i, hkl in enumerate(hkls):
+        fsum = 0.
+        for elem, elem_sites in sites.items():
+            fval = f0(elem, qhkls[i]/(2*TAU))[0]
+            for occu, fcoord in elem_sites:
+                fsum += fval*occu*np.exp(1j*TAU*(np.array(fcoord)*hkl).sum())
+        f2[i] = (fsum*fsum.conjugate()).real
+    return f2
+
+def test_structure_factors(tmp_path):
+    db, ids = make_db(tmp_path)
+
+    # reading structure factors does not write to a read-only database
+    rodb = AMCSD(db.dbname, read_only=True)
+    assert rodb.get_cif(ids[0]).get_structure_factors() is not None
+    assert db.get_cif(ids[0]).hkls is None
+    for cid in ids:
+        cif = db.get_cif(cid)
+        hkls, degen = cif.find_hkls(nmax=64, qmax=10)
+        assert len(hkls) == len(degen) and degen.min() >= 1
+        sfact = cif.get_structure_factors()
+        hkls, qhkls = sfact.hkl[:20], sfact.q[:20]
+        np.testing.assert_allclose(cif.calculate_f2(hkls, qhkls=qhkls),
+                                   loop_f2(cif, hkls, qhkls), rtol=1.e-10)
+
+        # reloaded CIF uses cached hkls and site factors
+        cached = db.get_cif(cid)
+        assert cached.hkls is not None and cached.sfactors is not None
+        sfact0 = cif.get_structure_factors(wavelength=1.0)
+        sfact1 = cached.get_structure_factors(wavelength=1.0)
+        assert cached.pmg_pstruct is None
+        np.testing.assert_allclose(sfact1.q, sfact0.q, rtol=1.e-12)
+        np.testing.assert_allclose(sfact1.intensity, sfact0.intensity, rtol=1.e-12)
+
+    batch = db.get_structure_factors(ids, wavelength=1.0)
+    for cid, sfact in zip(ids, batch):
+        one = db.get_cif(cid).get_structure_factors(wavelength=1.0)
+        np.testing.assert_allclose(sfact.intensity, one.intensity, rtol=1.e-12)
+        hkls, degen = unpack_hkl_degen(db.get_cif(cid).hkls)
+        assert sorted(degen) == sorted(sfact.degen)
+
+    # site factors are only saved explicitly
+    for cid in ids:
+        db.set_sfactors(cid, None)
+        assert db.get_cif(cid).get_structure_factors() is not None
+        assert db.get_cif(cid).sfactors is None
+    assert rodb.build_sfactors() == 0
+    assert db.build_sfactors() == len(ids)
+    assert db.build_sfactors() == 0
+    for cid, sfact in zip(ids, batch):
+        cached = db.get_cif(cid)
+        assert cached.sfactors is not None
+        np.testing.assert_allclose(cached.get_structure_factors(wavelength=1.0).intensity,
+                                   sfact.intensity, rtol=1.e-12)
+
+def make_synthetic_db(folder, ncifs=120):
+    "database of CIF entries with random formulas, minerals and publications"
+    dbname = str(Path(folder, 'amcsd_find.db'))
+    create_amcsd(dbname)
+    db = AMCSD(dbname)
+    db.add_spacegroup('P 1', json.dumps(['x, y, z']))
+    for i in range(12):
+        db.insert('minerals', name=f'Mineral{i}ite')
+    for j in range(6):
+        db.add_publication(f'Journal {j%3}', 1990+j, [f'Author {j%2}'], volume=j)
+    rng = np.random.default_rng(3)
+    entries = {}
+    for k in range(ncifs):
+        elems = list(rng.choice(ELEMS, size=rng.integers(1, 4), replace=False))
+        formula = ' '.join(f'{e}2' for e in elems)
+        occ = encode_farray(['1.0', '0.5']) if k % 5 == 0 else '0'
+        db.add_cifdata(100000+k, 1 + k%12, 1 + k%6, 1, formula=formula,
+                       atoms_occupancy=occ)
+        entries[100000+k] = dict(elems=set(elems), mineral=f'Mineral{k%12}ite',
+                                 journal=f'Journal {(k%6)%3}',
+                                 author=f'Author {(k%6)%2}', full=(k%5 != 0))
+    return db, entries
+
+def test_find_cifs(tmp_path):
+    db, entries = make_synthetic_db(tmp_path)
+    checks = ((dict(mineral_name='mineral1*'),
+               lambda e: e['mineral'].startswith('Mineral1')),
+              (dict(mineral_name='Mineral3ite', author_name='author 1'),
+               lambda e: e['mineral'] == 'Mineral3ite' and e['author'] == 'Author 1'),
+              (dict(journal_name='journal 2', contains_elements=['O']),
+               lambda e: e['journal'] == 'Journal 2' and 'O' in e['elems']),
+              (dict(contains_elements=['Fe'], excludes_elements=['O', 'S']),
+               lambda e: 'Fe' in e['elems'] and not e['elems'] & {'O', 'S'}),
+              (dict(contains_elements=['O', 'Si'], strict_contains=True),
+               lambda e: e['elems'] <= {'O', 'Si'} and e['elems'] >= {'O', 'Si'}),
+              (dict(full_occupancy=True, excludes_elements=['Cu']),
+               lambda e: e['full'] and 'Cu' not in e['elems']),
+              (dict(contains_elements=['Xx']), lambda e: False))
+    for kws, test in checks:
+        expected = sorted(cid for cid, e in entries.items() if test(e))
+        assert db.find_cif_ids(**kws) == expected
+        cifs = db.find_cifs(**kws)
+        assert [c.ams_id for c in cifs] == expected
+
+    cif = db.find_cifs(mineral_name='Mineral5ite')[0]
+    assert cif.__dict__['_loaded'] is False
+    assert cif.get_mineralname() == 'Mineral5ite'
+    assert cif.__dict__['_loaded'] is False
+    assert cif.publication.journalname == entries[cif.ams_id]['journal']
+    assert cif.__dict__['_loaded'] is True
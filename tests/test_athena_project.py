@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+""" Tests of reading Athena project files from an index of groups, with
+deferred processing (run with `pytest -s` to see timings)
+"""
+import time
+from pathlib import Path
+import numpy as np
+import pytest
+
+from larch import Group
+from larch.io import read_ascii, read_athena, AthenaProject
+from larch.io.athena_project import AthenaDataGroup, parse_perlathena, _read_raw_athena
+
+datadir = Path(__file__).parent.parent / 'examples' / 'xafsdata'
+
+def make_project(fname, ngroups):
+    dat = read_ascii(datadir / 'fe2o3_rt1.xmu', labels='energy mu i0')
+    prj = AthenaProject(fname)
+    for i in range(ngroups):
+        prj.add_group(Group(energy=dat.energy, mu=dat.mu*(1+i/100), i0=dat.i0,
+                            label=f'sample_{i:03d}', filename=f'sample_{i:03d}'))
+    prj.save()
+
+def test_athena_index(tmp_path):
+    fname = str(tmp_path / 'samples.prj')
+    make_project(fname, 50)
+    prj = AthenaProject()
+    index = prj.index(fname)
+    assert [rec.groupname for rec in index] == [f'sample_{i:03d}' for i in range(50)]
+    assert prj.index(fname) is index
+
+    prj.read(fname, match='sample_01*')
+    assert list(prj.groups) == [f'sample_{i:03d}' for i in range(10, 20)]
+    assert len(prj.group_names) == 50
+    full = parse_perlathena(_read_raw_athena(fname), fname)
+    np.testing.assert_allclose(prj.groups['sample_012'].mu, full.sample_012.mu)
+
+    # deferred processing, and processing in worker processes
+    eager = read_athena(fname, match='sample_00?', do_bkg=True)
+    lazy = read_athena(fname, match='sample_00?', do_bkg=True, lazy=True)
+    pooled = read_athena(fname, match='sample_00?', do_bkg=True, nworkers=2)
+    for name, group in lazy.groups.items():
+        assert isinstance(group, AthenaDataGroup)
+        assert 'norm' not in group.__dict__ and 'chi' not in dir(group)
+        assert getattr(group, 'is_frozen', None) is None
+        assert 'norm' not in group.__dict__
+        np.testing.assert_allclose(group.chi, eager.groups[name].chi)
+        assert 'norm' in dir(group)
+        np.testing.assert_allclose(pooled.groups[name].norm, eager.groups[name].norm)
+
+def test_athena_lazy_errors():
+    fname = str(datadir / 'AthenaProjectFiles' / 'cuybco.prj')
+    with pytest.raises(AttributeError):
+        read_athena(fname, do_bkg=True)
+    lazy = read_athena(fname, do_bkg=True, lazy=True)
+    assert lazy.groups['cuybco_010'].chi.max() > 0
+    group = lazy.groups['cu010']
+    for i in range(2):
+        with pytest.raises(RuntimeError, match='processing Athena group failed'):
+            hasattr(group, 'norm')
+    assert getattr(group, 'is_frozen', False) is False
+    assert not hasattr(group, 'no_such_attribute')
+
+def test_athena_benchmark(tmp_path):
+    fname = str(tmp_path / 'many_samples.prj')
+    make_project(fname, 400)
+    t0 = time.monotonic()
+    full = read_athena(fname, do_preedge=False)
+    t1 = time.monotonic()
+    some = read_athena(fname, match='sample_01*')
+    t2 = time.monotonic()
+    lazy = read_athena(fname, lazy=True)
+    t3 = time.monotonic()
+    print(f"\n  read_athena 400 groups: {1.e3*(t1-t0):.2f} msec, 10 matching groups: "
+          f"{1.e3*(t2-t1):.2f} msec, lazy: {1.e3*(t3-t2):.2f} msec")
+    assert len(full.groups) == len(lazy.groups) == 400
+    assert len(some.groups) == 10
+    assert lazy.sample_399.e0 > 7000
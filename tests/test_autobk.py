@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+""" Tests of autobk background subtraction """
+from pathlib import Path
+from copy import deepcopy
+import numpy as np
+from scipy.interpolate import splrep
+from scipy.optimize import leastsq
+
+from larch.io import read_ascii, read_athena
+from larch.math import index_nearest, realimag
+from larch.xafs import pre_edge, autobk, autobk_batch
+from larch.xafs.autobk import spline_eval, AutobkModel
+from larch.xafs.xafsft import ftwindow, xftf_fast
+
+datadir = Path(__file__).parent.parent / 'examples' / 'xafsdata'
+
+def get_data():
+    dat = read_ascii(str(datadir / 'cu_metal_rt.xdi'))
+    dat.mu = dat.mutrans
+    pre_edge(dat)
+    return dat
+
+def test_autobk_operators():
+    dat = get_data()
+    autobk(dat, rbkg=1.0, kweight=2, clamp_lo=1, calc_uncertainties=True)
+    d = dat.autobk_details
+    kraw = d.kraw[:d.iemax-d.iek0+1]
+    mu = dat.mu[d.iek0:d.iemax+1]
+    bkg, chi = spline_eval(kraw, mu, d.knots, d.coefs, d.order, dat.k)
+    np.testing.assert_allclose(dat.bkg[d.iek0:d.iemax+1], bkg, rtol=0, atol=1.e-10)
+    np.testing.assert_allclose(dat.chi*dat.edge_step, chi, rtol=0, atol=1.e-10)
+    assert len(dat.delta_chi) == len(dat.chi)
+
+    model = AutobkModel(kraw, dat.k, d.knots, d.order, d.nspl,
+                        np.ones(len(dat.k)), d.irbkg, clamp_lo=1, clamp_hi=1)
+    model.set_data(mu)
+    coefs = d.coefs[:d.nspl]*1.01
+    jac = model.jacobian(coefs)
+    for i in range(d.nspl):
+        step = np.zeros(d.nspl)
+        step[i] = 1.e-6
+        dresid = (model.resid(coefs+step) - model.resid(coefs-step))/2.e-6
+        np.testing.assert_allclose(jac[:, i], dresid, rtol=1.e-5,
+                                   atol=1.e-6*abs(jac).max())
+
+def test_autobk_batch():
+    dat = get_data()
+    groups = []
+    for i in range(4):
+        grp = deepcopy(dat)
+        grp.mu = dat.mu * (1 + 0.01*i) + 1.e-4*np.sin(0.1*i*dat.energy)
+        grp.edge_step = dat.edge_step * (1 + 0.01*i)
+        groups.append(grp)
+    singles = deepcopy(groups)
+    autobk_batch(groups, rbkg=1.1, kweight=2)
+    for grp, one in zip(groups, singles):
+        autobk(one, rbkg=1.1, kweight=2)
+        np.testing.assert_allclose(grp.chi, one.chi, rtol=0, atol=1.e-12)
+        np.testing.assert_allclose(grp.bkg, one.bkg, rtol=0, atol=1.e-12)
+
+def baseline_autobk_chi(dat):
+    """chi(k) from the finite-difference fit of the spline coefficients,
+    evaluating the spline directly, as autobk did before AutobkModel"""
+    args, d = dat.callargs.autobk, dat.autobk_details
+    kraw = d.kraw[:d.iemax-d.iek0+1]
+    mu = dat.mu[d.iek0:d.iemax+1]
+    ftwin = dat.k**args['kweight'] * ftwindow(dat.k, xmin=d.kmin, xmax=d.kmax,
+                                              window=args['win'],
+                                              dx=args['dk'], dx2=args['dk'])
+    nclamp, clamp_lo, clamp_hi = args['nclamp'], args['clamp_lo'], args['clamp_hi']
+    spl_k = [d.kraw[index_nearest(d.kraw, d.kmin + i*(d.kmax-d.kmin)/(d.nspl-1))]
+             for i in range(d.nspl)]
+    knots, coefs, order = splrep(spl_k, d.init_knots_y, k=d.order)
+    coefs[d.nspl:] = coefs[d.nspl-1]
+
+    def resid(vcoefs):
+        _coefs = np.ones(len(coefs))*vcoefs[-1]
+        _coefs[:d.nspl] = vcoefs
+        chi = spline_eval(kraw, mu, knots, _coefs, order, dat.k)[1]
+        out = realimag(xftf_fast(chi*ftwin, nfft=args['nfft'])[:d.irbkg])
+        scale = 1.0 + 100*(out*out).mean()
+        return np.concatenate((out, abs(clamp_lo)*scale*chi[:nclamp],
+                               abs(clamp_hi)*scale*chi[-nclamp:]))
+
+    best = leastsq(resid, coefs[:d.nspl], maxfev=2000*(len(coefs)+1),
+                   gtol=0.0, ftol=1.e-6, xtol=1.e-6, epsfcn=1.e-6,
+                   factor=100)[0]
+    coefs[:d.nspl] = best
+    coefs[d.nspl:] = best[-1]
+    return spline_eval(kraw, mu, knots, coefs, order, dat.k)[1]/dat.edge_step
+
+def test_autobk_scorodite():
+    # on this spectrum the analytic Jacobian converges to a different
+    # minimum than the finite-difference fit, which is the default
+    prj = read_athena(str(datadir / 'AthenaProjectFiles' / 'AsScorodite.prj'),
+                      match='EHC3_a1_as_xafs_fluor2_003', do_bkg=True)
+    dat = prj.groups['EHC3_a1_as_xafs_fluor2_003']
+    chisqr = dat.autobk_details.chisqr
+    np.testing.assert_allclose(dat.chi, baseline_autobk_chi(dat), rtol=0,
+                               atol=1.e-8*abs(dat.chi).max())
+
+    kws = dict(dat.callargs.autobk)
+    kws['analytic_jacobian'] = True
+    autobk(dat, **kws)
+    assert dat.autobk_details.chisqr < chisqr
+    assert np.all(np.isfinite(dat.chi)) and abs(dat.chi).max() < 1.0
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+""" Tests of batch_import, reading data files with the import cache
+"""
+import time
+import shutil
+from pathlib import Path
+import numpy as np
+
+from larch.io import batch_import, find_datafiles, read_ascii, read_xdi
+
+datadir = Path(__file__).parent.parent / 'examples' / 'xafsdata'
+DATAFILES = ('cu_metal_rt.xdi', 'fe2o3_rt1.xmu', 'fe_athena.prj', 'pt_metal_rt.xdi')
+
+def test_batch_import(tmp_path):
+    folder = tmp_path / 'data'
+    folder.mkdir()
+    for fname in DATAFILES:
+        shutil.copy(datadir / fname, folder / fname)
+    cache_folder = tmp_path / 'cache'
+
+    assert [Path(f).name for f in find_datafiles(folder)] == sorted(DATAFILES)
+    assert len(find_datafiles([folder / '*.xdi', folder / 'fe2o3_rt1.xmu'])) == 3
+
+    results = batch_import(folder, cache_folder=cache_folder, nworkers=2)
+    assert [r.cached for r in results] == [False]*4
+    assert [r.error for r in results] == [None]*4
+    readers = {Path(r.filename).name: r.reader for r in results}
+    assert readers == {'cu_metal_rt.xdi': 'read_xdi', 'fe2o3_rt1.xmu': 'read_ascii',
+                       'fe_athena.prj': 'read_athena', 'pt_metal_rt.xdi': 'read_xdi'}
+
+    xmu = read_ascii(folder / 'fe2o3_rt1.xmu')
+    for parallel in (results[1], batch_import(folder / '*.xmu', cache=False)[0]):
+        assert parallel.group.array_labels == xmu.array_labels
+        np.testing.assert_allclose(parallel.group.data, xmu.data)
+
+    # second import reads from cache, except for modified files
+    time.sleep(0.01)
+    with open(folder / 'cu_metal_rt.xdi', 'a') as fh:
+        fh.write('\n')
+    results = batch_import(folder, cache_folder=cache_folder, nworkers=1)
+    cached = {Path(r.filename).name: r.cached for r in results}
+    assert cached == {'cu_metal_rt.xdi': False, 'fe2o3_rt1.xmu': True,
+                      'fe_athena.prj': True, 'pt_metal_rt.xdi': True}
+    xdi = read_xdi(str(folder / 'pt_metal_rt.xdi'))
+    np.testing.assert_allclose(results[3].group.mutrans, xdi.mutrans)
+    assert results[3].group.attrs == xdi.attrs
+    assert len(results[2].group.fe3c_rt_xdi.energy) > 100
+
+    # different reader options use different cache files
+    results = batch_import(folder / 'fe2o3*', cache_folder=cache_folder,
+                           labels='energy mu i0')
+    assert not results[0].cached and results[0].group.array_labels[1] == 'mu'
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+""" Tests of q peak matching with the cif database, with a benchmark
+over synthetic peak lists (run with `pytest -s` to see timings)
+"""
+import os
+import re
+import time
+import shutil
+import numpy as np
+import pytest
+
+from larch.xrd import cifdb as cifdb_module
+from larch.xrd.cifdb import cifDB, QPeakIndex, QAXIS
+
+AXIS = QAXIS.round(5)
+
+def dense_amcsd_by_q(cifdb, peaks, qstep):
+    "dense peak matching, as done before the sparse index"
+    qaxis = cifdb.axis
+    amcsd, q_amcsd = cifdb.match_qc()
+    q_amcsd = np.array(q_amcsd)
+    new_qaxis = np.arange(qaxis.min(), qaxis.max()+qaxis[1]-qaxis[0], qstep)
+    new_q_amcsd = np.zeros((len(amcsd), len(new_qaxis)))
+    for m, qrow in enumerate(q_amcsd):
+        for n in np.nonzero(qrow)[0]:
+            new_q_amcsd[m][np.abs(new_qaxis-qaxis[n]).argmin()] = 1
+    weighting = -np.ones(len(new_qaxis))
+    for p in peaks:
+        weighting[np.abs(new_qaxis-p).argmin()] = 1
+    return dict(zip(amcsd, new_q_amcsd @ weighting))
+
+def synthetic_index(ncifs=20000, npeaks=60, seed=7):
+    rng = np.random.default_rng(seed)
+    qarrays = np.zeros((ncifs, len(AXIS)), dtype=np.int8)
+    for qarr in qarrays:
+        qarr[rng.integers(0, len(AXIS), size=npeaks)] = 1
+    return QPeakIndex.from_qarrays(AXIS, np.arange(ncifs)+1, qarrays), qarrays
+
+def test_amcsd_by_q(tmp_path, monkeypatch):
+    # keep the saved q index out of the user's larch folder
+    monkeypatch.setattr(cifDB, 'qindex_folder', lambda self: str(tmp_path))
+    cifdb = cifDB('amcsd_cif0.db')
+    peaks = [2.0, 2.3, 3.26, 3.82, 4.0]
+    result = cifdb.amcsd_by_q(peaks, qstep=0.05)
+    assert len(result) == cifdb.cif_count()
+    scores = [row[0] for row in result]
+    assert scores == sorted(scores, reverse=True)
+    dense = dense_amcsd_by_q(cifdb, peaks, 0.05)
+    for score, amcsd_id, total, match, miss in result:
+        assert score == dense[amcsd_id]
+        assert match - miss == score and match + miss == total
+
+def test_add_ciffile_qindex(tmp_path, monkeypatch):
+    pytest.importorskip('CifFile')
+    monkeypatch.setattr(cifDB, 'qindex_folder', lambda self: str(tmp_path))
+    dbname = str(tmp_path / 'amcsd_copy.db')
+    shutil.copy(os.path.join(os.path.dirname(cifdb_module.__file__),
+                             'amcsd_cif0.db'), dbname)
+    cifdb = cifDB(dbname, read_only=False)
+    key = cifdb.qindex_key()
+    assert key[2] == os.stat(dbname).st_mtime_ns
+    cifdb.qindex        # build and save the index before adding a cif
+
+    amcsd_id = int(cifdb.query(cifdb.ciftbl.c.amcsd_id).first()[0])
+    ciftext = re.sub(r'_database_code_amcsd\s+\d+',
+                     '_database_code_amcsd 9990001', cifdb.return_cif(amcsd_id))
+    ciffile = tmp_path / 'new.cif'
+    ciffile.write_text(ciftext)
+    cifdb.add_ciffile(str(ciffile), verbose=False)
+    assert cifdb.qindex_key() != key
+
+    peaks = cifdb.q_by_amcsd(9990001)
+    assert len(peaks) > 0
+    ids = [row[1] for row in cifdb.amcsd_by_q(peaks)]
+    assert 9990001 in ids
+    assert cifdb.cif_count() == len(ids)
+
+    # a new session loads the saved index, rebuilt with the new cif
+    ids = [row[1] for row in cifDB(dbname).amcsd_by_q(peaks)]
+    assert 9990001 in ids
+
+def test_qindex_save_load(tmp_path):
+    index, qarrays = synthetic_index(ncifs=200)
+    index.save(str(tmp_path))
+    saved = QPeakIndex.load(str(tmp_path), mmap_mode='r')
+    assert isinstance(saved.cifidx, np.memmap)
+    assert QPeakIndex.load(str(tmp_path), key=['other']) is None
+    peaks = AXIS[np.nonzero(qarrays[17])[0][:8]]
+    for kws in ({}, {'qstep': 0.05}, {'tol': 0.02}, {'peak_weights': np.arange(8)+1}):
+        out = index.score(peaks, **kws)
+        np.testing.assert_allclose(saved.score(peaks, **kws)[0], out[0])
+    scores, ids = index.score(peaks)[:2]
+    assert ids[np.argmax(scores)] == 18
+    wscores = index.score(peaks, peak_weights=2*np.ones(8))[0]
+    assert wscores[17] == scores[17] + 8
+    assert np.all(index.score(peaks, tol=0.02)[3] >= index.score(peaks)[3])
+
+def test_qindex_benchmark():
+    index, qarrays = synthetic_index()
+    rng = np.random.default_rng(11)
+    peak_lists = [np.sort(rng.uniform(0.5, 8, size=12)) for i in range(10)]
+
+    t0 = time.monotonic()
+    for peaks in peak_lists:
+        weighting = -np.ones(len(AXIS))
+        weighting[np.abs(AXIS[None, :]-peaks[:, None]).argmin(axis=1)] = 1
+        dense = qarrays @ weighting
+    t1 = time.monotonic()
+    print()
+    print(f"  dense scoring  {1.e3*(t1-t0)/len(peak_lists):8.2f} msec per peak list")
+    for kws in ({}, {'qstep': 0.05, 'tol': 0.02}):
+        t0 = time.monotonic()
+        index.score(peak_lists[0], **kws)
+        t1 = time.monotonic()
+        for peaks in peak_lists:
+            scores = index.score(peaks, **kws)[0]
+        t2 = time.monotonic()
+        print(f"  sparse scoring {1.e3*(t2-t1)/len(peak_lists):8.2f} msec per peak list "
+              f"for {len(index.amcsd_ids)} structures, {kws}, "
+              f"{1.e3*(t1-t0):.2f} msec for first")
+        if len(kws) == 0:
+            np.testing.assert_allclose(scores, dense)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+""" Tests of reading ASCII column files in chunks, compared to reading
+line-by-line, with a benchmark (run with `pytest -s` to see timings)
+"""
+import time
+from pathlib import Path
+import numpy as np
+
+from larch.io import read_ascii
+from larch.io.columnfile import _ascii_sections_chunked, _ascii_sections_lines
+
+datadir = Path(__file__).parent.parent / 'examples' / 'xafsdata'
+
+def compare_sections(fname, chunksize):
+    out = _ascii_sections_chunked(fname, chunksize=chunksize)
+    if out is None:
+        return False
+    headers, data, footers = _ascii_sections_lines(fname)
+    assert out[0] == headers and out[2] == footers
+    assert np.array_equal(out[1], np.array(data), equal_nan=True)
+    return True
+
+def test_read_ascii_chunked():
+    nchunked = 0
+    fnames = sorted(datadir.glob('*.*')) + sorted(datadir.glob('beamlines/*.*'))
+    for fname in fnames:
+        for chunksize in (256, 4*1024*1024):
+            nchunked += compare_sections(fname, chunksize)
+    assert nchunked > 1.5*len(fnames)
+
+def test_read_ascii_sections(tmp_path):
+    fname = tmp_path / 'sections.dat'
+    x = np.linspace(0, 1, 11)
+    rows = [f'{a:.4f}, {a*a:.4f}, {a/3.0:.7g}' for a in x]
+    with open(fname, 'w') as fh:
+        fh.write('\n'.join(['# header', '# 2 3', '1 2 3', '# x  y  z', ''] +
+                           rows + ['', '# footer 1', 'end 2']))
+    assert compare_sections(fname, 64)
+    dat = read_ascii(fname)
+    assert dat.header == ['# header', '# 2 3', '1 2 3', '# x  y  z']
+    assert dat.footer == ['# footer 1', 'end 2']
+    assert dat.array_labels == ['x', 'y', 'z']
+    np.testing.assert_allclose(dat.x, x)
+
+    # ragged rows and date/times use line-by-line reading
+    with open(fname, 'w') as fh:
+        fh.write('\n'.join(['# x y'] + rows[:4] + ['3 4'] + rows[4:]))
+    assert _ascii_sections_chunked(fname) is None
+    assert np.isnan(read_ascii(fname).data[2, 4])
+
+def test_read_ascii_benchmark(tmp_path):
+    fname = tmp_path / 'multi_element.dat'
+    ncols, nrows = 48, 10000
+    data = np.random.default_rng(3).uniform(size=(nrows, ncols))*1.e4
+    labels = ' '.join(['energy', 'i0'] + [f'mca{i+1}' for i in range(ncols-2)])
+    np.savetxt(fname, data, fmt='%.6f', header=f'Scan.start_time: 2024-06-01 10:01:22\n{labels}')
+
+    t0 = time.monotonic()
+    dat = read_ascii(fname)
+    t1 = time.monotonic()
+    _ascii_sections_lines(fname)
+    t2 = time.monotonic()
+    print(f"\n  read_ascii {ncols} x {nrows}: {1.e3*(t1-t0):.2f} msec, "
+          f"line-by-line parsing: {1.e3*(t2-t1):.2f} msec")
+    assert dat.data.shape == (ncols, nrows)
+    assert dat.array_labels[:3] == ['energy', 'i0', 'mca1']
+    assert dat.attrs.scan_start_time == '2024-06-01 10:01:22'
+    np.testing.assert_allclose(dat.mca7, data[:, 8], rtol=1.e-12, atol=1.e-6)
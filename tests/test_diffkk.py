@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+""" Tests of diffKK transforms, with a timing comparison of the
+MacLaurin series and FFT forms (run with `pytest -s` to see timings)
+"""
+import time
+from pathlib import Path
+import numpy as np
+
+from larch.io import read_ascii
+from larch.xafs import diffkk, diffkk_stack
+from larch.xafs.diffkk import (kkmclf, kkmclr, kkmclf_sca, kkmclr_sca,
+                               kkmclf_fft, kkmclr_fft)
+
+datadir = Path(__file__).parent.parent / 'examples' / 'xafsdata'
+MBACK_KWS = {'e0': 8979, 'order': 4}
+
+def get_fpp(npts=600):
+    energy = np.linspace(8800, 9800, npts)
+    fpp = 3 + np.tanh((energy-8980)/4.0) + 0.5*np.exp(-((energy-8995)/8.0)**2)
+    return energy, fpp
+
+def test_kk_fft():
+    energy, fpp = get_fpp()
+    for fft_form, forms in ((kkmclr_fft, (kkmclr, kkmclr_sca)),
+                            (kkmclf_fft, (kkmclf, kkmclf_sca))):
+        out = fft_form(energy, fpp)
+        for form in forms:
+            ref = np.asarray(form(energy, fpp))
+            np.testing.assert_allclose(out, ref, rtol=0, atol=1.e-10*abs(ref).max())
+    stack = np.array([fpp*scale for scale in (1.0, 0.5, 2.0)])
+    out = kkmclr_fft(energy, stack)
+    assert out.shape == stack.shape
+    for fpp_i, out_i in zip(stack, out):
+        np.testing.assert_allclose(out_i, kkmclr_fft(energy, fpp_i), rtol=0, atol=1.e-12)
+
+def test_diffkk_how():
+    dat = read_ascii(str(datadir / 'cu_metal_rt.xdi'))
+    dkk = diffkk(dat.energy, dat.mutrans, z=29, edge='K', mback_kws=MBACK_KWS)
+    dkk.kk(how='vector')
+    fp_vector = dkk.fp.copy()
+    dkk.kk()
+    np.testing.assert_allclose(dkk.fp, fp_vector, rtol=0, atol=1.e-9)
+
+    mus = np.array([dat.mutrans, 1.2*dat.mutrans + 0.1])
+    out = diffkk_stack(dat.energy, mus, z=29, edge='K', mback_kws=MBACK_KWS)
+    assert out.fp.shape == mus.shape
+    np.testing.assert_allclose(out.fp[0], fp_vector, rtol=0, atol=1.e-9)
+
+def test_kk_benchmark():
+    energy, fpp = get_fpp(npts=4000)
+    times = {}
+    for form in (kkmclr, kkmclr_fft):
+        t0 = time.monotonic()
+        form(energy, fpp)
+        times[form.__name__] = time.monotonic() - t0
+    print()
+    for key, val in times.items():
+        print(f"  {key:12s}: {1.e3*val:9.2f} msec for {len(energy)} points")
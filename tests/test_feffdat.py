@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+""" Tests of summing Feff Paths """
+import pickle
+from pathlib import Path
+import numpy as np
+from lmfit import Parameters
+
+from larch.xafs import feffpath, ff2chi
+from larch.xafs.feffdat import FeffPathStack
+
+feffdir = Path(__file__).parent.parent / 'examples' / 'feffit'
+
+def get_paths():
+    params = Parameters()
+    params.add('amp', value=0.9)
+    params.add('del_e0', value=2.3)
+    params.add('sig2', value=0.004)
+    params.add('alpha', value=0.01)
+    fnames = sorted((feffdir / 'Feff_Cu').glob('feff*.dat'))
+    fnames.append(feffdir / 'feff_feo01.dat')
+    paths = [feffpath(str(f), s02='amp', e0='del_e0', sigma2='sig2 + 0.001*reff',
+                      deltar='alpha*reff', third=1.e-4, fourth=1.e-5, ei=0.5)
+             for f in fnames]
+    return paths, params
+
+def test_ff2chi_batch():
+    paths, params = get_paths()
+    for interp in ('cubic', 'linear'):
+        loop = ff2chi(paths, params=params, batch=False, interp=interp)
+        chis = [p.chi.copy() for p in paths]
+        batch = ff2chi(paths, params=params, batch=True, interp=interp)
+        assert len(loop.k) == len(batch.k)
+        np.testing.assert_allclose(batch.chi, loop.chi, rtol=0, atol=1.e-12)
+        for chi, path in zip(chis, paths):
+            np.testing.assert_allclose(path.chi, chi, rtol=0, atol=1.e-12)
+
+def test_pathstack_updates():
+    paths, params = get_paths()
+    k = 0.05*np.arange(401)
+    stack = FeffPathStack(paths)
+    chi1 = ff2chi(paths, params=params, k=k, pathstack=stack).chi
+    params['del_e0'].value = -3.0
+    paths[1].use = False
+    paths[2].s02 = 0.5
+    chi2 = ff2chi(paths, params=params, k=k, pathstack=stack).chi
+    chi3 = ff2chi(paths, params=params, k=k, batch=False).chi
+    assert abs(chi2 - chi1).max() > 1.e-3
+    assert abs(paths[1].chi).max() == 0
+    np.testing.assert_allclose(chi2, chi3, rtol=0, atol=1.e-12)
+
+def test_interp_cache():
+    paths, params = get_paths()
+    path = paths[0]
+    k = 0.05*np.arange(401)
+    path.create_path_params(params=params)
+    path._calc_chi(k=k)
+    chi1 = path.chi.copy()
+    params['sig2'].value = 0.006
+    path._calc_chi(k=k)
+    info = path.interp_cache_info()
+    assert info['hits'] == 1 and info['misses'] == 1
+    params['del_e0'].value = 0.0
+    path._calc_chi(k=k)
+    assert path.interp_cache_info()['misses'] == 2
+
+    params['del_e0'].value = 2.3
+    params['sig2'].value = 0.004
+    path._calc_chi(k=k)
+    assert path.interp_cache_info()['hits'] == 2
+    np.testing.assert_allclose(path.chi, chi1, rtol=0, atol=1.e-14)
+
+    path.interp_cache_size = 1
+    params['del_e0'].value = 1.0
+    path._calc_chi(k=k)
+    assert path.interp_cache_info()['size'] == 1
+
+    # replacing the Feff data clears the cache
+    path._feffdat = paths[3]._feffdat
+    assert path.interp_cache_info()['size'] == 0
+    path._calc_chi(k=k)
+    assert abs(path.chi - chi1).max() > 1.e-3
+
+    # k grids with the same length and end points are different keys
+    k2 = k.copy()
+    k2[200] += 1.e-3
+    assert path._interp_cache_key(k2, 0, 0, 'cubic') != path._interp_cache_key(k, 0, 0, 'cubic')
+
+    # unpickled paths have a cache
+    restored = pickle.loads(pickle.dumps(paths[1]))
+    assert restored.dataset == 'd001'
+    assert restored.interp_cache_info() == dict(hits=0, misses=0, size=0,
+                                                maxsize=paths[1].interp_cache_size)
+    restored.create_path_params(params=params)
+    restored._calc_chi(k=k)
+    paths[1].create_path_params(params=params)
+    paths[1]._calc_chi(k=k)
+    np.testing.assert_allclose(restored.chi, paths[1].chi, rtol=0, atol=1.e-14)
+
+def test_feffit_analytic_jacobian():
+    from larch.io import read_ascii
+    from larch.fitting import param, param_group
+    from larch.xafs import autobk, feffit_transform, feffit_dataset, feffit
+    cu = read_ascii(str(feffdir.parent / 'xafsdata' / 'cu_metal_rt.xdi'))
+    cu.mu = cu.mutrans
+    autobk(cu, rbkg=1.1, kw=2)
+    results = []
+    for analytic in (False, True):
+        pars = param_group(amp=param(1, vary=True), del_e0=param(3, vary=True),
+                           sig2_1=param(.002, vary=True), sig2_2=param(.002, vary=True),
+                           alpha=param(0, vary=True))
+        paths = [feffpath(str(feffdir / f'feff000{i}.dat'), s02='amp', e0='del_e0',
+                          sigma2=f'sig2_{min(i, 2)}', deltar='alpha*reff')
+                 for i in (1, 2, 3)]
+        trans = feffit_transform(kmin=3, kmax=17, kw=2, dk=4, rmin=1.4, rmax=3.5)
+        dset = feffit_dataset(data=cu, paths=paths, transform=trans)
+        results.append(feffit(pars, dset, analytic_jacobian=analytic))
+    numer, analyt = results
+    assert analyt.nfev < numer.nfev
+    for name in numer.var_names:
+        pnum, pana = numer.params[name], analyt.params[name]
+        assert abs(pnum.value - pana.value) < 0.02*pnum.stderr
+        assert abs(pnum.stderr - pana.stderr) < 0.02*pnum.stderr
+
+def test_feffit_batch():
+    from larch import Group
+    from larch.io import read_ascii
+    from larch.fitting import param, param_group
+    from larch.xafs import autobk, feffit_transform, feffit_batch, feffit_report
+    cu = read_ascii(str(feffdir.parent / 'xafsdata' / 'cu_metal_rt.xdi'))
+    cu.mu = cu.mutrans
+    autobk(cu, rbkg=1.1, kw=2)
+    groups = [Group(k=cu.k, chi=cu.chi*scale, groupname=f'cu_{i}')
+              for i, scale in enumerate((1.0, 0.95, 0.9))]
+    pars = param_group(amp=param(1, vary=True), del_e0=param(3, vary=True),
+                       sig2=param(.002, vary=True), alpha=param(0, vary=True))
+    paths = [feffpath(str(feffdir / f'feff000{i}.dat'), s02='amp', e0='del_e0',
+                      sigma2='sig2', deltar='alpha*reff') for i in (1, 2, 3)]
+    trans = feffit_transform(kmin=3, kmax=17, kw=2, dk=4, rmin=1.4, rmax=3.5)
+    serial = feffit_batch(pars, paths, groups, transform=trans, ncpus=0)
+    pooled = feffit_batch(pars, paths, groups, transform=trans, ncpus=2,
+                          seed_previous=True)
+    assert len(serial.results) == len(pooled.results) == 3
+    assert serial.table['label'] == ['cu_0', 'cu_1', 'cu_2']
+    amps = serial.table['amp']
+    assert amps[0] > amps[1] > amps[2]
+    np.testing.assert_allclose(pooled.table['amp'], amps, rtol=1.e-4)
+    for result in serial.results + pooled.results:
+        report = feffit_report(result)
+        assert 'feff0001.dat' in report and 'amp' in report
+    assert pars.amp.value == 1
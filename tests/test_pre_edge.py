@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+""" Tests of pre-edge subtraction and normalization """
+from pathlib import Path
+import numpy as np
+
+from larch.io import read_ascii
+from larch.xafs import preedge, pre_edge_stack
+
+datadir = Path(__file__).parent.parent / 'examples' / 'xafsdata'
+
+def get_stack(nspectra=12):
+    dat = read_ascii(str(datadir / 'cu_metal_rt.xdi'))
+    rng = np.random.default_rng(11)
+    mus = [np.interp(dat.energy, dat.energy + shift, dat.mutrans)*scale + offset
+           + rng.normal(scale=2.e-4, size=len(dat.energy))
+           for shift, scale, offset in zip(rng.normal(scale=1.5, size=nspectra),
+                                           1 + 0.1*rng.random(nspectra),
+                                           0.02*rng.random(nspectra))]
+    return dat.energy, np.array(mus)
+
+def test_pre_edge_stack():
+    energy, mus = get_stack()
+    for kws in ({}, {'nnorm': 2, 'nvict': 1}, {'npre': 0, 'e0': 8980.0}):
+        out = pre_edge_stack(energy, mus, **kws)
+        assert out.norm.shape == mus.shape
+        for i, mu in enumerate(mus):
+            one = preedge(energy, mu, **kws)
+            assert abs(one['e0'] - out.e0[i]) < 1.e-6
+            assert abs(one['edge_step'] - out.edge_step[i]) < 1.e-10
+            np.testing.assert_allclose(out.norm[i], one['norm'], rtol=0, atol=1.e-10)
+            np.testing.assert_allclose(out.post_edge[i], one['post_edge'], rtol=0, atol=1.e-10)
+            ncoefs = len(one['norm_coefs'])
+            np.testing.assert_allclose(out.norm_coefs[i, :ncoefs], one['norm_coefs'],
+                                       rtol=1.e-6, atol=1.e-12)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+""" Tests of saving and reading Larch Session files, in both the
+Larix 1.0 (json text) and Larix 2.0 (binary arrays) formats, and of
+reading only some symbols (run with `pytest -s` to see timings)
+"""
+import json
+import time
+import numpy as np
+
+from larch import Interpreter, Group
+from larch.io import (save_session, read_session, load_session, open_session,
+                      is_larch_session_file)
+from larch.utils.jsonutils import encode4js, decode4js, ArrayBuffers
+
+def make_session(ngroups=4):
+    _larch = Interpreter()
+    rng = np.random.default_rng(5)
+    for i in range(ngroups):
+        setattr(_larch.symtable, f'g{i}',
+                Group(groupname=f'g{i}', filename=f'file{i}.dat',
+                      energy=np.linspace(8900, 9900, 501),
+                      mu=rng.normal(size=501), chir=rng.normal(size=64)+0.5j,
+                      flags=np.arange(6, dtype='>i4') > 2, label=f'data {i}'))
+    _larch.symtable.bigmap = rng.normal(size=(64, 64, 40))
+    return _larch
+
+def check_group(group, ref):
+    for attr in ('energy', 'mu', 'chir', 'flags'):
+        val = getattr(group, attr)
+        assert val.dtype.isnative
+        assert val.dtype == getattr(ref, attr).dtype
+        assert np.all(val == getattr(ref, attr))
+    assert group.label == ref.label
+
+def test_encode_buffers():
+    group = make_session().symtable.g1
+    buffers = ArrayBuffers()
+    text = json.dumps(encode4js(group, buffers))
+    assert len(buffers) == 4 and 'value' not in json.loads(text)['mu']
+    check_group(decode4js(json.loads(text), buffers), group)
+
+def test_session_formats(tmp_path):
+    _larch = make_session()
+    symtab = _larch.symtable
+    for binary in (False, True):
+        fname = str(tmp_path / f'session_{binary}.larix')
+        save_session(fname, binary=binary, auto_xasgroups=True, _larch=_larch)
+        assert is_larch_session_file(fname)
+        for mmap_arrays in (False, True):
+            session = read_session(fname, mmap_arrays=mmap_arrays)
+            assert session.config['Larix Version'] == ('2.0' if binary else '1.0')
+            assert len(session.symbols['_xasgroups']) == 4
+            for i in range(4):
+                check_group(session.symbols[f'g{i}'], getattr(symtab, f'g{i}'))
+            bigmap = session.symbols['bigmap']
+            assert isinstance(bigmap, np.memmap) == (binary and mmap_arrays)
+            assert np.all(bigmap == symtab.bigmap)
+
+    # memory-mapped arrays are copy-on-write, and survive overwriting the file
+    session = read_session(fname, mmap_arrays=True)
+    session.symbols['bigmap'][0, 0, 0] = -99.0
+    save_session(fname, symbols=['g0'], _larch=_larch)
+    assert session.symbols['bigmap'][0, 0, 0] == -99.0
+    assert np.all(session.symbols['bigmap'][1:] == symtab.bigmap[1:])
+
+    _larch2 = Interpreter()
+    load_session(fname, _larch=_larch2)
+    check_group(_larch2.symtable.g0, symtab.g0)
+    assert not hasattr(_larch2.symtable, 'bigmap')
+
+def test_open_session(tmp_path):
+    _larch = make_session(ngroups=20)
+    fname = str(tmp_path / 'session.larix')
+    save_session(fname, auto_xasgroups=True, _larch=_larch)
+    session = open_session(fname)
+    assert list(session.symbols) == ['_xasgroups'] + [f'g{i}' for i in range(20)] + ['bigmap']
+    assert session.toc['g3']['class'] == 'Group'
+    assert 'mu' in session.get_attrs('g3') and 'mu' in session.toc['g3']['attrs']
+    check_group(session.symbols['g3'], _larch.symtable.g3)
+    assert list(session._cache) == ['g3']
+
+    _larch1, _larch2 = Interpreter(), Interpreter()
+    t0 = time.monotonic()
+    load_session(fname, ignore_groups=['bigmap'] + [f'g{i}' for i in range(1, 20)],
+                 _larch=_larch1)
+    t1 = time.monotonic()
+    load_session(fname, _larch=_larch2)
+    t2 = time.monotonic()
+    print(f"\n  load 1 of 20 groups: {1.e3*(t1-t0):.2f} msec, all: {1.e3*(t2-t1):.2f} msec")
+    assert list(_larch1.symtable._xasgroups.values()) == ['g0']
+    assert len(_larch2.symtable._xasgroups) == 20
+
+    # older sessions files also list symbols before decoding them
+    save_session(fname, binary=False, symbols=['g2', 'g5'], _larch=_larch)
+    session = open_session(fname)
+    assert list(session.symbols) == ['g2', 'g5'] and len(session._cache) == 0
+    assert 'energy' in session.get_attrs('g5')
+    check_group(session.symbols['g2'], _larch.symtable.g2)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+""" Tests of sigma2 models for Feff Paths """
+from pathlib import Path
+import numpy as np
+from lmfit import Parameters
+
+from larch.xafs import feffpath, ff2chi, sigma2_debye, sigma2_eins
+from larch.xafs.sigma2_models import (sigma2_correldebye_py, sigma2_correldebye_np,
+                                      path_geometry, clear_sigma2_cache,
+                                      sigma2_cache_info)
+
+feffdir = Path(__file__).parent.parent / 'examples' / 'feffit'
+
+def get_paths():
+    return [feffpath(str(fname)) for fname in
+            sorted((feffdir / 'Feff_Cu').glob('feff*.dat'))]
+
+def test_correldebye_np():
+    for path in get_paths():
+        geom = path_geometry(path._feffdat)
+        for tk, theta in ((10, 300), (300, 315), (600, 200)):
+            args = (geom.natoms, tk, theta, geom.rnorm, list(geom.x),
+                    list(geom.y), list(geom.z), list(geom.mass))
+            assert abs(sigma2_correldebye_np(*args) -
+                       sigma2_correldebye_py(*args)) < 1.e-14
+
+def test_sigma2_path_geometry():
+    path = get_paths()[3]
+    geom = path_geometry(path._feffdat)
+    assert path_geometry(path._feffdat) is geom
+    assert geom.natoms == len(path._feffdat.geom)
+    rmass = 1.0/sum(1.0/atom[3] for atom in path._feffdat.geom)
+    assert abs(geom.rmass - rmass) < 1.e-12
+    assert abs(sigma2_eins(300, 250, path) - 24.2543601577*np.cosh(250/600)/
+               (250*rmass*np.sinh(250/600))) < 1.e-8
+
+def test_sigma2_debye_cache():
+    clear_sigma2_cache()
+    paths = get_paths()
+    params = Parameters()
+    params.add('theta', value=315)
+    for path in paths:
+        path.sigma2 = 'sigma2_debye(300, theta)'
+    ff2chi(paths, params=params)
+    info = sigma2_cache_info()
+    assert info['misses'] + info['hits'] >= len(paths)
+    sig2 = [sigma2_debye(300, 315, path) for path in paths]
+    assert sigma2_cache_info()['misses'] == info['misses']
+    for path, val in zip(paths, sig2):
+        assert abs(path.path_paramvals()['sigma2'] - val) < 1.e-12
+
+    params['theta'].value = 280
+    ff2chi(paths, params=params)
+    assert sigma2_cache_info()['misses'] > info['misses']
+    assert paths[0].path_paramvals()['sigma2'] > sig2[0]
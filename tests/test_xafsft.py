@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+""" Tests of XAFS Fourier transforms, with a micro-benchmark
+of the cached transforms used in fits (run with `pytest -s` to see timings)
+"""
+from timeit import repeat
+import numpy as np
+from scipy.fftpack import fft, ifft
+
+from larch.xafs import ftwindow, xftf_fast, xftr_fast
+from larch.xafs.feffit import TransformGroup
+
+sqrtpi = np.sqrt(np.pi)
+
+def uncached_fftf(trans, chi, kweight, kwin=None):
+    """forward transform recomputing k-weight and buffers, as done before
+    caching.  The window is also recomputed unless given"""
+    if kwin is None:
+        kwin = ftwindow(trans.k_, xmin=trans.kmin, xmax=trans.kmax,
+                        dx=trans.dk, dx2=trans.dk2, window=trans.window)
+    cx = chi * kwin[:len(chi)] * trans.k_[:len(chi)]**kweight
+    cchi = np.zeros(trans.nfft, dtype='complex128')
+    cchi[:len(cx)] = cx
+    return (trans.kstep/sqrtpi) * fft(cchi)[:trans.nfft//2]
+
+def uncached_fftr(trans, chir, rwin=None):
+    if rwin is None:
+        rwin = ftwindow(trans.r_, xmin=trans.rmin, xmax=trans.rmax,
+                        dx=trans.dr, dx2=trans.dr2, window=trans.rwindow)
+    cchi = np.zeros(trans.nfft, dtype='complex128')
+    cchi[:len(chir)] = chir * rwin[:len(chir)]
+    return (4*sqrtpi/trans.kstep) * ifft(cchi)[:trans.nfft//2]
+
+def get_chi():
+    k = 0.05*np.arange(361)
+    return np.sin(5.0*k)*np.exp(-0.01*k*k) + 0.2*np.sin(8.2*k)/(1+k)
+
+def time_per_call(func, nruns=500, nrepeat=5):
+    "best time per call over nrepeat sets of nruns calls"
+    return min(repeat(func, number=nruns, repeat=nrepeat))/nruns
+
+def test_transform_cache():
+    chi = get_chi()
+    for use_rfft in (True, False):
+        trans = TransformGroup(kmin=2, kmax=16, dk=3, rmin=1, rmax=3, dr=0.5,
+                               kweight=(1, 2, 3), use_rfft=use_rfft)
+        for kw in (1, 2, 3, 2):
+            chir = trans.fftf(chi, kweight=kw)
+            np.testing.assert_allclose(chir, uncached_fftf(trans, chi, kw),
+                                       rtol=0, atol=1.e-12)
+        np.testing.assert_allclose(trans.fftr(chir), uncached_fftr(trans, chir),
+                                   rtol=0, atol=1.e-12)
+        # shorter input must not see stale data in padded buffers
+        np.testing.assert_allclose(trans.fftf(chi[:200], kweight=2),
+                                   uncached_fftf(trans, chi[:200], 2),
+                                   rtol=0, atol=1.e-12)
+        np.testing.assert_allclose(trans.fftr(chir[:100]),
+                                   uncached_fftr(trans, chir[:100]),
+                                   rtol=0, atol=1.e-12)
+        # resetting kwin recomputes the cached window products
+        trans.kmax, trans.kwin = 12, None
+        np.testing.assert_allclose(trans.fftf(chi, kweight=2),
+                                   uncached_fftf(trans, chi, 2),
+                                   rtol=0, atol=1.e-12)
+
+def test_xftf_fast_real():
+    chi = get_chi()
+    out_real = xftf_fast(chi)
+    out_cplx = xftf_fast(chi.astype('complex128'))
+    np.testing.assert_allclose(out_real, out_cplx, rtol=0, atol=1.e-12)
+    assert len(xftr_fast(out_real)) == 1024
+
+def test_transform_benchmark():
+    chi = get_chi()
+    trans = TransformGroup(kmin=2, kmax=16, dk=3, rmin=1, rmax=3, kweight=2)
+    chir = trans.fftf(chi)
+    trans.fftr(chir)
+    kwin, rwin = trans.kwin, trans.rwin
+    times = {'fftf previous': time_per_call(lambda: uncached_fftf(trans, chi, 2, kwin=kwin)),
+             'fftf cached': time_per_call(lambda: trans.fftf(chi)),
+             'fftr previous': time_per_call(lambda: uncached_fftr(trans, chir, rwin=rwin)),
+             'fftr cached': time_per_call(lambda: trans.fftr(chir))}
+    trans.use_rfft = False
+    times['fftf cached, complex fft'] = time_per_call(lambda: trans.fftf(chi))
+    print()
+    for key, val in times.items():
+        print(f"  {key:25s}: {1.e6*val:8.2f} usec per transform")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+""" Tests of XRF models, and of decomposing XRF spectra and maps with
+an XRF fit result """
+from pathlib import Path
+import numpy as np
+from numpy.linalg import lstsq
+from scipy.optimize import nnls
+
+from larch.io import GSEMCA_File
+from larch.xrf import xrf_model
+from larch.xrf.xrf_model import XRFFitResult, nnls_batch
+
+mcafile = Path(__file__).parent.parent / 'examples' / 'xrf' / 'srm1832.mca'
+
+def get_model():
+    model = xrf_model(xray_energy=16.0, energy_min=2.0, energy_max=15.0)
+    model.set_detector(thickness=0.4, material='Si', cal_offset=-0.0107,
+                       cal_slope=0.014655, noise=0.05)
+    model.add_scatter_peak(name='elastic', center=16.0, amplitude=1e5)
+    model.add_scatter_peak(name='compton1', center=15.3, amplitude=1e5)
+    for elem in ('Ca', 'V', 'Mn', 'Fe', 'Co', 'Cu', 'Zn'):
+        model.add_element(elem)
+    model.add_escape(scale=0.3, vary=False)
+    return model
+
+def get_fitresult(nchan=512, ncomps=8):
+    energy = 0.02*np.arange(nchan)
+    rng = np.random.default_rng(5)
+    centers = rng.uniform(2, 8, ncomps)
+    xfer = np.exp(-(energy[:, None]-centers[None, :])**2/0.08)
+    window = np.zeros(nchan)
+    window[50:450] = 1.0
+    return XRFFitResult(transfer_matrix=xfer, fit_window=window, count_time=1.0,
+                        eigenvalues={f'comp{i}': 1.0 for i in range(ncomps)})
+
+def get_map(result, ny=9, nx=7):
+    rng = np.random.default_rng(7)
+    ncomps = result.transfer_matrix.shape[1]
+    weights = rng.uniform(-0.3, 2.0, (ny, nx, ncomps))
+    counts = weights @ result.transfer_matrix.T
+    return counts + rng.normal(scale=0.05, size=counts.shape)
+
+def test_nnls_batch():
+    result = get_fitresult()
+    xfer = result.transfer_matrix
+    spectra = get_map(result).reshape((-1, xfer.shape[0]))
+    weights = nnls_batch(xfer, spectra)
+    for spectrum, wts in zip(spectra, weights):
+        np.testing.assert_allclose(wts, nnls(xfer, spectrum)[0], rtol=0, atol=1.e-8)
+
+def test_decompose_map():
+    result = get_fitresult()
+    xmap = get_map(result)
+    ny, nx, nchan = xmap.shape
+    win = np.where(result.fit_window > 0)[0]
+    w0, w1 = max(0, win[0]-100), min(nchan-1, win[-1]+100)
+    xfer, window = result.transfer_matrix[w0:w1], result.fit_window[w0:w1]
+    for method, solver in (('lstsq', lstsq), ('nnls', nnls)):
+        expected = np.zeros((ny, nx, xfer.shape[1]))
+        for iy in range(ny):
+            for ix in range(nx):
+                expected[iy, ix] = solver(xfer, window*xmap[iy, ix, w0:w1])[0]
+        for nworkers, chunk_size in ((1, None), (3, 2)):
+            out = result.decompose_map(xmap, method=method, nworkers=nworkers,
+                                       chunk_size=chunk_size)
+            for i, name in enumerate(result.eigenvalues):
+                np.testing.assert_allclose(out[name], expected[:, :, i],
+                                           rtol=1.e-5, atol=1.e-5)
+
+def test_decompose_map_hdf5(tmp_path):
+    import h5py
+    result = get_fitresult()
+    xmap = get_map(result)
+    with h5py.File(tmp_path / 'map.h5', 'w') as h5file:
+        dset = h5file.create_dataset('counts', data=xmap, chunks=(1, 7, 512))
+        out = result.decompose_map(dset, method='nnls', chunk_size=3)
+    expected = result.decompose_map(xmap, method='nnls')
+    for name, wmap in expected.items():
+        np.testing.assert_allclose(out[name], wmap, rtol=0, atol=1.e-6)
+
+def test_model_component_cache():
+    model = get_model()
+    energy = 0.014655*np.arange(2048) - 0.0107
+    total = model.calc_spectrum(energy)
+    model.params['amp_fe'].value *= 2
+    model.params['elastic_amp'].value *= 0.5
+    total2 = model.calc_spectrum(energy)
+    assert model.fit_stats['cache_hits'] == 3
+    model.comp_cache.clear()
+    np.testing.assert_allclose(model.calc_spectrum(energy), total2, rtol=1.e-12)
+    assert abs(total2 - total).max() > 1.e-3*total.max()
+    model.params['peak_tail'].value *= 1.5
+    model.calc_spectrum(energy)
+    assert model.fit_stats['cache_hits'] == 5
+    assert model.fit_stats['model_evals'] == 4
+
+def test_model_cache_elements():
+    model = xrf_model(xray_energy=20.0)
+    model.set_detector(cal_offset=-0.0107, cal_slope=0.014655)
+    model.add_scatter_peak(name='elastic', center=20.0, amplitude=1e5)
+    model.add_element('Fe')
+    energy = 0.014655*np.arange(2048) - 0.0107
+    model.calc_spectrum(energy)
+    model.add_element('Cu')
+    model.calc_spectrum(energy)
+    assert set(model.comps) == {'Fe', 'Cu', 'elastic'}
+
+    # same number of elements, in a different order
+    other = xrf_model(xray_energy=20.0)
+    other.set_detector(cal_offset=-0.0107, cal_slope=0.014655)
+    other.add_scatter_peak(name='elastic', center=20.0, amplitude=1e5)
+    other.add_element('Cu')
+    other.add_element('Fe')
+    model.elements.reverse()
+    np.testing.assert_allclose(model.calc_spectrum(energy), other.calc_spectrum(energy))
+    np.testing.assert_allclose(model.comps['Cu'], other.comps['Cu'])
+
+def test_fit_stats():
+    model = get_model()
+    result = model.fit_spectrum(GSEMCA_File(str(mcafile)), energy_min=2.0,
+                                energy_max=15.0)
+    stats = result.fit_stats
+    assert stats['model_evals'] == result.fit_iter + 1
+    assert stats['cache_hits'] > stats['cache_misses']
+    assert stats['time_per_eval'] > 0
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+""" Tests of reading xMAP netCDF files, extracting all buffers at once,
+compared to extracting one buffer at a time, with a benchmark on
+synthetic buffers (run with `pytest -s` to see timings)
+"""
+import time
+import numpy as np
+from scipy.io import netcdf_file
+
+from larch.io import read_xrf_netcdf
+from larch.io.xrf_netcdf import (xMAPBufferHeader, xMAPData, aslong,
+                                 CLOCKTICK, _as_3d)
+
+MODPIXS = 124
+
+def extract_xmap_buffers(array_data):
+    """reference extraction of xMAPData from array_data one buffer at a time,
+    with xMAPBufferHeader, as read_xrf_netcdf did before extract_xmap_data.
+    This handles only one module."""
+    array_data = _as_3d(array_data)
+    narrays, nmodules, buffersize = array_data.shape
+    modpixs    = int(max(124, array_data[0, 0, 8]))
+    npix_total = 0
+    # real / live times are returned in microseconds.
+    for array in range(narrays):
+        for module in range(nmodules):
+            d   = array_data[array,module, :]
+            bh  = xMAPBufferHeader(d)
+            dat = d[256:].reshape(modpixs, int((d.size-256)/modpixs ))
+
+            npix = bh.numPixels
+            if module == 0:
+                npix_total += npix
+                if array == 0:
+                    # first time through, (array,module)=(0,0) we
+                    # read mapping mode, set up how to slice the
+                    # data, and build data arrays in xmapdat
+                    mapmode = dat[0, 3]
+                    if mapmode == 1:  # mapping, full spectra
+                        nchans = d[20]
+                        data_slice = slice(256, 8448)
+                    elif mapmode == 2:  # ROI mode
+                        # Note:  nchans = number of ROIS !!
+                        nchans     = max(d[264:268])
+                        data_slice = slice(64, 64+8*nchans)
+                    xmapdat = xMAPData(narrays*modpixs, nmodules, nchans)
+                    xmapdat.firstPixel = bh.startingPixel
+
+            # acquistion times and i/o counts data are stored
+            # as longs in locations 32:64
+            t_times = aslong(dat[:npix, 32:64]).reshape(npix, 4, 4)
+            p1 = npix_total - npix
+            p2 = npix_total
+            xmapdat.realTime[p1:p2, :]     = t_times[:, :, 0]
+            xmapdat.liveTime[p1:p2, :]     = t_times[:, :, 1]
+            xmapdat.inputCounts[p1:p2, :]  = t_times[:, :, 2]
+            xmapdat.outputCounts[p1:p2, :] = t_times[:, :, 3]
+
+            # the data, extracted as per data_slice and mapmode
+            t_data = dat[:npix, data_slice]
+            if mapmode == 2:
+                t_data = aslong(t_data)
+            xmapdat.counts[p1:p2, :, :] = t_data.reshape(npix, 4, nchans)
+
+    xmapdat.numPixels = npix_total
+    xmapdat.counts    = xmapdat.counts[:npix_total]
+    xmapdat.realTime = CLOCKTICK * xmapdat.realTime[:npix_total]
+    xmapdat.liveTime = CLOCKTICK * xmapdat.liveTime[:npix_total]
+    xmapdat.inputCounts  = xmapdat.inputCounts[:npix_total]
+    xmapdat.outputCounts = xmapdat.outputCounts[:npix_total]
+    return xmapdat
+
+def make_xmap_file(fname, narrays=3, nmodules=1, nchan=2048, lastpix=50,
+                   mapmode=1, seed=2):
+    """write xMAP netcdf file with random counts and times, in full spectrum
+    (mapmode=1) or ROI (mapmode=2) mode, with `lastpix` pixels in the last array"""
+    rng = np.random.default_rng(seed)
+    pixsize = 256 + 4*nchan if mapmode == 1 else 64 + 8*nchan
+    data = np.zeros((narrays, nmodules, 256 + MODPIXS*pixsize), dtype=np.uint16)
+    for iarr in range(narrays):
+        npix = MODPIXS if iarr < narrays-1 else lastpix
+        for imod in range(nmodules):
+            buff = data[iarr, imod]
+            buff[0:4] = (0x55AA, 0xAA55, 256, mapmode)
+            buff[8:12] = (npix, (iarr*MODPIXS) & 0xFFFF, 3, imod)
+            buff[20:24] = nchan
+            pixels = buff[256:].reshape(MODPIXS, pixsize)
+            pixels[:, 3] = mapmode
+            pixels[:, 8:12] = nchan
+            pixels[:, 32:64] = rng.integers(0, 65536, size=(MODPIXS, 32))
+            if mapmode == 1:
+                pixels[:, 256:] = rng.integers(0, 65536, size=(MODPIXS, 4*nchan))
+            else:
+                pixels[:, 64::2] = rng.integers(0, 3000, size=(MODPIXS, 4*nchan))
+    with netcdf_file(fname, 'w') as fh:
+        fh.createDimension('array_dim', narrays)
+        fh.createDimension('module_dim', nmodules)
+        fh.createDimension('buffer_dim', data.shape[2])
+        var = fh.createVariable('array_data', 'h', ('array_dim', 'module_dim', 'buffer_dim'))
+        var[:] = data.view(np.int16)
+    return data
+
+def read_buffers(fname):
+    with netcdf_file(fname, 'r', mmap=False) as fh:
+        return extract_xmap_buffers(fh.variables['array_data'].data)
+
+def test_read_xrf_netcdf(tmp_path):
+    fname = str(tmp_path / 'xmap.nc')
+    for mapmode, nchan in ((1, 2048), (2, 8)):
+        make_xmap_file(fname, mapmode=mapmode, nchan=nchan)
+        xmapdat = read_xrf_netcdf(fname)
+        ref = read_buffers(fname)
+        assert xmapdat.counts.shape == (2*MODPIXS+50, 4, nchan)
+        assert xmapdat.numPixels == ref.numPixels
+        assert xmapdat.firstPixel == ref.firstPixel == 3*65536
+        for attr in ('counts', 'realTime', 'liveTime', 'inputCounts', 'outputCounts'):
+            assert getattr(xmapdat, attr).dtype == getattr(ref, attr).dtype
+            np.testing.assert_array_equal(getattr(xmapdat, attr), getattr(ref, attr))
+
+    # module m holds detectors 4*m to 4*m+3
+    data = make_xmap_file(fname, narrays=2, nmodules=2, nchan=512, lastpix=10)
+    xmapdat = read_xrf_netcdf(fname)
+    pixel = data[1, 1, 256:].reshape(MODPIXS, -1)[7]
+    assert xmapdat.counts.shape == (MODPIXS+10, 8, 512)
+    np.testing.assert_array_equal(xmapdat.counts[MODPIXS+7, 6],
+                                  pixel[256+2*512:256+3*512].astype(np.int16))
+    icr = np.array(int(pixel[44]) + 65536*int(pixel[45]), dtype=np.uint32)
+    assert xmapdat.inputCounts[MODPIXS+7, 5] == icr.astype(np.int32)
+    assert read_xrf_netcdf(str(tmp_path / 'missing.nc')) is None
+
+def test_read_xrf_netcdf_benchmark(tmp_path):
+    fname = str(tmp_path / 'xmap_row.nc')
+    make_xmap_file(fname, narrays=8, lastpix=100)
+    t0 = time.monotonic()
+    xmapdat = read_xrf_netcdf(fname)
+    t1 = time.monotonic()
+    ref = read_buffers(fname)
+    t2 = time.monotonic()
+    print(f"\n  read xMAP row of {xmapdat.numPixels} pixels: {1.e3*(t1-t0):.2f} msec, "
+          f"one buffer at a time: {1.e3*(t2-t1):.2f} msec")
+    np.testing.assert_array_equal(xmapdat.counts, ref.counts)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+""" Tests of building XRM Map HDF5 files from raw map folders, with
+benchmarks of ROI and area sums (run with `pytest -s` to see timings)
+"""
+import time
+from pathlib import Path
+import numpy as np
+import h5py
+
+from larch.xrmmap import GSEXRM_MapFile
+
+SCAN_INI = """[general]
+basedir =
+envfile =
+[xps]
+type = NewportXPS
+host =
+user =
+passwd =
+group =
+positioners =
+[scan]
+filename = {name}
+comments =
+dimension = 2
+pos1 = 13XRM:m1
+start1 = 0.0
+stop1 = {stop1:.4f}
+step1 = 0.01
+time1 = 10.0
+pos2 = 13XRM:m2
+start2 = 0.0
+stop2 = {stop2:.4f}
+step2 = 0.01
+[fast_positioners]
+1 = 13XRM:m1 | FineX
+2 = 13XRM:m2 | FineY
+[slow_positioners]
+1 = 13XRM:m1 | FineX
+2 = 13XRM:m2 | FineY
+[xrf]
+use = True
+type = xsp3
+prefix = 13QX4:
+plugin = hdf5
+"""
+
+def make_mapfolder(folder, nrows=8, npts=40, ndet=4, nchan=2048, seed=1):
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    (folder / 'Scan.ini').write_text(SCAN_INI.format(name=folder.name + '.h5',
+                                                     stop1=0.01*(npts-1),
+                                                     stop2=0.01*(nrows-1)))
+    (folder / 'Environ.dat').write_text('; Facility.Ring_Current (S:SRcurrentAI.VAL) = 102.0\n')
+    rois = ['[rois]'] + [f'ROI{i:02d} = {name} | ' + ' '.join([f'{lo} {hi}']*ndet)
+                         for i, (name, lo, hi) in enumerate((('Fe Ka', 620, 660), ('Cu Ka', 780, 830)))]
+    rois += ['[calibration]', 'offset = ' + ' '.join(['0.0']*ndet),
+             'slope = ' + ' '.join(['0.01']*ndet), 'quad = ' + ' '.join(['0.0']*ndet)]
+    (folder / 'ROI.dat').write_text('\n'.join(rois) + '\n')
+    chan = np.arange(nchan)
+    peaks = np.exp(-(chan-640)**2/200.) + 0.5*np.exp(-(chan-805)**2/220.)
+    master = ['# scan.version = 2.0', f'# scan.nrows_expected = {nrows}',
+              f'# scan.starttime = {time.ctime()}',
+              '# XRF.filetype = hdf5',
+              '#------------------------------------',
+              '# yposition  xrf_file  struck_file  xps_file  xrd_file  time']
+    for irow in range(nrows):
+        xrff, sisf, xpsf = f'xsp3.{irow:04d}', f'struck.{irow:04d}', f'xps.{irow:04d}'
+        master.append(f'{0.01*irow:.4f} {xrff} {sisf} {xpsf} _unused_ {time.time():.1f}')
+        npix = npts + 1
+        counts = rng.poisson(5 + 40*peaks[None, None, :]*rng.uniform(0.5, 2, (npix, ndet, 1)))
+        with h5py.File(folder / xrff, 'w') as h5:
+            inst = h5.create_group('entry/instrument')
+            inst.create_dataset('detector/data', data=counts.astype('uint32'))
+            ndattr = inst.create_group('NDAttributes')
+            for i in range(ndet):
+                ndattr[f'CHAN{i+1}SCA0'] = np.full(npix, 8.e5)
+                ndattr[f'CHAN{i+1}SCA1'] = rng.uniform(1.e3, 2.e3, npix)
+                ndattr[f'CHAN{i+1}SCA3'] = counts[:, i, :].sum(axis=1)*1.1
+        sis = ['# Struck MCS', '# Column.1: TSCALER | 13IDE:mcs1 | ',
+               '# Column.2: I0 | 13IDE:mcs2 | ', '# TSCALER | I0']
+        sis += [f'{1.e5:.0f} {rng.uniform(9e4, 1e5):.0f}' for i in range(npix)]
+        (folder / sisf).write_text('\n'.join(sis) + '\n')
+        xps = ['# XPS gathering', '# FineX  FineY']
+        xps += [f'{0.01*i:.5f} {0.01*irow:.5f}' for i in range(npix)]
+        (folder / xpsf).write_text('\n'.join(xps) + '\n')
+    (folder / 'Master.dat').write_text('\n'.join(master) + '\n')
+    return folder
+
+def read_datasets(xrmmap):
+    "dict of all numeric datasets in an xrmmap group"
+    out = {}
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset) and obj.dtype.kind in 'biuf':
+            out[name] = obj[()]
+    xrmmap.visititems(visit)
+    return out
+
+def test_process(tmp_path):
+    folder = make_mapfolder(tmp_path / 'map1', nrows=7, npts=20, ndet=2, nchan=1024)
+    for fname in folder.parent.glob(folder.name + '*.h5'):
+        fname.unlink()
+    mapfile = GSEXRM_MapFile(folder=str(folder),
+                             filename=str(folder.parent / (folder.name + '.h5')))
+    mapfile.process(maxrow=4)
+    assert mapfile.last_row == 3
+    mapfile.process()
+    data = read_datasets(mapfile.xrmmap)
+    assert data['mcasum/counts'].shape == (7, 20, 1024)
+    assert data['mcasum/counts'].sum() > 0
+    # rows past the end of the Master file are skipped
+    assert mapfile.read_rowdata(7) is None
+    mapfile.process_row(7)
+    assert mapfile.last_row == 6
+    mapfile.close()
+
+def open_mapfile(folder, **kws):
+    "process map folder to a new map file, with options for GSEXRM_MapFile"
+    for fname in folder.parent.glob(folder.name + '*.h5'):
+        fname.unlink()
+    mapfile = GSEXRM_MapFile(folder=str(folder), all_mcas=True,
+                             filename=str(folder.parent / (folder.name + '.h5')), **kws)
+    mapfile.process()
+    return mapfile
+
+def test_roi_index(tmp_path):
+    folder = make_mapfolder(tmp_path / 'map3', nrows=6, npts=20, ndet=2, nchan=1000)
+    mapfile = open_mapfile(folder, roi_index=True)
+    dets = ('mca1', 'mca2', 'mcasum')
+    for det in dets:
+        counts = mapfile.xrmmap[det]['counts'][()]
+        index = mapfile.xrmmap[det]['roi_index']
+        assert index.shape == (6, 20, 63) and index.attrs['binsize'] == 16
+        assert np.allclose(index[:, :, -1], counts.sum(axis=2))
+        for cmin, cmax in ((0, 1000), (32, 640), (100, 900), (600, 661),
+                           (605, 610), (990, 1010)):
+            np.testing.assert_allclose(mapfile.calc_roi_counts(det, cmin, cmax),
+                                       counts[:, :, cmin:cmax].sum(axis=2))
+        approx = mapfile.calc_roi_counts(det, 100, 900, exact=False)
+        np.testing.assert_allclose(approx, counts[:, :, 96:896].sum(axis=2))
+
+    mapfile.add_xrfroi('Fe Kb', [6.9, 7.3])
+    en = mapfile.xrmmap['mca1/energy'][()]
+    i0, i1 = np.abs(en-6.9).argmin(), np.abs(en-7.3).argmin()+1
+    raw = mapfile.xrmmap['mca1/counts'][:, :, i0:i1].sum(axis=2)
+    np.testing.assert_array_equal(mapfile.xrmmap['roimap/mca1/Fe Kb/raw'][()], raw)
+    indices = {det: mapfile.xrmmap[det]['roi_index'][()] for det in dets}
+    mapfile.close()
+
+    # add ROI index to existing map file
+    mapfile = open_mapfile(folder)
+    assert 'roi_index' not in mapfile.xrmmap['mca1']
+    t0 = time.time()
+    mapfile.build_roi_index(nrows_block=4)
+    t1 = time.time()
+    for det in dets:
+        np.testing.assert_allclose(mapfile.xrmmap[det]['roi_index'][()], indices[det])
+    times = []
+    for det in ('mca1', 'mcasum'):
+        for exact in (True, False):
+            t2 = time.time()
+            mapfile.calc_roi_counts(det, 203, 711, exact=exact)
+            times.append(time.time()-t2)
+        del mapfile.xrmmap[det]['roi_index']
+        t2 = time.time()
+        mapfile.calc_roi_counts(det, 203, 711)
+        times.append(time.time()-t2)
+    mapfile.close()
+    print(f"\n  build ROI index: {1.e3*(t1-t0):.2f} msec")
+    for det, dtimes in (('mca1', times[:3]), ('mcasum', times[3:])):
+        print(f"  ROI map for {det}, with index: {1.e3*dtimes[0]:.2f} msec, "
+              f"bin edges only: {1.e3*dtimes[1]:.2f} msec, "
+              f"without index: {1.e3*dtimes[2]:.2f} msec")
+
+def test_mca_area(tmp_path):
+    folder = make_mapfolder(tmp_path / 'map4', nrows=10, npts=30, ndet=2, nchan=1024)
+    mapfile = open_mapfile(folder)
+    ny, nx = mapfile.get_shape()
+    area = np.zeros((ny, nx), dtype=bool)
+    for i in range(ny):
+        area[i, (3*i) % nx] = area[i, (3*i+1) % nx] = True
+    area[4:6, 20:25] = True
+    mapfile.add_area(area, name='diag')
+
+    for det in (None, 1, 2):
+        detgrp = mapfile.get_detgroup(det)
+        for dtcorrect in (True, False):
+            counts = detgrp['counts'][()]
+            if dtcorrect:
+                counts = counts*detgrp['dtfactor'][()].reshape(ny, nx, 1)
+            t0 = time.time()
+            mca = mapfile.get_mca_area('diag', det=det, dtcorrect=dtcorrect)
+            t1 = time.time()
+            np.testing.assert_allclose(mca.counts, counts[area].sum(axis=0), rtol=1.e-6)
+            assert mca.live_time == 1.e-6*detgrp['livetime'][()][area].sum()
+            pooled, _, _ = mapfile.sum_area_counts(area, det=det, dtcorrect=dtcorrect,
+                                                   nworkers=3)
+            np.testing.assert_allclose(pooled, mca.counts, rtol=1.e-6)
+            t2 = time.time()
+            mca = mapfile.get_mca_area('diag', det=det, dtcorrect=dtcorrect)
+            t3 = time.time()
+            np.testing.assert_allclose(mca.counts, counts[area].sum(axis=0), rtol=1.e-6)
+    print(f"\n  area spectrum: {1.e3*(t1-t0):.2f} msec, cached: {1.e3*(t3-t2):.2f} msec")
+    assert len(mapfile.area_sums) == 6
+
+    # cached area sums are not used when rows are added or the area changes
+    mca = mapfile.get_mca_area('diag', det=1, dtcorrect=False)
+    mca.counts[:] = 0
+    mapfile.xrmmap.attrs['Last_Row'] = 20
+    counts = mapfile.xrmmap['mca1/counts'][()]
+    np.testing.assert_allclose(mapfile.get_mca_area('diag', det=1, dtcorrect=False).counts,
+                               counts[area].sum(axis=0))
+    assert mapfile.area_sums[('diag', 'mca1', False)][0] == 20
+    del mapfile.xrmmap['areas/diag']
+    mapfile.add_area(area[::-1], name='diag')
+    np.testing.assert_allclose(mapfile.get_mca_area('diag', det=1, dtcorrect=False).counts,
+                               counts[area[::-1]].sum(axis=0))
+
+    rect = mapfile.get_mca_rect(2, 5, 10, 20, det=2, dtcorrect=False)
+    counts = mapfile.xrmmap['mca2/counts'][2:5, 10:20]
+    np.testing.assert_allclose(rect.counts, counts.sum(axis=(0, 1)))
+    mapfile.close()
+
+def test_add_xrfrois(tmp_path):
+    folder = make_mapfolder(tmp_path / 'map5', nrows=8, npts=30, ndet=3, nchan=1024)
+    mapfile = open_mapfile(folder)
+    rois = {f'roi{i:02d}': [0.2+0.4*i, 0.45+0.4*i] for i in range(20)}
+    rois['all'] = [0, 1023]
+    t0 = time.time()
+    for name, erange in rois.items():
+        mapfile.add_xrfroi(f'{name}_1', list(erange))
+    t1 = time.time()
+    mapfile.add_xrfrois(rois, nrows_block=3)
+    t2 = time.time()
+    mapfile.add_xrfrois({'pair': [100, 200]}, unit='channels', nworkers=0)
+    print(f"\n  add 21 ROIs one at a time: {1.e3*(t1-t0):.2f} msec, together: {1.e3*(t2-t1):.2f} msec")
+
+    roimap = mapfile.xrmmap['roimap']
+    for det in ('mca1', 'mca2', 'mca3', 'mcasum'):
+        for name in rois:
+            for arr in ('raw', 'cor', 'limits'):
+                np.testing.assert_allclose(roimap[f'{det}/{name}/{arr}'][()],
+                                           roimap[f'{det}/{name}_1/{arr}'][()])
+        counts = mapfile.xrmmap[f'{det}/counts'][()]
+        np.testing.assert_array_equal(roimap[f'{det}/pair/raw'][()],
+                                      counts[:, :, 100:200].sum(axis=2))
+    assert 'roi07' in mapfile.get_roi_list('mcasum')
+
+    # existing ROIs are skipped
+    mapfile.add_xrfrois({'pair': [10, 20], 'more': [10, 20]}, unit='channels')
+    assert roimap['mca2/pair/limits'][1] == 200
+    assert roimap['mca2/more/limits'][1] == 20
+    mapfile.close()
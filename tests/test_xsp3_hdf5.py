@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+""" Tests of reading Xspress3 HDF5 files in blocks of pixels, including
+files with corrupted chunks (run with `pytest -s` to see timings)
+"""
+import time
+import numpy as np
+import h5py
+
+from larch.io import read_xsp3_hdf5
+from larch.io.xsp3_hdf5 import iter_xsp3_counts, get_counts_carefully
+
+def make_xsp3_file(fname, npix=60, ndet=4, nchan=256, chunk=1, bad=(),
+                   nextra=0, seed=3):
+    """write Xspress3 file of random counts, with `chunk` pixels per compressed
+    chunk, corrupting the chunks holding pixels in `bad`, and with `nextra`
+    more pixels for the NDAttributes than for the counts"""
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(20, size=(npix, ndet, nchan)).astype('uint32')
+    with h5py.File(fname, 'w') as h5:
+        inst = h5.create_group('entry/instrument')
+        data = inst.create_dataset('detector/data', data=counts, compression='gzip',
+                                   chunks=(chunk, ndet, nchan))
+        ndattr = inst.create_group('NDAttributes')
+        for i in range(ndet):
+            ndattr[f'CHAN{i+1}SCA0'] = np.full(npix+nextra, 8.e5)
+            ndattr[f'CHAN{i+1}SCA1'] = rng.uniform(1.e3, 2.e3, npix+nextra)
+            ndattr[f'CHAN{i+1}SCA3'] = rng.uniform(1.e3, 2.e4, npix+nextra)
+        chunks = [data.id.get_chunk_info_by_coord((i, 0, 0)) for i in bad]
+    with open(fname, 'r+b') as fh:
+        for info in chunks:
+            fh.seek(info.byte_offset + 10)
+            fh.write(b'\xff'*(info.size - 20))
+    return counts
+
+def test_read_xsp3_hdf5(tmp_path):
+    fname = str(tmp_path / 'xsp3.h5')
+    counts = make_xsp3_file(fname, chunk=4)
+    with h5py.File(fname, 'r') as h5:
+        blocks = list(iter_xsp3_counts(h5['entry/instrument/detector/data'],
+                                       block_pixels=10))
+    assert [p0 for p0, block in blocks] == list(range(0, 60, 8))
+    assert blocks[0][1].dtype == np.uint32
+    np.testing.assert_array_equal(np.concatenate([b for p, b in blocks]), counts)
+
+    xsp3 = read_xsp3_hdf5(fname, block_pixels=10)
+    assert xsp3.counts.dtype == np.uint32 and xsp3.numPixels == 60
+    np.testing.assert_array_equal(xsp3.counts, counts)
+    np.testing.assert_allclose(xsp3.outputCounts, counts[:, :, 1:-1].sum(axis=2))
+    np.testing.assert_allclose(xsp3.realTime, 1.e4)
+
+    # counts padded with zeros to the number of pixels for NDAttributes
+    counts = make_xsp3_file(fname, nextra=2)
+    xsp3 = read_xsp3_hdf5(fname, block_pixels=16)
+    assert xsp3.counts.shape == (62, 4, 256) and xsp3.counts.dtype == np.uint32
+    np.testing.assert_array_equal(xsp3.counts[:60], counts)
+    assert np.all(xsp3.counts[60:] == 0) and np.all(xsp3.outputCounts[60:] == 0.1)
+
+def test_read_xsp3_corrupted(tmp_path):
+    fname = str(tmp_path / 'xsp3_bad.h5')
+    counts = make_xsp3_file(fname, bad=(17, 30, 31, 59))
+    xsp3 = read_xsp3_hdf5(fname, block_pixels=16)
+    good = np.ones(60, dtype=bool)
+    good[[17, 30, 31, 59]] = False
+    np.testing.assert_array_equal(xsp3.counts[good], counts[good])
+    np.testing.assert_array_equal(xsp3.counts[17], ((counts[16]+counts[18])/2.0).astype('uint32'))
+    np.testing.assert_array_equal(xsp3.counts[30], counts[29])
+    np.testing.assert_array_equal(xsp3.counts[31], counts[32])
+    np.testing.assert_array_equal(xsp3.counts[59], counts[58])
+
+    # bad chunks of 5 pixels, found in one block of all pixels
+    counts = make_xsp3_file(fname, npix=2000, chunk=5, bad=(1203,))
+    with h5py.File(fname, 'r') as h5:
+        t0 = time.monotonic()
+        fixed = get_counts_carefully(h5['entry/instrument/detector/data'])
+        t1 = time.monotonic()
+    print(f"\n  read 2000 pixels with a bad chunk: {1.e3*(t1-t0):.2f} msec")
+    np.testing.assert_array_equal(fixed[:1200], counts[:1200])
+    np.testing.assert_array_equal(fixed[1200:1203], np.array([counts[1199]]*3))
+    np.testing.assert_array_equal(fixed[1203:1205], np.array([counts[1205]]*2))
+    np.testing.assert_array_equal(fixed[1205:], counts[1205:])